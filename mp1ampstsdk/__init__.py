@@ -1,5 +1,17 @@
 from __future__ import absolute_import
+from . import remoteproc
+from . import framing
+from . import dispatcher
+from . import iocore
+from . import metrics
 from . import commsdk
+from . import async_commsdk
 from . import py_sdbsdk
 from . import comm_exceptions
-__all__ = ["commsdk", "py_sdbsdk", "comm_exceptions"]
+from . import emulator
+from . import recorder
+from . import decoder
+from . import pipeline
+from . import fanout
+from . import broker
+__all__ = ["remoteproc", "framing", "dispatcher", "iocore", "metrics", "commsdk", "async_commsdk", "py_sdbsdk", "comm_exceptions", "emulator", "recorder", "decoder", "pipeline", "fanout", "broker"]
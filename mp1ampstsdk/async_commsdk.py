@@ -0,0 +1,504 @@
+################################################################################
+# COPYRIGHT(c) 2020 STMicroelectronics                                         #
+#                                                                              #
+# Redistribution and use in source and binary forms, with or without           #
+# modification, are permitted provided that the following conditions are met:  #
+#   1. Redistributions of source code must retain the above copyright notice,  #
+#      this list of conditions and the following disclaimer.                   #
+#   2. Redistributions in binary form must reproduce the above copyright       #
+#      notice, this list of conditions and the following disclaimer in the     #
+#      documentation and/or other materials provided with the distribution.    #
+#   3. Neither the name of STMicroelectronics nor the names of its             #
+#      contributors may be used to endorse or promote products derived from    #
+#      this software without specific prior written permission.                #
+#                                                                              #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"  #
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE    #
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE   #
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE    #
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR          #
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF         #
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS     #
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN      #
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)      #
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE   #
+# POSSIBILITY OF SUCH DAMAGE.                                                  #
+################################################################################
+
+
+"""async_commsdk
+The async_commsdk module is the asyncio counterpart of the commsdk module: it
+drives the OpenAMP RpMsg virtual COM ports non-blocking from an event loop, so
+that no thread is created per command or per notification port.
+"""
+
+
+# IMPORT
+
+from collections import deque
+from collections import OrderedDict
+from serial import SerialException
+from serial import SerialTimeoutException
+from mp1ampstsdk.comm_exceptions import CommSDKInvalidOperationException
+from mp1ampstsdk.commsdk import DFT_TERMINATOR
+from mp1ampstsdk.commsdk import BINARY_ANSW_MAX_LENGHT
+from mp1ampstsdk.framing import TerminatorSplitter
+from mp1ampstsdk.framing import READ_CHUNK_SIZE
+from mp1ampstsdk.metrics import ChannelCounters
+from mp1ampstsdk.metrics import DFT_LATENCY_BUCKETS_s
+from mp1ampstsdk.metrics import NAMESPACE
+from mp1ampstsdk.metrics import REGISTRY
+from mp1ampstsdk.remoteproc import RemoteProc
+from mp1ampstsdk.remoteproc import DFT_REMOTEPROC
+from mp1ampstsdk.remoteproc import DFT_FIRMWARE_DIR
+from mp1ampstsdk.remoteproc import DFT_RUN_DIR
+from mp1ampstsdk.remoteproc import DFT_BOOT_TIMEOUT_s
+from mp1ampstsdk.remoteproc import DFT_STOP_TIMEOUT_s
+import asyncio
+import serial
+import os
+import time
+
+
+# CONSTANTS
+
+
+# CLASSES
+
+class AsyncCommAPI():
+    """AsyncCommAPI class.
+    This class manages the communication via OpenAMP serial Rpmsg between the A7
+    and the M4 from an asyncio event loop.
+    Both ports are read through the event loop readiness callbacks: commands are
+    awaited with :meth:`cmd_get` / :meth:`cmd_set`, notifications are consumed
+    with ``async for`` over :meth:`notifications`.
+    """
+
+    _SERIAL_PORT_RESPONSE_TIMEOUT_s = 1
+    """Default timeout for responses."""
+
+    _NOTIFICATION_QUEUE_SIZE = 256
+    """Number of queued notifications above which the notification port is no
+    longer read until the consumer catches up."""
+
+    def __init__(self, serial_port_cmd, serial_port_notification=None, m4_fw_name=None, terminator=DFT_TERMINATOR, verbose=False, remoteproc=DFT_REMOTEPROC, firmware_dir=DFT_FIRMWARE_DIR, boot_timeout=DFT_BOOT_TIMEOUT_s, force_restart=False, metrics=None, keep_running=True, run_dir=DFT_RUN_DIR):
+        """Constructor.
+        :param serial_port_cmd: Absolute path of the Serial Port device used for commands and responses.
+            E.g.: '/dev/ttyRPMSG0'.
+        :type serial_port_cmd: str
+
+        :param serial_port_notification: Absolute path of the Serial Port device used for notifications.
+            E.g.: '/dev/ttyRPMSG1'.
+        :type serial_port_notification: str
+
+        :param m4_fw_name: Absolute path of the M4 firmware.
+        :type m4_fw_name: str
+
+        :param terminator: Terminator sequence used to separate messages on the serial ports.
+            E.g.: ';'.
+        :type terminator: str
+
+        :param verbose: If True, enables verbosity on output.
+        :type verbose: boolean
+
+        :param remoteproc: Sysfs directory of the remoteproc instance.
+        :type remoteproc: str
+
+        :param firmware_dir: Directory the M4 firmware is copied to.
+        :type firmware_dir: str
+
+        :param boot_timeout: Max time in seconds for the M4 firmware to start
+            and its virtual COM ports to be ready (see :meth:`get_startup_timeline`).
+        :type boot_timeout: float
+
+        :param force_restart: If True, restarts the M4 firmware even when the
+            same image is already running.
+        :type force_restart: boolean
+
+        :param metrics: Registry of the metrics updated by this object (round-trip
+            time and timeouts of cmd_get / cmd_set, bytes and msgs of each port,
+            see :mod:`mp1ampstsdk.metrics`), the same as the ones of
+            :class:`mp1ampstsdk.commsdk.CommAPI`, labelled with the port paths;
+            defaults to :data:`mp1ampstsdk.metrics.REGISTRY`.
+        :type metrics: :class:`mp1ampstsdk.metrics.MetricsRegistry`
+
+        :param keep_running: If True, the M4 firmware is left running on
+            release, so that the next object using the same image finds it
+            running and does not restart it; if False, release stops the
+            firmware started, or found running, for m4_fw_name.
+        :type keep_running: boolean
+
+        :param run_dir: Directory of the records of the running firmware,
+            cleared at reboot (see :mod:`mp1ampstsdk.remoteproc`).
+        :type run_dir: str
+        """
+        try:
+            t0 = time.monotonic()
+            self._verbose = verbose
+            self._rproc = RemoteProc(remoteproc, firmware_dir, run_dir, verbose, "AsyncCommAPI")
+            self._keep_running = keep_running
+            self._startup_timeline = OrderedDict()
+            self._released = False
+            self._loop = None
+            self._lock_cmd = None
+
+            if self._verbose:
+                print("AsyncCommAPI: Creating AsyncCommAPI object.")
+
+            if serial_port_cmd == serial_port_notification:
+                raise CommSDKInvalidOperationException("AsyncCommAPI: Error: \"serial_port_cmd\" and \"serial_port_notification\" must be different.")
+
+            self._terminator = terminator.encode("utf-8")
+            self._m4_fw_name = None
+            self._m4_fw_path = None
+            if m4_fw_name != None:
+                self._m4_fw_path, self._m4_fw_name = os.path.split(m4_fw_name)
+                # (Re)starts the M4 Fw and waits for the virtual com ports.
+                self._rproc.boot(m4_fw_name, [serial_port_cmd, serial_port_notification], boot_timeout, force_restart)
+                self._startup_timeline.update(self._rproc.timeline)
+                self._startup_timeline.pop("total", None)
+            mark = time.monotonic()
+
+            # Ports are opened in non-blocking mode (timeout=0): pyserial only
+            # configures the tty, reads and writes are driven by the event loop.
+            self._serial_port_cmd = self._open_port(serial_port_cmd)
+            self._serial_port_notification = None
+            if serial_port_notification != None:
+                self._serial_port_notification = self._open_port(serial_port_notification)
+            self._init_metrics(metrics if metrics is not None else REGISTRY,
+                serial_port_cmd, serial_port_notification)
+
+            # Command channel state.
+            self._cmd_rx = TerminatorSplitter(self._terminator)
+            self._cmd_frames = deque()
+            self._cmd_waiter = None
+            self._cmd_binary = False
+
+            # Notification channel state.
+            self._ntf_rx = TerminatorSplitter(self._terminator)
+            self._ntf_queue = None
+            self._ntf_enabled = False
+            self._ntf_paused = False
+            self._startup_timeline["open"] = time.monotonic() - mark
+            self._startup_timeline["total"] = time.monotonic() - t0
+
+        except (Exception, SerialException, SerialTimeoutException, CommSDKInvalidOperationException) as e:
+            raise e
+
+
+    def __del__(self):
+        """Deleting object.
+        """
+        if self._verbose:
+            print("AsyncCommAPI: Deleting AsyncCommAPI object.")
+        if not self._released:
+            self.release()
+
+
+    async def __aenter__(self):
+        return self
+
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+
+
+    def release(self):
+        """Release resources.
+        Readers are removed from the event loop, pending waiters are cancelled
+        and notification iterators are terminated.
+        """
+        try:
+            if self._released:
+                return
+            if self._verbose:
+                print("AsyncCommAPI: Releasing resources.")
+            if self._cmd_waiter is not None and not self._cmd_waiter.done():
+                self._cmd_waiter.cancel()
+            for port in (getattr(self, '_serial_port_cmd', None),
+                         getattr(self, '_serial_port_notification', None)):
+                if port is not None and port.is_open:
+                    if self._loop is not None and not self._loop.is_closed():
+                        self._loop.remove_reader(port.fileno())
+                    port.close()
+            if self._ntf_queue is not None:
+                self._ntf_queue.put_nowait(None)
+            if not self._keep_running and self._m4_fw_name is not None and \
+                self._is_m4_firmware_running() and self._get_m4_firmware_name() == self._m4_fw_name:
+                self._rproc.shutdown(DFT_STOP_TIMEOUT_s)
+            self._released = True
+
+        except (Exception, SerialException, SerialTimeoutException, CommSDKInvalidOperationException) as e:
+            raise e
+
+
+    async def cmd_get(self, msg=None, timeout=None):
+        """Send a request to M4 and await the response.
+        Requests are serialized on the command channel: a second call awaits the
+        completion of the outstanding one instead of failing.
+
+        :param msg: if None just await a msg from M4, otherwise send it and await
+            the M4 response. Msg can be str type or binary type.
+        :type msg: str or bytes
+
+        :param timeout: seconds to wait for the response, defaults to
+            :attr:`_SERIAL_PORT_RESPONSE_TIMEOUT_s`.
+        :type timeout: float
+
+        :return: str type response msg ('' if no response within timeout) for str
+            msgs, bytes for binary msgs (up to :data:`BINARY_ANSW_MAX_LENGHT`).
+        """
+        try:
+            self._attach()
+            if timeout is None:
+                timeout = self._SERIAL_PORT_RESPONSE_TIMEOUT_s
+            async with self._lock_cmd:
+                start = time.perf_counter()
+                if msg is None or type(msg) == str:
+                    if msg is not None:
+                        # A late response to a timed out request must not be
+                        # taken for the response to this one.
+                        self._cmd_frames.clear()
+                        self._cmd_rx.reset()
+                        await self._write_cmd(msg.encode("utf-8"))
+                    response = await self._wait_cmd_frame(timeout)
+                    if self._verbose:
+                        print("AsyncCommAPI: Rx Response: \"%s\"" % (response))
+                else:  # binary msg type
+                    response = await self._wait_cmd_binary(msg, timeout)
+                if msg is not None:
+                    self._observe_response(start, response)
+                return response
+
+        except (Exception, SerialException, SerialTimeoutException, CommSDKInvalidOperationException) as e:
+            raise e
+
+
+    async def cmd_set(self, msg=None, timeout=None):
+        """Send a command to M4.
+        :msg: same as cmd_get
+        """
+        return await self.cmd_get(msg, timeout)
+
+
+    def notifications(self):
+        """Return an asynchronous iterator over the M4 spontaneous notifications.
+        The first call enables the notification channel by writing the terminator
+        on it, as the A7 has to send the first RPMSG message (see
+        :class:`mp1ampstsdk.commsdk.M4NotificationThread`).
+        The iteration ends when the object is released.
+
+        :return: async iterator yielding utf-8 decoded notifications.
+        """
+        try:
+            if self._serial_port_notification is None:
+                raise CommSDKInvalidOperationException("AsyncCommAPI: Error notifications(): no notification port.")
+            self._attach()
+            if not self._ntf_enabled:
+                fd = self._serial_port_notification.fileno()
+                os.write(fd, self._terminator)
+                self._ntf_counters.tx_bytes.inc(len(self._terminator))
+                self._ntf_counters.tx_msgs.inc()
+                self._loop.add_reader(fd, self._on_notification_readable)
+                self._ntf_enabled = True
+            return _NotificationIterator(self)
+
+        except (Exception, SerialException, SerialTimeoutException, CommSDKInvalidOperationException) as e:
+            raise e
+
+
+    def _open_port(self, path):
+        port = serial.Serial()
+        port.port = path
+        port.timeout = 0
+        port.write_timeout = 0
+        port.open()
+        if not port.is_open:
+            raise CommSDKInvalidOperationException("AsyncCommAPI: Error: opening serial port %s failed." % (path))
+        return port
+
+
+    def _attach(self):
+        """Bind the object to the running event loop on first use."""
+        if self._released:
+            raise CommSDKInvalidOperationException("AsyncCommAPI: Error: object released.")
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+            self._lock_cmd = asyncio.Lock()
+            self._ntf_queue = asyncio.Queue()
+            self._loop.add_reader(self._serial_port_cmd.fileno(), self._on_cmd_readable)
+
+
+    def _init_metrics(self, registry, serial_port_cmd, serial_port_notification):
+        # Same families as CommAPI: cmd_set is counted as the cmd_get it calls.
+        labels = {"port": serial_port_cmd, "call": "cmd_get"}
+        self._m_roundtrip = registry.histogram(NAMESPACE + "_comm_roundtrip_seconds",
+            "Time from sending a command to receiving its response.", DFT_LATENCY_BUCKETS_s, labels)
+        self._m_timeouts = registry.counter(NAMESPACE + "_comm_timeouts_total",
+            "Commands not answered before their timeout.", labels)
+        self._cmd_counters = ChannelCounters(registry, "comm", serial_port_cmd)
+        self._ntf_counters = None
+        if serial_port_notification != None:
+            self._ntf_counters = ChannelCounters(registry, "comm", serial_port_notification)
+
+
+    def _observe_response(self, start, response):
+        """Count the response of a command sent at the perf_counter() start:
+        its round-trip time, or a timeout if it is empty."""
+        if not response:
+            self._m_timeouts.inc()
+        else:
+            self._m_roundtrip.observe(time.perf_counter() - start)
+
+
+    async def _write_cmd(self, data):
+        await self._write(self._serial_port_cmd.fileno(), data)
+        self._cmd_counters.tx_bytes.inc(len(data))
+        self._cmd_counters.tx_msgs.inc()
+
+
+    async def _write(self, fd, data):
+        view = memoryview(data)
+        while view:
+            try:
+                n = os.write(fd, view)
+                view = view[n:]
+            except BlockingIOError:
+                writable = self._loop.create_future()
+                self._loop.add_writer(fd, writable.set_result, None)
+                try:
+                    await writable
+                finally:
+                    self._loop.remove_writer(fd)
+
+
+    async def _wait_cmd_frame(self, timeout):
+        if self._cmd_frames:
+            return self._cmd_frames.popleft().decode("utf-8")
+        self._cmd_waiter = self._loop.create_future()
+        try:
+            frame = await asyncio.wait_for(self._cmd_waiter, timeout)
+            return frame.decode("utf-8")
+        except asyncio.TimeoutError:
+            return ""
+        finally:
+            self._cmd_waiter = None
+
+
+    async def _wait_cmd_binary(self, msg, timeout):
+        # Stale frames are discarded: a binary answer is raw bytes up to
+        # BINARY_ANSW_MAX_LENGHT, as for the blocking CommAPI.cmd_get().
+        self._cmd_frames.clear()
+        self._cmd_rx.reset()
+        self._cmd_binary = True
+        self._cmd_waiter = self._loop.create_future()
+        try:
+            await self._write_cmd(msg)
+            try:
+                await asyncio.wait_for(asyncio.shield(self._cmd_waiter), timeout)
+            except asyncio.TimeoutError:
+                pass
+            response = self._cmd_rx.take(BINARY_ANSW_MAX_LENGHT)
+            if response:
+                self._cmd_counters.rx_msgs.inc()
+            return response
+        finally:
+            self._cmd_binary = False
+            self._cmd_waiter = None
+
+
+    def _on_cmd_readable(self):
+        try:
+            data = os.read(self._serial_port_cmd.fileno(), READ_CHUNK_SIZE)
+        except BlockingIOError:
+            return
+        self._cmd_rx.feed(data)
+        self._cmd_counters.rx_bytes.inc(len(data))
+        if self._cmd_binary:
+            if len(self._cmd_rx) >= BINARY_ANSW_MAX_LENGHT and \
+                self._cmd_waiter is not None and not self._cmd_waiter.done():
+                self._cmd_waiter.set_result(None)
+            return
+        for frame in self._cmd_rx.frames():
+            self._cmd_counters.rx_msgs.inc()
+            if self._cmd_waiter is not None and not self._cmd_waiter.done():
+                self._cmd_waiter.set_result(frame)
+            else:
+                self._cmd_frames.append(frame)
+
+
+    def _on_notification_readable(self):
+        fd = self._serial_port_notification.fileno()
+        try:
+            data = os.read(fd, READ_CHUNK_SIZE)
+        except BlockingIOError:
+            return
+        self._ntf_rx.feed(data)
+        self._ntf_counters.rx_bytes.inc(len(data))
+        for frame in self._ntf_rx.frames():
+            self._ntf_counters.rx_msgs.inc()
+            notification = frame.decode("utf-8")
+            if self._verbose:
+                print("AsyncCommAPI: Rx Notification: \"%s\"" % (notification))
+            self._ntf_queue.put_nowait(notification)
+        if self._ntf_queue.qsize() >= self._NOTIFICATION_QUEUE_SIZE:
+            # Backpressure: leave data in the tty until the consumer catches up.
+            self._loop.remove_reader(fd)
+            self._ntf_paused = True
+
+
+    def _resume_notifications(self):
+        if self._ntf_paused and not self._released and \
+            self._ntf_queue.qsize() < self._NOTIFICATION_QUEUE_SIZE // 2:
+            self._ntf_paused = False
+            self._loop.add_reader(self._serial_port_notification.fileno(), self._on_notification_readable)
+
+
+    def get_startup_timeline(self):
+        """Return the durations in seconds of the construction phases, see
+        :meth:`mp1ampstsdk.commsdk.CommAPI.get_startup_timeline`.
+        :return: OrderedDict.
+        """
+        return OrderedDict(self._startup_timeline)
+
+
+    def _is_m4_firmware_running(self):
+        return self._rproc.is_running()
+
+
+    def _get_m4_firmware_name(self):
+        return self._rproc.get_firmware_name()
+
+
+    def _set_m4_firmware_name(self, name):
+        return self._rproc.set_firmware_name(name)
+
+
+    def _start_m4_firmware(self):
+        return self._rproc.start()
+
+
+    def _stop_m4_firmware(self):
+        return self._rproc.stop()
+
+
+class _NotificationIterator():
+    """Asynchronous iterator returned by :meth:`AsyncCommAPI.notifications`."""
+
+    def __init__(self, caller):
+        self._caller = caller
+
+
+    def __aiter__(self):
+        return self
+
+
+    async def __anext__(self):
+        queue = self._caller._ntf_queue
+        notification = await queue.get()
+        if notification is None:
+            queue.put_nowait(None)  # let other iterators terminate too
+            raise StopAsyncIteration
+        self._caller._resume_notifications()
+        return notification
+
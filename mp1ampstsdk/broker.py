@@ -0,0 +1,237 @@
+################################################################################
+# COPYRIGHT(c) 2020 STMicroelectronics                                         #
+#                                                                              #
+# Redistribution and use in source and binary forms, with or without           #
+# modification, are permitted provided that the following conditions are met:  #
+#   1. Redistributions of source code must retain the above copyright notice,  #
+#      this list of conditions and the following disclaimer.                   #
+#   2. Redistributions in binary form must reproduce the above copyright       #
+#      notice, this list of conditions and the following disclaimer in the     #
+#      documentation and/or other materials provided with the distribution.    #
+#   3. Neither the name of STMicroelectronics nor the names of its             #
+#      contributors may be used to endorse or promote products derived from    #
+#      this software without specific prior written permission.                #
+#                                                                              #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"  #
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE    #
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE   #
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE    #
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR          #
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF         #
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS     #
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN      #
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)      #
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE   #
+# POSSIBILITY OF SUCH DAMAGE.                                                  #
+################################################################################
+
+
+
+"""broker
+The broker module lets several short-lived processes share the Shared Data
+Buffers of one long-lived owner.
+:class:`SdbBroker` owns the RpmsgSdbAPI (kernel module, eventfds and mmaps) and
+publishes every buffer received from M4 through an
+:class:`mp1ampstsdk.fanout.SdbFanOut` on a Unix socket. A
+:class:`SdbBrokerClient` attaches in milliseconds: it connects to the socket,
+maps the shared ring and reads the buffers in place.
+The broker runs as a daemon with::
+
+    mp1-sdb-broker --buff-size 1048576 --buff-num 3 --m4fw /path/to/fw.elf
+"""
+
+
+# IMPORT
+
+from mp1ampstsdk.py_sdbsdk import RpmsgSdbAPI
+from mp1ampstsdk.fanout import SdbFanOut
+from mp1ampstsdk.fanout import SdbFanOutConsumer
+import argparse
+import signal
+import threading
+
+
+# CONSTANTS
+
+DFT_BROKER_SOCKET = '/run/mp1ampstsdk/sdb-broker.sock'
+"""Unix socket the broker listens on."""
+DFT_SLOTS_PER_BUFFER = 4
+"""Default number of slots of the shared ring per SDB buffer: how far a client
+may lag behind."""
+
+
+# CLASSES
+
+class SdbBroker():
+    """SdbBroker class.
+    Serves the Shared Data Buffers of an RpmsgSdbAPI to the processes
+    attached to its Unix socket::
+
+        with SdbBroker(buff_size, buff_num, m4_fw_name=fw) as broker:
+            broker.serve_forever()
+    """
+
+    def __init__(self, buff_size, buff_num, socket_path=DFT_BROKER_SOCKET, slots=None, m4_fw_name=None, verbose=False, **sdb_kwargs):
+        """Constructor.
+        :param buff_size: Size of each SDB buffer in bytes.
+        :type buff_size: int
+
+        :param buff_num: Number of SDB buffers.
+        :type buff_num: int
+
+        :param socket_path: Unix socket served to the clients.
+        :type socket_path: str
+
+        :param slots: Number of slots of the shared ring, defaults to
+            DFT_SLOTS_PER_BUFFER * buff_num.
+        :type slots: int
+
+        :param m4_fw_name: M4 firmware, see :class:`mp1ampstsdk.py_sdbsdk.RpmsgSdbAPI`.
+        :type m4_fw_name: str
+
+        :param verbose: If True, enables verbosity on output.
+        :type verbose: boolean
+
+        :param sdb_kwargs: Other arguments of RpmsgSdbAPI, e.g. sdb_device.
+        """
+        self._verbose = verbose
+        self._buff_size = buff_size
+        self._buff_num = buff_num
+        self._closed = False
+        self._started = False
+        self._sdb = RpmsgSdbAPI(m4_fw_name, verbose, **sdb_kwargs)
+        try:
+            self._fanout = SdbFanOut(buff_size, socket_path, slots if slots is not None else DFT_SLOTS_PER_BUFFER * buff_num, verbose=verbose)
+        except (Exception) as e:
+            # Releasing the RpmsgSdbAPI object unloads the driver it may
+            # have started.
+            self._sdb = None
+            raise e
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+    @property
+    def socket_path(self):
+        return self._fanout.socket_path
+
+
+    @property
+    def sdb_api(self):
+        """The :class:`mp1ampstsdk.py_sdbsdk.RpmsgSdbAPI` owned by the broker."""
+        return self._sdb
+
+
+    @property
+    def fanout(self):
+        """The :class:`mp1ampstsdk.fanout.SdbFanOut` serving the clients."""
+        return self._fanout
+
+
+    def start(self):
+        """Map the SDB buffers and start publishing them to the clients."""
+        if self._started:
+            return
+        self._sdb.init_sdb(self._buff_size, self._buff_num)
+        self._sdb.add_sdb_buffer_rx_listener(self._fanout)
+        self._sdb.start_sdb_receiver()
+        self._started = True
+
+
+    def serve_forever(self):
+        """Start and serve until SIGINT or SIGTERM, then close."""
+        stop = threading.Event()
+        handlers = {}
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            handlers[signum] = signal.signal(signum, lambda signum, frame: stop.set())
+        try:
+            self.start()
+            while not stop.wait(1):
+                pass
+        finally:
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+            self.close()
+
+
+    def get_stats(self):
+        """Return the counters of the fan-out, see
+        :meth:`mp1ampstsdk.fanout.SdbFanOut.get_stats`."""
+        return self._fanout.get_stats()
+
+
+    def get_clients(self):
+        """Return the lag of the clients, see
+        :meth:`mp1ampstsdk.fanout.SdbFanOut.get_consumers`."""
+        return self._fanout.get_consumers()
+
+
+    def close(self):
+        """Stop the receiver, detach the clients and free the ring."""
+        if self._closed:
+            return
+        self._closed = True
+        if self._verbose:
+            print("SdbBroker: Closing.")
+        if self._started:
+            self._sdb.stop_sdb_receiver()
+            self._sdb.deinit_sdb()
+        self._fanout.close()
+        self._sdb = None
+
+
+class SdbBrokerClient(SdbFanOutConsumer):
+    """SdbBrokerClient class.
+    Attaches to an :class:`SdbBroker` and reads its buffers in place::
+
+        with SdbBrokerClient() as client:
+            for buffer in client:
+                with buffer:
+                    process(buffer.data)
+    """
+
+    def __init__(self, socket_path=DFT_BROKER_SOCKET, timeout=None, verbose=False):
+        """Constructor.
+        :param socket_path: Unix socket of the broker.
+        :type socket_path: str
+
+        :param timeout: Max time in seconds waited for each buffer, None
+            waits forever.
+        :type timeout: float
+
+        :param verbose: If True, enables verbosity on output.
+        :type verbose: boolean
+        """
+        super(SdbBrokerClient, self).__init__(socket_path, timeout, verbose)
+
+
+# FUNCTIONS
+
+def main():
+    """Run an SdbBroker daemon."""
+    parser = argparse.ArgumentParser(description="Shared Data Buffers broker.")
+    parser.add_argument("--buff-size", type=int, required=True, help="size of each SDB buffer in bytes")
+    parser.add_argument("--buff-num", type=int, required=True, help="number of SDB buffers")
+    parser.add_argument("--socket", default=DFT_BROKER_SOCKET, help="Unix socket served to the clients")
+    parser.add_argument("--slots", type=int, default=None, help="slots of the shared ring")
+    parser.add_argument("--m4fw", default=None, help="M4 firmware to (re)start")
+    parser.add_argument("--sdb-device", default=None, help="sdb driver device")
+    parser.add_argument("--no-driver", action="store_true", help="do not insert/remove the stm32_rpmsg_sdb module")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+
+    sdb_kwargs = {"load_driver": not args.no_driver}
+    if args.sdb_device is not None:
+        sdb_kwargs["sdb_device"] = args.sdb_device
+    broker = SdbBroker(args.buff_size, args.buff_num, args.socket, args.slots, args.m4fw, args.verbose, **sdb_kwargs)
+    broker.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
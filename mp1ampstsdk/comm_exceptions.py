@@ -41,4 +41,15 @@ class CommSDKInvalidOperationException(Exception):
         Args:
             msg (str): The message to raise.
         """
-        super(CommSDKInvalidOperationException, self).__init__(msg)
\ No newline at end of file
+        super(CommSDKInvalidOperationException, self).__init__(msg)
+
+
+class CommSDKTimeoutException(CommSDKInvalidOperationException):
+    """Exception raised whenever the M4 does not answer a command in time."""
+
+    def __init__(self, msg):
+        """Constructor
+        Args:
+            msg (str): The message to raise.
+        """
+        super(CommSDKTimeoutException, self).__init__(msg)
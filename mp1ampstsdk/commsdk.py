@@ -39,12 +39,34 @@ from abc import abstractmethod
 from serial import SerialException
 from serial import SerialTimeoutException
 from mp1ampstsdk.comm_exceptions import CommSDKInvalidOperationException
+from mp1ampstsdk.comm_exceptions import CommSDKTimeoutException
+from mp1ampstsdk.remoteproc import RemoteProc
+from mp1ampstsdk.remoteproc import DFT_REMOTEPROC
+from mp1ampstsdk.remoteproc import DFT_FIRMWARE_DIR
+from mp1ampstsdk.remoteproc import DFT_RUN_DIR
+from mp1ampstsdk.remoteproc import DFT_BOOT_TIMEOUT_s
+from mp1ampstsdk.remoteproc import DFT_STOP_TIMEOUT_s
+from mp1ampstsdk.framing import FrameDecoder
+from mp1ampstsdk.framing import FrameReader
+from mp1ampstsdk.framing import TerminatorSplitter
+from mp1ampstsdk.framing import FRAME_TEXT
+from mp1ampstsdk.framing import encode_frame
+from mp1ampstsdk.framing import decode_payload
+from mp1ampstsdk.dispatcher import NotificationDispatcher
+from mp1ampstsdk.dispatcher import DFT_WORKERS
+from mp1ampstsdk.metrics import ChannelCounters
+from mp1ampstsdk.metrics import DFT_LATENCY_BUCKETS_s
+from mp1ampstsdk.metrics import NAMESPACE
+from mp1ampstsdk.metrics import REGISTRY
+from collections import OrderedDict
+from concurrent.futures import Future
 import serial
+import queue
+import select
 import threading  
 import os
 import sys
 import time
-import shutil
 
 
 # CONSTANTS
@@ -53,6 +75,15 @@ DFT_TERMINATOR = ';'
 """Serial msgs terminator character."""
 BINARY_ANSW_MAX_LENGHT = 512
 """Maximum allowed binary message lenght."""
+SEQ_ID_PREFIX = '#'
+"""First character of the sequence ID prepended to msgs in correlated mode."""
+SEQ_ID_SEPARATOR = ':'
+"""Character separating the sequence ID from the msg in correlated mode."""
+SEQ_ID_MODULO = 0x10000
+"""Sequence IDs wrap around at this value (4 hex digits)."""
+METRICS_CALLS = ("cmd_get", "cmd_query", "cmd_submit")
+"""Values of the call label of the command metrics; in correlated mode every
+command is counted as cmd_submit."""
 
 
 # CLASSES
@@ -70,15 +101,17 @@ class M4ResponseThread(threading.Thread):
         try:
             if self._verbose:
                 print("CommAPI: Starting M4ResponseThread.")
-            self._response = self._caller._serial_port_cmd.read_until(self._terminator,None)
+            self._response = self._caller._read_msg(self._caller._cmd_reader,
+                time.perf_counter() + self._caller._serial_port_cmd.timeout)
+            self._caller._observe_response("cmd_get", self._caller._cmd_start, self._response)
             self._caller._lock_cmd.release()
             if self._verbose:
                 print("CommAPI: Lock released.")
-                print("CommAPI: Rx Response: \"%s\"" % (self._response.decode("utf-8")))
+                print("CommAPI: Rx Response: \"%s\"" % (self._response))
             if self._caller._response_listener:
-                if self._response.decode("utf-8") == "":  # TODO command timeout: generate ad-hoc msg 
-                    self._response = "Timeout".encode("utf-8")
-                self._caller._response_listener.on_m4_response(self._response.decode("utf-8"))                    
+                if self._response == "" or self._response is None:  # TODO command timeout: generate ad-hoc msg 
+                    self._response = "Timeout"
+                self._caller._response_listener.on_m4_response(self._response)                    
             else:
                 raise CommSDKInvalidOperationException("CommAPI: Error response listener to be added.")                
 
@@ -121,9 +154,7 @@ class M4NotificationThread(threading.Thread):
             # https://wiki.st.com/stm32mpu/wiki/Coprocessor_management_troubleshooting_grid
             if self._verbose:
                 print("CommAPI: Starting M4NotificationThread.")
-            self._caller._serial_port_notification.write(self._terminator)
-            #ret = self._caller._serial_port_notification.read_until(self._terminator, None)   # wait for spurious echo if any                
-            self._caller._serial_port_notification.flush() 
+            self._caller._enable_notifications()
 
             while True:
                 if self._evt_stop_notification.isSet():
@@ -131,19 +162,19 @@ class M4NotificationThread(threading.Thread):
                     if self._verbose:
                         print("CommAPI: Stopping M4NotificationThread.")
                     return
-                self._notification = self._caller._serial_port_notification.read_until(self._terminator, None)
+                self._notification = self._caller._read_msg(self._caller._ntf_reader,
+                    time.perf_counter() + self._caller._serial_port_notification.timeout)
+                if self._notification is None:
+                    self._notification = ""
                 if self._verbose and self._notification != "":
-                    print("CommAPI: Rx Notification: \"%s\""% (self._notification.decode("utf-8")))
-                if self._notification.decode("utf-8") != "":
-                    if self._caller._notification_listener:
-                        self._caller._notification_listener.on_m4_notification(self._notification.decode("utf-8"))
-                    else:
-                        raise CommSDKInvalidOperationException("CommAPI: Error notification listener to be added.")
+                    print("CommAPI: Rx Notification: \"%s\""% (self._notification))
+                if self._notification != "":
+                    # Only queued to the listeners, unless notification_workers is 0.
+                    self._caller._notifications.dispatch(self._notification)
 
         except (Exception, SerialException, SerialTimeoutException, CommSDKInvalidOperationException) as e:
             if self._caller._serial_port_notification.is_open:
                 self._caller._serial_port_notification.close()
-            self._caller._notification_listener = None            
             raise e
 
 
@@ -160,6 +191,48 @@ class M4NotificationThread(threading.Thread):
             print("CommAPI: Deleting M4NotificationThread.")
 
 
+class M4DispatcherThread(threading.Thread):
+    """Reads the command port in correlated mode and resolves the pending
+    requests by sequence ID, in whatever order the M4 answers them.
+    """
+
+    _DISPATCH_TICK_s = 0.05
+    """Read timeout, bounds the latency of the expired requests sweep."""
+
+    def __init__(self, caller, terminator, verbose=False):
+        super().__init__()
+        self.daemon = True
+        self._caller = caller
+        self._evt_stop_dispatcher = threading.Event()
+        self._terminator = terminator
+        self._verbose = verbose
+
+
+    def run(self):
+        try:
+            if self._verbose:
+                print("CommAPI: Starting M4DispatcherThread.")
+            reader = self._caller._cmd_reader
+            while not self._evt_stop_dispatcher.is_set():
+                frame = reader.read(time.perf_counter() + self._DISPATCH_TICK_s)
+                if frame is not None:
+                    self._caller._on_correlated_frame(frame)
+                self._caller._expire_requests(time.monotonic())
+            if self._verbose:
+                print("CommAPI: Stopping M4DispatcherThread.")
+
+        except (Exception, SerialException, SerialTimeoutException, CommSDKInvalidOperationException) as e:
+            self._caller._fail_requests(e)
+            raise e
+
+
+    def join(self, timeout=None):
+        if self._verbose:
+            print("CommAPI: Joining M4DispatcherThread.")
+        self._evt_stop_dispatcher.set()
+        super().join(timeout)
+
+
 class CommAPI():
     """CommAPI class.
     This class manages the communication via OpenAMP serial Rpmsg between the A7
@@ -172,7 +245,7 @@ class CommAPI():
     _SERIAL_PORT_NOTIFICATION_TIMEOUT_s = 1
     """Timeout for notifications."""
 
-    def __init__(self, serial_port_cmd, serial_port_notification=None, m4_fw_name=None, terminator=DFT_TERMINATOR, verbose=False):
+    def __init__(self, serial_port_cmd, serial_port_notification=None, m4_fw_name=None, terminator=DFT_TERMINATOR, verbose=False, correlated=False, remoteproc=DFT_REMOTEPROC, firmware_dir=DFT_FIRMWARE_DIR, boot_timeout=DFT_BOOT_TIMEOUT_s, force_restart=False, framing=False, frame_crc=False, notification_workers=DFT_WORKERS, io_core=None, metrics=None, keep_running=True, run_dir=DFT_RUN_DIR):
         """Constructor.
         :param serial_port_cmd: Absolute path of the Serial Port device used for commands and responses.
             E.g.: '/dev/ttyRPMSG0'.
@@ -198,11 +271,86 @@ class CommAPI():
 
         :param verbose: If True, enables verbosity on output.
         :type verbose: boolean
+
+        :param correlated: If True, enables the correlated mode: every msg is
+            prefixed with a sequence ID (e.g. '#002A:') that the M4 firmware has
+            to echo in front of its response, so that many commands can be in
+            flight at once and be answered out of order (see :meth:`cmd_submit`).
+        :type correlated: boolean
+
+        :param remoteproc: Sysfs directory of the remoteproc instance.
+            E.g.: '/sys/class/remoteproc/remoteproc0', or the root created by
+            :class:`mp1ampstsdk.emulator.FakeRemoteProc`.
+        :type remoteproc: str
+
+        :param firmware_dir: Directory the M4 firmware is copied to.
+        :type firmware_dir: str
+
+        :param boot_timeout: Max time in seconds for the M4 firmware to start
+            and its virtual COM ports to be ready (see :meth:`get_startup_timeline`).
+        :type boot_timeout: float
+
+        :param force_restart: If True, restarts the M4 firmware even when the
+            same image is already running.
+        :type force_restart: boolean
+
+        :param framing: If True, enables the framed mode: msgs are exchanged as
+            length-prefixed frames (see :mod:`mp1ampstsdk.framing`) instead of
+            terminator separated strings, so that str and binary msgs are
+            handled the same way, payloads may contain any byte and each
+            response is read by size. The M4 firmware has to use the same frames.
+        :type framing: boolean
+
+        :param frame_crc: If True, the frames sent carry a CRC-32.
+        :type frame_crc: boolean
+
+        :param notification_workers: Number of threads calling the
+            notification listeners (see :mod:`mp1ampstsdk.dispatcher`), so that
+            the thread reading the notifications never waits for them; 0 to
+            call the listeners from the reading thread. No thread is started
+            without a serial port for notifications.
+        :type notification_workers: int
+
+        :param io_core: I/O thread reading the ports in place of the threads
+            of this object: the notifications, the responses of the non
+            blocking cmd_get and, in correlated mode, every response are read
+            from its callbacks. The blocking calls still read from the calling
+            thread.
+        :type io_core: :class:`mp1ampstsdk.iocore.IOCore`
+
+        :param metrics: Registry of the metrics updated by this object (round-trip
+            time, timeouts and busy rejections of the commands, bytes and msgs of
+            each port, see :mod:`mp1ampstsdk.metrics`), labelled with the port
+            paths; defaults to :data:`mp1ampstsdk.metrics.REGISTRY`.
+        :type metrics: :class:`mp1ampstsdk.metrics.MetricsRegistry`
+
+        :param keep_running: If True, the M4 firmware is left running on
+            release, so that the next object using the same image finds it
+            running and does not restart it; if False, release stops the
+            firmware started, or found running, for m4_fw_name.
+        :type keep_running: boolean
+
+        :param run_dir: Directory of the records of the running firmware,
+            cleared at reboot (see :mod:`mp1ampstsdk.remoteproc`).
+        :type run_dir: str
         """
         try:
+            t0 = time.monotonic()
+            self._notifications = None
             self._verbose = verbose
+            self._framing = framing
+            self._frame_crc = frame_crc
+            self._rproc = RemoteProc(remoteproc, firmware_dir, run_dir, verbose, "CommAPI")
+            self._keep_running = keep_running
+            self._startup_timeline = OrderedDict()
+            self._correlated = correlated
+            self._th_dispatcher = None
             self._response_listener = None
-            self._notification_listener = None
+            self._th_notification = None
+            self._io_core = io_core
+            self._ntf_registered = False
+            self._response_timer = None
+            self._expire_timer = None
             self._released = False
 
             if self._verbose:
@@ -215,28 +363,12 @@ class CommAPI():
             self._m4_fw_name = None            
             self._m4_fw_path = None
             if m4_fw_name != None:
-                if os.path.isfile(m4_fw_name):
-                    self._m4_fw_path, self._m4_fw_name = os.path.split(m4_fw_name)
-                    shutil.copyfile(m4_fw_name, "/lib/firmware/" + self._m4_fw_name)
-
-                # FIXME check if FW is already running: if not rise an exception
-                if self._is_m4_firmware_running():
-                    self._stop_m4_firmware()
-                    # Checking for virtual com ports closed.
-                    if os.path.exists(serial_port_cmd) or \
-                        os.path.exists(serial_port_notification):
-                        raise CommSDKInvalidOperationException(
-                            "CommAPI: OpenAMP error. Please reboot your device.")
-
-                # start m4 Fw
-                self._set_m4_firmware_name(self._m4_fw_name)
-                self._start_m4_firmware()
-                # Checking for virtual com ports open.
-                while not os.path.exists(serial_port_cmd):
-                    pass
-                if serial_port_notification:
-                    while not os.path.exists(serial_port_notification):
-                        pass
+                self._m4_fw_path, self._m4_fw_name = os.path.split(m4_fw_name)
+                # (Re)starts the M4 Fw and waits for the virtual com ports.
+                self._rproc.boot(m4_fw_name, [serial_port_cmd, serial_port_notification], boot_timeout, force_restart)
+                self._startup_timeline.update(self._rproc.timeline)
+                self._startup_timeline.pop("total", None)
+            mark = time.monotonic()
 
             self._serial_port_cmd = serial.Serial()
             self._serial_port_cmd.port = serial_port_cmd
@@ -255,11 +387,40 @@ class CommAPI():
                     self._serial_port_notification.open()
                 if not self._serial_port_notification.is_open:            
                     raise CommSDKInvalidOperationException("CommAPI: Error: opening serial port for notifications failed.")
+                self._notifications = NotificationDispatcher(notification_workers, verbose=verbose)
+
+            self._init_metrics(metrics if metrics is not None else REGISTRY,
+                serial_port_cmd, serial_port_notification)
+
+            # Msgs are read through buffered readers, that split the bytes
+            # available on a port into msgs and keep the rest for the next read.
+            self._cmd_reader = self._new_reader(self._serial_port_cmd, self._cmd_counters)
+            self._ntf_reader = None
+            if serial_port_notification != None:
+                self._ntf_reader = self._new_reader(self._serial_port_notification, self._ntf_counters)
 
             self._response = None
+            self._cmd_start = None
             self._lock_cmd = threading.Lock()
+            self._startup_timeline["open"] = time.monotonic() - mark
+            self._startup_timeline["total"] = time.monotonic() - t0
+
+            if self._correlated:
+                self._seq_id = 0
+                self._pending = {}
+                self._unsolicited = queue.Queue()
+                self._lock_pending = threading.Lock()
+                self._lock_write = threading.Lock()
+                if self._io_core is not None:
+                    self._io_core.call(self._start_correlated_io)
+                else:
+                    self._th_dispatcher = M4DispatcherThread(self, self._terminator, self._verbose)
+                    self._th_dispatcher.start()
 
         except (Exception, SerialException, SerialTimeoutException, CommSDKInvalidOperationException) as e:
+            if self._notifications is not None:
+                self._notifications.close()
+                self._notifications = None
             raise e
 
 
@@ -278,6 +439,21 @@ class CommAPI():
         try:
             if self._verbose:
                 print("CommAPI: Releasing resources.")
+            if self._th_dispatcher is not None:
+                self._th_dispatcher.join()
+                self._th_dispatcher = None
+                self._fail_requests(CommSDKInvalidOperationException("CommAPI: Error: object released."))
+            if self._expire_timer is not None:
+                self._io_core.call(self._stop_correlated_io)
+                self._fail_requests(CommSDKInvalidOperationException("CommAPI: Error: object released."))
+            if self._th_notification is not None:
+                self._th_notification.join()
+                self._th_notification = None
+            if self._ntf_registered:
+                self._io_core.unregister(self._serial_port_notification)
+                self._ntf_registered = False
+            if self._notifications is not None:
+                self._notifications.close()
             if hasattr(self, '_serial_port_cmd') and \
                 self._serial_port_cmd and \
                 self._serial_port_cmd.is_open:
@@ -288,8 +464,9 @@ class CommAPI():
                 self._serial_port_notification.is_open:
                 self._serial_port_notification.close()
                 del self._serial_port_notification
-            if self._is_m4_firmware_running():
-                self._stop_m4_firmware()
+            if not self._keep_running and self._m4_fw_name is not None and \
+                self._is_m4_firmware_running() and self._get_m4_firmware_name() == self._m4_fw_name:
+                self._rproc.shutdown(DFT_STOP_TIMEOUT_s)
             self._released = True
             del self
 
@@ -306,51 +483,74 @@ class CommAPI():
         : if>0 response is sent back throug CommAPIListener call back on_m4_notification (async mode)
         : return: for blocking call (timeout =0 or -1) str type response msg, if no response return ''
                   for non blocking call (timout >0) return 0 if ok, -1 if error
+        : in correlated mode the command channel is never locked: -1 is not returned and
+          binary msgs are not allowed (see cmd_submit)
         :type listener: :class:
         """
         try:
 
+            if self._correlated:
+                return self._cmd_get_correlated(msg, timeout)
+
             if self._lock_cmd.acquire(False):
                 if self._verbose:
                     print("CommAPI: Lock acquired.")
+                if self._framing and (timeout == 0 or timeout == -1):   # blocking call
+                    try:
+                        start = time.perf_counter()
+                        if msg is not None:
+                            self._write_cmd(self._encode(msg))
+                        self._response = self._read_msg(self._cmd_reader,
+                            start + self._SERIAL_PORT_RESPONSE_TIMEOUT_s)
+                    finally:
+                        self._lock_cmd.release()
+                    if msg is not None:
+                        self._observe_response("cmd_get", start, self._response)
+                    if self._response is None:  # if no msg rx return '' (b'' for a binary msg)
+                        return "" if msg is None or type(msg) == str else b""
+                    return self._response
                 if timeout == 0 or timeout ==-1:   # blocking call
-                    self._serial_port_cmd.timeout = None
                     if msg==None:  # no cmd_xxx to send, just check for M4 spontaneous msg
-                        self._serial_port_cmd.timeout = 1                    
-                        self._response = self._serial_port_cmd.read_until(self._terminator,None)
+                        self._response = self._read_msg(self._cmd_reader, time.perf_counter() + 1)
                         self._lock_cmd.release()
                         if self._verbose:
                             print("CommAPI: Lock released.")
-                        return self._response.decode("utf-8") # if no msg rx return ''
+                        return self._response or "" # if no msg rx return ''
                     if type(msg) == str:
                         #print("CommAPI: Tx:", msg.encode("utf-8"))
-                        self._serial_port_cmd.write(msg.encode("utf-8"))
+                        start = time.perf_counter()
+                        self._write_cmd(msg.encode("utf-8"))
                         self._serial_port_cmd.flush()
-                        self._serial_port_cmd.timeout = 1
                         time.sleep(0.5)  # give M4 time to respond
-                        self._response = self._serial_port_cmd.read_until(self._terminator,None)
+                        self._response = self._read_msg(self._cmd_reader, time.perf_counter() + 1)
                         self._lock_cmd.release()
+                        self._observe_response("cmd_get", start, self._response)
                         if self._verbose:
                             print("CommAPI: Lock released.")
-                        return self._response.decode("utf-8")
+                        return self._response or ""
                     else:  # binary msg type
                         #print("CommAPI: Tx msg type: ", type(msg))
                         #print(msg, len(msg))
-                        self._serial_port_cmd.timeout = 1
-                        self._serial_port_cmd.write(msg)
+                        start = time.perf_counter()
+                        self._write_cmd(msg)
                         self._serial_port_cmd.flush()
-                        self._response = self._serial_port_cmd.read(BINARY_ANSW_MAX_LENGHT) 
+                        self._response = self._cmd_reader.read_bytes(BINARY_ANSW_MAX_LENGHT, time.perf_counter() + 1)
                         self._lock_cmd.release()
+                        self._observe_response("cmd_get", start, self._response)
                         if self._verbose:
                             print("CommAPI: Lock released.")
                         return self._response
 
                 elif timeout > 0 and self._response_listener != None:  # non blocking call
-                    self._th_comm_rx = M4ResponseThread(self, self._terminator, self._verbose)
-                    self._th_comm_rx.start()                       
-                    #print("CommAPI: Tx:", msg.encode("utf-8")+'\n'.encode("utf-8"))
                     self._serial_port_cmd.timeout = timeout
-                    self._serial_port_cmd.write(msg.encode("utf-8"))
+                    self._cmd_start = time.perf_counter()
+                    if self._io_core is not None:
+                        self._io_core.call(self._start_response_io, timeout)
+                    else:
+                        self._th_comm_rx = M4ResponseThread(self, self._terminator, self._verbose)
+                        self._th_comm_rx.start()                       
+                    #print("CommAPI: Tx:", msg.encode("utf-8")+'\n'.encode("utf-8"))
+                    self._write_cmd(self._encode(msg))
                     self._serial_port_cmd.flush()
                 elif (timeout): 
                     self._lock_cmd.release()
@@ -359,12 +559,243 @@ class CommAPI():
                         print("CommAPI: ERROR call add_notification_listener before.")  # TODO mange API usage error & raise exception
                 return 0
             else:   # channel locked by another async outstanding command 
+                self._m_busy["cmd_get"].inc()
                 return -1
 
         except (Exception, SerialException, SerialTimeoutException, CommSDKInvalidOperationException) as e:
             raise e
 
 
+    def cmd_query(self, msg, deadline=_SERIAL_PORT_RESPONSE_TIMEOUT_s):
+        """Send a request to M4 and block until its response, latency optimised.
+        Unlike the blocking cmd_get there is no fixed delay before reading and the
+        port timeout is left untouched: the command port is waited on directly and
+        the call returns as soon as the terminator arrives.
+
+        :param msg: str type msg (response read up to the terminator) or binary
+            type msg (response read up to BINARY_ANSW_MAX_LENGHT bytes); in
+            framed mode the response is read by size and its type (str or
+            bytes) is the one of the frame.
+        :type msg: str or bytes
+
+        :param deadline: maximum seconds to wait for the response.
+        :type deadline: float
+
+        :return: tuple (response, rtt) where response is the str (or bytes) type
+            response msg, '' (or b'') if none came before the deadline, and rtt is
+            the measured round-trip time in seconds, None on timeout.
+        """
+        try:
+            if self._correlated:
+                start = time.perf_counter()
+                try:
+                    response = self.cmd_submit(msg, deadline).result()
+                except CommSDKTimeoutException:
+                    return "", None
+                return response, time.perf_counter() - start
+
+            if not self._lock_cmd.acquire(False):
+                self._m_busy["cmd_query"].inc()
+                raise CommSDKInvalidOperationException("CommAPI: Error cmd_query(): locked by outstanding command.")
+            try:
+                binary = type(msg) != str
+                start = time.perf_counter()
+                self._write_cmd(self._encode(msg))
+                if self._framing:
+                    response = self._read_msg(self._cmd_reader, start + deadline)
+                    rtt = time.perf_counter() - start
+                    self._observe_response("cmd_query", start, response)
+                    if response is None:
+                        return (b"" if binary else ""), None
+                    return response, rtt
+                response = self._read_response(start + deadline, binary)
+                rtt = time.perf_counter() - start
+                self._observe_response("cmd_query", start, response)
+            finally:
+                self._lock_cmd.release()
+            if not response:
+                return response if binary else "", None
+            return (response if binary else response.decode("utf-8")), rtt
+
+        except (Exception, SerialException, SerialTimeoutException, CommSDKInvalidOperationException) as e:
+            raise e
+
+
+    def _read_response(self, deadline, binary=False):
+        """Read a response frame from the command port until the perf_counter()
+        deadline. Bytes following the terminator are kept for the next call.
+        """
+        if binary:
+            return self._cmd_reader.read_bytes(BINARY_ANSW_MAX_LENGHT, deadline)
+        response = self._cmd_reader.read(deadline)
+        return response if response is not None else b""
+
+
+    def _new_reader(self, port, counters):
+        if self._framing:
+            return FrameReader(port, FrameDecoder(), counters)
+        return FrameReader(port, TerminatorSplitter(self._terminator), counters)
+
+
+    def _init_metrics(self, registry, serial_port_cmd, serial_port_notification):
+        self._m_roundtrip = {}
+        self._m_timeouts = {}
+        self._m_busy = {}
+        for call in METRICS_CALLS:
+            labels = {"port": serial_port_cmd, "call": call}
+            self._m_roundtrip[call] = registry.histogram(NAMESPACE + "_comm_roundtrip_seconds",
+                "Time from sending a command to receiving its response.", DFT_LATENCY_BUCKETS_s, labels)
+            self._m_timeouts[call] = registry.counter(NAMESPACE + "_comm_timeouts_total",
+                "Commands not answered before their timeout.", labels)
+            self._m_busy[call] = registry.counter(NAMESPACE + "_comm_busy_total",
+                "Commands rejected as an outstanding command held the command channel.", labels)
+        self._cmd_counters = ChannelCounters(registry, "comm", serial_port_cmd)
+        self._ntf_counters = None
+        if serial_port_notification != None:
+            self._ntf_counters = ChannelCounters(registry, "comm", serial_port_notification)
+
+
+    def _observe_response(self, call, start, response):
+        """Count the response of a command sent at the perf_counter() start:
+        its round-trip time, or a timeout if it is None or empty."""
+        if not response:
+            self._m_timeouts[call].inc()
+        else:
+            self._m_roundtrip[call].observe(time.perf_counter() - start)
+
+
+    def _write_cmd(self, data):
+        self._serial_port_cmd.write(data)
+        self._cmd_counters.tx_bytes.inc(len(data))
+        self._cmd_counters.tx_msgs.inc()
+
+
+    def _read_msg(self, reader, deadline):
+        """Read a msg until the perf_counter() deadline.
+        :return: str msg (bytes for a binary frame), None if no msg came.
+        """
+        frame = reader.read(deadline)
+        return self._decode(frame) if frame is not None else None
+
+
+    def _decode(self, frame):
+        if self._framing:
+            return decode_payload(*frame)
+        return frame.decode("utf-8")
+
+
+    def _encode(self, msg):
+        """Return the bytes sent for a str or binary msg."""
+        if self._framing:
+            return encode_frame(msg, self._frame_crc)
+        return msg if type(msg) != str else msg.encode("utf-8")
+
+
+    def cmd_submit(self, msg, timeout=_SERIAL_PORT_RESPONSE_TIMEOUT_s):
+        """Send a request to M4 in correlated mode without waiting for the response.
+        Any number of requests can be outstanding at the same time; each one is
+        resolved independently when the response carrying its sequence ID comes.
+
+        :param msg: str type msg to be sent (the sequence ID is prepended).
+        :type msg: str
+
+        :param timeout: seconds to wait for the response before failing the future
+            with :class:`CommSDKTimeoutException`.
+        :type timeout: float
+
+        :return: a :class:`concurrent.futures.Future` resolved with the str type
+            response msg, without the sequence ID.
+        """
+        try:
+            if not self._correlated:
+                raise CommSDKInvalidOperationException("CommAPI: Error cmd_submit(): correlated mode not enabled.")
+            if type(msg) != str:
+                raise CommSDKInvalidOperationException("CommAPI: Error cmd_submit(): only str type msgs can be correlated.")
+            future = Future()
+            future.set_running_or_notify_cancel()
+            with self._lock_pending:
+                seq_id = self._seq_id
+                if seq_id in self._pending:
+                    self._m_busy["cmd_submit"].inc()
+                    raise CommSDKInvalidOperationException("CommAPI: Error cmd_submit(): too many outstanding commands.")
+                self._seq_id = (seq_id + 1) % SEQ_ID_MODULO
+                self._pending[seq_id] = (future, time.monotonic() + timeout, time.perf_counter())
+            data = self._encode("%s%04X%s%s" % (SEQ_ID_PREFIX, seq_id, SEQ_ID_SEPARATOR, msg))
+            with self._lock_write:
+                self._write_cmd(data)
+                self._serial_port_cmd.flush()
+            return future
+
+        except (Exception, SerialException, SerialTimeoutException, CommSDKInvalidOperationException) as e:
+            raise e
+
+
+    def _cmd_get_correlated(self, msg, timeout):
+        if msg is None:  # just check for M4 spontaneous msg
+            try:
+                return self._unsolicited.get(timeout=self._SERIAL_PORT_RESPONSE_TIMEOUT_s)
+            except queue.Empty:
+                return ""
+        if timeout == 0 or timeout == -1:   # blocking call
+            try:
+                return self.cmd_submit(msg).result()
+            except CommSDKTimeoutException:
+                return ""
+        if self._response_listener is None:
+            if self._verbose:
+                print("CommAPI: ERROR call add_response_listener before.")
+            return 0
+        listener = self._response_listener
+        def on_done(future):
+            if future.exception() is not None:
+                listener.on_m4_response("Timeout")
+            else:
+                listener.on_m4_response(future.result())
+        self.cmd_submit(msg, timeout).add_done_callback(on_done)
+        return 0
+
+
+    def _dispatch_response(self, response):
+        """Resolve the pending request matching the sequence ID of a response."""
+        seq_id = None
+        if response.startswith(SEQ_ID_PREFIX):
+            sep = response.find(SEQ_ID_SEPARATOR, 1)
+            if sep != -1:
+                try:
+                    seq_id = int(response[1:sep], 16)
+                except ValueError:
+                    pass
+        with self._lock_pending:
+            pending = self._pending.pop(seq_id, None)
+        if pending is None:
+            if self._verbose:
+                print("CommAPI: Rx uncorrelated msg: \"%s\"" % (response))
+            self._unsolicited.put(response)
+            return
+        self._m_roundtrip["cmd_submit"].observe(time.perf_counter() - pending[2])
+        if self._verbose:
+            print("CommAPI: Rx Response %04X: \"%s\"" % (seq_id, response))
+        pending[0].set_result(response[sep + 1:])
+
+
+    def _expire_requests(self, now):
+        with self._lock_pending:
+            expired = [seq_id for seq_id, (future, deadline, start) in self._pending.items() if deadline <= now]
+            futures = [self._pending.pop(seq_id)[0] for seq_id in expired]
+        if expired:
+            self._m_timeouts["cmd_submit"].inc(len(expired))
+        for seq_id, future in zip(expired, futures):
+            future.set_exception(CommSDKTimeoutException("CommAPI: Timeout waiting for response %04X." % (seq_id)))
+
+
+    def _fail_requests(self, exception):
+        with self._lock_pending:
+            futures = [pending[0] for pending in self._pending.values()]
+            self._pending.clear()
+        for future in futures:
+            future.set_exception(exception)
+
+
     def cmd_set(self, msg=None, timeout=0):
         """Send a command to M4. 
         :msg: same as cmd_get
@@ -373,20 +804,40 @@ class CommAPI():
         return self.cmd_get(msg, timeout)
 
 
-    def add_notification_listener(self, listener):
-        """Add a notification listener.
+    def add_notification_listener(self, listener, prefix=None, batch=None):
+        """Add a notification listener. Several listeners can be added, each
+        one receiving the notifications in order.
 
         :param listener: Listener to be added.
-        :type listener: :class:``
+        :type listener: :class:`CommAPINotificationListener`, or
+            :class:`CommAPINotificationBatchListener` with a batch policy.
+
+        :param prefix: Prefix, or list of prefixes, of the notifications to
+            deliver to the listener, e.g. 'temp:'; None for every notification.
+        :type prefix: str
+
+        :param batch: Policy to deliver the notifications in batches, with
+            optional coalescing of the notifications of the same key.
+        :type batch: :class:`mp1ampstsdk.dispatcher.BatchPolicy`
         """
         try:
             if listener is None:
                 raise CommSDKInvalidOperationException("CommAPI: Error add_notification_listener(): provide a valid listener.")
-            self._notification_listener = listener
+            if self._notifications is None:
+                raise CommSDKInvalidOperationException("CommAPI: Error add_notification_listener(): no serial port for notifications.")
+            self._notifications.subscribe(listener, prefix, batch)
+            if self._th_notification is not None or self._ntf_registered:
+                return 0
             if not self._serial_port_notification.is_open:
                 self._serial_port_notification.open()                
             if not self._serial_port_notification.is_open:            
+                self._notifications.unsubscribe(listener)
                 raise CommSDKInvalidOperationException("CommAPI: Error add_notification_listener(): serial port opening failed.")
+            if self._io_core is not None:
+                self._enable_notifications()
+                self._io_core.register(self._serial_port_notification, self._on_notification_readable)
+                self._ntf_registered = True
+                return 0
             self._th_notification = M4NotificationThread(self, self._terminator, self._verbose)
             self._th_notification.start()
             return 0
@@ -396,27 +847,143 @@ class CommAPI():
 
 
     def remove_notification_listener(self, listener):
-        """Remove a notification listener.
+        """Remove a notification listener; the notifications port is closed
+        with the last one.
         """
         try:
 
             if listener is None:
                 raise CommSDKInvalidOperationException("CommAPI: Error remove_notification_listener(): provide a valid listener.")
-            if not self._notification_listener:
+            try:
+                if self._notifications is None:
+                    raise CommSDKInvalidOperationException("CommAPI: Error: no serial port for notifications.")
+                self._notifications.unsubscribe(listener)
+            except CommSDKInvalidOperationException:
                 raise CommSDKInvalidOperationException("CommAPI: Error remove_notification_listener(): the listener was not added.") 
-            self._th_notification.join()    # stop the listening thread
+            if self._notifications.has_subscribers():
+                return 0
+            if self._ntf_registered:
+                self._io_core.unregister(self._serial_port_notification)
+                self._ntf_registered = False
+            else:
+                self._th_notification.join()    # stop the listening thread
             if self._serial_port_notification.is_open:
                 self._serial_port_notification.close()
             if self._serial_port_notification.is_open:            
                 raise CommSDKInvalidOperationException("CommAPI: Error remove_notification_listener(): serial port closing failed.")                                
             self._th_notification = None    # delete the listening thread
-            self._notification_listener = None
             return 0
 
         except (Exception, SerialException, SerialTimeoutException, CommSDKInvalidOperationException) as e:
             raise e
 
 
+    def _enable_notifications(self):
+        # Enabling spontaneous notifications by writing the OpenAMP RPMSG port
+        # at least once, see M4NotificationThread.
+        data = encode_frame("", self._frame_crc) if self._framing else self._terminator
+        self._serial_port_notification.write(data)
+        self._serial_port_notification.flush()
+        self._ntf_counters.tx_bytes.inc(len(data))
+        self._ntf_counters.tx_msgs.inc()
+
+
+    def _on_notification_readable(self):
+        # IOCore callback, in place of M4NotificationThread.
+        try:
+            frames = self._ntf_reader.read_ready()
+        except CommSDKInvalidOperationException as e:
+            self._io_core.unregister(self._serial_port_notification)
+            self._ntf_registered = False
+            raise e
+        for frame in frames:
+            notification = self._decode(frame)
+            if notification == "":
+                continue
+            if self._verbose:
+                print("CommAPI: Rx Notification: \"%s\""% (notification))
+            self._notifications.dispatch(notification)
+
+
+    def _start_response_io(self, timeout):
+        # IOCore call, in place of M4ResponseThread.
+        self._io_core.register(self._serial_port_cmd, self._on_response_readable)
+        self._response_timer = self._io_core.call_later(timeout, self._finish_response_io, None)
+
+
+    def _on_response_readable(self):
+        try:
+            frames = self._cmd_reader.read_ready(1)
+        except CommSDKInvalidOperationException as e:
+            self._finish_response_io(None)
+            raise e
+        if frames:
+            self._finish_response_io(self._decode(frames[0]))
+
+
+    def _finish_response_io(self, response):
+        self._io_core.unregister(self._serial_port_cmd)
+        self._response_timer.cancel()
+        self._response_timer = None
+        self._response = response
+        self._observe_response("cmd_get", self._cmd_start, response)
+        self._lock_cmd.release()
+        if self._verbose:
+            print("CommAPI: Lock released.")
+            print("CommAPI: Rx Response: \"%s\"" % (self._response))
+        if not self._response_listener:
+            raise CommSDKInvalidOperationException("CommAPI: Error response listener to be added.")
+        if response == "" or response is None:
+            response = "Timeout"
+        self._response_listener.on_m4_response(response)
+
+
+    def _start_correlated_io(self):
+        # IOCore call, in place of M4DispatcherThread.
+        self._io_core.register(self._serial_port_cmd, self._on_correlated_readable)
+        self._expire_timer = self._io_core.call_later(M4DispatcherThread._DISPATCH_TICK_s, self._on_expire_timer)
+
+
+    def _stop_correlated_io(self):
+        self._expire_timer.cancel()
+        self._expire_timer = None
+        self._io_core.unregister(self._serial_port_cmd)
+
+
+    def _on_correlated_readable(self):
+        try:
+            frames = self._cmd_reader.read_ready()
+        except CommSDKInvalidOperationException as e:
+            self._stop_correlated_io()
+            self._fail_requests(e)
+            raise e
+        for frame in frames:
+            self._on_correlated_frame(frame)
+
+
+    def _on_expire_timer(self):
+        self._expire_requests(time.monotonic())
+        self._expire_timer = self._io_core.call_later(M4DispatcherThread._DISPATCH_TICK_s, self._on_expire_timer)
+
+
+    def _on_correlated_frame(self, frame):
+        if self._framing and frame[0] != FRAME_TEXT:
+            # binary msgs carry no sequence ID
+            self._unsolicited.put(decode_payload(*frame))
+        else:
+            self._dispatch_response(self._decode(frame))
+
+
+    def get_notification_subscribers(self):
+        """Return the state of the notification listeners, see
+        :meth:`mp1ampstsdk.dispatcher.NotificationDispatcher.get_subscribers`.
+        :return: list of dicts, empty without a serial port for notifications.
+        """
+        if self._notifications is None:
+            return []
+        return self._notifications.get_subscribers()
+
+
     def add_response_listener(self, listener):
         """Add a response listener.
 
@@ -463,47 +1030,33 @@ class CommAPI():
             raise e        
 
 
-    def _is_m4_firmware_running(self):        
-        with open('/sys/class/remoteproc/remoteproc0/state', 'r') as fw_state_fd:
-            fw_state = fw_state_fd.read(50).strip()
-            fw_state_fd.close()
-            if fw_state == "running":
-                return True
-            return False
+    def get_startup_timeline(self):
+        """Return the durations in seconds of the construction phases: copy,
+        stop, start and device_ready of the M4 Fw when m4_fw_name is given,
+        then open of the serial ports, and total.
+        :return: OrderedDict.
+        """
+        return OrderedDict(self._startup_timeline)
+
+
+    def _is_m4_firmware_running(self):
+        return self._rproc.is_running()
 
 
     def _get_m4_firmware_name(self):
-        with open('/sys/class/remoteproc/remoteproc0/firmware', 'r') as fw_name_fd:
-            name = fw_name_fd.read(100).strip()
-            fw_name_fd.close()
-            return name
+        return self._rproc.get_firmware_name()
 
 
     def _set_m4_firmware_name(self, name):
-        with open('/sys/class/remoteproc/remoteproc0/firmware', 'r+') as fw_name_fd:
-            res = fw_name_fd.write(name)
-            fw_name_fd.close()
-            return res
+        return self._rproc.set_firmware_name(name)
 
 
     def _start_m4_firmware(self):
-        if self._verbose:
-            print("CommAPI: Starting firmware on M4.")
-        with open('/sys/class/remoteproc/remoteproc0/state', 'r+') as fw_state_fd:
-            res = fw_state_fd.write("start")
-            fw_state_fd.close()
-            #time.sleep(0.5)  # give fw time to start.
-            return res
+        return self._rproc.start()
 
 
     def _stop_m4_firmware(self):
-        if self._verbose:
-            print("CommAPI: Stopping firmware on M4.")
-        with open('/sys/class/remoteproc/remoteproc0/state', 'r+') as fw_state_fd:
-            res = fw_state_fd.write("stop")
-            fw_state_fd.close()  # give fw time to stop.
-            #time.sleep(0.5)
-            return res
+        return self._rproc.stop()
 
 
 # INTERFACES
@@ -528,6 +1081,23 @@ class CommAPINotificationListener(object):
             "use the \"CommAPINotificationListener\" class.")
 
 
+class CommAPINotificationBatchListener(object):
+    """Interface of the notification listeners added with a batch policy,
+    see :meth:`CommAPI.add_notification_listener`.
+    """
+    __metaclass__ = ABCMeta
+
+    @abstractmethod
+    def on_m4_notifications(self, notifications):
+        """To be called with the notifications received since the previous call.
+        :param notifications: list of notification msgs from M4, in order of
+            reception (of the latest update of each key when coalescing).
+        :raises NotImplementedError: is raised if the method is not implemented.
+        """
+        raise NotImplementedError("You must define \"on_m4_notifications()\" to "
+            "use the \"CommAPINotificationBatchListener\" class.")
+
+
 """listener to the messages from M4 (responses to cmd_set/cmd_get).
 It is a thread safe list, so a listener can subscribe itself through a
 callback."""
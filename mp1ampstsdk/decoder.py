@@ -0,0 +1,166 @@
+################################################################################
+# COPYRIGHT(c) 2020 STMicroelectronics                                         #
+#                                                                              #
+# Redistribution and use in source and binary forms, with or without           #
+# modification, are permitted provided that the following conditions are met:  #
+#   1. Redistributions of source code must retain the above copyright notice,  #
+#      this list of conditions and the following disclaimer.                   #
+#   2. Redistributions in binary form must reproduce the above copyright       #
+#      notice, this list of conditions and the following disclaimer in the     #
+#      documentation and/or other materials provided with the distribution.    #
+#   3. Neither the name of STMicroelectronics nor the names of its             #
+#      contributors may be used to endorse or promote products derived from    #
+#      this software without specific prior written permission.                #
+#                                                                              #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"  #
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE    #
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE   #
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE    #
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR          #
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF         #
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS     #
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN      #
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)      #
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE   #
+# POSSIBILITY OF SUCH DAMAGE.                                                  #
+################################################################################
+
+
+"""decoder
+The decoder module expands the run-length compressed sample stream sent by the
+M4 through the Shared Data Buffers: each byte is a run of 1 + (byte >> 5)
+samples of value byte & 0x1F.
+Buffers are decoded in a single native pass by the _sdbsdk extension when it is
+built, else with NumPy; samples are returned as NumPy uint8 arrays when NumPy is
+installed, as bytearrays otherwise.
+"""
+
+
+# IMPORT
+
+from mp1ampstsdk.comm_exceptions import CommSDKInvalidOperationException
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    from mp1ampstsdk import _sdbsdk
+except ImportError:
+    _sdbsdk = None
+
+
+# CONSTANTS
+
+RLE_RUN_SHIFT = 5
+"""A compressed byte holds a run of 1 + (byte >> RLE_RUN_SHIFT) samples."""
+RLE_VALUE_MASK = 0x1F
+"""A compressed byte holds samples of value byte & RLE_VALUE_MASK."""
+
+
+# FUNCTIONS
+
+def count_samples(data):
+    """Return the number of samples of a compressed buffer.
+    :param data: bytes-like object, e.g. :attr:`SdbBufferLease.data`.
+    """
+    if _sdbsdk is not None:
+        return _sdbsdk.rle_count(data)
+    if numpy is not None:
+        compressed = numpy.frombuffer(data, dtype=numpy.uint8)
+        return len(compressed) + int(numpy.sum(compressed >> RLE_RUN_SHIFT, dtype=numpy.uint64))
+    raise CommSDKInvalidOperationException("decoder: Error: numpy or the _sdbsdk extension is required.")
+
+
+def decode(data):
+    """Expand a compressed buffer.
+    :param data: bytes-like object, e.g. :attr:`SdbBufferLease.data`.
+    :return: samples, NumPy uint8 array or bytearray without NumPy.
+    """
+    if _sdbsdk is not None:
+        samples = _sdbsdk.rle_decode(data)
+        return numpy.frombuffer(samples, dtype=numpy.uint8) if numpy is not None else samples
+    if numpy is not None:
+        compressed = numpy.frombuffer(data, dtype=numpy.uint8)
+        return numpy.repeat(compressed & RLE_VALUE_MASK, (compressed >> RLE_RUN_SHIFT) + 1)
+    raise CommSDKInvalidOperationException("decoder: Error: numpy or the _sdbsdk extension is required.")
+
+
+# CLASSES
+
+class SdbSampleDecoder():
+    """SdbSampleDecoder class.
+    Decodes the buffers of a stream one after the other, keeping track of the
+    sample position in the stream and, with a block_size, cutting the samples
+    into blocks of fixed size whatever the buffer boundaries::
+
+        decoder = SdbSampleDecoder(block_size=4096)
+        for lease in sdb.stream():
+            for block in decoder.feed(lease.data):
+                analyse(block)
+    """
+
+    def __init__(self, block_size=None):
+        """Constructor.
+        :param block_size: Number of samples of the blocks returned by
+            :meth:`feed`, None to return the samples of each buffer as a whole.
+        :type block_size: int
+        """
+        if block_size is not None and block_size <= 0:
+            raise CommSDKInvalidOperationException("SdbSampleDecoder: Error: invalid block_size.")
+        self._block_size = block_size
+        self._carry = None
+        self.samples = 0
+        """Number of samples decoded since the creation or the last reset."""
+        self.buffers = 0
+        """Number of buffers decoded since the creation or the last reset."""
+
+
+    def decode(self, data):
+        """Expand a compressed buffer of the stream.
+        :param data: bytes-like object.
+        :return: samples, see :func:`decode`.
+        """
+        samples = decode(data)
+        self.samples += len(samples)
+        self.buffers += 1
+        return samples
+
+
+    def feed(self, data):
+        """Expand a compressed buffer of the stream into blocks of block_size
+        samples; samples left over wait for the next buffer.
+        :param data: bytes-like object.
+        :return: list of blocks (views of one array, valid until their
+            owner drops them), the whole buffer if block_size is None.
+        """
+        samples = self.decode(data)
+        if self._block_size is None:
+            return [samples]
+        if self._carry is not None and len(self._carry):
+            if numpy is not None:
+                samples = numpy.concatenate((self._carry, samples))
+            else:
+                samples = self._carry + samples
+        size = len(samples) - len(samples) % self._block_size
+        blocks = [samples[start:start + self._block_size] for start in range(0, size, self._block_size)]
+        # Copied so that the big array is freed with the blocks.
+        self._carry = samples[size:].copy() if numpy is not None else samples[size:]
+        return blocks
+
+
+    def flush(self):
+        """Return the samples waiting for a full block, and forget them."""
+        carry, self._carry = self._carry, None
+        if carry is None:
+            return numpy.empty(0, dtype=numpy.uint8) if numpy is not None else bytearray()
+        return carry
+
+
+    def reset(self):
+        """Restart from an empty stream, e.g. after a sequence gap (see
+        :attr:`SdbBufferLease.sequence`)."""
+        self._carry = None
+        self.samples = 0
+        self.buffers = 0
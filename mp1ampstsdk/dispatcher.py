@@ -0,0 +1,461 @@
+################################################################################
+# COPYRIGHT(c) 2020 STMicroelectronics                                         #
+#                                                                              #
+# Redistribution and use in source and binary forms, with or without           #
+# modification, are permitted provided that the following conditions are met:  #
+#   1. Redistributions of source code must retain the above copyright notice,  #
+#      this list of conditions and the following disclaimer.                   #
+#   2. Redistributions in binary form must reproduce the above copyright       #
+#      notice, this list of conditions and the following disclaimer in the     #
+#      documentation and/or other materials provided with the distribution.    #
+#   3. Neither the name of STMicroelectronics nor the names of its             #
+#      contributors may be used to endorse or promote products derived from    #
+#      this software without specific prior written permission.                #
+#                                                                              #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"  #
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE    #
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE   #
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE    #
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR          #
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF         #
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS     #
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN      #
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)      #
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE   #
+# POSSIBILITY OF SUCH DAMAGE.                                                  #
+################################################################################
+
+
+"""dispatcher
+The dispatcher module delivers the M4 notifications to several listeners, each
+one subscribed to every notification or only to those starting with given
+prefixes (e.g. 'temp:').
+:class:`NotificationDispatcher` looks up the subscribers of a notification in a
+routing table rebuilt on every (un)subscription, and queues the notification
+to each of them; a bounded pool of worker threads calls the listeners, never
+more than one worker per listener, so that each listener gets its
+notifications in order while a slow listener delays neither the others nor the
+thread reading the serial port. A listener lagging by more than queue_size
+notifications loses the oldest ones, which is counted (see
+:meth:`NotificationDispatcher.get_subscribers`).
+High-rate notifications can be delivered in batches instead (see
+:class:`BatchPolicy`): the listener gets the list of the notifications received
+since the previous call, at most max_batch of them and at most max_latency
+seconds after the first one; with a coalesce key, only the latest notification
+of each key is kept, e.g. the latest value of each sensor.
+"""
+
+
+# IMPORT
+
+from mp1ampstsdk.comm_exceptions import CommSDKInvalidOperationException
+from collections import deque
+from collections import OrderedDict
+import heapq
+import queue
+import threading
+import time
+
+
+# CONSTANTS
+
+DFT_WORKERS = 2
+"""Default number of worker threads calling the listeners."""
+DFT_QUEUE_SIZE = 1024
+"""Default max number of notifications waiting for a listener."""
+DRAIN_MAX = 64
+"""Max number of notifications delivered to a listener before a worker moves
+to the next one, so that a busy listener does not monopolize a worker."""
+DFT_MAX_BATCH = 64
+"""Default max number of notifications per batch."""
+DFT_MAX_LATENCY_s = 0.05
+"""Default max time a notification waits for its batch."""
+
+
+# CLASSES
+
+class BatchPolicy():
+    """BatchPolicy class.
+    Delivery of the notifications in batches, to a listener implementing
+    :class:`mp1ampstsdk.commsdk.CommAPINotificationBatchListener`::
+
+        # At most 10 calls per second, with the latest value of each sensor.
+        policy = BatchPolicy(max_batch=256, max_latency=0.1,
+                             coalesce_key=lambda msg: msg.split(":")[0])
+        api.add_notification_listener(dashboard, batch=policy)
+    """
+
+    def __init__(self, max_batch=DFT_MAX_BATCH, max_latency=DFT_MAX_LATENCY_s, coalesce_key=None):
+        """Constructor.
+        :param max_batch: Max number of notifications per batch; a batch is
+            delivered as soon as it is full.
+        :type max_batch: int
+
+        :param max_latency: Max time in seconds between the reception of a
+            notification and the delivery of its batch; 0 to deliver what
+            is received while the listener is busy, without waiting.
+        :type max_latency: float
+
+        :param coalesce_key: Function returning the key of a notification;
+            a notification replaces the one of the same key waiting for
+            the batch, which keeps the order of the latest updates. None to
+            keep every notification.
+        """
+        if max_batch <= 0:
+            raise CommSDKInvalidOperationException("BatchPolicy: Error: invalid max_batch.")
+        if max_latency < 0:
+            raise CommSDKInvalidOperationException("BatchPolicy: Error: invalid max_latency.")
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self.coalesce_key = coalesce_key
+
+
+class _Subscription():
+    """A listener, its prefixes and its queue of notifications."""
+
+    def __init__(self, listener, prefixes, batch):
+        self.listener = listener
+        self.prefixes = prefixes
+        self.batch = batch
+        # key -> latest notification when coalescing
+        self.pending = OrderedDict() if batch is not None and batch.coalesce_key is not None else deque()
+        self.scheduled = False  # queued to, or being served by, a worker
+        self.timer_armed = False
+        self.active = True
+        self.lock = threading.Lock()
+        self.call_lock = threading.Lock()   # orders the batches without workers
+        self.delivered = 0
+        self.batches = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.errors = 0
+
+
+    def push(self, notification, queue_size):
+        """Queue a notification, the subscription lock held."""
+        if type(self.pending) is OrderedDict:
+            key = self.batch.coalesce_key(notification)
+            if key in self.pending:
+                del self.pending[key]
+                self.coalesced += 1
+            elif len(self.pending) >= queue_size:
+                self.pending.popitem(last=False)
+                self.dropped += 1
+            self.pending[key] = notification
+            return
+        if len(self.pending) >= queue_size:
+            self.pending.popleft()
+            self.dropped += 1
+        self.pending.append(notification)
+
+
+    def pop(self):
+        """Pop the next notification, or batch, the subscription lock held."""
+        if self.batch is None:
+            return self.pending.popleft()
+        if type(self.pending) is OrderedDict:
+            pending = self.pending
+            if len(pending) <= self.batch.max_batch:
+                self.pending = OrderedDict()
+                return list(pending.values())
+            return [pending.popitem(last=False)[1] for _ in range(self.batch.max_batch)]
+        if len(self.pending) <= self.batch.max_batch:
+            batch = list(self.pending)
+            self.pending.clear()
+            return batch
+        return [self.pending.popleft() for _ in range(self.batch.max_batch)]
+
+
+    def is_ready(self):
+        """Return True if a batch has to be delivered without waiting, the
+        subscription lock held."""
+        return self.batch is None or self.batch.max_latency == 0 or \
+            len(self.pending) >= self.batch.max_batch
+
+
+class NotificationDispatcher():
+    """NotificationDispatcher class.
+    Routes each notification to the listeners subscribed to it::
+
+        dispatcher = NotificationDispatcher(workers=2)
+        dispatcher.subscribe(temperature_listener, prefix="temp:")
+        dispatcher.subscribe(logger)    # every notification
+        dispatcher.subscribe(uplink, batch=BatchPolicy(max_latency=1))
+        dispatcher.dispatch("temp:25.3;")
+
+    With workers=0 the listeners are called by the thread calling
+    :meth:`dispatch`, one after the other.
+    """
+
+    def __init__(self, workers=DFT_WORKERS, queue_size=DFT_QUEUE_SIZE, verbose=False):
+        """Constructor.
+        :param workers: Number of worker threads calling the listeners, 0 to
+            call them from :meth:`dispatch`.
+        :type workers: int
+
+        :param queue_size: Max number of notifications waiting for a
+            listener; beyond, the oldest one is dropped.
+        :type queue_size: int
+
+        :param verbose: If True, enables verbosity on output.
+        :type verbose: boolean
+        """
+        if workers < 0:
+            raise CommSDKInvalidOperationException("NotificationDispatcher: Error: invalid number of workers.")
+        if queue_size <= 0:
+            raise CommSDKInvalidOperationException("NotificationDispatcher: Error: invalid queue_size.")
+        self._workers = workers
+        self._queue_size = queue_size
+        self._verbose = verbose
+        self._subscriptions = []
+        self._lock = threading.Lock()
+        # (routes, prefix lengths from the longest, catch-all subscriptions),
+        # replaced as a whole so that dispatch() reads it without locking.
+        self._table = ({}, (), ())
+        self._stats = {"notifications": 0, "unrouted": 0}
+        self._closed = False
+        self._run_queue = queue.Queue()
+        self._timers = []   # heap of (deadline, id, subscription)
+        self._cond_timers = threading.Condition()
+        self._th_timer = None
+        self._th_workers = []
+        for index in range(workers):
+            th = threading.Thread(target=self._work, name="NotificationDispatcher-%d" % index, daemon=True)
+            th.start()
+            self._th_workers.append(th)
+
+
+    def subscribe(self, listener, prefix=None, batch=None):
+        """Subscribe a listener to the notifications.
+        :param listener: Listener, see :class:`mp1ampstsdk.commsdk.CommAPINotificationListener`,
+            or :class:`mp1ampstsdk.commsdk.CommAPINotificationBatchListener` with a batch policy.
+        :param prefix: Prefix, or list of prefixes, of the notifications to
+            deliver to the listener (str, or bytes for binary notifications);
+            None for every notification.
+        :param batch: :class:`BatchPolicy` to deliver the notifications in
+            batches, None to deliver them one by one.
+        """
+        if listener is None:
+            raise CommSDKInvalidOperationException("NotificationDispatcher: Error subscribe(): provide a valid listener.")
+        if prefix is None:
+            prefixes = ()
+        elif isinstance(prefix, (str, bytes)):
+            prefixes = (prefix,)
+        else:
+            prefixes = tuple(prefix)
+        if any(len(p) == 0 for p in prefixes):
+            raise CommSDKInvalidOperationException("NotificationDispatcher: Error subscribe(): empty prefix.")
+        with self._lock:
+            if self._closed:
+                raise CommSDKInvalidOperationException("NotificationDispatcher: Error subscribe(): dispatcher closed.")
+            if any(s.listener is listener for s in self._subscriptions):
+                raise CommSDKInvalidOperationException("NotificationDispatcher: Error subscribe(): listener already subscribed.")
+            self._subscriptions.append(_Subscription(listener, prefixes, batch))
+            self._build_table()
+            if batch is not None and batch.max_latency > 0 and self._th_timer is None:
+                self._th_timer = threading.Thread(target=self._run_timers, name="NotificationDispatcher-timer", daemon=True)
+                self._th_timer.start()
+        if self._verbose:
+            print("NotificationDispatcher: Subscribed listener to %s." % (list(prefixes) if prefixes else "every notification"))
+
+
+    def unsubscribe(self, listener):
+        """Unsubscribe a listener; its notifications not delivered yet are
+        dropped. A notification being delivered to it may still complete."""
+        with self._lock:
+            for subscription in self._subscriptions:
+                if subscription.listener is listener:
+                    break
+            else:
+                raise CommSDKInvalidOperationException("NotificationDispatcher: Error unsubscribe(): the listener was not subscribed.")
+            self._subscriptions.remove(subscription)
+            self._build_table()
+        with subscription.lock:
+            subscription.active = False
+            subscription.pending.clear()
+
+
+    def has_subscribers(self):
+        """Return True if at least one listener is subscribed."""
+        return len(self._subscriptions) > 0
+
+
+    def dispatch(self, notification):
+        """Deliver a notification to its subscribers; with workers, only
+        queues it and returns at once.
+        :param notification: str msg, or bytes for binary notifications.
+        """
+        routes, lengths, targets = self._table
+        for length in lengths:
+            subscriptions = routes.get(notification[:length])
+            if subscriptions is not None:
+                targets = subscriptions
+                break
+        self._stats["notifications"] += 1
+        if not targets:
+            self._stats["unrouted"] += 1
+            return
+        for subscription in targets:
+            if self._workers == 0 and subscription.batch is None:
+                self._deliver(subscription, notification)
+                continue
+            with subscription.lock:
+                if not subscription.active:
+                    continue
+                subscription.push(notification, self._queue_size)
+                if subscription.scheduled:
+                    continue
+                if not subscription.is_ready():
+                    if not subscription.timer_armed:
+                        subscription.timer_armed = True
+                        self._arm_timer(subscription)
+                    continue
+                subscription.scheduled = True
+            self._schedule(subscription)
+
+
+    def get_subscribers(self):
+        """Return the state of the subscribed listeners; growing pending or
+        dropped counters reveal a slow listener.
+        :return: list of dicts with keys listener, prefixes, pending
+            (notifications waiting), delivered, batches (calls of a batch
+            listener), dropped (oldest notifications dropped as the queue was
+            full), coalesced (notifications replaced by a newer one of the
+            same key) and errors (exceptions raised by the listener).
+        """
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        return [{"listener": s.listener, "prefixes": list(s.prefixes), "pending": len(s.pending),
+            "delivered": s.delivered, "batches": s.batches, "dropped": s.dropped,
+            "coalesced": s.coalesced, "errors": s.errors} for s in subscriptions]
+
+
+    def get_stats(self):
+        """Return the dispatcher counters.
+        :return: dict with keys notifications (dispatched), unrouted
+            (notifications without subscribers), subscribers and workers.
+        """
+        stats = dict(self._stats)
+        stats["subscribers"] = len(self._subscriptions)
+        stats["workers"] = self._workers
+        return stats
+
+
+    def close(self):
+        """Stop the workers; notifications not delivered yet are dropped."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            for subscription in self._subscriptions:
+                with subscription.lock:
+                    subscription.active = False
+                    subscription.pending.clear()
+            self._subscriptions = []
+            self._table = ({}, (), ())
+        with self._cond_timers:
+            self._timers = []
+            self._cond_timers.notify()
+        if self._th_timer is not None and self._th_timer is not threading.current_thread():
+            self._th_timer.join()
+        self._th_timer = None
+        for th in self._th_workers:
+            self._run_queue.put(None)
+        for th in self._th_workers:
+            if th is not threading.current_thread():
+                th.join()
+        self._th_workers = []
+
+
+    def _build_table(self):
+        """Precompute, for each prefix, the subscriptions whose prefixes
+        match a notification starting with it, so that dispatch() only
+        looks up the longest matching prefix."""
+        catch_all = tuple(s for s in self._subscriptions if not s.prefixes)
+        routes = {}
+        for subscription in self._subscriptions:
+            for prefix in subscription.prefixes:
+                routes[prefix] = None
+        for key in routes:
+            routes[key] = tuple(s for s in self._subscriptions if not s.prefixes or
+                any(type(p) is type(key) and key.startswith(p) for p in s.prefixes))
+        lengths = tuple(sorted(set(len(key) for key in routes), reverse=True))
+        self._table = (routes, lengths, catch_all)
+
+
+    def _deliver(self, subscription, item):
+        try:
+            if subscription.batch is None:
+                subscription.listener.on_m4_notification(item)
+                subscription.delivered += 1
+            else:
+                subscription.listener.on_m4_notifications(item)
+                subscription.delivered += len(item)
+                subscription.batches += 1
+        except Exception as e:
+            subscription.errors += 1
+            if self._verbose:
+                print("NotificationDispatcher: Error: listener raised %s: %s" % (type(e).__name__, e))
+
+
+    def _schedule(self, subscription):
+        """Serve a scheduled subscription: queue it to the workers, or without
+        workers, deliver its batch from the calling thread."""
+        if self._workers:
+            self._run_queue.put(subscription)
+            return
+        with subscription.call_lock:
+            with subscription.lock:
+                subscription.scheduled = False
+                if not subscription.pending:
+                    return
+                batch = subscription.pop()
+            self._deliver(subscription, batch)
+
+
+    def _arm_timer(self, subscription):
+        deadline = time.monotonic() + subscription.batch.max_latency
+        with self._cond_timers:
+            heapq.heappush(self._timers, (deadline, id(subscription), subscription))
+            if self._timers[0][2] is subscription:
+                self._cond_timers.notify()
+
+
+    def _run_timers(self):
+        with self._cond_timers:
+            while not self._closed:
+                if not self._timers:
+                    self._cond_timers.wait()
+                    continue
+                delay = self._timers[0][0] - time.monotonic()
+                if delay > 0:
+                    self._cond_timers.wait(delay)
+                    continue
+                _, _, subscription = heapq.heappop(self._timers)
+                self._cond_timers.release()
+                try:
+                    with subscription.lock:
+                        subscription.timer_armed = False
+                        ready = subscription.active and subscription.pending and not subscription.scheduled
+                        if ready:
+                            subscription.scheduled = True
+                    if ready:
+                        self._schedule(subscription)
+                finally:
+                    self._cond_timers.acquire()
+
+
+    def _work(self):
+        while True:
+            subscription = self._run_queue.get()
+            if subscription is None:
+                return
+            for _ in range(DRAIN_MAX):
+                with subscription.lock:
+                    if not subscription.pending:
+                        subscription.scheduled = False
+                        break
+                    item = subscription.pop()
+                self._deliver(subscription, item)
+            else:
+                self._run_queue.put(subscription)   # still scheduled, let the others run first
@@ -0,0 +1,647 @@
+################################################################################
+# COPYRIGHT(c) 2020 STMicroelectronics                                         #
+#                                                                              #
+# Redistribution and use in source and binary forms, with or without           #
+# modification, are permitted provided that the following conditions are met:  #
+#   1. Redistributions of source code must retain the above copyright notice,  #
+#      this list of conditions and the following disclaimer.                   #
+#   2. Redistributions in binary form must reproduce the above copyright       #
+#      notice, this list of conditions and the following disclaimer in the     #
+#      documentation and/or other materials provided with the distribution.    #
+#   3. Neither the name of STMicroelectronics nor the names of its             #
+#      contributors may be used to endorse or promote products derived from    #
+#      this software without specific prior written permission.                #
+#                                                                              #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"  #
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE    #
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE   #
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE    #
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR          #
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF         #
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS     #
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN      #
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)      #
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE   #
+# POSSIBILITY OF SUCH DAMAGE.                                                  #
+################################################################################
+
+
+"""emulator
+The emulator module is a hardware-free stand-in for the M4 side, so that
+CommAPI, AsyncCommAPI and RpmsgSdbAPI can be run and benchmarked on a build
+host:
+
+* :class:`FakeRemoteProc` is a remoteproc sysfs directory (state, firmware).
+* :class:`FakeM4Firmware` serves the RpMsg TTYs over pty pairs with a
+  scriptable command handler and notification streams.
+* :class:`FakeSdbProducer` fills the Shared Data Buffers of the sdbsdk
+  receiver at a given rate through its file-backed emulation mode.
+* :class:`Emulator` wires the three together in a temporary directory.
+"""
+
+
+# IMPORT
+
+from mp1ampstsdk.comm_exceptions import CommSDKInvalidOperationException
+from mp1ampstsdk.commsdk import DFT_TERMINATOR
+from mp1ampstsdk.framing import FrameDecoder
+from mp1ampstsdk.framing import encode_frame
+from mp1ampstsdk.framing import decode_payload
+import mmap
+import os
+import select
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import tty
+
+
+# CONSTANTS
+
+SDB_EMU_HEADER_SIZE = 4096
+"""Size of the header of the sdb emulation file, which holds the uint32 data
+size of each buffer; must match SDB_EMU_HEADER_SIZE in sdbsdk.h."""
+SDB_EMU_DATA_SIZE_FORMAT = '=I'
+"""struct format of a data size in the sdb emulation file header."""
+REMOTEPROC_POLL_s = 0.001
+"""Polling period of the fake remoteproc state file."""
+
+
+# CLASSES
+
+class FakeRemoteProc():
+    """FakeRemoteProc class.
+    A directory with the 'state' and 'firmware' files of
+    /sys/class/remoteproc/remoteproc0. A watcher thread turns the "start" and
+    "stop" written by the SDK into "running" and "offline", calling the
+    registered start and stop hooks in between, as the remoteproc framework
+    does with the M4 firmware.
+    """
+
+    def __init__(self, root=None, verbose=False):
+        """Constructor.
+        :param root: Directory to create the files in, a temporary one if None.
+        :type root: str
+
+        :param verbose: If True, enables verbosity on output.
+        :type verbose: boolean
+        """
+        self._verbose = verbose
+        self._tmp_root = root is None
+        self._root = tempfile.mkdtemp(prefix="remoteproc") if root is None else root
+        os.makedirs(self._root, exist_ok=True)
+        self._hooks = []
+        self._lock = threading.Lock()
+        self._firmware = ''
+        self._running = False
+        self._write('firmware', '')
+        self._write('state', 'offline')
+        self._exit = threading.Event()
+        self._th_watcher = threading.Thread(target=self._watch, daemon=True)
+        self._th_watcher.start()
+
+
+    @property
+    def root(self):
+        """Directory to pass as remoteproc to the SDK constructors."""
+        return self._root
+
+
+    @property
+    def firmware(self):
+        """Name of the firmware last started."""
+        return self._firmware
+
+
+    def add_hooks(self, on_start, on_stop):
+        """Add the callables run when the firmware starts and stops.
+        :param on_start: Called with the firmware name before "running".
+        :param on_stop: Called before "offline".
+        """
+        self._hooks.append((on_start, on_stop))
+
+
+    def is_running(self):
+        return self._running
+
+
+    def start(self, firmware=None):
+        """Start the firmware synchronously, as when it is started at boot.
+        :param firmware: Firmware name, the current one if None.
+        """
+        if firmware is not None:
+            self._write('firmware', firmware)
+        self._transition('start')
+
+
+    def stop(self):
+        """Stop the firmware synchronously."""
+        self._transition('stop')
+
+
+    def release(self):
+        """Stop the watcher, the firmware and remove the temporary directory."""
+        self._exit.set()
+        self._th_watcher.join()
+        self._transition('stop')
+        if self._tmp_root:
+            shutil.rmtree(self._root, ignore_errors=True)
+
+
+    def _watch(self):
+        while not self._exit.wait(REMOTEPROC_POLL_s):
+            state = self._read('state')
+            if state in ('start', 'stop'):
+                self._transition(state)
+
+
+    def _transition(self, request):
+        with self._lock:
+            if request == 'start' and not self._running:
+                self._firmware = self._read('firmware')
+                if self._verbose:
+                    print("FakeRemoteProc: Starting firmware %s." % (self._firmware))
+                for on_start, _ in self._hooks:
+                    on_start(self._firmware)
+                self._running = True
+            elif request == 'stop' and self._running:
+                if self._verbose:
+                    print("FakeRemoteProc: Stopping firmware %s." % (self._firmware))
+                for _, on_stop in self._hooks:
+                    on_stop()
+                self._running = False
+            # Writing "start" to a running remoteproc fails with EBUSY, "stop"
+            # to an offline one with EINVAL: the state is left unchanged.
+            self._write('state', 'running' if self._running else 'offline')
+
+
+    def _read(self, name):
+        with open(os.path.join(self._root, name), 'r') as fd:
+            return fd.read(100).strip()
+
+
+    def _write(self, name, value):
+        with open(os.path.join(self._root, name), 'w') as fd:
+            fd.write(value)
+
+
+class FakeM4Firmware():
+    """FakeM4Firmware class.
+    Serves the RpMsg TTYs with pty pairs linked as ttyRPMSG0 (commands) and
+    ttyRPMSG1 (notifications) in a directory. Each msg received on the command
+    port (split on the terminator, a write without terminator being one msg as
+    an RpMsg packet is) is passed to the handler, whose return value (if not None) is sent
+    back as response; the default handler echoes the msg, sequence ID included
+    (see CommAPI correlated mode). Notifications are sent with :meth:`notify`
+    or streamed at a given rate with :meth:`stream`. With framing, msgs are
+    length-prefixed frames (see :mod:`mp1ampstsdk.framing`) instead.
+    """
+
+    def __init__(self, dev_dir=None, terminator=DFT_TERMINATOR, handler=None, notification_port=True, remoteproc=None, verbose=False, framing=False):
+        """Constructor.
+        :param dev_dir: Directory to create the port links in, a temporary one if None.
+        :type dev_dir: str
+
+        :param terminator: Terminator sequence used to separate messages on the serial ports.
+        :type terminator: str
+
+        :param handler: Callable taking the received msg (str, without the
+            terminator, or bytes for a binary frame) and returning the
+            response (str or bytes) or None.
+        :type handler: callable
+
+        :param notification_port: If True, the notification port is created too.
+        :type notification_port: boolean
+
+        :param remoteproc: If given, the ports appear when its firmware starts
+            and disappear when it stops, otherwise call :meth:`start`.
+        :type remoteproc: :class:`FakeRemoteProc`
+
+        :param verbose: If True, enables verbosity on output.
+        :type verbose: boolean
+
+        :param framing: If True, msgs are exchanged as frames, responses
+            carry a CRC when the command did.
+        :type framing: boolean
+        """
+        self._verbose = verbose
+        self._framing = framing
+        self._tmp_dir = dev_dir is None
+        self._dev_dir = tempfile.mkdtemp(prefix="rpmsg") if dev_dir is None else dev_dir
+        os.makedirs(self._dev_dir, exist_ok=True)
+        self._terminator = terminator.encode("utf-8")
+        self._handler = handler if handler is not None else (lambda msg: msg)
+        self._cmd_port = os.path.join(self._dev_dir, 'ttyRPMSG0')
+        self._notification_port = os.path.join(self._dev_dir, 'ttyRPMSG1') if notification_port else None
+        self._ptys = {}
+        self._lock_ntf = threading.Lock()
+        self._th_cmd = None
+        self._th_stream = None
+        self._exit = threading.Event()
+        self._stream_exit = threading.Event()
+        self.commands = 0
+        """Number of msgs received on the command port."""
+        if remoteproc is not None:
+            remoteproc.add_hooks(lambda firmware: self.start(), self.stop)
+
+
+    @property
+    def cmd_port(self):
+        return self._cmd_port
+
+
+    @property
+    def notification_port(self):
+        return self._notification_port
+
+
+    def set_handler(self, handler):
+        """Replace the command handler, see the constructor."""
+        self._handler = handler
+
+
+    def start(self):
+        """Create the ports and start serving the command port."""
+        if self._th_cmd is not None:
+            return
+        for path in (self._cmd_port, self._notification_port):
+            if path is not None:
+                self._ptys[path] = self._open_pty(path)
+        self._exit.clear()
+        self._th_cmd = threading.Thread(target=self._serve, daemon=True)
+        self._th_cmd.start()
+        if self._verbose:
+            print("FakeM4Firmware: Ports %s created." % (", ".join(self._ptys)))
+
+
+    def stop(self):
+        """Stop streaming and serving, and remove the ports."""
+        if self._th_cmd is None:
+            return
+        self.stop_stream()
+        self._exit.set()
+        self._th_cmd.join()
+        self._th_cmd = None
+        for path, (master, slave) in self._ptys.items():
+            os.unlink(path)
+            os.close(master)
+            os.close(slave)
+        self._ptys = {}
+        if self._verbose:
+            print("FakeM4Firmware: Ports removed.")
+
+
+    def release(self):
+        self.stop()
+        if self._tmp_dir:
+            shutil.rmtree(self._dev_dir, ignore_errors=True)
+
+
+    def notify(self, msg):
+        """Send a notification.
+        :param msg: str or bytes, the terminator is appended (or framed).
+        """
+        if self._framing:
+            msg = encode_frame(msg)
+        elif isinstance(msg, str):
+            msg = msg.encode("utf-8") + self._terminator
+        else:
+            msg = msg + self._terminator
+        with self._lock_ntf:
+            self._write(self._ptys[self._notification_port][0], msg)
+
+
+    def stream(self, rate_hz, count=None, msg=None):
+        """Send notifications at a fixed rate from a thread.
+        :param rate_hz: Notifications per second, 0 for as fast as possible.
+        :param count: Number of notifications, unlimited if None.
+        :param msg: str, or callable taking the notification index and
+            returning it; defaults to 'ntf<index>'.
+        """
+        self.stop_stream()
+        self._stream_exit.clear()
+        self._th_stream = threading.Thread(target=self._stream, args=(rate_hz, count, msg), daemon=True)
+        self._th_stream.start()
+
+
+    def stop_stream(self):
+        if self._th_stream is not None:
+            self._stream_exit.set()
+            self._th_stream.join()
+            self._th_stream = None
+
+
+    def wait_stream(self, timeout=None):
+        """Wait for a stream with a count to be sent.
+        :return: True if the stream is over.
+        """
+        if self._th_stream is not None:
+            self._th_stream.join(timeout)
+            return not self._th_stream.is_alive()
+        return True
+
+
+    def _open_pty(self, path):
+        master, slave = os.openpty()
+        # Raw mode, else the line discipline echoes the msgs back. The slave end
+        # is kept open so that reading the master does not fail with EIO
+        # between two openings of the port by the SDK.
+        tty.setraw(slave)
+        if os.path.lexists(path):
+            os.unlink(path)
+        os.symlink(os.ttyname(slave), path)
+        return master, slave
+
+
+    def _serve(self):
+        master = self._ptys[self._cmd_port][0]
+        decoder = FrameDecoder()
+        while not self._exit.is_set():
+            readable, _, _ = select.select([master], [], [], 0.05)
+            if not readable:
+                continue
+            try:
+                packet = os.read(master, 4096)
+            except OSError:
+                continue
+            if self._framing:
+                decoder.feed(packet)
+                frame = decoder.next_frame()
+                while frame is not None:
+                    self.commands += 1
+                    response = self._handler(decode_payload(*frame))
+                    if response is not None:
+                        # Responses carry a CRC when the command did.
+                        self._write(master, encode_frame(response, decoder.last_crc))
+                    frame = decoder.next_frame()
+                continue
+            # RpMsg is packet based, the M4 gets each write of the SDK as one
+            # msg whether terminated or not: a read chunk stands for a packet.
+            for msg in packet.split(self._terminator):
+                if not msg:
+                    continue
+                self.commands += 1
+                response = self._handler(msg.decode("utf-8", "replace"))
+                if response is None:
+                    continue
+                if isinstance(response, str):
+                    response = response.encode("utf-8") + self._terminator
+                self._write(master, response)
+
+
+    def _stream(self, rate_hz, count, msg):
+        period = 1.0 / rate_hz if rate_hz else 0
+        deadline = time.monotonic()
+        index = 0
+        while (count is None or index < count) and not self._stream_exit.is_set():
+            if callable(msg):
+                payload = msg(index)
+            else:
+                payload = msg if msg is not None else "ntf%d" % (index)
+            self.notify(payload)
+            index += 1
+            if period:
+                deadline += period
+                delay = deadline - time.monotonic()
+                if delay > 0 and self._stream_exit.wait(delay):
+                    break
+
+
+    def _write(self, fd, data):
+        view = memoryview(data)
+        while view:
+            try:
+                view = view[os.write(fd, view):]
+            except BlockingIOError:
+                select.select([], [fd], [])
+
+
+class FakeSdbProducer():
+    """FakeSdbProducer class.
+    Plays the M4 and the stm32_rpmsg_sdb driver for the sdbsdk receiver: pass
+    :attr:`device` as sdb_device to RpmsgSdbAPI, so that the buffers are mapped
+    from this file instead of the driver, then :meth:`attach` the producer to
+    the receiver eventfds. Filling a buffer writes its data, its data size in
+    the file header (read back in place of the GET_DATA_SIZE ioctl) and
+    signals its eventfd, like the driver interrupt handler.
+    """
+
+    def __init__(self, buff_size, buff_num, path=None, verbose=False):
+        """Constructor.
+        :param buff_size: Size of each buffer, a multiple of the page size.
+        :param buff_num: Number of buffers in the ring.
+        :param path: Emulation file, a temporary one if None.
+        :param verbose: If True, enables verbosity on output.
+        """
+        if buff_size % mmap.PAGESIZE or \
+            buff_num * struct.calcsize(SDB_EMU_DATA_SIZE_FORMAT) > SDB_EMU_HEADER_SIZE:
+            raise CommSDKInvalidOperationException("FakeSdbProducer: Error: invalid buffer size or number.")
+        self._verbose = verbose
+        self._buff_size = buff_size
+        self._buff_num = buff_num
+        self._tmp_path = path is None
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix="rpmsg-sdb")
+            os.close(fd)
+        self._path = path
+        with open(self._path, 'wb') as fd:
+            fd.truncate(SDB_EMU_HEADER_SIZE + buff_size * buff_num)
+        self._fd = os.open(self._path, os.O_RDWR)
+        self._map = mmap.mmap(self._fd, SDB_EMU_HEADER_SIZE + buff_size * buff_num)
+        self._eventfds = None
+        self._next = 0
+        self._th_producer = None
+        self._exit = threading.Event()
+        self.buffers = 0
+        """Number of buffers filled."""
+
+
+    @property
+    def device(self):
+        """File to pass as sdb_device to RpmsgSdbAPI."""
+        return self._path
+
+
+    def attach(self, eventfds):
+        """Bind the producer to the receiver once init_sdb() is done.
+        :param eventfds: RpmsgSdbAPI object, or list of eventfds indexed by buffer.
+        """
+        if hasattr(eventfds, 'get_eventfds'):
+            eventfds = eventfds.get_eventfds()
+        if len(eventfds) != self._buff_num:
+            raise CommSDKInvalidOperationException("FakeSdbProducer: Error: %d eventfds for %d buffers." % (len(eventfds), self._buff_num))
+        self._eventfds = list(eventfds)
+        self._next = 0
+
+
+    def fill(self, data, idx=None):
+        """Fill a buffer and signal it.
+        :param data: bytes-like payload, at most buff_size bytes.
+        :param idx: Buffer index, the next one of the ring if None.
+        :return: index of the filled buffer.
+        """
+        if self._eventfds is None:
+            raise CommSDKInvalidOperationException("FakeSdbProducer: Error: not attached.")
+        if idx is None:
+            idx = self._next
+        self._next = (idx + 1) % self._buff_num
+        size = len(data)
+        offset = SDB_EMU_HEADER_SIZE + idx * self._buff_size
+        self._map[offset:offset + size] = data
+        struct.pack_into(SDB_EMU_DATA_SIZE_FORMAT, self._map, idx * struct.calcsize(SDB_EMU_DATA_SIZE_FORMAT), size)
+        os.write(self._eventfds[idx], struct.pack('=Q', 1))
+        self.buffers += 1
+        return idx
+
+
+    def run(self, rate_hz, count=None, data=None):
+        """Fill the ring in order at a fixed rate from a thread.
+        :param rate_hz: Buffers per second, 0 for as fast as possible.
+        :param count: Number of buffers, unlimited if None.
+        :param data: bytes, or callable taking the buffer sequence number and
+            returning them; defaults to a full buffer of the sequence byte.
+        """
+        self.stop()
+        self._exit.clear()
+        self._th_producer = threading.Thread(target=self._run, args=(rate_hz, count, data), daemon=True)
+        self._th_producer.start()
+
+
+    def stop(self):
+        if self._th_producer is not None:
+            self._exit.set()
+            self._th_producer.join()
+            self._th_producer = None
+
+
+    def wait(self, timeout=None):
+        """Wait for a run with a count to be over.
+        :return: True if it is over.
+        """
+        if self._th_producer is not None:
+            self._th_producer.join(timeout)
+            return not self._th_producer.is_alive()
+        return True
+
+
+    def release(self):
+        self.stop()
+        self._eventfds = None
+        self._map.close()
+        os.close(self._fd)
+        if self._tmp_path:
+            os.unlink(self._path)
+
+
+    def _run(self, rate_hz, count, data):
+        period = 1.0 / rate_hz if rate_hz else 0
+        deadline = time.monotonic()
+        seq = 0
+        while (count is None or seq < count) and not self._exit.is_set():
+            if callable(data):
+                payload = data(seq)
+            else:
+                payload = data if data is not None else bytes((seq & 0xFF,)) * self._buff_size
+            self.fill(payload)
+            seq += 1
+            if period:
+                deadline += period
+                delay = deadline - time.monotonic()
+                if delay > 0 and self._exit.wait(delay):
+                    break
+        if self._verbose:
+            print("FakeSdbProducer: %d buffers filled." % (seq))
+
+
+class Emulator():
+    """Emulator class.
+    A fake remoteproc, M4 firmware and, if buff_size is given, sdb producer in
+    a temporary directory. The firmware is started by the constructor, so the
+    SDK objects are to be created with m4_fw_name=None as when the firmware is
+    started at boot::
+
+        with Emulator(buff_size=4096, buff_num=8) as emu:
+            comm = emu.comm_api()
+            print(comm.cmd_get("ping"))
+            sdb = emu.sdb_api()
+            sdb.init_sdb(4096, 8)
+            emu.sdb_producer.attach(sdb)
+            emu.sdb_producer.run(rate_hz=1000, count=100)
+    """
+
+    def __init__(self, buff_size=None, buff_num=None, terminator=DFT_TERMINATOR, handler=None, verbose=False, framing=False):
+        """Constructor.
+        :param buff_size: Size of the sdb buffers, no sdb producer if None.
+        :param buff_num: Number of sdb buffers.
+        :param terminator: Terminator sequence used on the serial ports.
+        :param handler: Command handler of the fake firmware, echo if None.
+        :param verbose: If True, enables verbosity on output.
+        :param framing: If True, the firmware uses frames and the CommAPI
+            objects are created in framed mode.
+        """
+        self._root = tempfile.mkdtemp(prefix="mp1ampstsdk-emu")
+        self._terminator = terminator
+        self._framing = framing
+        self._verbose = verbose
+        self.firmware_dir = os.path.join(self._root, 'firmware')
+        os.makedirs(self.firmware_dir)
+        self.run_dir = os.path.join(self._root, 'run')
+        self.remoteproc = FakeRemoteProc(os.path.join(self._root, 'remoteproc0'), verbose)
+        self.firmware = FakeM4Firmware(os.path.join(self._root, 'dev'), terminator, handler,
+                                       remoteproc=self.remoteproc, verbose=verbose, framing=framing)
+        self.sdb_producer = None
+        if buff_size is not None:
+            self.sdb_producer = FakeSdbProducer(buff_size, buff_num, os.path.join(self._root, 'rpmsg-sdb'), verbose)
+        self.remoteproc.start('fake_m4.elf')
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+    def comm_api(self, **kwargs):
+        """Return a CommAPI object bound to the emulator.
+        :param kwargs: Other CommAPI constructor arguments.
+        """
+        from mp1ampstsdk.commsdk import CommAPI
+        if self._framing:
+            kwargs.setdefault("framing", True)
+        return CommAPI(self.firmware.cmd_port, self.firmware.notification_port,
+                       terminator=self._terminator, remoteproc=self.remoteproc.root,
+                       firmware_dir=self.firmware_dir, run_dir=self.run_dir, **kwargs)
+
+
+    def async_comm_api(self, **kwargs):
+        """Return an AsyncCommAPI object bound to the emulator.
+        :param kwargs: Other AsyncCommAPI constructor arguments.
+        """
+        from mp1ampstsdk.async_commsdk import AsyncCommAPI
+        return AsyncCommAPI(self.firmware.cmd_port, self.firmware.notification_port,
+                            terminator=self._terminator, remoteproc=self.remoteproc.root,
+                            firmware_dir=self.firmware_dir, run_dir=self.run_dir, **kwargs)
+
+
+    def sdb_api(self, **kwargs):
+        """Return an RpmsgSdbAPI object bound to the emulator.
+        :param kwargs: Other RpmsgSdbAPI constructor arguments.
+        """
+        from mp1ampstsdk.py_sdbsdk import RpmsgSdbAPI
+        if self.sdb_producer is None:
+            raise CommSDKInvalidOperationException("Emulator: Error: no sdb producer, buff_size not given.")
+        return RpmsgSdbAPI(remoteproc=self.remoteproc.root, firmware_dir=self.firmware_dir,
+                           run_dir=self.run_dir, sdb_device=self.sdb_producer.device, load_driver=False, **kwargs)
+
+
+    def release(self):
+        """Stop everything and remove the temporary directory."""
+        if self.sdb_producer is not None:
+            self.sdb_producer.release()
+        self.remoteproc.release()
+        self.firmware.release()
+        shutil.rmtree(self._root, ignore_errors=True)
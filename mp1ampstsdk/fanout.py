@@ -0,0 +1,674 @@
+################################################################################
+# COPYRIGHT(c) 2020 STMicroelectronics                                         #
+#                                                                              #
+# Redistribution and use in source and binary forms, with or without           #
+# modification, are permitted provided that the following conditions are met:  #
+#   1. Redistributions of source code must retain the above copyright notice,  #
+#      this list of conditions and the following disclaimer.                   #
+#   2. Redistributions in binary form must reproduce the above copyright       #
+#      notice, this list of conditions and the following disclaimer in the     #
+#      documentation and/or other materials provided with the distribution.    #
+#   3. Neither the name of STMicroelectronics nor the names of its             #
+#      contributors may be used to endorse or promote products derived from    #
+#      this software without specific prior written permission.                #
+#                                                                              #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"  #
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE    #
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE   #
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE    #
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR          #
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF         #
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS     #
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN      #
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)      #
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE   #
+# POSSIBILITY OF SUCH DAMAGE.                                                  #
+################################################################################
+
+
+
+"""fanout
+The fanout module publishes the Shared Data Buffers once into a shared memory
+ring read by several consumer processes, each at its own pace.
+:class:`SdbFanOut`, added as listener of an RpmsgSdbAPI, copies every buffer
+into the next slot of a ring in a /dev/shm file and rings the doorbell of the
+consumers over a Unix socket. Each :class:`SdbFanOutConsumer` has a read cursor
+in the ring header: it maps the ring read-only and reads the buffers in place,
+and its cursor tells the publisher how far behind it is. The publisher never
+waits for a consumer: a consumer lagging by more than the ring size has its
+unread buffers overwritten, which is counted on both sides (see
+:meth:`SdbFanOut.get_consumers`).
+"""
+
+
+# IMPORT
+
+from mp1ampstsdk.comm_exceptions import CommSDKInvalidOperationException
+from mp1ampstsdk.comm_exceptions import CommSDKTimeoutException
+from mp1ampstsdk.py_sdbsdk import RpmsgSdbAPIBufferListener
+import mmap
+import os
+import selectors
+import socket
+import struct
+import threading
+import time
+
+
+# CONSTANTS
+
+SHM_DIR = '/dev/shm'
+"""Directory of the shared memory files."""
+RING_MAGIC = b'SDBRING1'
+"""First bytes of a ring file."""
+RING_HEADER_FORMAT = '<8sIIII'
+"""Ring header: magic, buff_size, number of slots, slot stride, max consumers."""
+RING_WRITE_OFFSET = 64
+"""Offset of the write position (number of buffers published, uint64)."""
+RING_CONSUMERS_OFFSET = 128
+"""Offset of the table of consumers."""
+CONSUMER_FORMAT = '<IIQQ'
+"""Consumer entry: state (CONSUMER_FREE or CONSUMER_ACTIVE), pid, cursor
+(position of the oldest buffer not released, written by the consumer), overruns
+(unreleased buffers overwritten, written by the publisher)."""
+CONSUMER_SIZE = 64
+"""Room of a consumer entry, one cache line so that cursors do not share one."""
+CONSUMER_FREE = 0
+CONSUMER_ACTIVE = 1
+RING_HEADER_SIZE = 4096
+"""Room of the ring header and table of consumers, the slots follow."""
+MAX_CONSUMERS = (RING_HEADER_SIZE - RING_CONSUMERS_OFFSET) // CONSUMER_SIZE
+"""Max number of consumers attached at once."""
+SLOT_HEADER_FORMAT = '<QIIQ'
+"""Slot header: ring position of the buffer (SLOT_WRITING while written),
+stream sequence, length, timestamp (ns since the epoch)."""
+SLOT_HEADER_SIZE = 64
+"""Room of the slot header, the data starts cache line aligned after it."""
+SLOT_WRITING = 0xFFFFFFFFFFFFFFFF
+HELLO_FORMAT = '<8sI'
+"""Hello message sent to a new consumer: ring magic, index of its consumer
+entry; followed by the path of the ring file."""
+DOORBELL_FORMAT = '<Q'
+"""Doorbell message: write position after the publication."""
+DFT_SLOTS = 16
+"""Default number of slots of the ring."""
+
+
+# FUNCTIONS
+
+def _read_u64(shm, offset):
+    """Read a uint64 written by another process; read again until stable, as
+    the write may not be atomic (e.g. 32-bit ARM)."""
+    value = struct.unpack_from('<Q', shm, offset)[0]
+    while True:
+        again = struct.unpack_from('<Q', shm, offset)[0]
+        if again == value:
+            return value
+        value = again
+
+
+# CLASSES
+
+class SdbFanOut(RpmsgSdbAPIBufferListener):
+    """SdbFanOut class.
+    Publishes the Shared Data Buffers of an RpmsgSdbAPI to the consumers
+    attached to its Unix socket::
+
+        fanout = SdbFanOut(buff_size, '/run/sdb-fanout.sock')
+        sdb.add_sdb_buffer_rx_listener(fanout)
+
+    and, in any process::
+
+        for buffer in SdbFanOutConsumer('/run/sdb-fanout.sock'):
+            with buffer:
+                process(buffer.data)
+    """
+
+    def __init__(self, buff_size, socket_path, slots=DFT_SLOTS, max_consumers=MAX_CONSUMERS, verbose=False):
+        """Constructor.
+        :param buff_size: Max size of the buffers in bytes.
+        :type buff_size: int
+
+        :param socket_path: Unix socket served to the consumers.
+        :type socket_path: str
+
+        :param slots: Number of slots of the ring: how far a consumer may lag
+            behind before its buffers are overwritten.
+        :type slots: int
+
+        :param max_consumers: Max number of consumers attached at once, at
+            most MAX_CONSUMERS.
+        :type max_consumers: int
+
+        :param verbose: If True, enables verbosity on output.
+        :type verbose: boolean
+        """
+        if slots <= 0:
+            raise CommSDKInvalidOperationException("SdbFanOut: Error: invalid number of slots.")
+        if not 0 < max_consumers <= MAX_CONSUMERS:
+            raise CommSDKInvalidOperationException("SdbFanOut: Error: max_consumers must be in 1..%d." % (MAX_CONSUMERS))
+        self._verbose = verbose
+        self._buff_size = buff_size
+        self._socket_path = socket_path
+        self._slots = slots
+        self._max_consumers = max_consumers
+        self._stride = SLOT_HEADER_SIZE + -(-buff_size // SLOT_HEADER_SIZE) * SLOT_HEADER_SIZE
+        self._position = 0
+        self._consumers = {}    # consumer index -> socket
+        self._lock_consumers = threading.Lock()
+        self._stats = {"buffers": 0, "doorbell_drops": 0}
+        self._closed = False
+        self._shm = None
+        self._listen_sock = None
+        try:
+            self._shm_path = os.path.join(SHM_DIR, "mp1ampstsdk-ring-%d-%d" % (os.getpid(), id(self)))
+            size = RING_HEADER_SIZE + slots * self._stride
+            fd = os.open(self._shm_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o666)
+            try:
+                os.ftruncate(fd, size)
+                self._shm = mmap.mmap(fd, size)
+            finally:
+                os.close(fd)
+            self._ring = memoryview(self._shm)
+            struct.pack_into(RING_HEADER_FORMAT, self._shm, 0, RING_MAGIC, buff_size, slots, self._stride, max_consumers)
+
+            socket_dir = os.path.dirname(socket_path)
+            if socket_dir:
+                os.makedirs(socket_dir, exist_ok=True)
+            if os.path.lexists(socket_path):
+                os.unlink(socket_path)     # left by a publisher that did not exit cleanly
+            self._listen_sock = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+            self._listen_sock.bind(socket_path)
+            self._listen_sock.listen(8)
+            self._wake_r, self._wake_w = socket.socketpair()
+            self._th_server = threading.Thread(target=self._serve_consumers, name="SdbFanOut", daemon=True)
+            self._th_server.start()
+        except:
+            self.close()
+            raise
+        if self._verbose:
+            print("SdbFanOut: Publishing %d slots of %d bytes on %s." % (slots, buff_size, socket_path))
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+    @property
+    def socket_path(self):
+        return self._socket_path
+
+
+    def on_m4_sdb_buffer(self, lease):
+        try:
+            self.publish(lease.data, lease.sequence)
+        finally:
+            lease.release()
+
+
+    def publish(self, data, sequence):
+        """Copy a buffer into the next slot of the ring and ring the doorbell
+        of the consumers. Never waits for a consumer.
+        :param data: bytes-like object, at most buff_size bytes.
+        :param sequence: Stream sequence number of the buffer.
+        """
+        if self._closed:
+            raise CommSDKInvalidOperationException("SdbFanOut: Error: fan-out closed.")
+        length = len(data)
+        if length > self._buff_size:
+            raise CommSDKInvalidOperationException("SdbFanOut: Error: buffer of %d bytes larger than buff_size." % (length))
+        position = self._position
+        offset = RING_HEADER_SIZE + (position % self._slots) * self._stride
+        with self._lock_consumers:
+            # Consumers still holding the buffer published a ring ago lose it.
+            for index in self._consumers:
+                entry = RING_CONSUMERS_OFFSET + index * CONSUMER_SIZE
+                cursor = _read_u64(self._shm, entry + 8)
+                if position - cursor >= self._slots:
+                    overruns = struct.unpack_from('<Q', self._shm, entry + 16)[0]
+                    struct.pack_into('<Q', self._shm, entry + 16, overruns + 1)
+        struct.pack_into(SLOT_HEADER_FORMAT, self._shm, offset, SLOT_WRITING, sequence, length, 0)
+        self._ring[offset + SLOT_HEADER_SIZE:offset + SLOT_HEADER_SIZE + length] = data
+        struct.pack_into(SLOT_HEADER_FORMAT, self._shm, offset, position, sequence, length, time.time_ns())
+        self._position = position + 1
+        struct.pack_into('<Q', self._shm, RING_WRITE_OFFSET, self._position)
+        doorbell = struct.pack(DOORBELL_FORMAT, self._position)
+        with self._lock_consumers:
+            self._stats["buffers"] += 1
+            for index, consumer in list(self._consumers.items()):
+                try:
+                    consumer.send(doorbell, socket.MSG_DONTWAIT)
+                except BlockingIOError:
+                    # The consumer has doorbells pending already.
+                    self._stats["doorbell_drops"] += 1
+                except OSError:
+                    self._drop_consumer(index)
+
+
+    def get_consumers(self):
+        """Return the state of the attached consumers; a lag close to the
+        number of slots, or growing overruns, reveal a slow consumer.
+        :return: list of dicts with keys index, pid, lag (buffers published
+            and not released yet) and overruns (unreleased buffers overwritten).
+        """
+        consumers = []
+        with self._lock_consumers:
+            for index in sorted(self._consumers):
+                entry = RING_CONSUMERS_OFFSET + index * CONSUMER_SIZE
+                state, pid, cursor, overruns = struct.unpack_from(CONSUMER_FORMAT, self._shm, entry)
+                cursor = _read_u64(self._shm, entry + 8)    # written by the consumer
+                consumers.append({"index": index, "pid": pid, "lag": max(0, self._position - cursor), "overruns": overruns})
+        return consumers
+
+
+    def get_stats(self):
+        """Return the fan-out counters.
+        :return: dict with keys buffers (published), consumers (attached) and
+            doorbell_drops (doorbells not sent to consumers with doorbells
+            pending, harmless).
+        """
+        with self._lock_consumers:
+            stats = dict(self._stats)
+            stats["consumers"] = len(self._consumers)
+            return stats
+
+
+    def close(self):
+        """Detach the consumers and remove the ring file; consumers keep
+        their mapping until they close."""
+        if self._closed:
+            return
+        self._closed = True
+        if self._listen_sock is not None:
+            self._wake_w.send(b'\0')
+            self._th_server.join()
+            self._listen_sock.close()
+            self._wake_r.close()
+            self._wake_w.close()
+            if os.path.lexists(self._socket_path):
+                os.unlink(self._socket_path)
+        with self._lock_consumers:
+            for index in list(self._consumers):
+                self._drop_consumer(index)
+        if self._shm is not None:
+            self._ring.release()
+            self._shm.close()
+            os.unlink(self._shm_path)
+        if self._verbose:
+            print("SdbFanOut: Closed.")
+
+
+    def _serve_consumers(self):
+        """Attach the consumers and notice their hang-up."""
+        with selectors.DefaultSelector() as selector:
+            selector.register(self._listen_sock, selectors.EVENT_READ)
+            selector.register(self._wake_r, selectors.EVENT_READ)
+            while True:
+                for key, _ in selector.select():
+                    if key.fileobj is self._wake_r:
+                        return
+                    if key.fileobj is self._listen_sock:
+                        consumer, _ = self._listen_sock.accept()
+                        index = self._attach_consumer(consumer)
+                        if index is not None:
+                            selector.register(consumer, selectors.EVENT_READ, index)
+                        continue
+                    # Consumers do not send anything: readable means gone.
+                    selector.unregister(key.fileobj)
+                    with self._lock_consumers:
+                        self._drop_consumer(key.data)
+                    if self._verbose:
+                        print("SdbFanOut: Consumer %d detached." % (key.data))
+
+
+    def _attach_consumer(self, consumer):
+        with self._lock_consumers:
+            free = [index for index in range(self._max_consumers) if index not in self._consumers]
+            if not free:
+                consumer.close()
+                if self._verbose:
+                    print("SdbFanOut: Consumer refused, %d consumers attached." % (self._max_consumers))
+                return None
+            index = free[0]
+            creds = consumer.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+            pid = struct.unpack('3i', creds)[0]
+            # The consumer starts with the next buffer published.
+            struct.pack_into(CONSUMER_FORMAT, self._shm, RING_CONSUMERS_OFFSET + index * CONSUMER_SIZE,
+                             CONSUMER_ACTIVE, pid, self._position, 0)
+            try:
+                consumer.send(struct.pack(HELLO_FORMAT, RING_MAGIC, index) + self._shm_path.encode("utf-8"))
+            except OSError:
+                consumer.close()
+                return None
+            self._consumers[index] = consumer
+        if self._verbose:
+            print("SdbFanOut: Consumer %d attached, pid %d." % (index, pid))
+        return index
+
+
+    def _drop_consumer(self, index):
+        consumer = self._consumers.pop(index, None)
+        if consumer is not None:
+            struct.pack_into('<I', self._shm, RING_CONSUMERS_OFFSET + index * CONSUMER_SIZE, CONSUMER_FREE)
+            consumer.close()
+
+
+class SdbFanOutConsumer():
+    """SdbFanOutConsumer class.
+    Reads the buffers of an :class:`SdbFanOut` in place. Buffers are handed
+    out in order; the read cursor published to the fan-out is the oldest
+    buffer not released yet, so release the buffers as soon as done.
+    """
+
+    def __init__(self, socket_path, timeout=None, verbose=False):
+        """Constructor.
+        :param socket_path: Unix socket of the fan-out.
+        :type socket_path: str
+
+        :param timeout: Max time in seconds waited for each buffer, None
+            waits forever.
+        :type timeout: float
+
+        :param verbose: If True, enables verbosity on output.
+        :type verbose: boolean
+        """
+        self._verbose = verbose
+        self._timeout = timeout
+        self._closed = False
+        self._shm = None
+        self._data = None
+        self._listener = None
+        self._th_listener = None
+        self._outstanding = set()
+        self._lock_outstanding = threading.Lock()
+        self._next_sequence = None
+        self._sequence_gaps = 0
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        try:
+            self._sock.connect(socket_path)
+            hello = self._sock.recv(4096)
+            if len(hello) < struct.calcsize(HELLO_FORMAT):
+                raise CommSDKInvalidOperationException("SdbFanOutConsumer: Error: %s refused the consumer." % (socket_path))
+            magic, self._index = struct.unpack_from(HELLO_FORMAT, hello)
+            if magic != RING_MAGIC:
+                raise CommSDKInvalidOperationException("SdbFanOutConsumer: Error: %s is not an sdb fan-out." % (socket_path))
+            # The header, where the cursor is written, is mapped read-write,
+            # the ring read-only.
+            with open(hello[struct.calcsize(HELLO_FORMAT):].decode("utf-8"), 'r+b') as shm_fd:
+                self._shm = mmap.mmap(shm_fd.fileno(), RING_HEADER_SIZE)
+                magic, self._buff_size, self._slots, self._stride, _ = struct.unpack_from(RING_HEADER_FORMAT, self._shm)
+                self._data = mmap.mmap(shm_fd.fileno(), RING_HEADER_SIZE + self._slots * self._stride, access=mmap.ACCESS_READ)
+            self._ring = memoryview(self._data)
+            self._entry = RING_CONSUMERS_OFFSET + self._index * CONSUMER_SIZE
+            self._position = _read_u64(self._shm, self._entry + 8)
+        except:
+            self.close()
+            raise
+        if self._verbose:
+            print("SdbFanOutConsumer: Attached to %s as consumer %d." % (socket_path, self._index))
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+    def __iter__(self):
+        return self
+
+
+    def __next__(self):
+        buffer = self.next_buffer()
+        if buffer is None:
+            raise StopIteration
+        return buffer
+
+
+    @property
+    def buff_size(self):
+        return self._buff_size
+
+
+    @property
+    def index(self):
+        """Index of the consumer in the ring, see :meth:`SdbFanOut.get_consumers`."""
+        return self._index
+
+
+    def next_buffer(self):
+        """Return the next buffer, waiting for it to be published.
+        :return: :class:`SdbRingBuffer`, None once the fan-out is gone.
+        :raises CommSDKTimeoutException: if no buffer comes within the timeout.
+        """
+        if self._closed:
+            raise CommSDKInvalidOperationException("SdbFanOutConsumer: Error: consumer closed.")
+        deadline = None if self._timeout is None else time.monotonic() + self._timeout
+        while True:
+            written = _read_u64(self._shm, RING_WRITE_OFFSET)
+            if self._position < written:
+                buffer = self._take(written)
+                if buffer is not None:
+                    return buffer
+                continue
+            # Nothing to read: wait for a doorbell.
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                raise CommSDKTimeoutException("SdbFanOutConsumer: Error: no buffer within %ss." % (self._timeout))
+            self._sock.settimeout(remaining)
+            try:
+                doorbell = self._sock.recv(64)
+            except socket.timeout:
+                continue
+            except (ConnectionError, OSError):
+                return None
+            if not doorbell:
+                return None
+
+
+    def get_sequence_gaps(self):
+        """Return the number of buffers missed since the attachment, lost by
+        the SDB receiver or overwritten before being read."""
+        return self._sequence_gaps
+
+
+    def get_overruns(self):
+        """Return the number of buffers overwritten before being read or
+        released by this consumer."""
+        return struct.unpack_from('<Q', self._shm, self._entry + 16)[0]
+
+
+    def add_sdb_buffer_rx_listener(self, listener):
+        """Deliver the buffers to a listener from a thread of the consumer.
+        :param listener: :class:`mp1ampstsdk.py_sdbsdk.RpmsgSdbAPIBufferListener`,
+            its on_m4_sdb_buffer() receives :class:`SdbRingBuffer` objects.
+        """
+        if not isinstance(listener, RpmsgSdbAPIBufferListener):
+            raise CommSDKInvalidOperationException("SdbFanOutConsumer: Error: listener must be an RpmsgSdbAPIBufferListener.")
+        if self._th_listener is not None:
+            raise CommSDKInvalidOperationException("SdbFanOutConsumer: Error: listener already added.")
+        self._listener = listener
+        self._th_listener = threading.Thread(target=self._listen, name="SdbFanOutConsumer", daemon=True)
+        self._th_listener.start()
+
+
+    def close(self):
+        """Detach from the fan-out."""
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._sock.close()
+        if self._th_listener is not None and self._th_listener is not threading.current_thread():
+            self._th_listener.join()
+        if self._shm is not None:
+            with self._lock_outstanding:
+                self._shm.close()
+        if self._data is not None:
+            try:
+                self._ring.release()
+                self._data.close()
+            except BufferError:
+                pass    # buffers still held: unmapped with the last of them
+
+
+    def _take(self, written):
+        """Hand out the buffer at the read position, skipping the buffers
+        overwritten meanwhile. Return None if the slot is being rewritten."""
+        if written - self._position > self._slots:
+            self._position = written - self._slots
+        position = self._position
+        offset = RING_HEADER_SIZE + (position % self._slots) * self._stride
+        header_position, sequence, length, timestamp = struct.unpack_from(SLOT_HEADER_FORMAT, self._data, offset)
+        if header_position != position:
+            # Overwritten (or being) by a newer buffer: skip it.
+            self._position += 1
+            return None
+        self._position += 1
+        if self._next_sequence is not None and sequence != self._next_sequence:
+            self._sequence_gaps += (sequence - self._next_sequence) & 0xFFFFFFFF
+        self._next_sequence = (sequence + 1) & 0xFFFFFFFF
+        with self._lock_outstanding:
+            self._outstanding.add(position)
+            self._publish_cursor()
+        return SdbRingBuffer(self, position, sequence, offset, length, timestamp)
+
+
+    def _release(self, position):
+        with self._lock_outstanding:
+            self._outstanding.discard(position)
+            if not self._closed:
+                self._publish_cursor()
+
+
+    def _publish_cursor(self):
+        cursor = min(self._outstanding) if self._outstanding else self._position
+        struct.pack_into('<Q', self._shm, self._entry + 8, cursor)
+
+
+    def _is_valid(self, position, offset):
+        return struct.unpack_from('<Q', self._data, offset)[0] == position
+
+
+    def _listen(self):
+        while not self._closed:
+            try:
+                buffer = self.next_buffer()
+            except (CommSDKTimeoutException, CommSDKInvalidOperationException):
+                continue
+            if buffer is None:
+                return
+            self._listener.on_m4_sdb_buffer(buffer)
+
+
+class SdbRingBuffer():
+    """SdbRingBuffer class.
+    Read-only view of a buffer in the ring of an :class:`SdbFanOut`, with the
+    interface of :class:`mp1ampstsdk.py_sdbsdk.SdbBufferLease`.
+    """
+
+    def __init__(self, consumer, position, sequence, offset, length, timestamp):
+        self._consumer = consumer
+        self._position = position
+        self._sequence = sequence
+        self._offset = offset
+        self._timestamp = timestamp
+        self._len = length
+        self._view = consumer._ring[offset + SLOT_HEADER_SIZE:offset + SLOT_HEADER_SIZE + length]
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+    def __len__(self):
+        return self._len
+
+
+    @property
+    def index(self):
+        """Slot of the buffer in the ring."""
+        return self._position % self._consumer._slots
+
+
+    @property
+    def position(self):
+        """Position of the buffer in the ring: number of buffers published
+        before it."""
+        return self._position
+
+
+    @property
+    def sequence(self):
+        """Stream sequence number of the buffer."""
+        return self._sequence
+
+
+    @property
+    def timestamp(self):
+        """Time the buffer was published, in ns since the epoch."""
+        return self._timestamp
+
+
+    @property
+    def released(self):
+        return self._view is None
+
+
+    @property
+    def data(self):
+        """Read-only memoryview of the buffer content (unsigned bytes)."""
+        if self._view is None:
+            raise CommSDKInvalidOperationException("\nError SdbRingBuffer: buffer already released")
+        return self._view
+
+
+    def as_numpy(self, dtype='uint8'):
+        """Return the buffer content as a read-only NumPy array, without copy.
+        The array and the views derived from it share the ring mapping, that
+        stays valid as long as they are alive, but they must not be used after
+        :meth:`release`: the slot may then be rewritten by the publisher.
+        :param dtype: NumPy dtype used to interpret the buffer.
+        """
+        try:
+            import numpy
+        except ImportError:
+            raise CommSDKInvalidOperationException("\nError SdbRingBuffer: as_numpy() requires numpy")
+        return numpy.frombuffer(self.data, dtype=dtype)
+
+
+    def is_valid(self):
+        """Return False if the publisher has overwritten the slot, i.e. the
+        consumer lagged by more than the ring size: data read before this call
+        may then be corrupted."""
+        return self._consumer._is_valid(self._position, self._offset)
+
+
+    def release(self):
+        """Drop the view of the slot and move the read cursor forward.
+        Slices of :attr:`data` and arrays returned by :meth:`as_numpy` must
+        not be used after this call.
+        :raises CommSDKInvalidOperationException: if a buffer export of
+            :attr:`data` itself is still held; the buffer is then kept.
+        """
+        if self._view is None:
+            return
+        try:
+            self._view.release()
+        except BufferError:
+            raise CommSDKInvalidOperationException("\nError SdbRingBuffer: buffer %d still in use" % (self.index))
+        self._view = None
+        self._consumer._release(self._position)
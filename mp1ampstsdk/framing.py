@@ -0,0 +1,395 @@
+################################################################################
+# COPYRIGHT(c) 2020 STMicroelectronics                                         #
+#                                                                              #
+# Redistribution and use in source and binary forms, with or without           #
+# modification, are permitted provided that the following conditions are met:  #
+#   1. Redistributions of source code must retain the above copyright notice,  #
+#      this list of conditions and the following disclaimer.                   #
+#   2. Redistributions in binary form must reproduce the above copyright       #
+#      notice, this list of conditions and the following disclaimer in the     #
+#      documentation and/or other materials provided with the distribution.    #
+#   3. Neither the name of STMicroelectronics nor the names of its             #
+#      contributors may be used to endorse or promote products derived from    #
+#      this software without specific prior written permission.                #
+#                                                                              #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"  #
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE    #
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE   #
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE    #
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR          #
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF         #
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS     #
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN      #
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)      #
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE   #
+# POSSIBILITY OF SUCH DAMAGE.                                                  #
+################################################################################
+
+
+
+"""framing
+The framing module defines the length-prefixed frames exchanged on the RpMsg
+TTYs by CommAPI in framed mode, as an alternative to the terminator separated
+msgs: payloads may then contain any byte, text and binary msgs are handled the
+same way and the reader knows the size of a msg from its header.
+A frame is a 4 bytes header, the payload and, if flagged, a CRC-32::
+
+    +------+-------+--------+-----------------+----------------+
+    | sync | flags | length | payload         | CRC-32         |
+    | 0xA5 | 1 B   | 2 B LE | length bytes    | 4 B LE, option |
+    +------+-------+--------+-----------------+----------------+
+
+The low nibble of flags is the frame type (FRAME_TEXT: UTF-8 str, FRAME_BINARY:
+bytes), FRAME_FLAG_CRC tells that the CRC-32 of header and payload follows.
+:class:`FrameReader` reads the ports for both modes: it pulls all the bytes
+available with one os.read() and lets a :class:`TerminatorSplitter` or a
+:class:`FrameDecoder` cut them into msgs, keeping the remainder for the next
+one, so that the cost goes with the number of msgs, not of bytes.
+"""
+
+
+# IMPORT
+
+from mp1ampstsdk.comm_exceptions import CommSDKInvalidOperationException
+import os
+import select
+import struct
+import time
+import zlib
+
+
+# CONSTANTS
+
+FRAME_SYNC = 0xA5
+"""First byte of a frame."""
+FRAME_HEADER_FORMAT = '<BBH'
+"""Frame header: sync, flags (type and FRAME_FLAG_CRC), payload length."""
+FRAME_HEADER_SIZE = struct.calcsize(FRAME_HEADER_FORMAT)
+FRAME_CRC_FORMAT = '<I'
+"""CRC-32 (zlib) of the header and the payload."""
+FRAME_CRC_SIZE = struct.calcsize(FRAME_CRC_FORMAT)
+FRAME_TYPE_MASK = 0x0F
+FRAME_TEXT = 0x01
+"""Frame type of a UTF-8 str payload."""
+FRAME_BINARY = 0x02
+"""Frame type of a bytes payload."""
+FRAME_FLAG_CRC = 0x80
+"""Flag of the frames followed by a CRC-32."""
+FRAME_MAX_PAYLOAD = 0xFFFF
+"""Maximum payload length."""
+READ_CHUNK_SIZE = 4096
+"""Maximum number of bytes read from a port at once in terminator mode."""
+
+
+# FUNCTIONS
+
+def encode_frame(msg, crc=False):
+    """Return the frame of a msg.
+    :param msg: str (FRAME_TEXT frame) or bytes-like (FRAME_BINARY frame).
+    :param crc: If True, the CRC-32 is appended.
+    :return: bytes.
+    """
+    if isinstance(msg, str):
+        payload = msg.encode("utf-8")
+        flags = FRAME_TEXT
+    else:
+        payload = bytes(msg)
+        flags = FRAME_BINARY
+    if len(payload) > FRAME_MAX_PAYLOAD:
+        raise CommSDKInvalidOperationException("framing: Error: payload of %d bytes too long." % (len(payload)))
+    if crc:
+        flags |= FRAME_FLAG_CRC
+    frame = struct.pack(FRAME_HEADER_FORMAT, FRAME_SYNC, flags, len(payload)) + payload
+    if crc:
+        frame += struct.pack(FRAME_CRC_FORMAT, zlib.crc32(frame))
+    return frame
+
+
+def decode_payload(frame_type, payload):
+    """Return the msg of a frame: str for FRAME_TEXT, bytes otherwise."""
+    if frame_type == FRAME_TEXT:
+        return payload.decode("utf-8", "replace")
+    return payload
+
+
+def _is_hung_up(fd):
+    poller = select.poll()
+    poller.register(fd, select.POLLIN)
+    events = poller.poll(0)
+    return bool(events) and bool(events[0][1] & (select.POLLHUP | select.POLLERR | select.POLLNVAL))
+
+
+# CLASSES
+
+class FrameDecoder():
+    """FrameDecoder class.
+    Cuts a byte stream into frames. Bytes not starting a frame are skipped up
+    to the next sync byte, frames failing their CRC are dropped; both are
+    counted.
+    """
+
+    def __init__(self):
+        self._rx = bytearray()
+        self.sync_errors = 0
+        """Number of bytes skipped while looking for a sync byte."""
+        self.crc_errors = 0
+        """Number of frames dropped on a CRC mismatch."""
+        self.last_crc = False
+        """True if the last frame popped carried a CRC."""
+
+
+    def __len__(self):
+        """Number of bytes received and not popped yet."""
+        return len(self._rx)
+
+
+    def feed(self, data):
+        """Append received bytes."""
+        self._rx += data
+
+
+    def frames(self):
+        """Pop all the complete frames.
+        :return: list of (frame_type, payload bytes).
+        """
+        frames = []
+        frame = self.next_frame()
+        while frame is not None:
+            frames.append(frame)
+            frame = self.next_frame()
+        return frames
+
+
+    def needed(self):
+        """Return the number of bytes missing to complete the next frame,
+        header only if the header is not complete: the size of the next read."""
+        if len(self._rx) < FRAME_HEADER_SIZE:
+            return FRAME_HEADER_SIZE - len(self._rx)
+        sync, flags, length = struct.unpack_from(FRAME_HEADER_FORMAT, self._rx)
+        size = FRAME_HEADER_SIZE + length + (FRAME_CRC_SIZE if flags & FRAME_FLAG_CRC else 0)
+        return max(1, size - len(self._rx))
+
+
+    def next_frame(self):
+        """Pop the next complete frame.
+        :return: (frame_type, payload bytes), None if no frame is complete.
+        """
+        rx = self._rx
+        while True:
+            if rx and rx[0] != FRAME_SYNC:
+                skip = rx.find(bytes((FRAME_SYNC,)))
+                skip = len(rx) if skip == -1 else skip
+                self.sync_errors += skip
+                del rx[:skip]
+            if len(rx) < FRAME_HEADER_SIZE:
+                return None
+            sync, flags, length = struct.unpack_from(FRAME_HEADER_FORMAT, rx)
+            end = FRAME_HEADER_SIZE + length
+            size = end + (FRAME_CRC_SIZE if flags & FRAME_FLAG_CRC else 0)
+            if len(rx) < size:
+                return None
+            if flags & FRAME_FLAG_CRC and \
+                struct.unpack_from(FRAME_CRC_FORMAT, rx, end)[0] != zlib.crc32(rx[:end]):
+                # Not a frame after all, or a corrupted one: resync after the sync byte.
+                self.crc_errors += 1
+                del rx[:1]
+                continue
+            payload = bytes(rx[FRAME_HEADER_SIZE:end])
+            del rx[:size]
+            self.last_crc = bool(flags & FRAME_FLAG_CRC)
+            return flags & FRAME_TYPE_MASK, payload
+
+
+    def reset(self):
+        """Drop the bytes received so far."""
+        del self._rx[:]
+
+
+class TerminatorSplitter():
+    """TerminatorSplitter class.
+    Cuts a byte stream into terminator separated msgs, with the interface of
+    :class:`FrameDecoder`.
+    """
+
+    def __init__(self, terminator):
+        """Constructor.
+        :param terminator: Terminator sequence.
+        :type terminator: bytes
+        """
+        self._terminator = terminator
+        self._rx = bytearray()
+        self._start = 0     # bytes of _rx already popped, trimmed in frames()
+
+
+    def __len__(self):
+        """Number of bytes received and not popped yet."""
+        return len(self._rx) - self._start
+
+
+    def feed(self, data):
+        """Append received bytes."""
+        self._trim()
+        self._rx += data
+
+
+    def needed(self):
+        """Return the size of the next read: everything available."""
+        return READ_CHUNK_SIZE
+
+
+    def next_frame(self):
+        """Pop the next complete msg.
+        :return: bytes, terminator included, None if no msg is complete.
+        """
+        end = self._rx.find(self._terminator, self._start)
+        if end == -1:
+            return None
+        end += len(self._terminator)
+        frame = bytes(self._rx[self._start:end])
+        self._start = end
+        return frame
+
+
+    def frames(self):
+        """Pop all the complete msgs.
+        :return: list of bytes, terminator included.
+        """
+        frames = []
+        frame = self.next_frame()
+        while frame is not None:
+            frames.append(frame)
+            frame = self.next_frame()
+        self._trim()
+        return frames
+
+
+    def take(self, size):
+        """Pop up to size raw bytes, whatever the terminators, e.g. a binary
+        response."""
+        self._trim()
+        data = bytes(self._rx[:size])
+        del self._rx[:size]
+        return data
+
+
+    def reset(self):
+        """Drop the bytes received so far."""
+        del self._rx[:]
+        self._start = 0
+
+
+    def _trim(self):
+        # The popped msgs are deleted at once rather than one by one.
+        if self._start:
+            del self._rx[:self._start]
+            self._start = 0
+
+
+class FrameReader():
+    """FrameReader class.
+    Reads msgs from a port through a :class:`TerminatorSplitter` or a
+    :class:`FrameDecoder`: each read takes all the bytes available (or, with
+    frames, exactly the bytes missing from the current frame) in one
+    os.read() call.
+    """
+
+    def __init__(self, port, splitter, counters=None):
+        """Constructor.
+        :param port: pyserial Serial object, or file descriptor, in
+            non-blocking mode.
+        :param splitter: :class:`TerminatorSplitter` or :class:`FrameDecoder`.
+        :param counters: :class:`mp1ampstsdk.metrics.ChannelCounters` counting
+            the bytes read and the msgs returned, None not to count them.
+        """
+        self._port = port
+        self._splitter = splitter
+        self._counters = counters
+
+
+    @property
+    def splitter(self):
+        return self._splitter
+
+
+    def read(self, deadline=None):
+        """Return the next msg, reading the port until the perf_counter()
+        deadline (forever if None).
+        :return: msg as popped from the splitter, None if no complete msg came
+            before the deadline; the bytes of an incomplete msg are kept.
+        """
+        frame = self._splitter.next_frame()
+        while frame is None:
+            if not self._fill(deadline, self._splitter.needed()):
+                return None
+            frame = self._splitter.next_frame()
+        if self._counters is not None:
+            self._counters.rx_msgs.inc()
+        return frame
+
+
+    def read_bytes(self, size, deadline=None):
+        """Return up to size raw bytes, read until size bytes are there or the
+        deadline (TerminatorSplitter only)."""
+        while len(self._splitter) < size:
+            if not self._fill(deadline, size - len(self._splitter)):
+                break
+        data = self._splitter.take(size)
+        if data and self._counters is not None:
+            self._counters.rx_msgs.inc()
+        return data
+
+
+    def read_ready(self, count=None):
+        """Read the bytes available on the port without waiting, e.g. on a
+        readiness event of a selector.
+        :param count: max number of msgs to pop, None for all of them; the
+            others are kept for the next read.
+        :return: list of the complete msgs.
+        """
+        fd = self._port if isinstance(self._port, int) else self._port.fileno()
+        try:
+            data = os.read(fd, READ_CHUNK_SIZE)
+        except BlockingIOError:
+            data = None
+        if data == b'' and _is_hung_up(fd):
+            raise CommSDKInvalidOperationException("FrameReader: Error: port closed.")
+        if data:
+            self._splitter.feed(data)
+            if self._counters is not None:
+                self._counters.rx_bytes.inc(len(data))
+        if count is None:
+            frames = self._splitter.frames()
+        else:
+            frames = []
+            while len(frames) < count:
+                frame = self._splitter.next_frame()
+                if frame is None:
+                    break
+                frames.append(frame)
+        if frames and self._counters is not None:
+            self._counters.rx_msgs.inc(len(frames))
+        return frames
+
+
+    def _fill(self, deadline, size):
+        fd = self._port if isinstance(self._port, int) else self._port.fileno()
+        remaining = None if deadline is None else deadline - time.perf_counter()
+        if remaining is not None and remaining <= 0:
+            return False
+        if not select.select([fd], [], [], remaining)[0]:
+            return False
+        try:
+            data = os.read(fd, size)
+        except BlockingIOError:
+            return True
+        if not data:
+            # A tty in non-blocking mode reads 0 bytes when another reader
+            # was faster, or the input is not processed yet: only a hang up
+            # (e.g. the M4 firmware stopped) closes the port.
+            if _is_hung_up(fd):
+                raise CommSDKInvalidOperationException("FrameReader: Error: port closed.")
+            return True
+        self._splitter.feed(data)
+        if self._counters is not None:
+            self._counters.rx_bytes.inc(len(data))
+        return True
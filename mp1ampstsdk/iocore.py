@@ -0,0 +1,288 @@
+################################################################################
+# COPYRIGHT(c) 2020 STMicroelectronics                                         #
+#                                                                              #
+# Redistribution and use in source and binary forms, with or without           #
+# modification, are permitted provided that the following conditions are met:  #
+#   1. Redistributions of source code must retain the above copyright notice,  #
+#      this list of conditions and the following disclaimer.                   #
+#   2. Redistributions in binary form must reproduce the above copyright       #
+#      notice, this list of conditions and the following disclaimer in the     #
+#      documentation and/or other materials provided with the distribution.    #
+#   3. Neither the name of STMicroelectronics nor the names of its             #
+#      contributors may be used to endorse or promote products derived from    #
+#      this software without specific prior written permission.                #
+#                                                                              #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"  #
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE    #
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE   #
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE    #
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR          #
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF         #
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS     #
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN      #
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)      #
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE   #
+# POSSIBILITY OF SUCH DAMAGE.                                                  #
+################################################################################
+
+
+"""iocore
+The iocore module runs the I/O of the SDK objects on a single thread.
+:class:`IOCore` waits on a selector (epoll on Linux) for every registered file
+descriptor, e.g. the command and notification TTYs of a CommAPI and the buffer
+eventfds of an RpmsgSdbAPI, and calls their callbacks from its thread, along
+with timers. SDK objects given an io_core start no reading thread of their own,
+which saves a thread stack per channel and per outstanding command, and the
+loop counters (see :meth:`IOCore.get_stats`) tell how long the callbacks hold
+it up::
+
+    core = IOCore()
+    api = CommAPI('/dev/ttyRPMSG0', '/dev/ttyRPMSG1', io_core=core)
+    sdb = RpmsgSdbAPI(io_core=core)
+    ...
+    core.close()
+
+Callbacks run on the loop thread and must not block: a listener with long
+processing should hand the work over (see :mod:`mp1ampstsdk.dispatcher`).
+"""
+
+
+# IMPORT
+
+from mp1ampstsdk.comm_exceptions import CommSDKInvalidOperationException
+from concurrent.futures import Future
+from collections import deque
+import heapq
+import os
+import selectors
+import threading
+import time
+import traceback
+
+
+# CLASSES
+
+class IOCoreTimer():
+    """Timer returned by :meth:`IOCore.call_later`."""
+
+    def __init__(self, deadline, callback, args):
+        self.deadline = deadline
+        self._callback = callback
+        self._args = args
+        self._cancelled = False
+
+
+    def cancel(self):
+        """Cancel the timer; no effect once it has fired."""
+        self._cancelled = True
+
+
+    @property
+    def cancelled(self):
+        return self._cancelled
+
+
+    def __lt__(self, other):
+        return self.deadline < other.deadline
+
+
+class IOCore():
+    """IOCore class.
+    Selector loop thread calling the callbacks of the registered file
+    descriptors when they are readable, and the timers when they expire.
+    Every method can be called from any thread, including from a callback.
+    """
+
+    def __init__(self, verbose=False):
+        """Constructor, starts the loop thread.
+        :param verbose: If True, enables verbosity on output.
+        :type verbose: boolean
+        """
+        self._verbose = verbose
+        self._selector = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ, None)
+        self._lock = threading.Lock()
+        self._ready = deque()   # (callback, args) from call_soon()
+        self._timers = []       # heap of IOCoreTimer
+        self._closed = False
+        self._stats = {"wakeups": 0, "events": 0, "callbacks": 0, "timers": 0, "errors": 0,
+            "callback_time_ns": 0, "max_callback_ns": 0, "max_timer_lag_ns": 0}
+        self._th_loop = threading.Thread(target=self._run, name="IOCore", daemon=True)
+        self._th_loop.start()
+        if self._verbose:
+            print("IOCore: Started.")
+
+
+    def in_loop(self):
+        """Return True if called from the loop thread."""
+        return threading.current_thread() is self._th_loop
+
+
+    def register(self, fd, callback, *args):
+        """Call callback(*args) from the loop thread whenever fd is readable.
+        Once this method returns, the loop waits on fd.
+        :param fd: file descriptor, or object with a fileno() method.
+        """
+        self.call(self._selector.register, fd, selectors.EVENT_READ, (callback, args))
+
+
+    def unregister(self, fd):
+        """Stop waiting on fd. Once this method returns, its callback is not
+        running and will not be called again."""
+        self.call(self._unregister, fd)
+
+
+    def call_soon(self, callback, *args):
+        """Call callback(*args) from the loop thread, as soon as possible."""
+        with self._lock:
+            if self._closed:
+                raise CommSDKInvalidOperationException("IOCore: Error: closed.")
+            self._ready.append((callback, args))
+        self._wake()
+
+
+    def call_later(self, delay, callback, *args):
+        """Call callback(*args) from the loop thread in delay seconds.
+        :return: :class:`IOCoreTimer`, to cancel the call.
+        """
+        timer = IOCoreTimer(time.monotonic() + delay, callback, args)
+        with self._lock:
+            if self._closed:
+                raise CommSDKInvalidOperationException("IOCore: Error: closed.")
+            heapq.heappush(self._timers, timer)
+            first = self._timers[0] is timer
+        if first and not self.in_loop():
+            self._wake()
+        return timer
+
+
+    def call(self, callback, *args):
+        """Call callback(*args) from the loop thread and wait for it to return.
+        :return: what the callback returns; what it raises is raised.
+        """
+        if self.in_loop():
+            return callback(*args)
+        future = Future()
+        def run():
+            try:
+                future.set_result(callback(*args))
+            except Exception as e:
+                future.set_exception(e)
+        self.call_soon(run)
+        return future.result()
+
+
+    def get_stats(self):
+        """Return the loop counters.
+        :return: dict with keys wakeups (selector returns), events (readable
+            file descriptors), callbacks, timers (expired), errors (exceptions
+            raised by callbacks), callback_time_ns (total), max_callback_ns
+            and max_timer_lag_ns (max delay of a timer past its deadline, as
+            the loop was held up by the callbacks).
+        """
+        return dict(self._stats)
+
+
+    def reset_stats(self):
+        """Reset the loop counters."""
+        for key in self._stats:
+            self._stats[key] = 0
+
+
+    def close(self):
+        """Stop the loop thread; registered file descriptors are not closed.
+        Called from a callback, the loop stops once the callback returns.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._wake()
+        if not self.in_loop():
+            self._th_loop.join()
+
+
+    def _wake(self):
+        try:
+            os.write(self._wake_w, b'\0')
+        except BlockingIOError:
+            pass    # already woken up
+
+
+    def _unregister(self, fd):
+        try:
+            self._selector.unregister(fd)
+        except KeyError:
+            raise CommSDKInvalidOperationException("IOCore: Error unregister(): file descriptor not registered.")
+
+
+    def _invoke(self, callback, args):
+        start = time.perf_counter_ns()
+        try:
+            callback(*args)
+        except Exception:
+            self._stats["errors"] += 1
+            if self._verbose:
+                print("IOCore: Error in callback %r:" % (callback,))
+                traceback.print_exc()
+        elapsed = time.perf_counter_ns() - start
+        self._stats["callbacks"] += 1
+        self._stats["callback_time_ns"] += elapsed
+        if elapsed > self._stats["max_callback_ns"]:
+            self._stats["max_callback_ns"] = elapsed
+
+
+    def _run(self):
+        while not self._closed:
+            with self._lock:
+                timeout = None
+                if self._ready:
+                    timeout = 0
+                elif self._timers:
+                    timeout = max(0, self._timers[0].deadline - time.monotonic())
+            events = self._selector.select(timeout)
+            self._stats["wakeups"] += 1
+            for key, mask in events:
+                if key.data is None:
+                    try:
+                        os.read(self._wake_r, 4096)
+                    except BlockingIOError:
+                        pass
+                    continue
+                # A callback may have unregistered this fd in the meantime.
+                if self._selector.get_map().get(key.fd) is not key:
+                    continue
+                self._stats["events"] += 1
+                self._invoke(*key.data)
+            with self._lock:
+                ready, self._ready = self._ready, deque()
+            for callback, args in ready:
+                self._invoke(callback, args)
+            now = time.monotonic()
+            while True:
+                with self._lock:
+                    if not self._timers or self._timers[0].deadline > now:
+                        break
+                    timer = heapq.heappop(self._timers)
+                if timer.cancelled:
+                    continue
+                self._stats["timers"] += 1
+                lag = int((now - timer.deadline) * 1e9)
+                if lag > self._stats["max_timer_lag_ns"]:
+                    self._stats["max_timer_lag_ns"] = lag
+                self._invoke(timer._callback, timer._args)
+        # Calls queued before close() still run, e.g. unregistrations.
+        with self._lock:
+            ready, self._ready = self._ready, deque()
+        for callback, args in ready:
+            self._invoke(callback, args)
+        # The selector is only closed here: close() may be called by a
+        # callback while the loop is still iterating over it.
+        self._selector.close()
+        os.close(self._wake_r)
+        os.close(self._wake_w)
+        if self._verbose:
+            print("IOCore: Closed.")
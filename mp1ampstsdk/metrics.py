@@ -0,0 +1,308 @@
+################################################################################
+# COPYRIGHT(c) 2020 STMicroelectronics                                         #
+#                                                                              #
+# Redistribution and use in source and binary forms, with or without           #
+# modification, are permitted provided that the following conditions are met:  #
+#   1. Redistributions of source code must retain the above copyright notice,  #
+#      this list of conditions and the following disclaimer.                   #
+#   2. Redistributions in binary form must reproduce the above copyright       #
+#      notice, this list of conditions and the following disclaimer in the     #
+#      documentation and/or other materials provided with the distribution.    #
+#   3. Neither the name of STMicroelectronics nor the names of its             #
+#      contributors may be used to endorse or promote products derived from    #
+#      this software without specific prior written permission.                #
+#                                                                              #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"  #
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE    #
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE   #
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE    #
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR          #
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF         #
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS     #
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN      #
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)      #
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE   #
+# POSSIBILITY OF SUCH DAMAGE.                                                  #
+################################################################################
+
+
+
+"""metrics
+The metrics module keeps the counters and histograms that the SDK objects
+update while they run: round-trip time of the commands, bytes and msgs in and
+out of each RpMsg TTY, timeouts, commands rejected because the command channel
+is busy, Shared Data Buffers received with their size and the time spent in
+the listener callbacks.
+Metrics are always on: an update is a bisect and an addition under a lock.
+They are created in a :class:`MetricsRegistry`, :data:`REGISTRY` unless the SDK
+objects are given another one (metrics=), and read as a dict or in the
+Prometheus text format, e.g. for the textfile collector of the node exporter::
+
+    api = CommAPI('/dev/ttyRPMSG0', '/dev/ttyRPMSG1')
+    ...
+    print(REGISTRY.as_dict())
+    REGISTRY.write_prometheus('/var/lib/node_exporter/mp1ampstsdk.prom')
+"""
+
+
+# IMPORT
+
+from mp1ampstsdk.comm_exceptions import CommSDKInvalidOperationException
+from collections import OrderedDict
+import bisect
+import os
+import tempfile
+import threading
+
+
+# CONSTANTS
+
+NAMESPACE = "mp1ampstsdk"
+"""Prefix of the names of the SDK metrics."""
+DFT_LATENCY_BUCKETS_s = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+    0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+"""Default upper bounds, in seconds, of the latency histograms."""
+DFT_SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+"""Default upper bounds, in bytes, of the size histograms."""
+COUNTER = "counter"
+HISTOGRAM = "histogram"
+
+
+# FUNCTIONS
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{%s}" % (",".join('%s="%s"' % (name, str(value).replace("\\", "\\\\")
+        .replace("\"", "\\\"").replace("\n", "\\n")) for name, value in labels))
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, int):
+        return "%d" % (value)
+    return repr(float(value))
+
+
+# CLASSES
+
+class Counter():
+    """Counter class.
+    Monotonic count, e.g. of msgs or bytes.
+    """
+
+    def __init__(self):
+        self._value = 0
+        self._lock = threading.Lock()
+
+
+    def inc(self, amount=1):
+        """Add amount (>= 0) to the count."""
+        with self._lock:
+            self._value += amount
+
+
+    @property
+    def value(self):
+        return self._value
+
+
+    def reset(self):
+        with self._lock:
+            self._value = 0
+
+
+class Histogram():
+    """Histogram class.
+    Count of the observed values falling under each bucket upper bound, with
+    their number and sum, e.g. of latencies or buffer sizes.
+    """
+
+    def __init__(self, buckets):
+        """Constructor.
+        :param buckets: increasing upper bounds of the buckets; values above the
+            last one are counted in the +Inf bucket only.
+        :type buckets: tuple of float
+        """
+        self._bounds = tuple(buckets)
+        if not self._bounds or list(self._bounds) != sorted(set(self._bounds)):
+            raise CommSDKInvalidOperationException("Histogram: Error: buckets must be increasing.")
+        self._lock = threading.Lock()
+        self.reset()
+
+
+    @property
+    def buckets(self):
+        return self._bounds
+
+
+    def observe(self, value):
+        """Count a value."""
+        index = bisect.bisect_left(self._bounds, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+
+    def snapshot(self):
+        """Return the histogram state.
+        :return: dict with keys count, sum and buckets, OrderedDict of the
+            cumulative count of each upper bound, float('inf') last.
+        """
+        with self._lock:
+            counts = list(self._counts)
+            total, count = self._sum, self._count
+        buckets = OrderedDict()
+        cumulative = 0
+        for bound, n in zip(self._bounds + (float("inf"),), counts):
+            cumulative += n
+            buckets[bound] = cumulative
+        return {"count": count, "sum": total, "buckets": buckets}
+
+
+    def reset(self):
+        with self._lock:
+            self._counts = [0] * (len(self._bounds) + 1)
+            self._sum = 0
+            self._count = 0
+
+
+class ChannelCounters():
+    """ChannelCounters class.
+    Bytes and msgs received and sent on a channel, e.g. an RpMsg TTY.
+    """
+
+    def __init__(self, registry, subsystem, port):
+        """Constructor.
+        :param registry: :class:`MetricsRegistry` holding the counters.
+        :param subsystem: middle part of the counter names, e.g. 'comm'.
+        :param port: value of the port label, e.g. '/dev/ttyRPMSG0', as in
+            the command metrics of the same port.
+        """
+        labels = {"port": port}
+        prefix = "%s_%s" % (NAMESPACE, subsystem)
+        self.rx_bytes = registry.counter(prefix + "_rx_bytes_total", "Bytes received.", labels)
+        self.rx_msgs = registry.counter(prefix + "_rx_msgs_total", "Msgs received.", labels)
+        self.tx_bytes = registry.counter(prefix + "_tx_bytes_total", "Bytes sent.", labels)
+        self.tx_msgs = registry.counter(prefix + "_tx_msgs_total", "Msgs sent.", labels)
+
+
+class MetricsRegistry():
+    """MetricsRegistry class.
+    Set of metrics families: a family has a name, a help text, a type and one
+    metric for each set of label values. Getting a metric that already exists
+    returns it, so that the objects reopening a channel add to the same counts.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._families = OrderedDict()  # name -> [type, help, buckets, OrderedDict(labels -> metric)]
+
+
+    def counter(self, name, help, labels=None):
+        """Return the :class:`Counter` of a family for the given labels,
+        creating it if needed.
+        :param name: metric name, e.g. 'mp1ampstsdk_comm_timeouts_total'.
+        :param help: description of the family.
+        :param labels: dict of label names and values.
+        """
+        return self._get(name, help, COUNTER, None, labels)
+
+
+    def histogram(self, name, help, buckets=DFT_LATENCY_BUCKETS_s, labels=None):
+        """Return the :class:`Histogram` of a family for the given labels,
+        creating it if needed.
+        :param buckets: upper bounds of the buckets, the same for the whole family.
+        """
+        return self._get(name, help, HISTOGRAM, tuple(buckets), labels)
+
+
+    def as_dict(self):
+        """Return the values of every metric.
+        :return: dict keyed by name and labels, as in the Prometheus format
+            (e.g. 'mp1ampstsdk_comm_timeouts_total{port="/dev/ttyRPMSG0",call="cmd_get"}'):
+            counters map to their count, histograms to their
+            :meth:`Histogram.snapshot`.
+        """
+        values = OrderedDict()
+        for name, kind, help, metrics in self._collect():
+            for labels, metric in metrics:
+                key = name + _format_labels(labels)
+                values[key] = metric.value if kind == COUNTER else metric.snapshot()
+        return values
+
+
+    def to_prometheus(self):
+        """Return the metrics in the Prometheus text exposition format."""
+        lines = []
+        for name, kind, help, metrics in self._collect():
+            lines.append("# HELP %s %s" % (name, help.replace("\\", "\\\\").replace("\n", "\\n")))
+            lines.append("# TYPE %s %s" % (name, kind))
+            for labels, metric in metrics:
+                if kind == COUNTER:
+                    lines.append("%s%s %s" % (name, _format_labels(labels), _format_value(metric.value)))
+                    continue
+                snapshot = metric.snapshot()
+                for bound, count in snapshot["buckets"].items():
+                    lines.append("%s_bucket%s %d" % (name,
+                        _format_labels(labels + (("le", _format_value(bound)),)), count))
+                lines.append("%s_sum%s %s" % (name, _format_labels(labels), _format_value(snapshot["sum"])))
+                lines.append("%s_count%s %d" % (name, _format_labels(labels), snapshot["count"]))
+        return "\n".join(lines) + "\n"
+
+
+    def write_prometheus(self, path):
+        """Write the metrics to a file in the Prometheus text format.
+        The file is replaced atomically, so that a collector never reads it
+        half written (the node exporter textfile collector reads the *.prom
+        files of its directory).
+        :param path: file path.
+        """
+        try:
+            directory = os.path.dirname(os.path.abspath(path))
+            fd, tmp = tempfile.mkstemp(prefix=".metrics-", dir=directory)
+            try:
+                with os.fdopen(fd, "w") as f:
+                    f.write(self.to_prometheus())
+                os.chmod(tmp, 0o644)
+                os.replace(tmp, path)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+        except (Exception, OSError) as e:
+            raise e
+
+
+    def reset(self):
+        """Reset every metric to zero, e.g. between two benchmark runs."""
+        for name, kind, help, metrics in self._collect():
+            for labels, metric in metrics:
+                metric.reset()
+
+
+    def _get(self, name, help, kind, buckets, labels):
+        key = tuple(labels.items()) if labels else ()
+        with self._lock:
+            family = self._families.get(name)
+            if family is None:
+                family = [kind, help, buckets, OrderedDict()]
+                self._families[name] = family
+            elif family[0] != kind or family[2] != buckets:
+                raise CommSDKInvalidOperationException("MetricsRegistry: Error: %s already registered as another %s." % (name, family[0]))
+            metric = family[3].get(key)
+            if metric is None:
+                metric = Counter() if kind == COUNTER else Histogram(buckets)
+                family[3][key] = metric
+            return metric
+
+
+    def _collect(self):
+        with self._lock:
+            return [(name, kind, help, list(metrics.items()))
+                for name, (kind, help, buckets, metrics) in self._families.items()]
+
+
+REGISTRY = MetricsRegistry()
+"""Registry of the SDK objects not given one."""
@@ -0,0 +1,341 @@
+################################################################################
+# COPYRIGHT(c) 2020 STMicroelectronics                                         #
+#                                                                              #
+# Redistribution and use in source and binary forms, with or without           #
+# modification, are permitted provided that the following conditions are met:  #
+#   1. Redistributions of source code must retain the above copyright notice,  #
+#      this list of conditions and the following disclaimer.                   #
+#   2. Redistributions in binary form must reproduce the above copyright       #
+#      notice, this list of conditions and the following disclaimer in the     #
+#      documentation and/or other materials provided with the distribution.    #
+#   3. Neither the name of STMicroelectronics nor the names of its             #
+#      contributors may be used to endorse or promote products derived from    #
+#      this software without specific prior written permission.                #
+#                                                                              #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"  #
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE    #
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE   #
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE    #
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR          #
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF         #
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS     #
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN      #
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)      #
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE   #
+# POSSIBILITY OF SUCH DAMAGE.                                                  #
+################################################################################
+
+
+
+"""pipeline
+The pipeline module spreads the processing of the Shared Data Buffers over
+worker processes, so that CPU-heavy analysis is not bound to the single GIL of
+the receiver and uses all the A7 cores.
+:class:`SdbProcessPool` copies each buffer once into a slot of a shared memory
+file mapped by every worker, and submits only the slot coordinates to a
+ProcessPoolExecutor: the data is never pickled. The results are handed back in
+the order of the buffers.
+"""
+
+
+# IMPORT
+
+from mp1ampstsdk.comm_exceptions import CommSDKInvalidOperationException
+from mp1ampstsdk.comm_exceptions import CommSDKTimeoutException
+from mp1ampstsdk.py_sdbsdk import RpmsgSdbAPIBufferListener
+from collections import deque
+from concurrent.futures import CancelledError
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError
+import mmap
+import os
+import queue
+import threading
+
+
+# CONSTANTS
+
+SHM_DIR = '/dev/shm'
+"""Directory of the shared memory files."""
+SLOT_ALIGN = 64
+"""Alignment of the slots in the shared memory file."""
+DFT_SLOTS_PER_WORKER = 2
+"""Default number of slots per worker: buffers queued while the others are
+processed."""
+
+
+# FUNCTIONS
+
+_worker_shm = None
+"""Shared memory file, as mapped by the worker process."""
+
+
+def _worker_init(shm_path, size):
+    global _worker_shm
+    with open(shm_path, 'rb') as shm_fd:
+        _worker_shm = mmap.mmap(shm_fd.fileno(), size, access=mmap.ACCESS_READ)
+
+
+def _worker_run(func, offset, length):
+    view = memoryview(_worker_shm)[offset:offset + length]
+    try:
+        return func(view)
+    finally:
+        try:
+            view.release()
+        except BufferError:
+            pass    # still referenced by the result: freed with it
+
+
+# CLASSES
+
+class SdbProcessPool(RpmsgSdbAPIBufferListener):
+    """SdbProcessPool class.
+    Runs func(data) on each Shared Data Buffer in a pool of worker processes.
+    data is a read-only memoryview of the buffer, valid during the call; func
+    must be a module level function (it is pickled) and its result picklable.
+    Results are delivered in order, either to a callback::
+
+        pool = SdbProcessPool(analyse, buff_size, callback=on_result)
+        sdb.add_sdb_buffer_rx_listener(pool)
+
+    or by iterating :meth:`results`::
+
+        for sequence, result in pool.results():
+            ...
+    """
+
+    def __init__(self, func, buff_size, workers=None, slots=None, callback=None, verbose=False):
+        """Constructor.
+        :param func: Function called with the data of each buffer.
+        :type func: callable
+
+        :param buff_size: Size of the sdb buffers (as passed to init_sdb).
+        :type buff_size: int
+
+        :param workers: Number of worker processes, defaults to the number
+            of CPUs.
+        :type workers: int
+
+        :param slots: Number of buffers processed or waiting; when they are
+            all in use the receiver waits for the workers. Defaults to
+            DFT_SLOTS_PER_WORKER per worker.
+        :type slots: int
+
+        :param callback: Called as callback(sequence, result) from a thread
+            of the pool for each buffer, in order; if None the results are
+            read with :meth:`results`.
+        :type callback: callable
+
+        :param verbose: If True, enables verbosity on output.
+        :type verbose: boolean
+        """
+        # Set first: close() is called if the constructor fails.
+        self._closed = False
+        self._error = None
+        self._shm = None
+        self._executor = None
+        self._th_results = None
+        self._pending = deque()     # (sequence, future) in submission order
+        self._cond = threading.Condition()
+        try:
+            workers = workers if workers is not None else (os.cpu_count() or 1)
+            slots = slots if slots is not None else DFT_SLOTS_PER_WORKER * workers
+            if buff_size <= 0 or workers <= 0 or slots <= 0:
+                raise CommSDKInvalidOperationException("SdbProcessPool: Error: invalid buff_size, workers or slots.")
+            self._verbose = verbose
+            self._func = func
+            self._buff_size = buff_size
+            self._callback = callback
+            self._stride = -(-buff_size // SLOT_ALIGN) * SLOT_ALIGN
+            self._slots = slots
+
+            self._shm_path = os.path.join(SHM_DIR, "mp1ampstsdk-pool-%d-%d" % (os.getpid(), id(self)))
+            size = slots * self._stride
+            fd = os.open(self._shm_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+            try:
+                os.ftruncate(fd, size)
+                self._shm = mmap.mmap(fd, size)
+            finally:
+                os.close(fd)
+            self._free = queue.Queue()
+            for slot in range(slots):
+                self._free.put(slot)
+            self._stats = {"buffers": 0, "results": 0, "errors": 0, "slots_high_water": 0}
+            self._executor = ProcessPoolExecutor(workers, initializer=_worker_init, initargs=(self._shm_path, size))
+            if callback is not None:
+                self._th_results = threading.Thread(target=self._deliver_results, name="SdbProcessPool", daemon=True)
+                self._th_results.start()
+            if self._verbose:
+                print("SdbProcessPool: %d workers, %d slots of %d bytes." % (workers, slots, buff_size))
+
+        except (OSError, CommSDKInvalidOperationException) as e:
+            self.close()
+            raise e
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+    def on_m4_sdb_buffer(self, lease):
+        self.submit(lease)
+
+
+    def submit(self, lease):
+        """Queue a buffer for processing and release its lease.
+        Blocks while all the slots are in use.
+        :param lease: :class:`mp1ampstsdk.py_sdbsdk.SdbBufferLease`.
+        :return: Future of the result.
+        """
+        try:
+            return self.submit_data(lease.data, lease.sequence)
+        finally:
+            lease.release()
+
+
+    def submit_data(self, data, sequence):
+        """Queue a copy of data for processing.
+        :param data: bytes-like object, at most buff_size bytes.
+        :param sequence: Sequence number returned with the result.
+        :return: Future of the result.
+        """
+        if self._closed:
+            raise CommSDKInvalidOperationException("SdbProcessPool: Error: pool closed.")
+        length = len(data)
+        if length > self._buff_size:
+            raise CommSDKInvalidOperationException("SdbProcessPool: Error: buffer of %d bytes larger than buff_size." % (length))
+        slot = self._free.get()
+        offset = slot * self._stride
+        self._shm[offset:offset + length] = data
+        future = self._executor.submit(_worker_run, self._func, offset, length)
+        # The slot is free again as soon as the worker is done with it.
+        future.add_done_callback(lambda f, slot=slot: self._free.put(slot))
+        with self._cond:
+            self._pending.append((sequence, future))
+            self._stats["buffers"] += 1
+            in_use = self._slots - self._free.qsize()
+            if in_use > self._stats["slots_high_water"]:
+                self._stats["slots_high_water"] = in_use
+            self._cond.notify()
+        return future
+
+
+    def results(self, timeout=None):
+        """Yield the (sequence, result) of the buffers submitted, in order,
+        until the pool is closed.
+        :param timeout: Max time in seconds waited for each result.
+        :raises CommSDKTimeoutException: if a result does not come in time.
+        :raises Exception: the exception raised by func, if any.
+        """
+        if self._callback is not None:
+            raise CommSDKInvalidOperationException("SdbProcessPool: Error: results are delivered to the callback.")
+        while True:
+            item = self._next_pending(timeout)
+            if item is None:
+                return
+            sequence, future = item
+            try:
+                result = future.result(timeout)
+            except TimeoutError:
+                # Still processed: the result is returned by the next call.
+                raise CommSDKTimeoutException("SdbProcessPool: Error: no result within %ss." % (timeout))
+            except CancelledError:  # by close(wait=False)
+                self._pop_pending(item, None)
+                continue
+            except Exception:
+                self._pop_pending(item, False)
+                raise
+            self._pop_pending(item, True)
+            yield sequence, result
+
+
+    def get_stats(self):
+        """Return the pool counters.
+        :return: dict with keys buffers (submitted), results (delivered),
+            errors (raised by func, or by the callback), pending and
+            slots_high_water.
+        """
+        with self._cond:
+            stats = dict(self._stats)
+            stats["pending"] = len(self._pending)
+            return stats
+
+
+    def close(self, wait=True):
+        """Stop accepting buffers and shut the workers down.
+        :param wait: If True, processes the queued buffers first.
+        :raises CommSDKInvalidOperationException: if func, or the callback,
+            failed on a buffer delivered to the callback.
+        """
+        if self._closed:
+            return
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._executor is not None:
+            if not wait:
+                with self._cond:
+                    for sequence, future in self._pending:
+                        future.cancel()
+            self._executor.shutdown(wait=wait)
+        if self._th_results is not None:
+            self._th_results.join()
+        if self._shm is not None:
+            self._shm.close()
+            os.unlink(self._shm_path)
+        if self._error is not None:
+            raise CommSDKInvalidOperationException("SdbProcessPool: Error: processing failed: %s" % (self._error))
+
+
+    def _next_pending(self, timeout):
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._pending or self._closed, timeout):
+                raise CommSDKTimeoutException("SdbProcessPool: Error: no buffer within %ss." % (timeout))
+            return self._pending[0] if self._pending else None
+
+
+    def _pop_pending(self, item, done):
+        """Remove the first pending item, counted as a result if done is True,
+        as an error if False, not counted if None (cancelled)."""
+        with self._cond:
+            if self._pending and self._pending[0] is item:
+                self._pending.popleft()
+                if done is not None:
+                    self._stats["results" if done else "errors"] += 1
+
+
+    def _deliver_results(self):
+        while True:
+            item = self._next_pending(None)
+            if item is None:
+                return
+            sequence, future = item
+            try:
+                result = future.result()
+            except CancelledError:  # by close(wait=False): not a func error
+                self._pop_pending(item, None)
+                continue
+            except Exception as e:
+                self._pop_pending(item, False)
+                self._record_error(sequence, e)
+                continue
+            # A failing callback must not stop the delivery of the next results.
+            try:
+                self._callback(sequence, result)
+            except Exception as e:
+                self._pop_pending(item, False)
+                self._record_error(sequence, e)
+                continue
+            self._pop_pending(item, True)
+
+
+    def _record_error(self, sequence, e):
+        if self._error is None:
+            self._error = e
+        if self._verbose:
+            print("SdbProcessPool: Error on buffer %d: %s" % (sequence, e))
@@ -37,6 +37,7 @@ the needed memory resources.
 
 from abc import ABCMeta
 from abc import abstractmethod
+from collections import deque
 from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
 import time
@@ -45,22 +46,54 @@ import threading
 from struct import *
 import os
 import sys
-import ctypes 
-from ctypes import *
-from ctypes import CFUNCTYPE, POINTER
 from mp1ampstsdk.comm_exceptions import CommSDKInvalidOperationException
+from mp1ampstsdk.comm_exceptions import CommSDKTimeoutException
+from mp1ampstsdk.remoteproc import RemoteProc
+from mp1ampstsdk.remoteproc import DFT_REMOTEPROC
+from mp1ampstsdk.remoteproc import DFT_FIRMWARE_DIR
+from mp1ampstsdk.remoteproc import DFT_RUN_DIR
+from mp1ampstsdk.remoteproc import DFT_BOOT_TIMEOUT_s
+from mp1ampstsdk.remoteproc import DFT_STOP_TIMEOUT_s
+from mp1ampstsdk.metrics import DFT_LATENCY_BUCKETS_s
+from mp1ampstsdk.metrics import DFT_SIZE_BUCKETS
+from mp1ampstsdk.metrics import NAMESPACE
+from mp1ampstsdk.metrics import REGISTRY
+from collections import OrderedDict
 import subprocess
+import asyncio
+
+
+# CONSTANTS
+
+DFT_SDB_DEVICE = '/dev/rpmsg-sdb'
+"""Character device of the stm32_rpmsg_sdb kernel driver."""
+SDB_LOG_ERROR = 0
+"""sdbsdk C receiver verbosity: errors only."""
+SDB_LOG_INFO = 1
+"""sdbsdk C receiver verbosity: setup and stream anomalies."""
+SDB_LOG_DEBUG = 2
+"""sdbsdk C receiver verbosity: per buffer traces (slows the receiver down)."""
 
 
 # CLASSES
 
+class SdbOverflowPolicy(Enum):
+    """What the sdb receiver does when the hand-off queue to Python is full."""
+    BLOCK = 0
+    """The receiver waits for room: M4 may overwrite buffers meanwhile."""
+    DROP_OLDEST = 1
+    """The oldest buffer waiting in the queue is dropped."""
+    DROP_NEWEST = 2
+    """The incoming buffer is dropped."""
+
+
 class RpmsgSdbAPI():    # TODO make it a singleton object
     """RpmsgSdbAPI class.
     This class manages the communication between the A7 host userland python 
     application and the M4 customized FW through the kernel module rpmsg_sdb_driver
     """
 
-    def __init__(self, m4_fw_name=None, verbose=False):
+    def __init__(self, m4_fw_name=None, verbose=False, remoteproc=DFT_REMOTEPROC, firmware_dir=DFT_FIRMWARE_DIR, sdb_device=DFT_SDB_DEVICE, load_driver=True, boot_timeout=DFT_BOOT_TIMEOUT_s, force_restart=False, io_core=None, metrics=None, keep_running=True, run_dir=DFT_RUN_DIR):
         """Constructor.
         :param serial_port: Serial Port device path. Refer to
             `Serial <https://pyserial.readthedocs.io/en/latest/pyserial_api.html#serial.Serial>`_
@@ -68,51 +101,98 @@ class RpmsgSdbAPI():    # TODO make it a singleton object
         :type serial_port: str (eg. /dev/ttyRPMSG0)
         :m4_fw_name: M4 firmare path 
         :type m4_fw_name: str (eg. /usr/local/Cube-M4-examples/STM32MP157C-DK2/Applications/OpenAMP/OpenAMP_TTY_echo/lib/firmware/OpenAMP_TTY_echo.elf)
+        :param remoteproc: sysfs directory of the remoteproc instance.
+        :type remoteproc: str (eg. /sys/class/remoteproc/remoteproc0)
+        :param firmware_dir: directory the M4 firmware is copied to.
+        :type firmware_dir: str (eg. /lib/firmware)
+        :param sdb_device: sdb driver device, or the file of a
+            :class:`mp1ampstsdk.emulator.FakeSdbProducer`.
+        :type sdb_device: str (eg. /dev/rpmsg-sdb)
+        :param load_driver: if False the stm32_rpmsg_sdb kernel module is
+            neither inserted nor removed.
+        :type load_driver: boolean
+        :param boot_timeout: max time in seconds for the M4 firmware to start
+            and the sdb device to be ready (see :meth:`get_startup_timeline`).
+        :type boot_timeout: float
+        :param force_restart: if True the M4 firmware is restarted even when
+            the same image is already running.
+        :type force_restart: boolean
+        :param io_core: I/O thread polling the buffer eventfds in place of the
+            receiver thread of the extension; the buffers are then delivered
+            from its thread (see the queue_depth of :meth:`init_sdb`).
+        :type io_core: :class:`mp1ampstsdk.iocore.IOCore`
+        :param metrics: registry of the metrics updated by this object (buffers
+            received, their size and the time spent in the listener callbacks,
+            see :mod:`mp1ampstsdk.metrics`), labelled with the sdb device;
+            defaults to :data:`mp1ampstsdk.metrics.REGISTRY`.
+        :type metrics: :class:`mp1ampstsdk.metrics.MetricsRegistry`
+        :param keep_running: if True the M4 firmware is left running when the
+            object is deleted, so that the next object using the same image
+            does not restart it; if False it is stopped, if it is the firmware
+            of m4_fw_name.
+        :type keep_running: boolean
+        :param run_dir: directory of the records of the running firmware,
+            cleared at reboot (see :mod:`mp1ampstsdk.remoteproc`).
+        :type run_dir: str (eg. /run/mp1ampstsdk)
         """
         try:
 
+            t0 = time.monotonic()
             self._verbose = verbose
+            self._keep_running = keep_running
+            self._rproc = RemoteProc(remoteproc, firmware_dir, run_dir, verbose, "RpmsgSdbAPI")
+            self._startup_timeline = OrderedDict()
+            self._sdb_device = sdb_device
+            self._load_driver = load_driver
+            self._io_core = io_core
+            self._io_fds = []
+            registry = metrics if metrics is not None else REGISTRY
+            labels = {"device": sdb_device}
+            self._m_buffers = registry.counter(NAMESPACE + "_sdb_buffers_total",
+                "Shared Data Buffers received from the M4.", labels)
+            self._m_bytes = registry.counter(NAMESPACE + "_sdb_rx_bytes_total",
+                "Bytes of the Shared Data Buffers received from the M4.", labels)
+            self._m_size = registry.histogram(NAMESPACE + "_sdb_buffer_size_bytes",
+                "Size of the Shared Data Buffers received from the M4.", DFT_SIZE_BUCKETS, labels)
+            self._m_callback = registry.histogram(NAMESPACE + "_sdb_callback_seconds",
+                "Time spent handing a buffer over to the listener or the stream.", DFT_LATENCY_BUCKETS_s, labels)
 # Insert kernel module stm32_rpmsg_sdb.ko
 # TODO ?the kernel module should already be inserted by the distro?
-            self._start_sdb_cmd = "insmod /lib/modules/" + str(subprocess.check_output(['uname', '-r']),'utf-8').strip('\n') + "/extra/stm32_rpmsg_sdb.ko"
-            os.system(self._start_sdb_cmd)
-            time.sleep(0.5)     # give kern drv time to start
+            if self._load_driver:
+                self._rproc.load_module("/lib/modules/" + str(subprocess.check_output(['uname', '-r']),'utf-8').strip('\n') + "/extra/stm32_rpmsg_sdb.ko")
+                self._startup_timeline.update(self._rproc.timeline)
+                self._startup_timeline.pop("total", None)
             
         # Start M4 Fw if any
 
             self._m4_fw_name = None            
             self._m4_fw_path = None
             if m4_fw_name != None:
-                if os.path.isfile(m4_fw_name):
-                    self._m4_fw_path, self._m4_fw_name = os.path.split(m4_fw_name)
-                    shutil.copyfile(m4_fw_name, "/lib/firmware/"+self._m4_fw_name)
-
-                if self._is_m4_firmware_running():
-                    self._stop_m4_firmware()
-                    time.sleep(0.5)  # give fw time to stop
-
-                # start m4 Fw
-                self._set_m4_firmware_name(self._m4_fw_name)
-                self._start_m4_firmware()
-                time.sleep(1)  # give fw time to start
+                self._m4_fw_path, self._m4_fw_name = os.path.split(m4_fw_name)
+                # The sdb device is created when the M4 Fw announces its rpmsg
+                # channel; an emulated device (regular file) stays in place.
+                devices = [] if os.path.isfile(self._sdb_device) else [self._sdb_device]
+                self._rproc.boot(m4_fw_name, devices, boot_timeout, force_restart)
+                self._startup_timeline.update(self._rproc.timeline)
+                self._startup_timeline.pop("total", None)
             # if m4_fw_name == None: assumes m4 FW was already started by someone else
+            self._startup_timeline["total"] = time.monotonic() - t0
 
             self._buff_num = 0
             self._buff_size = 0      
 
-            temp = os.path.abspath(__file__)
-            temp = os.path.realpath(temp)
-            temp = os.path.dirname(temp)
-            libname = os.path.join(temp, "libsdbsdk.so")
-            self._sdb_drv = CDLL(libname)
-            if self._sdb_drv == None:
+            try:
+                from mp1ampstsdk import _sdbsdk
+            except ImportError:
                 if self._is_m4_firmware_running():
                     self._stop_m4_firmware()      
-                raise CommSDKInvalidOperationException("\nError: library 'libsdbsdk.so' not found. Please build it again.")
-        #        CB_FTYPE_CHAR_P = CFUNCTYPE(c_int, c_char_p, c_uint) 
-            CB_FTYPE_CHAR_P = CFUNCTYPE(c_int, POINTER(c_char), c_uint) 
-            self._cb_get_buffer = CB_FTYPE_CHAR_P(self._buffer_ready_cb) 
+                raise CommSDKInvalidOperationException("\nError: extension '_sdbsdk' not found. Please build it again.")
+            self._sdb_drv = _sdbsdk
+            self._sdb_drv.set_verbosity(SDB_LOG_INFO if self._verbose else SDB_LOG_ERROR)
             self._sdb_buffer_rx_listener = None
+            self._stream = None
+            self._leases = {}
+            self._lock_leases = threading.Lock()
 
         except (CommSDKInvalidOperationException) as e:
             raise e        
@@ -121,80 +201,193 @@ class RpmsgSdbAPI():    # TODO make it a singleton object
     def __del__(self):
         if self._verbose:
             print("Deleting RpmsgSdbAPI object")
-        if (self._m4_fw_name != None and self._get_m4_firmware_name() == self._m4_fw_name):
+        if (not self._keep_running and self._m4_fw_name != None and self._get_m4_firmware_name() == self._m4_fw_name):
             if self._verbose:
                 print("RpmsgSdbAPI obj stopping M4 FW: ", self._m4_fw_name)
-            self._stop_m4_firmware()
-        while (self._is_m4_firmware_running()):
-             time.sleep(0.3)  # give M4 FW time to stop
+            try:
+                self._rproc.shutdown(DFT_STOP_TIMEOUT_s)
+            except CommSDKTimeoutException as e:
+                print(e)
         self._sdb_buffer_rx_listener = None             
-        if self._verbose:
-            print("RpmsgSdbAPI removing stm32_rpmsg_sdb.ko kernel mod")
-        os.system("rmmod stm32_rpmsg_sdb.ko")
-
-
-    def init_sdb(self, buffsize, buffnum): 
+        if self._load_driver:
+            if self._verbose:
+                print("RpmsgSdbAPI removing stm32_rpmsg_sdb.ko kernel mod")
+            self._rproc.unload_module("stm32_rpmsg_sdb")
+
+
+    def init_sdb(self, buffsize, buffnum, queue_depth=None, overflow_policy=SdbOverflowPolicy.BLOCK): 
+        """Map the Shared Data Buffers and start the receiver threads.
+        Buffers are handed from the receiver to the Python listener through a
+        bounded queue, so that a slow listener does not stall the receiver.
+        :param buffsize: size of each buffer in bytes.
+        :param buffnum: number of buffers in the ring.
+        :param queue_depth: depth of the hand-off queue, defaults to buffnum,
+            or to 0 with an io_core. 0 delivers the buffers on the receiver
+            thread (the io_core thread) itself.
+        :param overflow_policy: :class:`SdbOverflowPolicy` applied when the
+            queue is full; drops are counted in the queue_drops stat.
+        """
         try:
 
-            if (self._sdb_drv.InitSdbReceiver() !=0):
-                raise CommSDKInvalidOperationException("\nError init_sdb failed")              
+            if queue_depth is None:
+                queue_depth = 0 if self._io_core is not None else buffnum
+            self._sdb_drv.set_queue(queue_depth, SdbOverflowPolicy(overflow_policy).value)
+            self._sdb_drv.set_external_poll(self._io_core is not None)
+            self._sdb_drv.init_receiver()
             self._buff_num = buffnum
             self._buff_size = buffsize        
-            self._sdb_drv.register_buff_ready_cb(self._cb_get_buffer)                          
-            if (self._sdb_drv.InitSdb(self._buff_size, self._buff_num) != 0):
-                raise CommSDKInvalidOperationException("\nError init_sdb failed")
-
+            self._sdb_drv.set_callback(self._buffer_ready_cb)
+            self._sdb_drv.init(self._buff_size, self._buff_num, self._sdb_device)
+            if self._io_core is not None:
+                for idx, fd in enumerate(self._sdb_drv.get_eventfds()):
+                    self._io_core.register(fd, self._sdb_drv.dispatch, (idx,))
+                    self._io_fds.append(fd)
+
+        except (OSError, RuntimeError) as e:
+            raise CommSDKInvalidOperationException("\nError init_sdb failed: %s" % (e))
         except (CommSDKInvalidOperationException) as e:
             raise e        
 
     def deinit_sdb(self):
-        self._sdb_drv.DeInitSdbReceiver()
-        return self._sdb_drv.unregister_buff_ready_cb(self._cb_get_buffer)
+        if self._stream is not None:
+            self._stream.close()
+        while self._io_fds:
+            self._io_core.unregister(self._io_fds.pop())
+        # stop_sdb_receiver() does not wait for the buffers being handed
+        # out: the receiver threads exit first, then the leases are checked.
+        self._sdb_drv.halt()
+        with self._lock_leases:
+            if self._leases:
+                raise CommSDKInvalidOperationException("\nError deinit_sdb: %d buffer(s) still leased" % (len(self._leases)))
+        self._sdb_drv.deinit()
+        self._sdb_drv.set_callback(None)
+        return 0
+
+
+    def get_sequence_gaps(self):
+        """Return the buffer fills lost since init_sdb().
+        :return: tuple (total, per_buffer) where per_buffer is a list with the
+            number of lost fills for each buffer of the ring.
+        """
+        return self._sdb_drv.get_seq_gaps()
+
+
+    def get_stats(self):
+        """Return the cumulative counters of the sdb receiver.
+        :return: dict with keys buffers, bytes, poll_wakeups, empty_buffers,
+            cb_time_ns, uncomp_samples, seq_gaps, lease_overruns, queue_drops,
+            queue_high_water and size_errors.
+        """
+        return self._sdb_drv.get_stats()
+
+
+    def reset_stats(self):
+        """Reset the cumulative counters of the sdb receiver."""
+        self._sdb_drv.reset_stats()
+
+
+    def set_verbosity(self, level):
+        """Set the verbosity of the sdb receiver.
+        :param level: SDB_LOG_ERROR, SDB_LOG_INFO or SDB_LOG_DEBUG.
+        """
+        self._sdb_drv.set_verbosity(level)
+
+
+    def set_uncomp_count(self, enable):
+        """Enable the count of the uncompressed samples (uncomp_samples stat).
+        It costs an extra pass over every received buffer, disabled by default.
+        """
+        self._sdb_drv.set_uncomp_count(enable)
+
+
+    def get_eventfds(self):
+        """Return the eventfds signalled when each buffer of the ring is filled.
+        With a :class:`mp1ampstsdk.emulator.FakeSdbProducer` as sdb_device, the
+        producer writes them in place of the kernel driver.
+        :return: list of file descriptors, indexed by buffer.
+        """
+        return self._sdb_drv.get_eventfds()
 
 
     def start_sdb_receiver(self):
-        return self._sdb_drv.StartSdbReceiver()
+        return self._sdb_drv.start()
 
 
     def stop_sdb_receiver(self):
-        return self._sdb_drv.StopSdbReceiver()
+        """Stop the sdb receiver; an open :meth:`stream` ends once the buffers
+        already prefetched have been consumed."""
+        res = self._sdb_drv.stop()
+        stream = self._stream
+        if stream is not None:
+            stream._end()
+        return res
+
+
+    def stream(self, prefetch=None, auto_release=True, timeout=None):
+        """Start the sdb receiver and return the received buffers as an
+        iterator, usable with ``for`` or ``async for``, in place of a listener.
+        The receiver thread blocks when prefetch buffers are waiting, so that a
+        slow consumer slows the receiver down instead of piling up buffers
+        (see the overflow_policy of :meth:`init_sdb`). The stream ends on
+        :meth:`stop_sdb_receiver` or :meth:`SdbBufferStream.close`::
+
+            with sdb.stream() as buffers:
+                for lease in buffers:
+                    process(lease.data)
+
+        :param prefetch: number of buffers waiting for the consumer, defaults
+            to half the ring.
+        :param auto_release: if True, each lease is released when the next one
+            is requested, otherwise the consumer releases them.
+        :param timeout: max wait for a buffer in seconds, None waits forever.
+            On expiry CommSDKTimeoutException is raised.
+        :return: :class:`SdbBufferStream`.
+        """
+        try:
+
+            if self._buff_num == 0:
+                raise CommSDKInvalidOperationException("\nError stream: call init_sdb() before")
+            if self._sdb_buffer_rx_listener is not None:
+                raise CommSDKInvalidOperationException("\nError stream: remove the sdb buffer listener before")
+            if self._stream is not None:
+                self._stream.close()
+            if prefetch is None:
+                prefetch = max(1, self._buff_num // 2)
+            self._stream = SdbBufferStream(self, prefetch, auto_release, timeout)
+            self.start_sdb_receiver()
+            return self._stream
+
+        except (CommSDKInvalidOperationException) as e:
+            raise e
+
+
+    def get_startup_timeline(self):
+        """Return the durations in seconds of the construction phases: insmod
+        of the driver, then copy, stop, start and device_ready of the M4 Fw
+        when m4_fw_name is given, and total.
+        :return: OrderedDict.
+        """
+        return OrderedDict(self._startup_timeline)
 
 
     def _is_m4_firmware_running(self):        
-        with open('/sys/class/remoteproc/remoteproc0/state', 'r') as fw_state_fd:
-            fw_state = fw_state_fd.read(50).strip()
-            fw_state_fd.close()
-            if fw_state == "running":
-                return True
-            return False
+        return self._rproc.is_running()
 
             
     def _get_m4_firmware_name(self):
-        with open('/sys/class/remoteproc/remoteproc0/firmware', 'r') as fw_name_fd:
-            name = fw_name_fd.read(100).strip()
-            fw_name_fd.close()
-            return name
+        return self._rproc.get_firmware_name()
 
         
     def _set_m4_firmware_name(self, name):   #     "how2eldb03110.elf"  
-        with open('/sys/class/remoteproc/remoteproc0/firmware', 'r+') as fw_name_fd:
-            res = fw_name_fd.write(name)
-            fw_name_fd.close()
-            return res
+        return self._rproc.set_firmware_name(name)
 
 
     def _start_m4_firmware(self):
-        with open('/sys/class/remoteproc/remoteproc0/state', 'r+') as fw_state_fd:
-            res = fw_state_fd.write("start")
-            fw_state_fd.close()
-            return res
+        return self._rproc.start()
 
         
     def _stop_m4_firmware(self):
-        with open('/sys/class/remoteproc/remoteproc0/state', 'r+') as fw_state_fd:
-            res = fw_state_fd.write("stop")
-            fw_state_fd.close()
-            return res
+        return self._rproc.stop()
 
         
     def add_sdb_buffer_rx_listener(self, listener):
@@ -206,6 +399,8 @@ class RpmsgSdbAPI():    # TODO make it a singleton object
 
             if listener is None:
                 raise CommSDKInvalidOperationException("\nError add_sdb_buffer_rx_listener: null listener")
+            if self._stream is not None:
+                raise CommSDKInvalidOperationException("\nError add_sdb_buffer_rx_listener: close the stream before")
 
     #        self._th_ntf = ThM4Notifications(self, "ThM4Notifications")            
             self._sdb_buffer_rx_listener=listener
@@ -230,13 +425,281 @@ class RpmsgSdbAPI():    # TODO make it a singleton object
             raise e
 
 
-    def _buffer_ready_cb(self, sdb_buff, sdb_buff_len):
+    def _buffer_ready_cb(self, sdb_buffer):
+        """Called by the _sdbsdk receiver thread, with the GIL held, for every
+        buffer received from M4."""
+        start = time.perf_counter()
+        size = len(sdb_buffer)
         if self._verbose:
-            print("CB _buffer_ready_cb called buff len: ", sdb_buff_len)
-        if self._sdb_buffer_rx_listener is not None:
-            self._sdb_buffer_rx_listener.on_m4_sdb_rx(sdb_buff, sdb_buff_len)
+            print("CB _buffer_ready_cb called buff len: ", size)
+        listener = self._sdb_buffer_rx_listener
+        stream = self._stream
+        try:
+            if stream is not None:
+                stream._put(self._lease_buffer(sdb_buffer))
+            elif isinstance(listener, RpmsgSdbAPIBufferListener):
+                # the listener owns the lease: the buffer goes back on lease.release()
+                listener.on_m4_sdb_buffer(self._lease_buffer(sdb_buffer))
+            else:
+                try:
+                    if listener is not None:
+                        # items as 1-byte bytes, as the former ctypes char pointer
+                        with memoryview(sdb_buffer) as view, view.cast('c') as sdb:
+                            listener.on_m4_sdb_rx(sdb, size)
+                finally:
+                    try:
+                        sdb_buffer.invalidate()
+                    finally:
+                        self._sdb_drv.release_buffer(sdb_buffer.index)
+        finally:
+            self._m_callback.observe(time.perf_counter() - start)
+            self._m_buffers.inc()
+            self._m_bytes.inc(size)
+            self._m_size.observe(size)
         return 0
 
+
+    def _lease_buffer(self, sdb_buffer):
+        lease = SdbBufferLease(self, sdb_buffer)
+        with self._lock_leases:
+            self._leases[sdb_buffer.index] = lease
+        return lease
+
+
+    def _release_buffer(self, lease):
+        with self._lock_leases:
+            if self._leases.get(lease.index) is lease:
+                del self._leases[lease.index]
+        return self._sdb_drv.release_buffer(lease.index)
+
+
+class SdbBufferLease():
+    """SdbBufferLease class.
+    Zero-copy, read-only view of a Shared Data Buffer mmapped from the
+    rpmsg_sdb_driver. The view is valid until :meth:`release` is called (or the
+    ``with`` block is exited), then the buffer goes back to the receiver.
+    """
+
+    def __init__(self, sdb_api, sdb_buffer):
+        self._sdb_api = sdb_api
+        self._sdb_buffer = sdb_buffer
+        self._index = sdb_buffer.index
+        self._sequence = sdb_buffer.sequence
+        self._len = len(sdb_buffer)
+        self._view = memoryview(sdb_buffer)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+    def __len__(self):
+        return self._len
+
+
+    @property
+    def index(self):
+        """Index of the buffer in the SDB ring."""
+        return self._index
+
+
+    @property
+    def sequence(self):
+        """Stream sequence number of the buffer: a jump between two consecutive
+        leases means that fills have been lost (see
+        :meth:`RpmsgSdbAPI.get_sequence_gaps`)."""
+        return self._sequence
+
+
+    @property
+    def released(self):
+        """True once the lease has been released."""
+        return self._view is None
+
+
+    @property
+    def data(self):
+        """Read-only memoryview of the buffer content (unsigned bytes)."""
+        if self._view is None:
+            raise CommSDKInvalidOperationException("\nError SdbBufferLease: lease already released")
+        return self._view
+
+
+    def as_numpy(self, dtype='uint8'):
+        """Return the buffer content as a read-only NumPy array, without copy.
+        The array, and every view derived from it, must be deleted before
+        releasing the lease.
+        :param dtype: NumPy dtype used to interpret the buffer.
+        """
+        try:
+            import numpy
+        except ImportError:
+            raise CommSDKInvalidOperationException("\nError SdbBufferLease: as_numpy() requires numpy")
+        if self._view is None:
+            raise CommSDKInvalidOperationException("\nError SdbBufferLease: lease already released")
+        # Exported from the buffer object itself, so that the array and the
+        # views derived from it hold the buffer until they are collected.
+        return numpy.frombuffer(self._sdb_buffer, dtype=dtype)
+
+
+    def release(self):
+        """Give the buffer back to the receiver.
+        :raises CommSDKInvalidOperationException: if views of the buffer (e.g.
+            slices of :attr:`data`, NumPy arrays or their views) are still
+            alive; the lease is then kept and can be released later.
+        """
+        if self._view is None:
+            return
+        try:
+            self._view.release()
+        except BufferError:
+            raise CommSDKInvalidOperationException("\nError SdbBufferLease: buffer %d still in use" % (self._index))
+        try:
+            self._sdb_buffer.invalidate()
+        except BufferError:
+            self._view = memoryview(self._sdb_buffer)
+            raise CommSDKInvalidOperationException("\nError SdbBufferLease: buffer %d still in use" % (self._index))
+        self._view = None
+        self._sdb_buffer = None
+        self._sdb_api._release_buffer(self)
+
+
+class SdbBufferStream():
+    """SdbBufferStream class.
+    Iterator over the Shared Data Buffers returned by
+    :meth:`RpmsgSdbAPI.stream`, yielding :class:`SdbBufferLease` objects.
+    """
+
+    _PUT_POLL_s = 0.1
+    """Period the receiver thread checks for close() while the stream is full."""
+
+    def __init__(self, sdb_api, prefetch, auto_release, timeout):
+        self._sdb_api = sdb_api
+        self._auto_release = auto_release
+        self._timeout = timeout
+        self._slots = threading.Semaphore(prefetch)
+        self._ready = deque()
+        self._cond = threading.Condition()
+        self._current = None
+        self._ended = False
+        self._closed = False
+        self._loop = None
+        self._wakeup = None
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+    def __iter__(self):
+        return self
+
+
+    def __next__(self):
+        self._release_current()
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._ready or self._ended, self._timeout):
+                raise CommSDKTimeoutException("\nError SdbBufferStream: no buffer within %ss" % (self._timeout))
+            return self._pop()
+
+
+    def __aiter__(self):
+        return self
+
+
+    async def __anext__(self):
+        self._release_current()
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+            self._wakeup = asyncio.Event()
+        while True:
+            with self._cond:
+                if self._ready or self._ended:
+                    try:
+                        return self._pop()
+                    except StopIteration:
+                        raise StopAsyncIteration
+            # set() is scheduled by _put()/_end() after they update the state,
+            # so clearing here cannot lose a wake-up.
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self._timeout)
+            except asyncio.TimeoutError:
+                raise CommSDKTimeoutException("\nError SdbBufferStream: no buffer within %ss" % (self._timeout))
+
+
+    def close(self):
+        """Stop the receiver and release the buffers not consumed yet."""
+        if self._closed:
+            return
+        if not self._ended:
+            self._sdb_api.stop_sdb_receiver()
+        with self._cond:
+            self._closed = True
+            self._ended = True
+            ready = list(self._ready)
+            self._ready.clear()
+            self._cond.notify_all()
+        if self._sdb_api._stream is self:
+            self._sdb_api._stream = None
+        for lease in ready:
+            lease.release()
+        self._release_current()
+
+
+    def _pop(self):
+        if not self._ready:
+            raise StopIteration
+        lease = self._ready.popleft()
+        self._slots.release()
+        if self._auto_release:
+            self._current = lease
+        return lease
+
+
+    def _release_current(self):
+        if self._current is not None:
+            lease, self._current = self._current, None
+            lease.release()
+
+
+    def _put(self, lease):
+        """Called by the receiver thread for every buffer."""
+        while not self._slots.acquire(timeout=self._PUT_POLL_s):
+            if self._closed:
+                break
+        with self._cond:
+            if not self._closed:
+                self._ready.append(lease)
+                self._cond.notify()
+                lease = None
+        if lease is not None:
+            lease.release()
+            return
+        self._wake()
+
+
+    def _end(self):
+        with self._cond:
+            self._ended = True
+            self._cond.notify_all()
+        self._wake()
+
+
+    def _wake(self):
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._wakeup.set)
+
+
 # INTERFACES
 
 class RpmsgSdbAPIListener(object):
@@ -256,3 +719,20 @@ class RpmsgSdbAPIListener(object):
             "the \"RpmsgSdbAPIListener\" class.")
 
 
+class RpmsgSdbAPIBufferListener(object):
+    """Interface used by the :class:`RpmsgSdbAPI` to hand over the Shared Data
+    Buffers received from M4 as zero-copy leases.
+    """
+    __metaclass__ = ABCMeta
+
+    @abstractmethod
+    def on_m4_sdb_buffer(self, lease):
+        """To be called whenever a M4 processor sends a sdb buffer.
+        The buffer is not handed out again until the lease is released.
+        :param lease: :class:`SdbBufferLease` of the received buffer.
+        :raises NotImplementedError: is raised if the method is not implemented.
+        """
+        raise NotImplementedError("You must define \"on_m4_sdb_buffer()\" to use "
+            "the \"RpmsgSdbAPIBufferListener\" class.")
+
+
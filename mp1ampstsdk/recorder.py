@@ -0,0 +1,431 @@
+################################################################################
+# COPYRIGHT(c) 2020 STMicroelectronics                                         #
+#                                                                              #
+# Redistribution and use in source and binary forms, with or without           #
+# modification, are permitted provided that the following conditions are met:  #
+#   1. Redistributions of source code must retain the above copyright notice,  #
+#      this list of conditions and the following disclaimer.                   #
+#   2. Redistributions in binary form must reproduce the above copyright       #
+#      notice, this list of conditions and the following disclaimer in the     #
+#      documentation and/or other materials provided with the distribution.    #
+#   3. Neither the name of STMicroelectronics nor the names of its             #
+#      contributors may be used to endorse or promote products derived from    #
+#      this software without specific prior written permission.                #
+#                                                                              #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"  #
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE    #
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE   #
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE    #
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR          #
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF         #
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS     #
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN      #
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)      #
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE   #
+# POSSIBILITY OF SUCH DAMAGE.                                                  #
+################################################################################
+
+
+"""recorder
+The recorder module captures the Shared Data Buffers received by RpmsgSdbAPI to
+disk and reads the recordings back.
+:class:`SdbRecorder` copies each buffer into a pool of page aligned slots, so
+that the buffer goes back to the receiver at once, and a dedicated I/O thread
+writes the slots with batched writev() calls, optionally with O_DIRECT, rotating
+the files by size or time. Each data file comes with an index file of
+(sequence, timestamp, offset, length) records, used by :class:`SdbRecording` to
+seek and memory-map the buffers back.
+"""
+
+
+# IMPORT
+
+from mp1ampstsdk.comm_exceptions import CommSDKInvalidOperationException
+from mp1ampstsdk.py_sdbsdk import RpmsgSdbAPIBufferListener
+import bisect
+import glob
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+
+
+# CONSTANTS
+
+DATA_FILE_EXT = '.sdb'
+"""Extension of the recording data files."""
+INDEX_FILE_EXT = '.idx'
+"""Extension of the recording index files."""
+INDEX_MAGIC = b'SDBIDX01'
+"""First bytes of an index file."""
+INDEX_HEADER_FORMAT = '<8sII'
+"""Index file header: magic, alignment of the records in the data file, reserved."""
+INDEX_RECORD_FORMAT = '<IIQQ'
+"""Index record: sequence, length, timestamp (ns since the epoch), offset in the data file."""
+DIRECT_IO_ALIGN = 4096
+"""Alignment of the records (offset, length and memory) written with O_DIRECT."""
+MAX_WRITEV_BUFFERS = 64
+"""Max number of buffers gathered by a single writev() call."""
+
+
+# CLASSES
+
+class SdbRecorder(RpmsgSdbAPIBufferListener):
+    """SdbRecorder class.
+    Records the Shared Data Buffers to '<directory>/<prefix>_<NNNN>.sdb' files
+    along with their '.idx' index. Add it as listener of an RpmsgSdbAPI, or
+    call :meth:`record` with the leases of a stream::
+
+        with SdbRecorder("/media/sdcard/run1", buff_size=1024*1024, max_file_size=1 << 30) as rec:
+            sdb.add_sdb_buffer_rx_listener(rec)
+            sdb.init_sdb(1024*1024, 3)
+            sdb.start_sdb_receiver()
+            ...
+            sdb.stop_sdb_receiver()
+            sdb.deinit_sdb()
+    """
+
+    def __init__(self, directory, buff_size, prefix='sdb', max_file_size=None, max_file_time=None, pool_buffers=16, direct_io=False, verbose=False):
+        """Constructor.
+        :param directory: Directory of the recording, created if missing.
+        :type directory: str
+
+        :param buff_size: Size of the sdb buffers (as passed to init_sdb).
+        :type buff_size: int
+
+        :param prefix: Prefix of the file names.
+        :type prefix: str
+
+        :param max_file_size: Size in bytes above which a new file is started.
+        :type max_file_size: int
+
+        :param max_file_time: Seconds after which a new file is started.
+        :type max_file_time: float
+
+        :param pool_buffers: Number of buffers waiting to be written; when
+            they are all in use the receiver waits for the disk.
+        :type pool_buffers: int
+
+        :param direct_io: If True, the data files are written with O_DIRECT,
+            bypassing the page cache, and each buffer is padded to 4 KiB; falls
+            back to buffered writes where the file system does not support it.
+        :type direct_io: boolean
+
+        :param verbose: If True, enables verbosity on output.
+        :type verbose: boolean
+        """
+        try:
+
+            if buff_size <= 0 or pool_buffers <= 0:
+                raise CommSDKInvalidOperationException("SdbRecorder: Error: invalid buff_size or pool_buffers.")
+            self._verbose = verbose
+            self._directory = directory
+            self._prefix = prefix
+            self._max_file_size = max_file_size
+            self._max_file_time = max_file_time
+            self._direct_io = direct_io and hasattr(os, 'O_DIRECT')
+            self._align = DIRECT_IO_ALIGN if self._direct_io else 1
+            self._slot_size = -(-buff_size // DIRECT_IO_ALIGN) * DIRECT_IO_ALIGN
+            os.makedirs(self._directory, exist_ok=True)
+
+            # Anonymous mappings are page aligned, as O_DIRECT requires.
+            self._free = queue.Queue()
+            for i in range(pool_buffers):
+                self._free.put(mmap.mmap(-1, self._slot_size))
+            self._filled = queue.Queue()
+            self._pool_buffers = pool_buffers
+
+            self._file_num = 0
+            self._fd = None
+            self._index = None
+            self._file_size = 0
+            self._file_start = 0
+            self._closed = False
+            self._error = None
+            self._stats = {"buffers": 0, "bytes": 0, "files": 0, "write_time_ns": 0, "pool_high_water": 0}
+            self._lock_stats = threading.Lock()
+            self._th_writer = threading.Thread(target=self._write_loop, daemon=True)
+            self._th_writer.start()
+
+        except (OSError, CommSDKInvalidOperationException) as e:
+            raise e
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+    def on_m4_sdb_buffer(self, lease):
+        self.record(lease)
+
+
+    def record(self, lease):
+        """Queue a buffer for writing and release its lease.
+        Blocks while all the pool buffers are waiting for the disk.
+        :param lease: :class:`mp1ampstsdk.py_sdbsdk.SdbBufferLease`.
+        """
+        try:
+            self.record_data(lease.data, lease.sequence)
+        finally:
+            lease.release()
+
+
+    def record_data(self, data, sequence):
+        """Queue a copy of data for writing.
+        :param data: bytes-like object, at most buff_size bytes.
+        :param sequence: Sequence number stored in the index.
+        """
+        if self._closed:
+            raise CommSDKInvalidOperationException("SdbRecorder: Error: recorder closed.")
+        if self._error is not None:
+            raise CommSDKInvalidOperationException("SdbRecorder: Error: writer failed: %s" % (self._error))
+        timestamp = time.time_ns()
+        length = len(data)
+        if length > self._slot_size:
+            raise CommSDKInvalidOperationException("SdbRecorder: Error: buffer of %d bytes larger than buff_size." % (length))
+        slot = self._free.get()
+        slot[:length] = data
+        padded = -(-length // self._align) * self._align
+        if padded > length:
+            slot[length:padded] = bytes(padded - length)
+        self._filled.put((slot, length, padded, sequence, timestamp))
+        in_use = self._pool_buffers - self._free.qsize()
+        if in_use > self._stats["pool_high_water"]:
+            self._stats["pool_high_water"] = in_use
+
+
+    def get_stats(self):
+        """Return the recorder counters.
+        :return: dict with keys buffers, bytes (written to the data files,
+            padding included), files, write_time_ns and pool_high_water.
+        """
+        with self._lock_stats:
+            return dict(self._stats)
+
+
+    def close(self):
+        """Write the queued buffers and close the files."""
+        if self._closed:
+            return
+        self._closed = True
+        self._filled.put(None)
+        self._th_writer.join()
+        if self._error is not None:
+            raise CommSDKInvalidOperationException("SdbRecorder: Error: writer failed: %s" % (self._error))
+
+
+    def _write_loop(self):
+        try:
+            exiting = False
+            while not exiting:
+                batch = [self._filled.get()]
+                while len(batch) < MAX_WRITEV_BUFFERS:
+                    try:
+                        batch.append(self._filled.get_nowait())
+                    except queue.Empty:
+                        break
+                if batch[-1] is None:
+                    batch.pop()
+                    exiting = True
+                self._write_batch(batch)
+        except OSError as e:
+            self._error = e
+            if self._verbose:
+                print("SdbRecorder: Error writing: %s" % (e))
+            # Keep the receiver going: slots are given back unwritten.
+            while True:
+                item = self._filled.get()
+                if item is None:
+                    break
+                self._free.put(item[0])
+        finally:
+            self._close_file()
+
+
+    def _write_batch(self, batch):
+        start = 0
+        while start < len(batch):
+            now = time.monotonic()
+            if self._fd is None or \
+                (self._max_file_size and self._file_size + batch[start][2] > self._max_file_size and self._file_size) or \
+                (self._max_file_time and now - self._file_start >= self._max_file_time):
+                self._open_file(now)
+            # Records going to the current file.
+            end = start
+            size = self._file_size
+            while end < len(batch) and (end == start or not self._max_file_size or size + batch[end][2] <= self._max_file_size):
+                size += batch[end][2]
+                end += 1
+            self._writev(batch[start:end])
+            start = end
+
+
+    def _writev(self, items):
+        t0 = time.perf_counter_ns()
+        views = [memoryview(slot)[:padded] for slot, length, padded, sequence, timestamp in items]
+        try:
+            total = sum(len(view) for view in views)
+            while views:
+                written = os.writev(self._fd, views)
+                while views and written >= len(views[0]):
+                    written -= len(views[0])
+                    views.pop(0).release()
+                if views and written:
+                    view = views[0]
+                    views[0] = view[written:]
+                    view.release()
+        finally:
+            for view in views:
+                view.release()
+        for slot, length, padded, sequence, timestamp in items:
+            self._index.write(struct.pack(INDEX_RECORD_FORMAT, sequence, length, timestamp, self._file_size))
+            self._file_size += padded
+            self._free.put(slot)
+        with self._lock_stats:
+            self._stats["buffers"] += len(items)
+            self._stats["bytes"] += total
+            self._stats["write_time_ns"] += time.perf_counter_ns() - t0
+
+
+    def _open_file(self, now):
+        self._close_file()
+        name = os.path.join(self._directory, "%s_%04d" % (self._prefix, self._file_num))
+        flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC
+        if self._direct_io:
+            try:
+                self._fd = os.open(name + DATA_FILE_EXT, flags | os.O_DIRECT, 0o644)
+            except OSError:
+                # e.g. tmpfs: keep the 4 KiB layout, through the page cache.
+                if self._verbose:
+                    print("SdbRecorder: O_DIRECT not supported, using buffered writes.")
+                self._fd = os.open(name + DATA_FILE_EXT, flags, 0o644)
+        else:
+            self._fd = os.open(name + DATA_FILE_EXT, flags, 0o644)
+        self._index = open(name + INDEX_FILE_EXT, 'wb')
+        self._index.write(struct.pack(INDEX_HEADER_FORMAT, INDEX_MAGIC, self._align, 0))
+        self._file_num += 1
+        self._file_size = 0
+        self._file_start = now
+        with self._lock_stats:
+            self._stats["files"] += 1
+        if self._verbose:
+            print("SdbRecorder: Recording to %s." % (name + DATA_FILE_EXT))
+
+
+    def _close_file(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        if self._index is not None:
+            self._index.close()
+            self._index = None
+
+
+class SdbRecording():
+    """SdbRecording class.
+    Read access to a recording made by :class:`SdbRecorder`: buffers are
+    addressed by their position in the recording and returned as read-only
+    memoryviews of the memory-mapped data files, without copy.
+    """
+
+    def __init__(self, directory, prefix='sdb'):
+        """Constructor.
+        :param directory: Directory of the recording.
+        :param prefix: Prefix of the file names.
+        """
+        self._files = []
+        self._maps = []
+        self._records = []
+        for index_name in sorted(glob.glob(os.path.join(directory, "%s_*%s" % (glob.escape(prefix), INDEX_FILE_EXT)))):
+            with open(index_name, 'rb') as index_fd:
+                content = index_fd.read()
+            header_size = struct.calcsize(INDEX_HEADER_FORMAT)
+            if len(content) < header_size or struct.unpack_from(INDEX_HEADER_FORMAT, content)[0] != INDEX_MAGIC:
+                raise CommSDKInvalidOperationException("SdbRecording: Error: %s is not an index file." % (index_name))
+            record_size = struct.calcsize(INDEX_RECORD_FORMAT)
+            # A trailing partial record is an interrupted recording: ignored.
+            end = header_size + (len(content) - header_size) // record_size * record_size
+            file_num = len(self._files)
+            self._files.append(index_name[:-len(INDEX_FILE_EXT)] + DATA_FILE_EXT)
+            self._maps.append(None)
+            for sequence, length, timestamp, offset in struct.iter_unpack(INDEX_RECORD_FORMAT, content[header_size:end]):
+                self._records.append((timestamp, sequence, file_num, offset, length))
+        self._timestamps = [record[0] for record in self._records]
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+    def __len__(self):
+        return len(self._records)
+
+
+    def __getitem__(self, position):
+        return self.read(position)
+
+
+    def __iter__(self):
+        for position in range(len(self._records)):
+            yield self.read(position)
+
+
+    @property
+    def files(self):
+        """Data files of the recording, in order."""
+        return list(self._files)
+
+
+    def info(self, position):
+        """Return the index record of a buffer.
+        :return: tuple (sequence, timestamp_ns, file, offset, length).
+        """
+        timestamp, sequence, file_num, offset, length = self._records[position]
+        return sequence, timestamp, self._files[file_num], offset, length
+
+
+    def read(self, position):
+        """Return a buffer of the recording.
+        :param position: Position of the buffer in the recording.
+        :return: read-only memoryview, valid until :meth:`close`.
+        """
+        timestamp, sequence, file_num, offset, length = self._records[position]
+        data_map = self._maps[file_num]
+        if data_map is None:
+            with open(self._files[file_num], 'rb') as data_fd:
+                data_map = mmap.mmap(data_fd.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[file_num] = data_map
+        return memoryview(data_map)[offset:offset + length]
+
+
+    def find_sequence(self, sequence):
+        """Return the position of the first buffer with the given sequence
+        number, or -1 (sequence numbers restart with each init_sdb())."""
+        for position, record in enumerate(self._records):
+            if record[1] == sequence:
+                return position
+        return -1
+
+
+    def find_time(self, timestamp):
+        """Return the position of the first buffer received at or after
+        timestamp (time.time_ns() clock), len(self) if none."""
+        return bisect.bisect_left(self._timestamps, timestamp)
+
+
+    def close(self):
+        """Unmap the data files; memoryviews still referenced raise BufferError."""
+        for file_num, data_map in enumerate(self._maps):
+            if data_map is not None:
+                data_map.close()
+                self._maps[file_num] = None
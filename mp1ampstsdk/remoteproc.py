@@ -0,0 +1,456 @@
+################################################################################
+# COPYRIGHT(c) 2020 STMicroelectronics                                         #
+#                                                                              #
+# Redistribution and use in source and binary forms, with or without           #
+# modification, are permitted provided that the following conditions are met:  #
+#   1. Redistributions of source code must retain the above copyright notice,  #
+#      this list of conditions and the following disclaimer.                   #
+#   2. Redistributions in binary form must reproduce the above copyright       #
+#      notice, this list of conditions and the following disclaimer in the     #
+#      documentation and/or other materials provided with the distribution.    #
+#   3. Neither the name of STMicroelectronics nor the names of its             #
+#      contributors may be used to endorse or promote products derived from    #
+#      this software without specific prior written permission.                #
+#                                                                              #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"  #
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE    #
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE   #
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE    #
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR          #
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF         #
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS     #
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN      #
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)      #
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE   #
+# POSSIBILITY OF SUCH DAMAGE.                                                  #
+################################################################################
+
+
+"""remoteproc
+The remoteproc module controls the life cycle of the M4 firmware through the
+Linux remoteproc sysfs interface, shared by CommAPI, AsyncCommAPI and
+RpmsgSdbAPI.
+Waits have deadlines and no fixed sleeps: device nodes (RpMsg TTYs, sdb device)
+are awaited with inotify on their directory, the remoteproc state, which sysfs
+does not notify, is polled with a short backoff. Each boot records a timeline
+of its phases (copy, stop, start, device_ready).
+Firmware images are content-addressed: an image identical (SHA-256) to the one
+in the firmware directory is not copied again, a different one is installed by
+atomic rename, and a firmware already running with the same name and content is
+left running.
+"""
+
+
+# IMPORT
+
+from mp1ampstsdk.comm_exceptions import CommSDKTimeoutException
+from collections import OrderedDict
+import ctypes
+import hashlib
+import os
+import select
+import subprocess
+import tempfile
+import time
+
+
+# CONSTANTS
+
+DFT_REMOTEPROC = '/sys/class/remoteproc/remoteproc0'
+"""Sysfs directory of the remoteproc instance running the M4 firmware."""
+DFT_FIRMWARE_DIR = '/lib/firmware'
+"""Directory the remoteproc framework loads the M4 firmware from."""
+DFT_BOOT_TIMEOUT_s = 5
+"""Default max time for the firmware to run and its devices to be ready."""
+DFT_STOP_TIMEOUT_s = 5
+"""Default max time for the firmware to stop and its devices to go."""
+SYSFS_MODULE_DIR = '/sys/module'
+"""Sysfs directory listing the inserted kernel modules."""
+DFT_RUN_DIR = '/run/mp1ampstsdk'
+"""Directory, cleared at reboot, of the records of the running firmware."""
+HASH_CHUNK_SIZE = 65536
+"""Read size when hashing firmware images."""
+DFT_MODULE_TIMEOUT_s = 2
+"""Default max time for a kernel module to create its device."""
+STATE_POLL_MIN_s = 0.001
+"""First polling period of the remoteproc state, doubled up to STATE_POLL_MAX_s."""
+STATE_POLL_MAX_s = 0.05
+"""Longest polling period of the remoteproc state."""
+
+_IN_ATTRIB = 0x00000004
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_NONBLOCK = os.O_NONBLOCK
+_IN_CLOEXEC = os.O_CLOEXEC
+_IN_MASK = _IN_ATTRIB | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+
+
+# FUNCTIONS
+
+def _file_digest(path):
+    """Return the SHA-256 of a file in hexadecimal."""
+    sha = hashlib.sha256()
+    with open(path, 'rb') as fd:
+        for chunk in iter(lambda: fd.read(HASH_CHUNK_SIZE), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+# CLASSES
+
+class RemoteProc():
+    """RemoteProc class.
+    Starts and stops the M4 firmware and waits, with deadlines, for the
+    firmware state and for the devices it creates.
+    """
+
+    def __init__(self, remoteproc=DFT_REMOTEPROC, firmware_dir=DFT_FIRMWARE_DIR, run_dir=DFT_RUN_DIR, verbose=False, caller="RemoteProc"):
+        """Constructor.
+        :param remoteproc: Sysfs directory of the remoteproc instance.
+        :type remoteproc: str
+
+        :param firmware_dir: Directory the M4 firmware is copied to.
+        :type firmware_dir: str
+
+        :param run_dir: Directory of the records of the firmware started by
+            :meth:`boot`, to be cleared at reboot.
+        :type run_dir: str
+
+        :param verbose: If True, enables verbosity on output.
+        :type verbose: boolean
+
+        :param caller: Name prefixed to the verbose traces.
+        :type caller: str
+        """
+        self._remoteproc = remoteproc
+        self._firmware_dir = firmware_dir
+        self._run_dir = run_dir
+        self._verbose = verbose
+        self._caller = caller
+        self._timeline = OrderedDict()
+        self._run_record = os.path.join(run_dir, os.path.realpath(remoteproc).strip(os.sep).replace(os.sep, '_'))
+
+
+    @property
+    def remoteproc(self):
+        return self._remoteproc
+
+
+    @property
+    def firmware_dir(self):
+        return self._firmware_dir
+
+
+    @property
+    def run_dir(self):
+        return self._run_dir
+
+
+    @property
+    def timeline(self):
+        """Durations in seconds of the phases of the last :meth:`boot` or
+        :meth:`load_module`, plus their 'total'."""
+        return OrderedDict(self._timeline)
+
+
+    def is_running(self):
+        return self.get_state() == "running"
+
+
+    def get_state(self):
+        with open(os.path.join(self._remoteproc, 'state'), 'r') as fw_state_fd:
+            return fw_state_fd.read(50).strip()
+
+
+    def get_firmware_name(self):
+        with open(os.path.join(self._remoteproc, 'firmware'), 'r') as fw_name_fd:
+            return fw_name_fd.read(100).strip()
+
+
+    def set_firmware_name(self, name):
+        with open(os.path.join(self._remoteproc, 'firmware'), 'w') as fw_name_fd:
+            return fw_name_fd.write(name)
+
+
+    def start(self):
+        if self._verbose:
+            print("%s: Starting firmware on M4." % (self._caller))
+        with open(os.path.join(self._remoteproc, 'state'), 'w') as fw_state_fd:
+            return fw_state_fd.write("start")
+
+
+    def stop(self):
+        if self._verbose:
+            print("%s: Stopping firmware on M4." % (self._caller))
+        self._write_run_record(None, None)
+        with open(os.path.join(self._remoteproc, 'state'), 'w') as fw_state_fd:
+            return fw_state_fd.write("stop")
+
+
+    def deploy_firmware(self, fw_path):
+        """Install a firmware image in the firmware directory, unless an
+        identical one is already there; the install is an atomic rename, so
+        that the remoteproc never loads a partially written image.
+        :param fw_path: Path of the firmware file.
+        :return: (name, digest) of the firmware, name as written to the
+            remoteproc, digest the SHA-256 of the image in hexadecimal.
+        """
+        name = os.path.basename(fw_path)
+        target = os.path.join(self._firmware_dir, name)
+        with open(fw_path, 'rb') as fw_fd:
+            image = fw_fd.read()
+        digest = hashlib.sha256(image).hexdigest()
+        try:
+            if os.path.getsize(target) == len(image) and _file_digest(target) == digest:
+                if self._verbose:
+                    print("%s: Firmware %s already deployed." % (self._caller, name))
+                return name, digest
+        except OSError:
+            pass
+        fd, tmp_path = tempfile.mkstemp(prefix="." + name + ".", dir=self._firmware_dir)
+        try:
+            with os.fdopen(fd, 'wb') as tmp_fd:
+                tmp_fd.write(image)
+                tmp_fd.flush()
+                os.fchmod(tmp_fd.fileno(), 0o644)
+                os.fsync(tmp_fd.fileno())
+            os.replace(tmp_path, target)
+        except:
+            os.unlink(tmp_path)
+            raise
+        if self._verbose:
+            print("%s: Firmware %s deployed." % (self._caller, name))
+        return name, digest
+
+
+    def boot(self, fw_path=None, devices=(), timeout=DFT_BOOT_TIMEOUT_s, force=False):
+        """(Re)start the M4 firmware and wait for its devices.
+        A firmware already running with the same name and image is left
+        running, unless force is set.
+        The timeline of the phases is available from :attr:`timeline`.
+        :param fw_path: Path of the firmware file, deployed to the firmware
+            directory; if it is not a file, taken as the name of a firmware
+            already there.
+        :param devices: Paths of the devices created by the firmware, e.g.
+            the RpMsg TTYs.
+        :param timeout: Max time in seconds of each wait.
+        :param force: If True, restarts the firmware in any case.
+        :return: True if the firmware was (re)started, False if kept running.
+        :raises CommSDKTimeoutException: if the firmware or its devices are not
+            ready in time.
+        """
+        devices = [device for device in devices if device]
+        self._timeline = OrderedDict()
+        t0 = mark = time.monotonic()
+
+        name = None
+        digest = None
+        if fw_path is not None:
+            if os.path.isfile(fw_path):
+                name, digest = self.deploy_firmware(fw_path)
+            else:
+                name = os.path.basename(fw_path)
+        mark = self._mark("copy", mark)
+
+        restart = True
+        if self.is_running():
+            if not force and name is not None and name == self.get_firmware_name():
+                record = self._read_run_record()
+                if record is not None and record[0] == name:
+                    if digest is None:
+                        digest = self._deployed_digest(name)
+                    restart = record[1] != digest
+            if restart:
+                self.stop()
+                self.wait_state("offline", timeout)
+                # The virtual COM ports must go with the firmware that created them.
+                if not self.wait_paths(devices, timeout, exist=False):
+                    raise CommSDKTimeoutException(
+                        "%s: OpenAMP error: %s still present after stop. Please reboot your device." % (self._caller, ", ".join(devices)))
+                mark = self._mark("stop", mark)
+            elif self._verbose:
+                print("%s: Firmware %s already running." % (self._caller, name))
+
+        if restart:
+            if name is not None:
+                self.set_firmware_name(name)
+                if digest is None:
+                    digest = self._deployed_digest(name)
+            self.start()
+            self.wait_state("running", timeout)
+            self._write_run_record(name, digest)
+            mark = self._mark("start", mark)
+
+        if not self.wait_paths(devices, timeout):
+            raise CommSDKTimeoutException("%s: Error: %s not ready in %ss." % (self._caller, ", ".join(devices), timeout))
+        mark = self._mark("device_ready", mark)
+        self._timeline["total"] = mark - t0
+        if self._verbose:
+            print("%s: Firmware boot timeline: %s." % (self._caller, self._format_timeline()))
+        return restart
+
+
+    def shutdown(self, timeout=DFT_STOP_TIMEOUT_s):
+        """Stop the M4 firmware, if running, and wait for it to be offline."""
+        if self.is_running():
+            self.stop()
+            self.wait_state("offline", timeout)
+
+
+    def load_module(self, module_path, device=None, timeout=DFT_MODULE_TIMEOUT_s):
+        """Insert a kernel module and wait for the device it creates.
+        A module already inserted (e.g. by the distribution) is not an error.
+        :param module_path: Path of the .ko file.
+        :param device: Path of the device node created by the module, None if
+            the device only comes with the firmware.
+        :raises CommSDKTimeoutException: if the device is not ready in time.
+        """
+        self._timeline = OrderedDict()
+        t0 = time.monotonic()
+        name = os.path.splitext(os.path.basename(module_path))[0]
+        if not os.path.isdir(os.path.join(SYSFS_MODULE_DIR, name)):
+            subprocess.run(["insmod", module_path], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        mark = self._mark("insmod", t0)
+        if device is not None:
+            if not self.wait_paths([device], timeout):
+                raise CommSDKTimeoutException("%s: Error: %s not ready in %ss." % (self._caller, device, timeout))
+            mark = self._mark("device_ready", mark)
+        self._timeline["total"] = mark - t0
+
+
+    def unload_module(self, module_name):
+        subprocess.run(["rmmod", module_name], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+    def wait_state(self, state, timeout):
+        """Wait for the remoteproc state.
+        :param state: e.g. 'running' or 'offline'.
+        :raises CommSDKTimeoutException: if the state is not reached in time.
+        """
+        deadline = time.monotonic() + timeout
+        period = STATE_POLL_MIN_s
+        while self.get_state() != state:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise CommSDKTimeoutException("%s: Error: firmware not %s in %ss." % (self._caller, state, timeout))
+            time.sleep(min(period, remaining))
+            period = min(period * 2, STATE_POLL_MAX_s)
+
+
+    def wait_paths(self, paths, timeout, exist=True):
+        """Wait for paths to exist and be accessible (udev may set the
+        permissions of a device node after creating it), or to be gone.
+        :param paths: Paths to wait for.
+        :param timeout: Max wait in seconds.
+        :param exist: True to wait for the paths, False for their removal.
+        :return: True if the condition is met in time.
+        """
+        def ready():
+            for path in paths:
+                if exist and not (os.path.exists(path) and os.access(path, os.R_OK | os.W_OK)):
+                    return False
+                if not exist and os.path.lexists(path):
+                    return False
+            return True
+
+        if ready():
+            return True
+        deadline = time.monotonic() + timeout
+        watcher = _DirectoryWatcher(set(os.path.dirname(os.path.abspath(path)) for path in paths))
+        try:
+            # Checked again once watched, not to miss a change in between.
+            while not ready():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                watcher.wait(remaining)
+            return True
+        finally:
+            watcher.close()
+
+
+    def _deployed_digest(self, name):
+        try:
+            return _file_digest(os.path.join(self._firmware_dir, name))
+        except OSError:
+            return None
+
+
+    def _read_run_record(self):
+        """Return the (name, digest) of the firmware started by :meth:`boot`,
+        None if unknown."""
+        try:
+            with open(self._run_record, 'r') as record_fd:
+                record = record_fd.read().split()
+            return (record[0], record[1]) if len(record) == 2 else None
+        except OSError:
+            return None
+
+
+    def _write_run_record(self, name, digest):
+        """Record the firmware started by :meth:`boot`; the record is dropped
+        when name or digest is None. Best effort: without a record the
+        firmware is simply restarted by the next boot."""
+        try:
+            if name is None or digest is None:
+                if os.path.lexists(self._run_record):
+                    os.unlink(self._run_record)
+                return
+            os.makedirs(self._run_dir, exist_ok=True)
+            tmp_path = self._run_record + ".tmp"
+            with open(tmp_path, 'w') as record_fd:
+                record_fd.write("%s %s\n" % (name, digest))
+            os.replace(tmp_path, self._run_record)
+        except OSError:
+            pass
+
+
+    def _mark(self, phase, mark):
+        now = time.monotonic()
+        self._timeline[phase] = now - mark
+        return now
+
+
+    def _format_timeline(self):
+        return ", ".join("%s %.1f ms" % (phase, duration * 1e3) for phase, duration in self._timeline.items())
+
+
+class _DirectoryWatcher():
+    """inotify watch of directories, polling where inotify is not available."""
+
+    _libc = None
+
+    def __init__(self, directories):
+        self._fd = -1
+        try:
+            if _DirectoryWatcher._libc is None:
+                _DirectoryWatcher._libc = ctypes.CDLL(None, use_errno=True)
+            libc = _DirectoryWatcher._libc
+            self._fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+            for directory in directories:
+                if self._fd >= 0 and libc.inotify_add_watch(self._fd, os.fsencode(directory), _IN_MASK) < 0:
+                    self.close()
+        except (OSError, AttributeError):
+            self.close()
+
+
+    def wait(self, timeout):
+        """Wait for a change in the directories, at most timeout seconds."""
+        if self._fd < 0:
+            time.sleep(min(timeout, STATE_POLL_MAX_s))
+            return
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if readable:
+            try:
+                while os.read(self._fd, 4096):
+                    pass
+            except BlockingIOError:
+                pass
+
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
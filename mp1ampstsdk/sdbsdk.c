@@ -17,12 +17,11 @@
 #include <sys/stat.h>
 #include <sys/types.h>
 #include <sys/eventfd.h>
-#include <sys/poll.h>
+#include <sys/epoll.h>
 #include <regex.h>
 #include <sched.h>
 #include <assert.h>
 #include <errno.h>
-#include <error.h>
 
 #define PY_SSIZE_T_CLEAN
 //#include <python3.7/Python.h>
@@ -38,6 +37,14 @@
 #define RPMSG_SDB_IOCTL_GET_DATA_SIZE _IOWR('R', 0x01, struct rpmsg_sdb_ioctl_get_data_size *)
 
 #define TIMEOUT 30
+#define SDB_DEVICE "/dev/rpmsg-sdb"
+#define CTRL_EVENT_ID 0xFFFFFFFF    // epoll data of the control eventfd
+#define MAX_EPOLL_EVENTS 64
+
+#define SDB_LOG_ERROR 0     // verbosity levels, see SetSdbVerbosity()
+#define SDB_LOG_INFO  1
+#define SDB_LOG_DEBUG 2     // per buffer traces: slows the receiver down
+#define SDB_LOG(level, ...) do { if (mVerbosity >= (level)) printf(__VA_ARGS__); } while (0)
 
 
 /***   Typedefs   ***/
@@ -64,26 +71,54 @@ typedef enum {
 
 static int * efd;
 static int mFdSdbRpmsg = -1;  
-static struct pollfd * fds;
+static int mEmulated = 0;       // device is a regular file, see SDB_EMU_HEADER_SIZE
+static uint32_t * mEmuSizes = NULL;
+static int mEpollFd = -1;       // buffer eventfds (while sampling) + control eventfd
+static int mCtrlEfd = -1;       // signalled on every machine state change
 static void * (*mmappedData); 
+static volatile uint8_t * mLeased;  // buffer handed to the A7 app and not yet released
+static uint8_t * mPending;      // content not delivered yet, waiting for its turn in ring order
+static int64_t * mFills;        // fills read from the eventfd and not yet matched with a ring
+                                // position, negative for positions skipped before their eventfd
+static uint32_t * mBuffGaps;    // per buffer count of fills never delivered
+static uint32_t mHeld = 0;      // number of pending buffers
+static uint32_t mSeq = 0;       // stream sequence number of the awaited buffer
 static int32_t fMappedData = 0;
 static pthread_t thread;
+static pthread_t delivery_thread;
+static int mDeliveryRunning = 0;    // delivery_thread created and not joined yet
 static machine_state_t mMachineState = STATE_READY;
-static uint8_t mDdrBuffAwaited=0;
+static uint32_t mDdrBuffAwaited=0;
+static int mRingSynced = 0;     // mDdrBuffAwaited set from the first fills since the ring reset
 static int32_t mSampFreq_Hz = 4;
 static int32_t mSampParmCount;
-static uint32_t mNbCompData=0, mNbUncompData=0;
+static int mVerbosity = SDB_LOG_ERROR;
+static int mUncompCount = 0;    // walk every byte to count the uncompressed samples
+static int mExternalPoll = 0;   // eventfds polled by the app, see DispatchSdbEvents()
+static int mExternalArmed = 0;  // external poll: state seen by the last dispatch
+static sdb_stats_t mStats;
+static pthread_mutex_t mStatsLock = PTHREAD_MUTEX_INITIALIZER;
 static size_t filesize = 0; // also sdb buff size
 static uint32_t sdbnum = 0;
 
 static rpmsg_sdb_ioctl_set_efd q_set_efd;
 
+// Bounded hand-off queue between sdb_thread and the app callback, run on
+// delivery_thread. With a depth of 0 buffers are delivered on sdb_thread.
+static sdb_queue_entry_t * mQueue = NULL;
+static uint32_t mQueueDepth = 0, mQueueHead = 0, mQueueLen = 0;
+static sdb_overflow_policy_t mQueuePolicy = SDB_OVERFLOW_BLOCK;
+static int mQueueExit = 0;
+static pthread_mutex_t mQueueLock = PTHREAD_MUTEX_INITIALIZER;
+static pthread_cond_t mQueueNotEmpty = PTHREAD_COND_INITIALIZER;
+static pthread_cond_t mQueueNotFull = PTHREAD_COND_INITIALIZER;
+
 static buffer_ready_cb * notify_buffer_ready = NULL;
 
 void register_buff_ready_cb(buffer_ready_cb * cbfunc)
 {
 	assert (cbfunc != NULL && notify_buffer_ready == NULL);
-    printf("C func register_buff_ready_cb called\n");  
+    SDB_LOG(SDB_LOG_INFO, "C func register_buff_ready_cb called\n");
     notify_buffer_ready = cbfunc;
 //    Py_XINCREF(notify_buffer_ready);      
 }
@@ -96,25 +131,49 @@ void unregister_buff_ready_cb(buffer_ready_cb * cbfunc)
 	notify_buffer_ready = NULL;
 }
 
-static int CreateSdbBuffers(unsigned int buff_size, unsigned int buff_num) 
+static int CreateSdbBuffers(unsigned int buff_size, unsigned int buff_num, const char * filename) 
 {  
-    char *filename = "/dev/rpmsg-sdb";
+    struct stat st;
  
     filesize = buff_size;
     sdbnum = buff_num;
     efd = calloc(buff_num, sizeof(int));
-    fds = calloc(buff_num, sizeof(struct pollfd));    
     mmappedData = calloc(buff_num, sizeof(void *));
-    printf("DBG filesize:%d\n",(unsigned int)filesize);
+    mLeased = calloc(buff_num, sizeof(uint8_t));
+    mPending = calloc(buff_num, sizeof(uint8_t));
+    mBuffGaps = calloc(buff_num, sizeof(uint32_t));
+    mFills = calloc(buff_num, sizeof(int64_t));
+    SDB_LOG(SDB_LOG_INFO, "DBG filesize:%d\n",(unsigned int)filesize);
     //Open file
     mFdSdbRpmsg = open(filename, O_RDWR);
     if (mFdSdbRpmsg == -1) {
         perror("CreateSdbBuffers failed to open file");
         free (mmappedData);
-        free (fds);
+        free ((void *)mLeased);
+        free (mPending);
+        free (mBuffGaps);
+        free (mFills);
         free (efd);
         return -1;
     }
+    // A regular file instead of the driver: user space emulation, where the
+    // data sizes come from the file header and the buffers follow it.
+    mEmulated = fstat(mFdSdbRpmsg, &st) == 0 && S_ISREG(st.st_mode);
+    if (mEmulated) {
+        if (buff_num * sizeof(uint32_t) > SDB_EMU_HEADER_SIZE || buff_size % sysconf(_SC_PAGESIZE) ||
+            (mEmuSizes = mmap(NULL, SDB_EMU_HEADER_SIZE, PROT_READ, MAP_SHARED, mFdSdbRpmsg, 0)) == MAP_FAILED) {
+            fprintf(stderr, "CreateSdbBuffers invalid emulation file %s\n", filename);
+            mEmuSizes = NULL;
+            free (mmappedData);
+            free ((void *)mLeased);
+            free (mPending);
+            free (mBuffGaps);
+            free (mFills);
+            free (efd);
+            close (mFdSdbRpmsg);
+            return -1;
+        }
+    }
     for (int i=0; i<sdbnum; i++){
         // Create the evenfd, and sent it to kernel driver, for notification of buffer full
         efd[i] = eventfd(0, 0);
@@ -126,16 +185,19 @@ static int CreateSdbBuffers(unsigned int buff_size, unsigned int buff_num)
             }
 	    sdbnum = 0;	    
             free (mmappedData);
-            free (fds);
+            free ((void *)mLeased);
+            free (mPending);
+            free (mBuffGaps);
+            free (mFills);
             free (efd);
             close (mFdSdbRpmsg);            
             return -1;
         }
-        printf("\nForward efd info for buf%d with fd:%d and efd:%d\n",i,mFdSdbRpmsg,efd[i]);
+        SDB_LOG(SDB_LOG_INFO, "\nForward efd info for buf%d with fd:%d and efd:%d\n",i,mFdSdbRpmsg,efd[i]);
         q_set_efd.bufferId = i;
         q_set_efd.eventfd = efd[i];
 //        printf ("\nIOCTL RPMSG_SDB_IOCTL_SET_EFD: %d\n", RPMSG_SDB_IOCTL_SET_EFD);
-        if(ioctl(mFdSdbRpmsg, RPMSG_SDB_IOCTL_SET_EFD, &q_set_efd) < 0){
+        if(!mEmulated && ioctl(mFdSdbRpmsg, RPMSG_SDB_IOCTL_SET_EFD, &q_set_efd) < 0){
             perror("CreateSdbBuffers failed to set efd");
             for (int n=0; n<i; n++){
                 int rc = munmap(mmappedData[n], filesize);
@@ -143,20 +205,20 @@ static int CreateSdbBuffers(unsigned int buff_size, unsigned int buff_num)
             }            
 	    sdbnum = 0;
             free (mmappedData);
-            free (fds);
+            free ((void *)mLeased);
+            free (mPending);
+            free (mBuffGaps);
+            free (mFills);
             free (efd);
             close (mFdSdbRpmsg);            
             return -1;            
         }
-        // watch eventfd for input
-        fds[i].fd = efd[i];
-        fds[i].events = POLLIN;
         mmappedData[i] = mmap(NULL,
                                 filesize,
                                 PROT_READ | PROT_WRITE,
-                                MAP_PRIVATE,
+                                mEmulated ? MAP_SHARED : MAP_PRIVATE,
                                 mFdSdbRpmsg,
-                                0);
+                                mEmulated ? SDB_EMU_HEADER_SIZE + (off_t)i * filesize : 0);
 /*** FIXME  ?msynk tb called to flush mem ? ***/
         if (mmappedData[i] == MAP_FAILED){
             perror("CreateSdbBuffers failed to mmap buffer");            
@@ -166,12 +228,15 @@ static int CreateSdbBuffers(unsigned int buff_size, unsigned int buff_num)
             } 
             sdbnum = 0;	    
             free (mmappedData);
-            free (fds);
+            free ((void *)mLeased);
+            free (mPending);
+            free (mBuffGaps);
+            free (mFills);
             free (efd);
             close (mFdSdbRpmsg);            
             return -1;                        
         }
-        printf("\nDBG mmappedData[%d]:%p\n", i, mmappedData[i]);        
+        SDB_LOG(SDB_LOG_INFO, "\nDBG mmappedData[%d]:%p\n", i, mmappedData[i]);
         fMappedData = 1;
     }
     return 0;
@@ -179,146 +244,1148 @@ static int CreateSdbBuffers(unsigned int buff_size, unsigned int buff_num)
 
 
 
-static void sleep_ms(int milliseconds)
+static void SignalSdbReceiver(machine_state_t state)
 {
-    usleep(milliseconds * 1000);
+    uint64_t one = 1;
+
+    mMachineState = state;
+    if (mCtrlEfd == -1) {
+        return;     // external poll: the next dispatch sees the new state
+    }
+    if (write(mCtrlEfd, &one, sizeof(one)) != sizeof(one)) {
+        perror("SignalSdbReceiver failed to write control eventfd");
+    }
 }
- 
 
-void *sdb_thread(void *arg)
+
+static void ResetSdbRing(void)
 {
-    int ret, rc;
-//    int8_t mesgOK = 1;
-//    uint32_t length;
-//    int32_t wsize;
-    int buffIdx = 0;
-//    char tmpStr[100];
-    char buf[16];
-    int ThRetVal;
-    
-    rpmsg_sdb_ioctl_get_data_size q_get_data_size;
+    // M4 does not restart from the first buffer of the ring when sampling is
+    // restarted: the awaited buffer is set by SyncSdbRing() on the first fills
+    mDdrBuffAwaited = 0;
+    mRingSynced = 0;
+    mHeld = 0;
+    if (sdbnum) {
+        memset(mPending, 0, sdbnum);
+        memset(mFills, 0, sdbnum * sizeof(int64_t));
+    }
+}
+
+
+static void ArmSdbBuffers(int arm)
+{
+    struct epoll_event ev;
+
+    for (int i=0; i<sdbnum; i++) {
+        ev.events = EPOLLIN;
+        ev.data.u32 = i;
+        if (epoll_ctl(mEpollFd, arm ? EPOLL_CTL_ADD : EPOLL_CTL_DEL, efd[i], &ev) < 0) {
+            perror("ArmSdbBuffers epoll_ctl");
+        }
+    }
+}
+
+
+static void CollectSdbBuffer(unsigned int idx)
+{
+    uint64_t count;
+
+    if (idx >= sdbnum) {
+        return;
+    }
+    if (read(efd[idx], &count, sizeof(count)) != sizeof(count)) {
+        perror("sdb_thread failed to read eventfd");
+        return;
+    }
+    // The eventfd counts the fills since the last read, the buffer holds the
+    // last one. Each fill is accounted once, when DeliverSdbBuffers() reaches
+    // its ring position: delivered, or lost if overwritten. The fills of
+    // positions already skipped as missing are only matched here.
+    if (count > 1 || (mPending[idx] && mFills[idx] > 0)) {
+        SDB_LOG(SDB_LOG_INFO, "sdb_thread => buf[%d] overwritten before read\n", idx);
+    }
+    if (mFills[idx] <= 0 && mFills[idx] + (int64_t)count > 0) {
+        mHeld++;
+    }
+    mFills[idx] += count;
+    mPending[idx] = mFills[idx] > 0;
+}
+
+
+static void CountSdbGap(unsigned int idx)
+{
+    pthread_mutex_lock(&mStatsLock);
+    mBuffGaps[idx]++;
+    mStats.seq_gaps++;
+    pthread_mutex_unlock(&mStatsLock);
+}
+
+
+static void NotifySdbBuffer(sdb_queue_entry_t * entry)
+{
+    struct timespec t0, t1;
+    uint64_t cb_time_ns;
+
+    if (notify_buffer_ready == NULL) {
+/*** FIXME ?whath to do? exit thread and roll back everything? how to notify app? through callback with NULL args? ***/                                             
+        SDB_LOG(SDB_LOG_ERROR, "Error: Call register_buff_ready_cb() before StartSdbReceiver()\n");
+        mLeased[entry->idx] = 0;
+        return;
+    }
+    clock_gettime(CLOCK_MONOTONIC, &t0);
+    notify_buffer_ready(entry->data, entry->len, entry->idx, entry->seq);
+    clock_gettime(CLOCK_MONOTONIC, &t1);
+    cb_time_ns = (uint64_t)(t1.tv_sec - t0.tv_sec) * 1000000000ULL + (t1.tv_nsec - t0.tv_nsec);
+
+    pthread_mutex_lock(&mStatsLock);
+    mStats.buffers++;
+    mStats.cb_time_ns += cb_time_ns;
+    pthread_mutex_unlock(&mStatsLock);
+}
+
+
+static void QueueSdbBuffer(sdb_queue_entry_t * entry)
+{
+    uint32_t dropped = 0;
+
+    pthread_mutex_lock(&mQueueLock);
+    while (mQueueLen == mQueueDepth && !mQueueExit) {
+        if (mQueuePolicy == SDB_OVERFLOW_DROP_NEWEST) {
+            mLeased[entry->idx] = 0;
+            dropped = 1;
+            break;
+        } else if (mQueuePolicy == SDB_OVERFLOW_DROP_OLDEST) {
+            mLeased[mQueue[mQueueHead].idx] = 0;
+            mQueueHead = (mQueueHead + 1) % mQueueDepth;
+            mQueueLen--;
+            dropped = 1;
+        } else {
+            pthread_cond_wait(&mQueueNotFull, &mQueueLock);
+        }
+    }
+    if (mQueueExit) {
+        mLeased[entry->idx] = 0;
+    } else if (mQueueLen < mQueueDepth) {
+        mQueue[(mQueueHead + mQueueLen) % mQueueDepth] = *entry;
+        mQueueLen++;
+        pthread_cond_signal(&mQueueNotEmpty);
+    }
+    pthread_mutex_lock(&mStatsLock);
+    mStats.queue_drops += dropped;
+    if (mQueueLen > mStats.queue_high_water) {
+        mStats.queue_high_water = mQueueLen;
+    }
+    pthread_mutex_unlock(&mStatsLock);
+    pthread_mutex_unlock(&mQueueLock);
+    if (dropped) {
+        SDB_LOG(SDB_LOG_INFO, "sdb_thread => hand-off queue full, buffer dropped\n");
+    }
+}
+
 
+void *sdb_delivery_thread(void *arg)
+{
+    sdb_queue_entry_t entry;
+
+    pthread_mutex_lock(&mQueueLock);
     while (1) {
-        if (mMachineState == STATE_SAMPLING) {
-            // wait till at least one buffer becomes available
-            ret = poll(fds, sdbnum, TIMEOUT * 1000);
-            if (ret == -1)
-                perror("poll()");
-            else if (ret)
-                printf("Data buffer is available now. ret: %d\n", ret);
-            else if (ret == 0){
-                printf("No buffer data within %d seconds.\n", TIMEOUT);
+        while (mQueueLen == 0 && !mQueueExit) {
+            pthread_cond_wait(&mQueueNotEmpty, &mQueueLock);
+        }
+        if (mQueueExit) {
+            break;
+        }
+        entry = mQueue[mQueueHead];
+        mQueueHead = (mQueueHead + 1) % mQueueDepth;
+        mQueueLen--;
+        pthread_cond_signal(&mQueueNotFull);
+        pthread_mutex_unlock(&mQueueLock);
+        NotifySdbBuffer(&entry);
+        pthread_mutex_lock(&mQueueLock);
+    }
+    // exiting: buffers still queued are not handed out anymore
+    while (mQueueLen) {
+        mLeased[mQueue[mQueueHead].idx] = 0;
+        mQueueHead = (mQueueHead + 1) % mQueueDepth;
+        mQueueLen--;
+    }
+    pthread_mutex_unlock(&mQueueLock);
+    return NULL;
+}
+
+
+uint64_t CountSdbSamples(const unsigned char * data, unsigned int len)
+{
+    uint64_t samples = len;
+
+    for (unsigned int i=0; i<len; i++) {
+        samples += data[i] >> SDB_RLE_RUN_SHIFT;
+    }
+    return samples;
+}
+
+
+unsigned int DecodeSdbSamples(const unsigned char * data, unsigned int len, unsigned char * samples, uint64_t samples_len, uint64_t * decoded)
+{
+    unsigned char * out = samples;
+    unsigned char * end = samples + samples_len;
+    unsigned int i;
+
+    // runs are 1..8 samples: a fixed size store beats a memset of the run
+    // length, as long as 8 bytes are left in the output
+    for (i=0; i<len && end - out >= 8; i++) {
+        memset(out, data[i] & SDB_RLE_VALUE_MASK, 8);
+        out += 1 + (data[i] >> SDB_RLE_RUN_SHIFT);
+    }
+    for (; i<len; i++) {
+        unsigned int run = 1 + (data[i] >> SDB_RLE_RUN_SHIFT);
+        if (run > end - out) {
+            break;
+        }
+        memset(out, data[i] & SDB_RLE_VALUE_MASK, run);
+        out += run;
+    }
+    *decoded = out - samples;
+    return i;   // compressed bytes decoded
+}
+
+
+static void ProcessSdbBuffer(unsigned int idx, uint32_t seq)
+{
+    rpmsg_sdb_ioctl_get_data_size q_get_data_size;
+    sdb_queue_entry_t entry;
+    uint64_t uncomp = 0;
+    int overrun = 0;
+
+    /* Get buffer data size*/
+    q_get_data_size.bufferId = idx;
+
+    if (mEmulated) {
+        q_get_data_size.size = mEmuSizes[idx];
+    } else if(ioctl(mFdSdbRpmsg, RPMSG_SDB_IOCTL_GET_DATA_SIZE, &q_get_data_size) < 0) {
+        // the content of the buffer is unknown: skip it, the receiver goes on
+        perror("ProcessSdbBuffer failed to get data size");
+        pthread_mutex_lock(&mStatsLock);
+        mStats.size_errors++;
+        pthread_mutex_unlock(&mStatsLock);
+        return;
+    }
+
+    if (q_get_data_size.size) {
+        SDB_LOG(SDB_LOG_DEBUG, "buf[%d] size:%d seq:%u\n", q_get_data_size.bufferId, q_get_data_size.size, seq);
+
+        unsigned char* pCompData = (unsigned char*)mmappedData[idx];
+        if (mUncompCount) {
+            // a full extra pass over the buffer: only when enabled
+            uncomp = CountSdbSamples(pCompData, q_get_data_size.size);
+        }
+        if (mLeased[idx]) {
+            // the app still holds the previous content: do not hand it out twice
+            overrun = 1;
+            SDB_LOG(SDB_LOG_INFO, "sdb_thread => buf[%d] still leased, dropped\n", idx);
+        } else {
+            mLeased[idx] = 1;
+            entry.data = pCompData;
+            entry.len = q_get_data_size.size;
+            entry.idx = idx;
+            entry.seq = seq;
+            if (mQueueDepth) {
+                QueueSdbBuffer(&entry);
+            } else {
+                NotifySdbBuffer(&entry);
             }
-            if (fds[mDdrBuffAwaited].revents & POLLIN) {
-                rc = read(efd[mDdrBuffAwaited], buf, 16);
-                if (!rc) {
-/*** FIXME ?whath to do? exit thread and roll back everything? how to notify app? through callback with NULL args? ***/                     
-                    printf("stdin closed\n");
-                    return 0;
-                }
-                printf("Parent read %lu (0x%lx) (%s) from efd[%d]\n",
-                        (unsigned long) buf, (unsigned long) buf, buf, mDdrBuffAwaited);
-                /* Get buffer data size*/
-                q_get_data_size.bufferId = mDdrBuffAwaited;
-
-                if(ioctl(mFdSdbRpmsg, RPMSG_SDB_IOCTL_GET_DATA_SIZE, &q_get_data_size) < 0) {
-/*** FIXME ?whath to do? exit thread and roll back everything? how to notify app? through callback with NULL args? ***/                                         
-                    error(EXIT_FAILURE, errno, "Failed to get data size");
-                }
+        }
+    }
+    else {
+        SDB_LOG(SDB_LOG_DEBUG, "sdb_thread => buf[%d] is empty\n", idx);
+    }
 
-                if (q_get_data_size.size) {
-                    printf("buf[%d] size:%d\n", q_get_data_size.bufferId, q_get_data_size.size);
-                    mNbCompData += q_get_data_size.size;
-
-                    unsigned char* pCompData = (unsigned char*)mmappedData[mDdrBuffAwaited];
-                    for (int i=0; i<q_get_data_size.size; i++) {
-                        mNbUncompData += (1 + (*(pCompData+i) >> 5));
-                    }
-//                    printf("[%ld.%06ld] vitural_tty_thread data EVENT buffIdx=%d mNbCompData=%u mNbUncompData=%u mNbWrittenInFileData=%u\n", 
-//                          (long int)tval_result.tv_sec, (long int)tval_result.tv_usec, buffIdx, mNbCompData, mNbUncompData, mNbWrittenInFileData);    
-#define DBG                    
-#ifdef DBG                   
-                    pCompData[0] = 0x55;    // just for debug
-                    pCompData[1] = 0xAA;  
-#endif                    
-                    if(notify_buffer_ready != NULL) {                    
-                    	notify_buffer_ready(pCompData, q_get_data_size.size);     					                    
-                    } else {
-/*** FIXME ?whath to do? exit thread and roll back everything? how to notify app? through callback with NULL args? ***/                                             
-                    	printf ("Error: Call register_buff_ready_cb() before StartSdbReceiver()");
-                    }   			
-                }
-                else {
-                    printf("sdb_thread => buf[%d] is empty\n", mDdrBuffAwaited);
-                }
-                mDdrBuffAwaited++;
-                if (mDdrBuffAwaited > 2) {
-                    mDdrBuffAwaited = 0;
-                }
-            } else if (mMachineState == STATE_SAMPLING) {
-                printf("sdb_thread wrong buffer index ERROR, waiting buffIdx=%d", buffIdx);
+    pthread_mutex_lock(&mStatsLock);
+    if (q_get_data_size.size) {
+        mStats.bytes += q_get_data_size.size;
+        mStats.uncomp_samples += uncomp;
+        mStats.lease_overruns += overrun;
+    } else {
+        mStats.empty_buffers++;
+    }
+    pthread_mutex_unlock(&mStatsLock);
+}
+
+
+static void SyncSdbRing(void)
+{
+    // the ring position filled first is the one following an empty one
+    for (unsigned int i=0; i<sdbnum; i++) {
+        if (mFills[i] > 0 && mFills[(i + sdbnum - 1) % sdbnum] <= 0) {
+            mDdrBuffAwaited = i;
+            break;
+        }
+    }
+    mRingSynced = 1;
+    SDB_LOG(SDB_LOG_INFO, "sdb_thread => ring restarted at buf[%d]\n", mDdrBuffAwaited);
+}
+
+
+static void DeliverSdbBuffers(void)
+{
+    // M4 fills the ring in order: pending buffers are delivered starting from
+    // the awaited one. A buffer completing out of order is held back until the
+    // awaited one comes, unless half of the ring is held: the awaited fill is
+    // then considered lost and reported as a sequence gap. A buffer filled
+    // several times before its turn is delivered once, its extra fills are
+    // the gaps of its next positions.
+    uint32_t window = sdbnum > 1 ? sdbnum / 2 : 1;
+
+    if (mHeld && !mRingSynced) {
+        SyncSdbRing();
+    }
+    while (mHeld) {
+        if (mFills[mDdrBuffAwaited] > 0) {
+            if (--mFills[mDdrBuffAwaited] == 0) {
+                mHeld--;
             }
-        } else if (mMachineState == STATE_EXITING) {
-            pthread_exit(&ThRetVal);
+            if (mPending[mDdrBuffAwaited]) {
+                mPending[mDdrBuffAwaited] = 0;
+                ProcessSdbBuffer(mDdrBuffAwaited, mSeq);
+            } else {
+                CountSdbGap(mDdrBuffAwaited);   // overwritten by the content delivered
+            }
+        } else if (mHeld >= window) {
+            // its eventfd, if it ever comes, is matched by CollectSdbBuffer()
+            mFills[mDdrBuffAwaited]--;
+            CountSdbGap(mDdrBuffAwaited);
+            SDB_LOG(SDB_LOG_INFO, "sdb_thread => buf[%d] seq:%u missing, skipped\n", mDdrBuffAwaited, mSeq);
+        } else {
+            break;
+        }
+        mDdrBuffAwaited = (mDdrBuffAwaited + 1) % sdbnum;
+        mSeq++;
+    }
+}
+
+
+void *sdb_thread(void *arg)
+{
+    int ret;
+    int armed = 0;
+    uint64_t count;
+    struct epoll_event events[MAX_EPOLL_EVENTS];
+
+    // Event driven: the thread sleeps in epoll_wait() until a buffer eventfd
+    // (armed only while sampling) or the control eventfd is signalled.
+    while (1) {
+        machine_state_t state = mMachineState;
+
+        if (state == STATE_EXITING) {
             break;
         }
-        sleep_ms(50);      // give time to system sched
+        if ((state == STATE_SAMPLING) != armed) {
+            armed = !armed;
+            ArmSdbBuffers(armed);
+            if (armed) {
+                ResetSdbRing();
+            }
+        }
+        ret = epoll_wait(mEpollFd, events, MAX_EPOLL_EVENTS, armed ? TIMEOUT * 1000 : -1);
+        pthread_mutex_lock(&mStatsLock);
+        mStats.poll_wakeups++;
+        pthread_mutex_unlock(&mStatsLock);
+        if (ret == -1) {
+            if (errno != EINTR) {
+                perror("epoll_wait()");
+            }
+            continue;
+        }
+        if (ret == 0) {
+            SDB_LOG(SDB_LOG_INFO, "No buffer data within %d seconds.\n", TIMEOUT);
+            continue;
+        }
+        for (int i=0; i<ret; i++) {
+            if (events[i].data.u32 == CTRL_EVENT_ID) {
+                if (read(mCtrlEfd, &count, sizeof(count)) != sizeof(count)) {
+                    perror("sdb_thread failed to read control eventfd");
+                }
+            } else if (armed && mMachineState == STATE_SAMPLING) {
+                CollectSdbBuffer(events[i].data.u32);
+            }
+        }
+        DeliverSdbBuffers();
+    }
+    if (armed) {
+        ArmSdbBuffers(0);
     }
+    return NULL;
 }  
 
 
-int InitSdb(unsigned int buff_size, unsigned int buff_num)
+int DispatchSdbEvents(const unsigned int * idx, unsigned int num)
 {
-    printf("C func InitSdb called, buff_size: %d buff_num: %d \n", buff_size, buff_num);       
-    return CreateSdbBuffers(buff_size, buff_num);  
+    uint64_t count;
+    int sampling = mMachineState == STATE_SAMPLING;
+
+    // Same as one sdb_thread wakeup, on the thread of the app polling the
+    // eventfds (see SetSdbExternalPoll()). The eventfds stay in the app poll
+    // set whatever the state: the fills outside sampling are discarded.
+    if (!mExternalPoll || thread) {
+        return -1;
+    }
+    if (sampling != mExternalArmed) {
+        mExternalArmed = sampling;
+        if (sampling) {
+            ResetSdbRing();
+        }
+    }
+    pthread_mutex_lock(&mStatsLock);
+    mStats.poll_wakeups++;
+    pthread_mutex_unlock(&mStatsLock);
+    for (int i=0; i<num; i++) {
+        if (idx[i] >= sdbnum) {
+            continue;
+        }
+        if (sampling) {
+            CollectSdbBuffer(idx[i]);
+        } else if (read(efd[idx[i]], &count, sizeof(count)) != sizeof(count)) {
+            perror("DispatchSdbEvents failed to read eventfd");
+        }
+    }
+    if (sampling) {
+        DeliverSdbBuffers();
+    }
+    return 0;
+}
+
+
+int SetSdbExternalPoll(int enable)
+{
+    if (thread || mEpollFd != -1) {
+        return -1;  // to be set before InitSdbReceiver()
+    }
+    mExternalPoll = enable;
+    return 0;
+}
+
+
+int ReleaseSdbBuffer(unsigned int buff_idx)
+{
+    if (buff_idx >= sdbnum || !mLeased[buff_idx]) {
+        return -1;
+    }
+    mLeased[buff_idx] = 0;
+    return 0;
+}
+
+
+int GetSdbSeqGaps(uint32_t * gaps, unsigned int gaps_num)
+{
+    int total;
+
+    pthread_mutex_lock(&mStatsLock);
+    for (int i=0; i<gaps_num && i<sdbnum; i++) {
+        gaps[i] = mBuffGaps[i];
+    }
+    total = (int)mStats.seq_gaps;
+    pthread_mutex_unlock(&mStatsLock);
+    return total;
+}
+
+
+void GetSdbStats(sdb_stats_t * stats)
+{
+    pthread_mutex_lock(&mStatsLock);
+    *stats = mStats;
+    pthread_mutex_unlock(&mStatsLock);
+}
+
+
+void ResetSdbStats(void)
+{
+    pthread_mutex_lock(&mStatsLock);
+    memset(&mStats, 0, sizeof(mStats));
+    pthread_mutex_unlock(&mStatsLock);
+}
+
+
+int SetSdbQueue(unsigned int depth, sdb_overflow_policy_t policy)
+{
+    sdb_queue_entry_t * queue = NULL;
+
+    if (thread) {
+        return -1;  // to be set before InitSdbReceiver()
+    }
+    if (depth) {
+        queue = calloc(depth, sizeof(sdb_queue_entry_t));
+        if (queue == NULL) {
+            return -1;
+        }
+    }
+    free(mQueue);
+    mQueue = queue;
+    mQueueDepth = depth;
+    mQueuePolicy = policy;
+    return 0;
+}
+
+
+void SetSdbVerbosity(int level)
+{
+    mVerbosity = level;
+}
+
+
+void SetSdbUncompCount(int enable)
+{
+    mUncompCount = enable;
+}
+
+
+int GetSdbEventFds(int * fds, unsigned int fds_num)
+{
+    for (int i=0; i<fds_num && i<sdbnum; i++) {
+        fds[i] = efd[i];
+    }
+    return sdbnum;
+}
+
+
+int InitSdb(unsigned int buff_size, unsigned int buff_num, const char * device)
+{
+    SDB_LOG(SDB_LOG_INFO, "C func InitSdb called, buff_size: %d buff_num: %d \n", buff_size, buff_num);       
+    return CreateSdbBuffers(buff_size, buff_num, device ? device : SDB_DEVICE);  
 }
 
  
 int InitSdbReceiver(void)
 {
+    struct epoll_event ev;
+
     mMachineState = STATE_READY;
     mSampFreq_Hz = 4;
     mSampParmCount = 0;
+    mExternalArmed = 0;
     
-    printf("C func InitSdbReceiver called\n");        
+    SDB_LOG(SDB_LOG_INFO, "C func InitSdbReceiver called\n");
+    mQueueExit = 0;
+    mQueueHead = mQueueLen = 0;
+    if (mExternalPoll) {
+        // no sdb_thread: the app calls DispatchSdbEvents() on eventfd readiness
+        if (mQueueDepth && pthread_create(&delivery_thread, NULL, sdb_delivery_thread, NULL) != 0) {
+            perror("sdb_delivery_thread creation fails\n");
+            return -1;
+        }
+        mDeliveryRunning = mQueueDepth != 0;
+        return 0;
+    }
+    mCtrlEfd = eventfd(0, EFD_CLOEXEC);
+    mEpollFd = epoll_create1(EPOLL_CLOEXEC);
+    if (mCtrlEfd == -1 || mEpollFd == -1) {
+        perror("InitSdbReceiver failed to create eventfd/epoll");
+        goto err;
+    }
+    ev.events = EPOLLIN;
+    ev.data.u32 = CTRL_EVENT_ID;
+    if (epoll_ctl(mEpollFd, EPOLL_CTL_ADD, mCtrlEfd, &ev) < 0) {
+        perror("InitSdbReceiver failed to watch control eventfd");
+        goto err;
+    }
+    if (mQueueDepth && pthread_create(&delivery_thread, NULL, sdb_delivery_thread, NULL) != 0) {
+        perror("sdb_delivery_thread creation fails\n");
+        goto err;
+    }
+    mDeliveryRunning = mQueueDepth != 0;
     if (pthread_create( &thread, NULL, sdb_thread, NULL) != 0) {
         perror("sdb_thread creation fails\n");
-        return -1;
+        if (mQueueDepth) {
+            mQueueExit = 1;
+            pthread_cond_broadcast(&mQueueNotEmpty);
+            pthread_join(delivery_thread, NULL);
+            mDeliveryRunning = 0;
+        }
+        thread = 0;
+        goto err;
     }
     return 0;
+
+err:
+    if (mEpollFd != -1) close(mEpollFd);
+    if (mCtrlEfd != -1) close(mCtrlEfd);
+    mEpollFd = mCtrlEfd = -1;
+    return -1;
 }
 
  
 void StartSdbReceiver(void)
 {
-	mDdrBuffAwaited=0;
-    mMachineState = STATE_SAMPLING;
+    SignalSdbReceiver(STATE_SAMPLING);
 } 
  
 void StopSdbReceiver(void)
 {
-    mMachineState = STATE_READY;
+    SignalSdbReceiver(STATE_READY);
 }
  
+/* Exit and join the receiver threads, the buffers staying mapped: once it
+ * returns no buffer is being handed out anymore. Can be called again. */
+void HaltSdbReceiver(void)
+{
+    SignalSdbReceiver(STATE_EXITING);
+    // unblock sdb_thread if waiting for room in the queue and let
+    // delivery_thread exit
+    pthread_mutex_lock(&mQueueLock);
+    mQueueExit = 1;
+    pthread_cond_broadcast(&mQueueNotFull);
+    pthread_cond_broadcast(&mQueueNotEmpty);
+    pthread_mutex_unlock(&mQueueLock);
+    if (thread) {
+        pthread_join(thread, NULL);
+        thread = 0;
+    }
+    if (mDeliveryRunning) {
+        pthread_join(delivery_thread, NULL);
+        mDeliveryRunning = 0;
+    }
+}
+
+
 int  DeInitSdbReceiver(void)
 {
-	int * pThRetVal;
-    mMachineState = STATE_EXITING;
-    pthread_join(thread, (void **)&pThRetVal);
+    HaltSdbReceiver();
+    if (mEpollFd != -1) {
+        close(mEpollFd);
+        close(mCtrlEfd);
+    }
+    mEpollFd = mCtrlEfd = -1;
     for (int i=0;i<sdbnum;i++){
         int rc = munmap(mmappedData[i], filesize);
         assert(rc == 0);
+        close(efd[i]);
     }
     sdbnum = 0;
+    mSeq = 0;
+    if (mEmuSizes) {
+        munmap(mEmuSizes, SDB_EMU_HEADER_SIZE);
+        mEmuSizes = NULL;
+    }
     close(mFdSdbRpmsg);
     fMappedData = 0;
+    free ((void *)mLeased);
+    free (mPending);
+    free (mBuffGaps);
+    free (mFills);
     free (efd);
-    free (fds);
     free (mmappedData);
-    printf("Buffers successfully unmapped\n");    
+    SDB_LOG(SDB_LOG_INFO, "Buffers successfully unmapped\n");
     return 0;
 } 
  
  
  
+/***   Python bindings   ***/
+
+/* SdbBuffer: read-only buffer protocol view of a mmapped Shared Data Buffer.
+ * It is handed to the Python callback and stays valid until invalidate() is
+ * called, which fails while views exported from it are alive. */
+typedef struct {
+    PyObject_HEAD
+    unsigned char * data;
+    Py_ssize_t len;
+    unsigned int index;
+    uint32_t seq;
+    Py_ssize_t exports;
+    int valid;
+} SdbBufferObject;
+
+static PyObject * mPyCallback = NULL;   // owned reference, protected by the GIL
+
+
+static int SdbBuffer_getbuffer(SdbBufferObject * self, Py_buffer * view, int flags)
+{
+    if (!self->valid) {
+        PyErr_SetString(PyExc_BufferError, "sdb buffer released");
+        return -1;
+    }
+    if (PyBuffer_FillInfo(view, (PyObject *)self, self->data, self->len, 1, flags) < 0) {
+        return -1;
+    }
+    self->exports++;
+    return 0;
+}
+
+
+static void SdbBuffer_releasebuffer(SdbBufferObject * self, Py_buffer * view)
+{
+    self->exports--;
+}
+
+
+static PyBufferProcs SdbBuffer_as_buffer = {
+    (getbufferproc)SdbBuffer_getbuffer,
+    (releasebufferproc)SdbBuffer_releasebuffer,
+};
+
+
+static Py_ssize_t SdbBuffer_length(SdbBufferObject * self)
+{
+    return self->len;
+}
+
+
+static PySequenceMethods SdbBuffer_as_sequence = {
+    (lenfunc)SdbBuffer_length,
+};
+
+
+static PyObject * SdbBuffer_invalidate(SdbBufferObject * self, PyObject * Py_UNUSED(ignored))
+{
+    if (self->exports > 0) {
+        PyErr_Format(PyExc_BufferError, "sdb buffer %u still in use", self->index);
+        return NULL;
+    }
+    self->valid = 0;
+    Py_RETURN_NONE;
+}
+
+
+static PyObject * SdbBuffer_get_index(SdbBufferObject * self, void * closure)
+{
+    return PyLong_FromUnsignedLong(self->index);
+}
+
+
+static PyObject * SdbBuffer_get_sequence(SdbBufferObject * self, void * closure)
+{
+    return PyLong_FromUnsignedLong(self->seq);
+}
+
+
+static PyObject * SdbBuffer_get_valid(SdbBufferObject * self, void * closure)
+{
+    return PyBool_FromLong(self->valid);
+}
+
+
+static PyMethodDef SdbBuffer_methods[] = {
+    {"invalidate", (PyCFunction)SdbBuffer_invalidate, METH_NOARGS,
+     "Forbid any further access to the buffer, BufferError if views are alive."},
+    {NULL}
+};
+
+
+static PyGetSetDef SdbBuffer_getset[] = {
+    {"index", (getter)SdbBuffer_get_index, NULL, "Index of the buffer in the SDB ring.", NULL},
+    {"sequence", (getter)SdbBuffer_get_sequence, NULL, "Stream sequence number of the buffer.", NULL},
+    {"valid", (getter)SdbBuffer_get_valid, NULL, "False once invalidated.", NULL},
+    {NULL}
+};
+
+
+static PyTypeObject SdbBufferType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    .tp_name = "mp1ampstsdk._sdbsdk.SdbBuffer",
+    .tp_basicsize = sizeof(SdbBufferObject),
+    .tp_flags = Py_TPFLAGS_DEFAULT,
+    .tp_doc = "Read-only view of a mmapped Shared Data Buffer.",
+    .tp_as_buffer = &SdbBuffer_as_buffer,
+    .tp_as_sequence = &SdbBuffer_as_sequence,
+    .tp_methods = SdbBuffer_methods,
+    .tp_getset = SdbBuffer_getset,
+};
+
+
+/* Called on sdb_thread, a thread unknown to Python: take the GIL only for the
+ * time of the callback. */
+static unsigned int PyNotifyBufferReady(unsigned char * buffer, unsigned int buffer_len, unsigned int buffer_idx, uint32_t seq)
+{
+    PyGILState_STATE gstate = PyGILState_Ensure();
+    SdbBufferObject * sdb_buffer;
+    PyObject * res;
+
+    if (mPyCallback == NULL) {
+        mLeased[buffer_idx] = 0;
+        goto out;
+    }
+    sdb_buffer = PyObject_New(SdbBufferObject, &SdbBufferType);
+    if (sdb_buffer == NULL) {
+        mLeased[buffer_idx] = 0;
+        PyErr_WriteUnraisable(mPyCallback);
+        goto out;
+    }
+    sdb_buffer->data = buffer;
+    sdb_buffer->len = buffer_len;
+    sdb_buffer->index = buffer_idx;
+    sdb_buffer->seq = seq;
+    sdb_buffer->exports = 0;
+    sdb_buffer->valid = 1;
+    res = PyObject_CallFunctionObjArgs(mPyCallback, (PyObject *)sdb_buffer, NULL);
+    if (res == NULL) {
+        PyErr_WriteUnraisable(mPyCallback);
+    }
+    Py_XDECREF(res);
+    Py_DECREF(sdb_buffer);
+out:
+    PyGILState_Release(gstate);
+    return 0;
+}
+
+
+static PyObject * py_set_callback(PyObject * self, PyObject * callback)
+{
+    PyObject * old = mPyCallback;
+
+    if (callback == Py_None) {
+        mPyCallback = NULL;
+    } else if (PyCallable_Check(callback)) {
+        Py_INCREF(callback);
+        mPyCallback = callback;
+    } else {
+        PyErr_SetString(PyExc_TypeError, "callback must be callable or None");
+        return NULL;
+    }
+    Py_XDECREF(old);
+    notify_buffer_ready = mPyCallback ? PyNotifyBufferReady : NULL;
+    Py_RETURN_NONE;
+}
+
+
+static PyObject * py_init_receiver(PyObject * self, PyObject * Py_UNUSED(args))
+{
+    if (InitSdbReceiver() != 0) {
+        PyErr_SetString(PyExc_OSError, "sdb receiver thread creation failed");
+        return NULL;
+    }
+    Py_RETURN_NONE;
+}
+
+
+static PyObject * py_init(PyObject * self, PyObject * args)
+{
+    unsigned int buff_size, buff_num;
+    const char * device = SDB_DEVICE;
+    int ret;
+
+    if (!PyArg_ParseTuple(args, "II|s", &buff_size, &buff_num, &device)) {
+        return NULL;
+    }
+    Py_BEGIN_ALLOW_THREADS
+    ret = InitSdb(buff_size, buff_num, device);
+    Py_END_ALLOW_THREADS
+    if (ret != 0) {
+        PyErr_SetString(PyExc_OSError, "sdb buffers creation failed");
+        return NULL;
+    }
+    Py_RETURN_NONE;
+}
+
+
+static PyObject * py_start(PyObject * self, PyObject * Py_UNUSED(args))
+{
+    StartSdbReceiver();
+    Py_RETURN_NONE;
+}
+
+
+static PyObject * py_stop(PyObject * self, PyObject * Py_UNUSED(args))
+{
+    StopSdbReceiver();
+    Py_RETURN_NONE;
+}
 
+
+static PyObject * py_halt(PyObject * self, PyObject * Py_UNUSED(args))
+{
+    // sdb_thread may be waiting for the GIL in the callback: join without it
+    Py_BEGIN_ALLOW_THREADS
+    HaltSdbReceiver();
+    Py_END_ALLOW_THREADS
+    Py_RETURN_NONE;
+}
+
+
+static PyObject * py_deinit(PyObject * self, PyObject * Py_UNUSED(args))
+{
+    // sdb_thread may be waiting for the GIL in the callback: join without it
+    Py_BEGIN_ALLOW_THREADS
+    DeInitSdbReceiver();
+    Py_END_ALLOW_THREADS
+    Py_RETURN_NONE;
+}
+
+
+static PyObject * py_release_buffer(PyObject * self, PyObject * args)
+{
+    unsigned int buff_idx;
+
+    if (!PyArg_ParseTuple(args, "I", &buff_idx)) {
+        return NULL;
+    }
+    return PyLong_FromLong(ReleaseSdbBuffer(buff_idx));
+}
+
+
+static PyObject * py_get_seq_gaps(PyObject * self, PyObject * Py_UNUSED(args))
+{
+    PyObject * gaps = PyList_New(sdbnum);
+    int total;
+
+    if (gaps == NULL) {
+        return NULL;
+    }
+    pthread_mutex_lock(&mStatsLock);
+    total = (int)mStats.seq_gaps;
+    for (int i=0; i<sdbnum; i++) {
+        PyList_SET_ITEM(gaps, i, PyLong_FromUnsignedLong(mBuffGaps[i]));
+    }
+    pthread_mutex_unlock(&mStatsLock);
+    return Py_BuildValue("(iN)", total, gaps);
+}
+
+
+static PyObject * py_rle_count(PyObject * self, PyObject * args)
+{
+    Py_buffer data;
+    uint64_t samples;
+
+    if (!PyArg_ParseTuple(args, "y*", &data)) {
+        return NULL;
+    }
+    Py_BEGIN_ALLOW_THREADS
+    samples = CountSdbSamples(data.buf, data.len);
+    Py_END_ALLOW_THREADS
+    PyBuffer_Release(&data);
+    return PyLong_FromUnsignedLongLong(samples);
+}
+
+
+static PyObject * py_rle_decode(PyObject * self, PyObject * args)
+{
+    Py_buffer data, out = {NULL};
+    PyObject * samples = NULL;
+    unsigned int consumed;
+    uint64_t decoded;
+
+    if (!PyArg_ParseTuple(args, "y*|w*", &data, &out)) {
+        return NULL;
+    }
+    if (out.buf == NULL) {
+        // whole buffer into a new bytearray
+        samples = PyByteArray_FromStringAndSize(NULL, CountSdbSamples(data.buf, data.len));
+        if (samples == NULL) {
+            PyBuffer_Release(&data);
+            return NULL;
+        }
+        Py_BEGIN_ALLOW_THREADS
+        DecodeSdbSamples(data.buf, data.len, (unsigned char *)PyByteArray_AS_STRING(samples), PyByteArray_GET_SIZE(samples), &decoded);
+        Py_END_ALLOW_THREADS
+        PyBuffer_Release(&data);
+        return samples;
+    }
+    // as much as fits into out: the caller goes on from data[consumed:]
+    Py_BEGIN_ALLOW_THREADS
+    consumed = DecodeSdbSamples(data.buf, data.len, out.buf, out.len, &decoded);
+    Py_END_ALLOW_THREADS
+    PyBuffer_Release(&data);
+    PyBuffer_Release(&out);
+    return Py_BuildValue("(IK)", consumed, (unsigned long long)decoded);
+}
+
+
+static PyObject * py_get_eventfds(PyObject * self, PyObject * Py_UNUSED(args))
+{
+    PyObject * fds = PyList_New(sdbnum);
+
+    if (fds == NULL) {
+        return NULL;
+    }
+    for (int i=0; i<sdbnum; i++) {
+        PyList_SET_ITEM(fds, i, PyLong_FromLong(efd[i]));
+    }
+    return fds;
+}
+
+
+static PyObject * py_set_external_poll(PyObject * self, PyObject * args)
+{
+    int enable;
+
+    if (!PyArg_ParseTuple(args, "p", &enable)) {
+        return NULL;
+    }
+    if (SetSdbExternalPoll(enable) != 0) {
+        PyErr_SetString(PyExc_RuntimeError, "external poll must be set before init_receiver()");
+        return NULL;
+    }
+    Py_RETURN_NONE;
+}
+
+
+static PyObject * py_dispatch(PyObject * self, PyObject * indices)
+{
+    unsigned int idx[MAX_EPOLL_EVENTS];
+    PyObject * seq = PySequence_Fast(indices, "indices must be a sequence");
+    Py_ssize_t num;
+    int ret;
+
+    if (seq == NULL) {
+        return NULL;
+    }
+    num = PySequence_Fast_GET_SIZE(seq);
+    if (num > MAX_EPOLL_EVENTS) {
+        Py_DECREF(seq);
+        PyErr_SetString(PyExc_ValueError, "too many indices");
+        return NULL;
+    }
+    for (Py_ssize_t i=0; i<num; i++) {
+        idx[i] = (unsigned int)PyLong_AsUnsignedLong(PySequence_Fast_GET_ITEM(seq, i));
+        if (PyErr_Occurred()) {
+            Py_DECREF(seq);
+            return NULL;
+        }
+    }
+    Py_DECREF(seq);
+    // the callback takes the GIL back for the time of each buffer
+    Py_BEGIN_ALLOW_THREADS
+    ret = DispatchSdbEvents(idx, (unsigned int)num);
+    Py_END_ALLOW_THREADS
+    if (ret != 0) {
+        PyErr_SetString(PyExc_RuntimeError, "dispatch() requires set_external_poll(True) before init_receiver()");
+        return NULL;
+    }
+    Py_RETURN_NONE;
+}
+
+
+static PyObject * py_get_stats(PyObject * self, PyObject * Py_UNUSED(args))
+{
+    sdb_stats_t stats;
+
+    GetSdbStats(&stats);
+    return Py_BuildValue("{sKsKsKsKsKsKsKsKsKsKsK}",
+                         "buffers", (unsigned long long)stats.buffers,
+                         "bytes", (unsigned long long)stats.bytes,
+                         "poll_wakeups", (unsigned long long)stats.poll_wakeups,
+                         "empty_buffers", (unsigned long long)stats.empty_buffers,
+                         "cb_time_ns", (unsigned long long)stats.cb_time_ns,
+                         "uncomp_samples", (unsigned long long)stats.uncomp_samples,
+                         "seq_gaps", (unsigned long long)stats.seq_gaps,
+                         "lease_overruns", (unsigned long long)stats.lease_overruns,
+                         "queue_drops", (unsigned long long)stats.queue_drops,
+                         "queue_high_water", (unsigned long long)stats.queue_high_water,
+                         "size_errors", (unsigned long long)stats.size_errors);
+}
+
+
+static PyObject * py_reset_stats(PyObject * self, PyObject * Py_UNUSED(args))
+{
+    ResetSdbStats();
+    Py_RETURN_NONE;
+}
+
+
+static PyObject * py_set_queue(PyObject * self, PyObject * args)
+{
+    unsigned int depth;
+    int policy;
+
+    if (!PyArg_ParseTuple(args, "Ii", &depth, &policy)) {
+        return NULL;
+    }
+    if (policy < SDB_OVERFLOW_BLOCK || policy > SDB_OVERFLOW_DROP_NEWEST) {
+        PyErr_SetString(PyExc_ValueError, "invalid overflow policy");
+        return NULL;
+    }
+    if (SetSdbQueue(depth, (sdb_overflow_policy_t)policy) != 0) {
+        PyErr_SetString(PyExc_RuntimeError, "hand-off queue must be set before init_receiver()");
+        return NULL;
+    }
+    Py_RETURN_NONE;
+}
+
+
+static PyObject * py_set_verbosity(PyObject * self, PyObject * args)
+{
+    int level;
+
+    if (!PyArg_ParseTuple(args, "i", &level)) {
+        return NULL;
+    }
+    SetSdbVerbosity(level);
+    Py_RETURN_NONE;
+}
+
+
+static PyObject * py_set_uncomp_count(PyObject * self, PyObject * args)
+{
+    int enable;
+
+    if (!PyArg_ParseTuple(args, "p", &enable)) {
+        return NULL;
+    }
+    SetSdbUncompCount(enable);
+    Py_RETURN_NONE;
+}
+
+
+static PyMethodDef SdbsdkMethods[] = {
+    {"set_callback", py_set_callback, METH_O, "Set the buffer ready callback, called with a SdbBuffer."},
+    {"init_receiver", py_init_receiver, METH_NOARGS, "Create the receiver thread."},
+    {"init", py_init, METH_VARARGS, "Open the driver (or emulation file) and map buff_num buffers of buff_size bytes."},
+    {"start", py_start, METH_NOARGS, "Start delivering buffers."},
+    {"stop", py_stop, METH_NOARGS, "Stop delivering buffers."},
+    {"halt", py_halt, METH_NOARGS, "Exit the receiver threads, the buffers staying mapped."},
+    {"deinit", py_deinit, METH_NOARGS, "Exit the receiver thread and unmap the buffers."},
+    {"release_buffer", py_release_buffer, METH_VARARGS, "Give a leased buffer back to the receiver."},
+    {"get_seq_gaps", py_get_seq_gaps, METH_NOARGS, "Return (total, per_buffer) lost buffer fills."},
+    {"rle_count", py_rle_count, METH_VARARGS, "Return the number of samples of a compressed buffer."},
+    {"rle_decode", py_rle_decode, METH_VARARGS, "Expand a compressed buffer into a new bytearray of samples, "
+        "or into out: return (compressed bytes consumed, samples written)."},
+    {"get_eventfds", py_get_eventfds, METH_NOARGS, "Return the buffer eventfds, for user space emulation."},
+    {"get_stats", py_get_stats, METH_NOARGS, "Return the receiver counters as a dict."},
+    {"reset_stats", py_reset_stats, METH_NOARGS, "Reset the receiver counters."},
+    {"set_queue", py_set_queue, METH_VARARGS, "Set depth and overflow policy of the hand-off queue (0: no queue)."},
+    {"set_verbosity", py_set_verbosity, METH_VARARGS, "Set the receiver log level."},
+    {"set_uncomp_count", py_set_uncomp_count, METH_VARARGS, "Enable the uncompressed samples count."},
+    {"set_external_poll", py_set_external_poll, METH_VARARGS, "Let the app poll the buffer eventfds instead of the receiver thread."},
+    {"dispatch", py_dispatch, METH_O, "Process the buffers whose eventfds are readable, given by index (external poll)."},
+    {NULL, NULL, 0, NULL}
+};
+
+
+static struct PyModuleDef sdbsdkmodule = {
+    PyModuleDef_HEAD_INIT,
+    "_sdbsdk",
+    "User space API of the stm32_rpmsg_sdb kernel driver.",
+    -1,
+    SdbsdkMethods
+};
+
+
+PyMODINIT_FUNC PyInit__sdbsdk(void)
+{
+    PyObject * m;
+
+#if PY_VERSION_HEX < 0x03070000
+    PyEval_InitThreads();   // sdb_thread calls back into Python
+#endif
+    if (PyType_Ready(&SdbBufferType) < 0) {
+        return NULL;
+    }
+    m = PyModule_Create(&sdbsdkmodule);
+    if (m == NULL) {
+        return NULL;
+    }
+    Py_INCREF(&SdbBufferType);
+    if (PyModule_AddObject(m, "SdbBuffer", (PyObject *)&SdbBufferType) < 0) {
+        Py_DECREF(&SdbBufferType);
+        Py_DECREF(m);
+        return NULL;
+    }
+    PyModule_AddIntConstant(m, "SDB_EMU_HEADER_SIZE", SDB_EMU_HEADER_SIZE);
+    PyModule_AddIntConstant(m, "SDB_RLE_RUN_SHIFT", SDB_RLE_RUN_SHIFT);
+    PyModule_AddIntConstant(m, "SDB_RLE_VALUE_MASK", SDB_RLE_VALUE_MASK);
+    PyModule_AddIntConstant(m, "SDB_LOG_ERROR", SDB_LOG_ERROR);
+    PyModule_AddIntConstant(m, "SDB_LOG_INFO", SDB_LOG_INFO);
+    PyModule_AddIntConstant(m, "SDB_LOG_DEBUG", SDB_LOG_DEBUG);
+    PyModule_AddIntConstant(m, "SDB_OVERFLOW_BLOCK", SDB_OVERFLOW_BLOCK);
+    PyModule_AddIntConstant(m, "SDB_OVERFLOW_DROP_OLDEST", SDB_OVERFLOW_DROP_OLDEST);
+    PyModule_AddIntConstant(m, "SDB_OVERFLOW_DROP_NEWEST", SDB_OVERFLOW_DROP_NEWEST);
+    return m;
+}
@@ -1,11 +1,57 @@
 
-typedef unsigned int buffer_ready_cb(unsigned char * buffer, unsigned int buffer_len);
+#define SDB_RLE_RUN_SHIFT 5         // compressed byte: run of 1 + (byte >> 5) samples
+#define SDB_RLE_VALUE_MASK 0x1F     // of value byte & 0x1F
+#define SDB_EMU_HEADER_SIZE 4096    // emulation file: uint32_t data size of each buffer, then the buffers
 
-extern int InitSdb(unsigned int, unsigned int);    
+typedef struct
+{
+    uint64_t buffers;           // buffers handed to the app
+    uint64_t bytes;             // bytes received (compressed)
+    uint64_t poll_wakeups;      // receiver thread wakeups
+    uint64_t empty_buffers;     // buffer events with no data
+    uint64_t cb_time_ns;        // time spent in the buffer ready callback
+    uint64_t uncomp_samples;    // samples after decompression, see SetSdbUncompCount()
+    uint64_t seq_gaps;          // buffer fills lost
+    uint64_t lease_overruns;    // buffers dropped as still leased by the app
+    uint64_t queue_drops;       // buffers dropped by the hand-off queue overflow policy
+    uint64_t queue_high_water;  // maximum number of buffers waiting in the hand-off queue
+    uint64_t size_errors;       // buffers skipped as their data size could not be read
+} sdb_stats_t;
+
+typedef enum {
+    SDB_OVERFLOW_BLOCK = 0,     // the receiver waits for room in the queue
+    SDB_OVERFLOW_DROP_OLDEST,   // the oldest queued buffer is dropped
+    SDB_OVERFLOW_DROP_NEWEST,   // the incoming buffer is dropped
+} sdb_overflow_policy_t;
+
+typedef struct
+{
+    unsigned char * data;
+    unsigned int len;
+    unsigned int idx;
+    uint32_t seq;
+} sdb_queue_entry_t;
+
+typedef unsigned int buffer_ready_cb(unsigned char * buffer, unsigned int buffer_len, unsigned int buffer_idx, uint32_t seq);
+
+extern int InitSdb(unsigned int, unsigned int, const char *);    
 extern int  InitSdbReceiver(void);
 extern void StartSdbReceiver(void);
 extern void StopSdbReceiver(void);
+extern void HaltSdbReceiver(void);
 extern int  DeInitSdbReceiver(void);
 extern void register_buff_ready_cb(buffer_ready_cb *);
 extern void unregister_buff_ready_cb(buffer_ready_cb *); 
+extern int  ReleaseSdbBuffer(unsigned int);
+extern int  DispatchSdbEvents(const unsigned int *, unsigned int);
+extern int  SetSdbExternalPoll(int);
+extern int  GetSdbSeqGaps(uint32_t *, unsigned int);
+extern int  GetSdbEventFds(int *, unsigned int);
+extern uint64_t CountSdbSamples(const unsigned char *, unsigned int);
+extern unsigned int DecodeSdbSamples(const unsigned char *, unsigned int, unsigned char *, uint64_t, uint64_t *);
+extern void GetSdbStats(sdb_stats_t *);
+extern void ResetSdbStats(void);
+extern int  SetSdbQueue(unsigned int, sdb_overflow_policy_t);
+extern void SetSdbVerbosity(int);
+extern void SetSdbUncompCount(int);
 
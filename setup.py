@@ -1,37 +1,11 @@
-from setuptools.command.build_py import build_py
 from setuptools import setup, find_packages, Extension
 import setuptools
-import subprocess
-import shlex
 import sys
 import os
 
 VERSION='0.0.14'
 
-def pre_install():
-    """Do the custom compiling of the libsdbsdk.so library from the makefile"""
-    try:
-        print("Working dir is " + os.getcwd())
-#        with open("bluepy/version.h","w") as verfile:
-#            verfile.write('#define VERSION_STRING "%s"\n' % VERSION)
-        for cmd in [ "make -C ./mp1ampstsdk clean", "make -C mp1ampstsdk -j1" ]:
-            print("execute " + cmd)
-            msgs = subprocess.check_output(shlex.split(cmd), stderr=subprocess.STDOUT)
-    except subprocess.CalledProcessError as e:
-        print("Failed to compile sdbsdk. Exiting install.")
-        print("Command was " + repr(cmd) + " in " + os.getcwd())
-        print("Return code was %d" % e.returncode)
-        print("Output was:\n%s" % e.output)
-        sys.exit(1)
-
-class my_build_py(build_py):
-    def run(self):
-        pre_install()
-        build_py.run(self)
-
-setup_cmdclass = {
-    'build_py' : my_build_py,
-}
+setup_cmdclass = {}
 
 # Force package to be *not* pure Python
 # Discusssed at issue #158
@@ -54,10 +28,10 @@ with open("README.md", "r", encoding='utf-8') as fh:
     long_description = fh.read()
 
 module_1 = Extension(
-    "libsdbsdk",
+    "mp1ampstsdk._sdbsdk",
     include_dirs=["mp1ampstsdk"],
     sources = ["mp1ampstsdk/sdbsdk.c"],
-    library_dirs = ['.'])
+    libraries = ["pthread"])
 
 setup(
     name="mp1ampstsdk", 
@@ -77,11 +51,14 @@ setup(
         "Development Status :: 3 - Alpha"
     ],
     install_requires=['pyserial>=3'],
-    python_requires='>=3.5',
+    python_requires='>=3.7',
     packages=['mp1ampstsdk'],
     package_data={
-        'mp1ampstsdk': ['sdbsdk.c','sdbsdk.h','Makefile','libsdbsdk.so']
+        'mp1ampstsdk': ['sdbsdk.c','sdbsdk.h','Makefile']
     },
     cmdclass=setup_cmdclass,
     ext_modules=[module_1],
+    entry_points={
+        'console_scripts': ['mp1-sdb-broker=mp1ampstsdk.broker:main']
+    },
 )
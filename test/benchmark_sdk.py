@@ -0,0 +1,346 @@
+################################################################################
+# COPYRIGHT(c) 2020 STMicroelectronics                                         #
+#                                                                              #
+# Redistribution and use in source and binary forms, with or without           #
+# modification, are permitted provided that the following conditions are met:  #
+#   1. Redistributions of source code must retain the above copyright notice,  #
+#      this list of conditions and the following disclaimer.                   #
+#   2. Redistributions in binary form must reproduce the above copyright       #
+#      notice, this list of conditions and the following disclaimer in the     #
+#      documentation and/or other materials provided with the distribution.    #
+#   3. Neither the name of STMicroelectronics nor the names of its             #
+#      contributors may be used to endorse or promote products derived from    #
+#      this software without specific prior written permission.                #
+#                                                                              #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"  #
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE    #
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE   #
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE    #
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR          #
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF         #
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS     #
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN      #
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)      #
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE   #
+# POSSIBILITY OF SUCH DAMAGE.                                                  #
+################################################################################
+
+import sys, argparse
+import os
+import asyncio
+import json
+import platform
+import threading
+import time
+import serial
+from datetime import datetime
+from mp1ampstsdk.commsdk import CommAPI
+from mp1ampstsdk.commsdk import CommAPINotificationListener
+from mp1ampstsdk.async_commsdk import AsyncCommAPI
+from mp1ampstsdk.py_sdbsdk import RpmsgSdbAPI
+from mp1ampstsdk.py_sdbsdk import RpmsgSdbAPIListener
+from mp1ampstsdk.emulator import Emulator
+from mp1ampstsdk.iocore import IOCore
+from mp1ampstsdk.metrics import REGISTRY
+
+BENCHMARKS = ["startup", "cmd_sync", "cmd_async", "notifications", "sdb"]
+
+
+class Bench_ntfy_listener (CommAPINotificationListener):
+
+    def __init__(self, count):
+        self.count = count
+        self.received = 0
+        self.done = threading.Event()
+
+    def on_m4_notification(self, msg):
+        self.received += 1
+        if self.received >= self.count:
+            self.done.set()
+
+
+class Bench_sdb_rx_listener (RpmsgSdbAPIListener):
+
+    def __init__(self):
+        self.buffers = 0
+        self.bytes = 0
+
+    def on_m4_sdb_rx(self, sdb, sdb_len):
+        self.buffers += 1
+        self.bytes += sdb_len
+
+
+def latency_stats(samples):
+    """Summary of a list of latencies in seconds, reported in microseconds."""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+    def pct(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))] * 1e6
+    return {"count": len(ordered),
+            "mean_us": sum(ordered) / len(ordered) * 1e6,
+            "min_us": ordered[0] * 1e6,
+            "p50_us": pct(50),
+            "p90_us": pct(90),
+            "p99_us": pct(99),
+            "max_us": ordered[-1] * 1e6}
+
+
+#========================================================
+# SETUP
+#
+# With --emulate the M4 side is played by mp1ampstsdk.emulator, otherwise the
+# SDK drives the board: CommAPI stops the M4 FW on release, so each benchmark
+# (re)starts it.
+
+def new_comm(args, emu, notification=True, **kwargs):
+    kwargs.setdefault("io_core", args.core)
+    if emu is not None:
+        emu.remoteproc.start()
+        return emu.comm_api(**kwargs)
+    return CommAPI(args.cmd_port, args.ntf_port if notification else None, args.m4fw, args.terminator, **kwargs)
+
+
+def new_async_comm(args, emu):
+    if emu is not None:
+        emu.remoteproc.start()
+        return emu.async_comm_api()
+    return AsyncCommAPI(args.cmd_port, args.ntf_port, args.m4fw, args.terminator)
+
+
+def new_sdb(args, emu):
+    if emu is not None:
+        emu.remoteproc.start()
+        return emu.sdb_api(io_core=args.core)
+    return RpmsgSdbAPI(args.sdb_m4fw, io_core=args.core)
+
+
+#========================================================
+# BENCHMARKS
+
+def bench_startup(args, emu):
+    comm = []
+    for i in range(args.startup_iterations):
+        start = time.perf_counter()
+        api_obj = new_comm(args, emu)
+        comm.append(time.perf_counter() - start)
+        api_obj.release()
+    sdb = []
+    for i in range(args.startup_iterations):
+        start = time.perf_counter()
+        sdb_obj = new_sdb(args, emu)
+        sdb.append(time.perf_counter() - start)
+        del sdb_obj
+    return {"CommAPI.__init__": latency_stats(comm), "RpmsgSdbAPI.__init__": latency_stats(sdb)}
+
+
+def bench_cmd_sync(args, emu):
+    msg = args.msg + args.terminator
+    results = {}
+    api_obj = new_comm(args, emu, notification=False)
+    try:
+        samples = []
+        for i in range(args.cmd_get_iterations):
+            start = time.perf_counter()
+            answ = api_obj.cmd_get(msg, 0)
+            samples.append(time.perf_counter() - start)
+        results["cmd_get"] = latency_stats(samples)
+        samples = []
+        timeouts = 0
+        for i in range(args.iterations):
+            start = time.perf_counter()
+            answ, rtt = api_obj.cmd_query(msg)
+            samples.append(time.perf_counter() - start)
+            timeouts += rtt is None
+        results["cmd_query"] = latency_stats(samples)
+        results["cmd_query"]["timeouts"] = timeouts
+    finally:
+        api_obj.release()
+    api_obj = new_comm(args, emu, notification=False, correlated=True)
+    try:
+        samples = []
+        for i in range(args.iterations):
+            start = time.perf_counter()
+            api_obj.cmd_submit(msg).result()
+            samples.append(time.perf_counter() - start)
+        results["cmd_submit"] = latency_stats(samples)
+        start = time.perf_counter()
+        futures = [api_obj.cmd_submit(msg) for i in range(args.iterations)]
+        for future in futures:
+            future.result()
+        elapsed = time.perf_counter() - start
+        results["cmd_submit_pipelined"] = {"count": args.iterations, "elapsed_s": elapsed, "cmds_per_s": args.iterations / elapsed}
+    finally:
+        api_obj.release()
+    return results
+
+
+def bench_cmd_async(args, emu):
+    msg = args.msg + args.terminator
+
+    async def run():
+        async with new_async_comm(args, emu) as api_obj:
+            samples = []
+            for i in range(args.iterations):
+                start = time.perf_counter()
+                await api_obj.cmd_get(msg, timeout=1)
+                samples.append(time.perf_counter() - start)
+            return samples
+
+    return {"cmd_get": latency_stats(asyncio.run(run()))}
+
+
+def bench_notifications(args, emu):
+    api_obj = new_comm(args, emu)
+    listener = Bench_ntfy_listener(args.notifications)
+    try:
+        api_obj.add_notification_listener(listener)
+        start = time.perf_counter()
+        if emu is not None:
+            emu.firmware.stream(args.notification_rate, count=args.notifications, msg=args.msg)
+        else:
+            # The echo FW sends back on the notification port what it receives there.
+            ntf_port = serial.Serial(args.ntf_port)
+            for i in range(args.notifications):
+                ntf_port.write((args.msg + args.terminator).encode("utf-8"))
+            ntf_port.close()
+        listener.done.wait(args.timeout)
+        elapsed = time.perf_counter() - start
+    finally:
+        api_obj.release()
+    return {"sent": args.notifications,
+            "received": listener.received,
+            "elapsed_s": elapsed,
+            "notifications_per_s": listener.received / elapsed}
+
+
+def bench_sdb(args, emu):
+    sdb_obj = new_sdb(args, emu)
+    listener = Bench_sdb_rx_listener()
+    sdb_obj.add_sdb_buffer_rx_listener(listener)
+    sdb_obj.init_sdb(args.sdb_buff_size, args.sdb_buff_num)
+    api_obj = None
+    try:
+        sdb_obj.reset_stats()
+        sdb_obj.start_sdb_receiver()
+        start = time.perf_counter()
+        if emu is not None:
+            emu.sdb_producer.attach(sdb_obj)
+            emu.sdb_producer.run(args.sdb_rate, count=args.sdb_buffers)
+            emu.sdb_producer.wait(args.timeout)
+            # Done when every fill is either delivered or accounted as lost.
+            deadline = time.monotonic() + args.timeout
+            while time.monotonic() < deadline:
+                stats = sdb_obj.get_stats()
+                if listener.buffers + stats["seq_gaps"] + stats["lease_overruns"] + stats["queue_drops"] >= emu.sdb_producer.buffers:
+                    break
+                time.sleep(0.01)
+        else:
+            api_obj = new_comm(args, None, notification=False)
+            for cmd in args.sdb_cmd:
+                api_obj.cmd_set(cmd, 0)
+            time.sleep(args.duration)
+            api_obj.cmd_set(args.sdb_stop_cmd, 0)
+        elapsed = time.perf_counter() - start
+        sdb_obj.stop_sdb_receiver()
+        stats = sdb_obj.get_stats()
+    finally:
+        sdb_obj.deinit_sdb()
+        if api_obj is not None:
+            api_obj.release()
+        del sdb_obj
+    return {"buffers": listener.buffers,
+            "bytes": listener.bytes,
+            "elapsed_s": elapsed,
+            "MB_per_s": listener.bytes / elapsed / 1e6,
+            "buffers_per_s": listener.buffers / elapsed,
+            "callback_us": stats["cb_time_ns"] / max(1, stats["buffers"]) / 1e3,
+            "stats": stats}
+
+
+#========================================================
+# MAIN APPLICATION
+#
+# Benchmarks of the SDK, results are written as JSON.
+#eg. python3 benchmark_sdk.py --emulate -o results.json
+#eg. python3 benchmark_sdk.py --m4fw /usr/local/Cube-M4-examples/STM32MP157C-DK2/Applications/OpenAMP/OpenAMP_TTY_echo/lib/firmware/OpenAMP_TTY_echo.elf \
+#        --sdb-m4fw /usr/local/Cube-M4-examples/STM32MP157C-DK2/Applications/la/lib/firmware/how2eldb03110.elf
+
+
+def main(argv):
+
+    parser = argparse.ArgumentParser(description='Benchmark the SDK against the board or the emulator.')
+    parser.add_argument('benchmarks', nargs='*', default=BENCHMARKS,
+                        help='Benchmarks to run, all by default: %s' % (", ".join(BENCHMARKS)))
+    parser.add_argument('--emulate', action='store_true', help='Run against mp1ampstsdk.emulator instead of the board')
+    parser.add_argument('--m4fw', type=str, default=None, help='Echo M4 fw for the command benchmarks, eg. OpenAMP_TTY_echo.elf')
+    parser.add_argument('--sdb-m4fw', type=str, default=None, help='M4 fw filling the sdb, eg. how2eldb03110.elf')
+    parser.add_argument('--cmd-port', type=str, default='/dev/ttyRPMSG0')
+    parser.add_argument('--ntf-port', type=str, default='/dev/ttyRPMSG1')
+    parser.add_argument('--terminator', type=str, default=';')
+    parser.add_argument('--msg', type=str, default='ping', help='Command and notification payload')
+    parser.add_argument('--iterations', type=int, default=1000, help='Round trips per latency benchmark')
+    parser.add_argument('--cmd-get-iterations', type=int, default=10, help='Round trips of the blocking cmd_get (0.5 s each)')
+    parser.add_argument('--startup-iterations', type=int, default=3)
+    parser.add_argument('--notifications', type=int, default=10000)
+    parser.add_argument('--notification-rate', type=float, default=0, help='Emulator notifications per second, 0 as fast as possible')
+    parser.add_argument('--sdb-buff-size', type=int, default=1024*1024)
+    parser.add_argument('--sdb-buff-num', type=int, default=3)
+    parser.add_argument('--sdb-buffers', type=int, default=1000, help='Emulator buffers to fill')
+    parser.add_argument('--sdb-rate', type=float, default=0, help='Emulator buffers per second, 0 as fast as possible')
+    parser.add_argument('--sdb-cmd', type=str, nargs='*', default=['r', 'S002M'], help='Cmds starting the sdb fw')
+    parser.add_argument('--sdb-stop-cmd', type=str, default='Exit')
+    parser.add_argument('--duration', type=float, default=10, help='Board sdb acquisition time (s)')
+    parser.add_argument('--timeout', type=float, default=30, help='Max wait for a throughput benchmark (s)')
+    parser.add_argument('--io-core', action='store_true', help='Run the SDK objects I/O on a single IOCore thread')
+    parser.add_argument('--prometheus', type=str, default=None, help='Also write the SDK metrics to this file in the Prometheus text format')
+    parser.add_argument('-o', '--output', type=str, default=None, help='JSON file, stdout if omitted')
+    args = parser.parse_args(argv)
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark %s" % (name))
+
+    emu = None
+    if args.emulate:
+        emu = Emulator(args.sdb_buff_size, args.sdb_buff_num, args.terminator)
+
+    report = {"timestamp": datetime.now().isoformat(),
+              "mode": "emulator" if args.emulate else "board",
+              "python": platform.python_version(),
+              "machine": platform.machine(),
+              "config": dict(vars(args)),
+              "results": {}}
+    args.core = IOCore() if args.io_core else None
+    try:
+        from importlib.metadata import version
+        report["sdk_version"] = version("mp1ampstsdk")
+    except Exception:
+        report["sdk_version"] = None
+
+    try:
+        for name in args.benchmarks:
+            print("Running %s ..." % (name), file=sys.stderr)
+            try:
+                report["results"][name] = globals()["bench_" + name](args, emu)
+            except Exception as e:
+                report["results"][name] = {"error": "%s: %s" % (type(e).__name__, e)}
+    finally:
+        if args.core is not None:
+            report["io_core"] = args.core.get_stats()
+            args.core.close()
+        if emu is not None:
+            emu.release()
+    report["metrics"] = REGISTRY.as_dict()
+    if args.prometheus:
+        REGISTRY.write_prometheus(args.prometheus)
+
+    if args.output:
+        with open(args.output, 'w') as out:
+            json.dump(report, out, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
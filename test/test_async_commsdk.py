@@ -0,0 +1,142 @@
+################################################################################
+# COPYRIGHT(c) 2020 STMicroelectronics                                         #
+#                                                                              #
+# Redistribution and use in source and binary forms, with or without           #
+# modification, are permitted provided that the following conditions are met:  #
+#   1. Redistributions of source code must retain the above copyright notice,  #
+#      this list of conditions and the following disclaimer.                   #
+#   2. Redistributions in binary form must reproduce the above copyright       #
+#      notice, this list of conditions and the following disclaimer in the     #
+#      documentation and/or other materials provided with the distribution.    #
+#   3. Neither the name of STMicroelectronics nor the names of its             #
+#      contributors may be used to endorse or promote products derived from    #
+#      this software without specific prior written permission.                #
+#                                                                              #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"  #
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE    #
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE   #
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE    #
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR          #
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF         #
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS     #
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN      #
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)      #
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE   #
+# POSSIBILITY OF SUCH DAMAGE.                                                  #
+################################################################################
+
+
+
+"""Tests of AsyncCommAPI against mp1ampstsdk.emulator.
+Run with: python3 -m pytest test
+"""
+
+
+# IMPORT
+
+from mp1ampstsdk.emulator import Emulator
+import asyncio
+import time
+import unittest
+
+
+# CLASSES
+
+class TestAsyncCommAPI(unittest.TestCase):
+
+    def test_late_response_is_not_taken_for_the_next_one(self):
+        def handler(msg):
+            if msg.startswith("slow"):
+                time.sleep(0.3)
+            return "R" + msg
+        async def exchange(api):
+            timed_out = await api.cmd_get("slow;", timeout=0.1)
+            await asyncio.sleep(0.5)     # the late response comes meanwhile
+            return timed_out, await api.cmd_get("a;"), await api.cmd_get("b;")
+        with Emulator(handler=handler) as emu:
+            api = emu.async_comm_api()
+            try:
+                self.assertEqual(asyncio.run(exchange(api)), ("", "Ra;", "Rb;"))
+            finally:
+                api.release()
+
+
+
+    def test_cmd_set_and_concurrent_commands_are_answered_in_order(self):
+        async def exchange(api):
+            first = await api.cmd_set("led on;")
+            return [first] + list(await asyncio.gather(*[api.cmd_get("c%d;" % (i)) for i in range(3)]))
+        with Emulator(handler=lambda msg: "R" + msg) as emu:
+            api = emu.async_comm_api()
+            try:
+                self.assertEqual(asyncio.run(exchange(api)), ["Rled on;", "Rc0;", "Rc1;", "Rc2;"])
+                self.assertEqual(emu.firmware.commands, 4)
+            finally:
+                api.release()
+
+
+    def test_unanswered_command_times_out(self):
+        async def exchange(api):
+            start = time.monotonic()
+            response = await api.cmd_get("mute;", timeout=0.1)
+            return response, time.monotonic() - start
+        with Emulator(handler=lambda msg: None) as emu:
+            api = emu.async_comm_api()
+            try:
+                response, elapsed = asyncio.run(exchange(api))
+                self.assertEqual(response, "")
+                self.assertLess(elapsed, 0.5)
+            finally:
+                api.release()
+
+
+    def test_cancelled_command_frees_the_channel(self):
+        def handler(msg):
+            if msg.startswith("slow"):
+                time.sleep(0.2)
+            return "R" + msg
+        async def exchange(api):
+            task = asyncio.ensure_future(api.cmd_get("slow;"))
+            await asyncio.sleep(0.05)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(api.cmd_get("slow;"), 0.05)
+            await asyncio.sleep(0.5)     # the late responses come meanwhile
+            return await api.cmd_get("a;")
+        with Emulator(handler=handler) as emu:
+            api = emu.async_comm_api()
+            try:
+                self.assertEqual(asyncio.run(exchange(api)), "Ra;")
+            finally:
+                api.release()
+
+
+    def test_async_for_over_notifications_ends_on_release(self):
+        async def consume(api, firmware):
+            received = []
+            notifications = api.notifications()     # enables the notification channel
+            firmware.stream(0, 5)
+            async for notification in notifications:
+                received.append(notification)
+                if len(received) == 5:
+                    break
+            # a second iterator ends when the object is released
+            pending = asyncio.ensure_future(self.drain(api.notifications()))
+            await asyncio.sleep(0.05)
+            api.release()
+            return received, await asyncio.wait_for(pending, 1)
+        with Emulator() as emu:
+            api = emu.async_comm_api()
+            received, rest = asyncio.run(consume(api, emu.firmware))
+            self.assertEqual(received, ["ntf%d;" % (i) for i in range(5)])
+            self.assertEqual(rest, [])
+
+
+    async def drain(self, notifications):
+        return [notification async for notification in notifications]
+
+
+if __name__ == "__main__":
+    unittest.main()
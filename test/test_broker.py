@@ -0,0 +1,110 @@
+################################################################################
+# COPYRIGHT(c) 2020 STMicroelectronics                                         #
+#                                                                              #
+# Redistribution and use in source and binary forms, with or without           #
+# modification, are permitted provided that the following conditions are met:  #
+#   1. Redistributions of source code must retain the above copyright notice,  #
+#      this list of conditions and the following disclaimer.                   #
+#   2. Redistributions in binary form must reproduce the above copyright       #
+#      notice, this list of conditions and the following disclaimer in the     #
+#      documentation and/or other materials provided with the distribution.    #
+#   3. Neither the name of STMicroelectronics nor the names of its             #
+#      contributors may be used to endorse or promote products derived from    #
+#      this software without specific prior written permission.                #
+#                                                                              #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"  #
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE    #
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE   #
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE    #
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR          #
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF         #
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS     #
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN      #
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)      #
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE   #
+# POSSIBILITY OF SUCH DAMAGE.                                                  #
+################################################################################
+
+"""Tests of the SDB broker and its clients against mp1ampstsdk.emulator.
+Run with: python3 -m pytest test
+"""
+
+
+# IMPORT
+
+from mp1ampstsdk.broker import SdbBroker
+from mp1ampstsdk.broker import SdbBrokerClient
+from mp1ampstsdk.comm_exceptions import CommSDKInvalidOperationException
+from mp1ampstsdk.emulator import Emulator
+import os
+import time
+import unittest
+
+
+# CONSTANTS
+
+BUFF_SIZE = 4096
+BUFF_NUM = 8
+TIMEOUT_s = 5
+
+
+# CLASSES
+
+class TestSdbBroker(unittest.TestCase):
+
+    def setUp(self):
+        self.emu = Emulator(buff_size=BUFF_SIZE, buff_num=BUFF_NUM)
+        self.socket_path = os.path.join(self.emu.remoteproc.root, "broker.sock")
+        self.sdb_kwargs = {"remoteproc": self.emu.remoteproc.root, "firmware_dir": self.emu.firmware_dir,
+                           "sdb_device": self.emu.sdb_producer.device, "load_driver": False}
+
+
+    def tearDown(self):
+        self.emu.release()
+
+
+    def test_clients_read_every_buffer(self):
+        fills = 40
+        with SdbBroker(BUFF_SIZE, BUFF_NUM, self.socket_path, slots=fills, **self.sdb_kwargs) as broker:
+            clients = [SdbBrokerClient(self.socket_path, timeout=TIMEOUT_s) for _ in range(2)]
+            try:
+                broker.start()
+                self.emu.sdb_producer.attach(broker.sdb_api)
+                for sequence in range(fills):
+                    self.emu.sdb_producer.fill(bytes([sequence]) * BUFF_SIZE)
+                    time.sleep(0.002)   # paced, so that the receiver loses no fill
+                for client in clients:
+                    for sequence in range(fills):
+                        with client.next_buffer() as buffer:
+                            self.assertEqual(bytes(buffer.data[:1]), bytes([buffer.sequence & 0xFF]))
+                    self.assertEqual((client.get_sequence_gaps(), client.get_overruns()), (0, 0))
+                self.assertEqual(broker.get_stats()["buffers"], fills)
+                self.assertEqual(len(broker.get_clients()), 2)
+            finally:
+                for client in clients:
+                    client.close()
+
+
+    def test_close_with_buffers_in_flight(self):
+        for _ in range(10):
+            broker = SdbBroker(BUFF_SIZE, BUFF_NUM, self.socket_path, **self.sdb_kwargs)
+            client = SdbBrokerClient(self.socket_path, timeout=TIMEOUT_s)
+            try:
+                broker.start()
+                self.emu.sdb_producer.attach(broker.sdb_api)
+                for sequence in range(BUFF_NUM * 4):
+                    self.emu.sdb_producer.fill(bytes([sequence]) * BUFF_SIZE)
+                client.next_buffer().release()
+            finally:
+                client.close()
+                broker.close()
+
+
+    def test_failed_fanout_leaves_no_socket(self):
+        with self.assertRaises(CommSDKInvalidOperationException):
+            SdbBroker(BUFF_SIZE, BUFF_NUM, self.socket_path, slots=-1, **self.sdb_kwargs)
+        self.assertFalse(os.path.lexists(self.socket_path))
+
+
+if __name__ == "__main__":
+    unittest.main()
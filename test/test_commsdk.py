@@ -0,0 +1,230 @@
+################################################################################
+# COPYRIGHT(c) 2020 STMicroelectronics                                         #
+#                                                                              #
+# Redistribution and use in source and binary forms, with or without           #
+# modification, are permitted provided that the following conditions are met:  #
+#   1. Redistributions of source code must retain the above copyright notice,  #
+#      this list of conditions and the following disclaimer.                   #
+#   2. Redistributions in binary form must reproduce the above copyright       #
+#      notice, this list of conditions and the following disclaimer in the     #
+#      documentation and/or other materials provided with the distribution.    #
+#   3. Neither the name of STMicroelectronics nor the names of its             #
+#      contributors may be used to endorse or promote products derived from    #
+#      this software without specific prior written permission.                #
+#                                                                              #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"  #
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE    #
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE   #
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE    #
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR          #
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF         #
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS     #
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN      #
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)      #
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE   #
+# POSSIBILITY OF SUCH DAMAGE.                                                  #
+################################################################################
+
+"""Tests of CommAPI against mp1ampstsdk.emulator.
+Run with: python3 -m pytest test
+"""
+
+
+# IMPORT
+
+from mp1ampstsdk.comm_exceptions import CommSDKInvalidOperationException
+from mp1ampstsdk.comm_exceptions import CommSDKTimeoutException
+from mp1ampstsdk.commsdk import SEQ_ID_MODULO
+from mp1ampstsdk.emulator import Emulator
+from mp1ampstsdk.iocore import IOCore
+import threading
+import time
+import unittest
+
+
+# CONSTANTS
+
+TIMEOUT_s = 5
+
+
+# FUNCTIONS
+
+def split_seq_id(msg):
+    """Return the (sequence ID, msg) of a correlated msg, e.g. '#002A:ping'."""
+    seq_id, _, body = msg[1:].partition(":")
+    return seq_id, body
+
+
+# CLASSES
+
+class TestCorrelated(unittest.TestCase):
+    """Correlated mode, the responses read by M4DispatcherThread.
+    The msgs sent are terminated: the fake firmware reads them from a pty,
+    where back to back writes are not kept apart as RpMsg packets are.
+    """
+
+    io_core = False
+
+    def setUp(self):
+        self.core = IOCore() if self.io_core else None
+        self.received = []
+        self.handler = lambda msg: msg
+        self.emu = Emulator(handler=self.handle)
+        self.api = self.emu.comm_api(correlated=True, io_core=self.core)
+
+
+    def tearDown(self):
+        self.api.release()
+        self.emu.release()
+        if self.core is not None:
+            self.core.close()
+
+
+    def handle(self, msg):
+        self.received.append(msg)
+        return self.handler(msg)
+
+
+    def test_responses_resolve_their_request_in_any_order(self):
+        held = []
+        watched = threading.Event()
+        def answer_in_reverse(msg):
+            held.append(msg)
+            if len(held) < 3:
+                return None
+            watched.wait(TIMEOUT_s)
+            # the three responses at once, the last request answered first
+            return ";".join(reversed(held))
+        self.handler = answer_in_reverse
+        completed = []
+        futures = [self.api.cmd_submit("c%d;" % (i), TIMEOUT_s) for i in range(3)]
+        for i, future in enumerate(futures):
+            future.add_done_callback(lambda f, i=i: completed.append(i))
+        watched.set()
+        self.assertEqual([future.result(TIMEOUT_s) for future in futures], ["c0;", "c1;", "c2;"])
+        self.assertEqual(completed, [2, 1, 0])
+
+
+    def test_sequence_id_wraps_around(self):
+        self.api._seq_id = SEQ_ID_MODULO - 2
+        futures = [self.api.cmd_submit("c%d;" % (i), TIMEOUT_s) for i in range(4)]
+        self.assertEqual([future.result(TIMEOUT_s) for future in futures], ["c%d;" % (i) for i in range(4)])
+        self.assertEqual([split_seq_id(msg)[0] for msg in self.received], ["FFFE", "FFFF", "0000", "0001"])
+
+
+    def test_sequence_id_still_pending_is_not_reused(self):
+        self.handler = lambda msg: None
+        self.api._seq_id = 5
+        pending = self.api.cmd_submit("first;", TIMEOUT_s)
+        self.api._seq_id = 5    # as after SEQ_ID_MODULO - 1 other requests
+        self.assertRaises(CommSDKInvalidOperationException, self.api.cmd_submit, "second;")
+        self.assertFalse(pending.done())
+
+
+    def test_unanswered_request_expires(self):
+        self.handler = lambda msg: None
+        start = time.monotonic()
+        future = self.api.cmd_submit("mute;", 0.1)
+        self.assertIsInstance(future.exception(TIMEOUT_s), CommSDKTimeoutException)
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(self.api._pending, {})
+        # the blocking call returns '' on expiry
+        self.assertEqual(self.api.cmd_get("mute;"), "")
+
+
+    def test_uncorrelated_msgs_are_kept_for_cmd_get(self):
+        # a msg without sequence ID, then one with an ID no request waits for
+        self.handler = lambda msg: "spontaneous;#BEEF:stale;" + msg
+        self.assertEqual(self.api.cmd_get("ping;"), "ping;")
+        self.assertEqual(self.api.cmd_get(), "spontaneous;")
+        self.assertEqual(self.api.cmd_get(), "#BEEF:stale;")
+
+
+    def test_release_fails_the_requests_in_flight(self):
+        self.handler = lambda msg: None
+        futures = [self.api.cmd_submit("c%d;" % (i), TIMEOUT_s) for i in range(3)]
+        self.api.release()
+        for future in futures:
+            self.assertIsInstance(future.exception(TIMEOUT_s), CommSDKInvalidOperationException)
+
+
+class TestCorrelatedOnIOCore(TestCorrelated):
+    """Correlated mode, the responses read by the IOCore callbacks."""
+
+    io_core = True
+
+
+
+class TestCmdQuery(unittest.TestCase):
+
+    def setUp(self):
+        self.delay = 0
+        self.emu = Emulator(handler=self.handle)
+        self.api = self.emu.comm_api()
+
+
+    def tearDown(self):
+        self.api.release()
+        self.emu.release()
+
+
+    def handle(self, msg):
+        if msg.startswith("mute"):
+            return None
+        time.sleep(self.delay)
+        return msg
+
+
+    def test_response_comes_with_its_round_trip_time(self):
+        self.delay = 0.05
+        start = time.perf_counter()
+        response, rtt = self.api.cmd_query("ping;")
+        elapsed = time.perf_counter() - start
+        self.assertEqual(response, "ping;")
+        self.assertGreaterEqual(rtt, self.delay)
+        self.assertLessEqual(rtt, elapsed)
+
+
+    def test_response_is_returned_without_fixed_delay(self):
+        start = time.perf_counter()
+        for i in range(5):
+            self.assertEqual(self.api.cmd_query("ping%d;" % (i))[0], "ping%d;" % (i))
+        # the blocking cmd_get waits 0.5 s for each response
+        self.assertLess(time.perf_counter() - start, 0.5)
+
+
+    def test_unanswered_query_returns_at_the_deadline(self):
+        start = time.perf_counter()
+        self.assertEqual(self.api.cmd_query("mute;", 0.2), ("", None))
+        elapsed = time.perf_counter() - start
+        self.assertGreaterEqual(elapsed, 0.2)
+        self.assertLess(elapsed, 0.5)
+        # the command channel is free again
+        self.assertEqual(self.api.cmd_query("ping;")[0], "ping;")
+
+
+    def test_port_timeout_is_left_untouched(self):
+        port = self.api._serial_port_cmd
+        timeout = port.timeout
+        base = type(port)
+        class TimeoutSpy(base):
+            sets = 0
+            @property
+            def timeout(self):
+                return base.timeout.fget(self)
+            @timeout.setter
+            def timeout(self, value):
+                TimeoutSpy.sets += 1
+                base.timeout.fset(self, value)
+        port.__class__ = TimeoutSpy
+        try:
+            self.api.cmd_query("ping;")
+            self.api.cmd_query("mute;", 0.1)
+        finally:
+            port.__class__ = base
+        self.assertEqual(TimeoutSpy.sets, 0)
+        self.assertEqual(port.timeout, timeout)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,143 @@
+################################################################################
+# COPYRIGHT(c) 2020 STMicroelectronics                                         #
+#                                                                              #
+# Redistribution and use in source and binary forms, with or without           #
+# modification, are permitted provided that the following conditions are met:  #
+#   1. Redistributions of source code must retain the above copyright notice,  #
+#      this list of conditions and the following disclaimer.                   #
+#   2. Redistributions in binary form must reproduce the above copyright       #
+#      notice, this list of conditions and the following disclaimer in the     #
+#      documentation and/or other materials provided with the distribution.    #
+#   3. Neither the name of STMicroelectronics nor the names of its             #
+#      contributors may be used to endorse or promote products derived from    #
+#      this software without specific prior written permission.                #
+#                                                                              #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"  #
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE    #
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE   #
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE    #
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR          #
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF         #
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS     #
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN      #
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)      #
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE   #
+# POSSIBILITY OF SUCH DAMAGE.                                                  #
+################################################################################
+
+"""Tests of the decoder of the compressed sample format, native and NumPy,
+on buffers of mp1ampstsdk.emulator.
+Run with: python3 -m pytest test
+"""
+
+
+# IMPORT
+
+from mp1ampstsdk import decoder
+from mp1ampstsdk.decoder import SdbSampleDecoder
+from mp1ampstsdk.emulator import Emulator
+from mp1ampstsdk.py_sdbsdk import RpmsgSdbAPIBufferListener
+import os
+import time
+import unittest
+import unittest.mock
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# CONSTANTS
+
+BUFF_SIZE = 4096
+SETTLE_TIMEOUT_s = 10
+
+
+# FUNCTIONS
+
+def reference_decode(data):
+    samples = bytearray()
+    for byte in bytes(data):
+        samples += bytes([byte & 0x1F]) * (1 + (byte >> 5))
+    return bytes(samples)
+
+
+# CLASSES
+
+class DecodingListener(RpmsgSdbAPIBufferListener):
+
+    def __init__(self):
+        self.checked = 0
+        self.mismatches = 0
+
+    def on_m4_sdb_buffer(self, lease):
+        with lease:
+            samples = decoder.decode(lease.data)
+            if bytes(samples) != reference_decode(lease.data) or \
+                decoder.count_samples(lease.data) != len(samples):
+                self.mismatches += 1
+            self.checked += 1
+
+
+class TestDecode(unittest.TestCase):
+
+    def setUp(self):
+        self.data = os.urandom(1000) + bytes([0x00, 0x1F, 0xE0, 0xFF])
+
+
+    def test_decode_expands_the_runs(self):
+        self.assertEqual(bytes(decoder.decode(bytes([0x21, 0x03, 0xFF]))), b"\x01\x01\x03" + b"\x1f" * 8)
+        self.assertEqual(bytes(decoder.decode(self.data)), reference_decode(self.data))
+        self.assertEqual(decoder.count_samples(self.data), len(reference_decode(self.data)))
+        self.assertEqual(len(decoder.decode(b"")), 0)
+
+
+    @unittest.skipIf(numpy is None, "numpy not installed")
+    def test_numpy_decode_matches_the_native_one(self):
+        with unittest.mock.patch.object(decoder, "_sdbsdk", None):
+            samples = decoder.decode(self.data)
+            count = decoder.count_samples(self.data)
+        self.assertEqual(bytes(samples), reference_decode(self.data))
+        self.assertEqual(count, len(samples))
+
+
+    def test_blocks_span_the_buffer_boundaries(self):
+        stream = SdbSampleDecoder(block_size=7)
+        chunks = [self.data[:300], self.data[300:301], self.data[301:]]
+        blocks = []
+        for chunk in chunks:
+            blocks += stream.feed(chunk)
+        rest = stream.flush()
+        expected = reference_decode(self.data)
+        self.assertTrue(all(len(block) == 7 for block in blocks))
+        self.assertEqual(b"".join(bytes(block) for block in blocks) + bytes(rest), expected)
+        self.assertEqual((stream.samples, stream.buffers), (len(expected), 3))
+        self.assertEqual(len(stream.flush()), 0)
+
+
+class TestDecodeEmulatorBuffers(unittest.TestCase):
+
+    def test_every_buffer_decodes_like_the_reference(self):
+        fills = 20
+        with Emulator(buff_size=BUFF_SIZE, buff_num=8) as emu:
+            sdb = emu.sdb_api()
+            listener = DecodingListener()
+            sdb.add_sdb_buffer_rx_listener(listener)
+            sdb.init_sdb(BUFF_SIZE, 8)
+            try:
+                emu.sdb_producer.attach(sdb)
+                sdb.start_sdb_receiver()
+                emu.sdb_producer.run(100, count=fills)
+                emu.sdb_producer.wait(SETTLE_TIMEOUT_s)
+                deadline = time.monotonic() + SETTLE_TIMEOUT_s
+                while time.monotonic() < deadline and listener.checked < fills:
+                    time.sleep(0.01)
+                sdb.stop_sdb_receiver()
+            finally:
+                sdb.deinit_sdb()
+        self.assertEqual((listener.checked, listener.mismatches), (fills, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,226 @@
+################################################################################
+# COPYRIGHT(c) 2020 STMicroelectronics                                         #
+#                                                                              #
+# Redistribution and use in source and binary forms, with or without           #
+# modification, are permitted provided that the following conditions are met:  #
+#   1. Redistributions of source code must retain the above copyright notice,  #
+#      this list of conditions and the following disclaimer.                   #
+#   2. Redistributions in binary form must reproduce the above copyright       #
+#      notice, this list of conditions and the following disclaimer in the     #
+#      documentation and/or other materials provided with the distribution.    #
+#   3. Neither the name of STMicroelectronics nor the names of its             #
+#      contributors may be used to endorse or promote products derived from    #
+#      this software without specific prior written permission.                #
+#                                                                              #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"  #
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE    #
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE   #
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE    #
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR          #
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF         #
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS     #
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN      #
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)      #
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE   #
+# POSSIBILITY OF SUCH DAMAGE.                                                  #
+################################################################################
+
+"""Tests of the notification dispatcher, alone and behind CommAPI against
+mp1ampstsdk.emulator.
+Run with: python3 -m pytest test
+"""
+
+
+# IMPORT
+
+from mp1ampstsdk.commsdk import CommAPINotificationBatchListener
+from mp1ampstsdk.commsdk import CommAPINotificationListener
+from mp1ampstsdk.dispatcher import BatchPolicy
+from mp1ampstsdk.dispatcher import NotificationDispatcher
+from mp1ampstsdk.emulator import Emulator
+import threading
+import time
+import unittest
+
+
+# CONSTANTS
+
+SETTLE_TIMEOUT_s = 10
+
+
+# FUNCTIONS
+
+def wait_for(condition, timeout=SETTLE_TIMEOUT_s):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+# CLASSES
+
+class RecordingListener(CommAPINotificationListener):
+
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.received = []
+        self.entered = threading.Event()
+        self.proceed = threading.Event()
+        self.proceed.set()
+
+
+    def on_m4_notification(self, notification):
+        self.entered.set()
+        self.proceed.wait()
+        if self.delay:
+            time.sleep(self.delay)
+        self.received.append(notification)
+
+
+class BatchRecordingListener(CommAPINotificationBatchListener):
+
+    def __init__(self):
+        self.batches = []
+
+
+    def on_m4_notifications(self, notifications):
+        self.batches.append(notifications)
+
+
+class TestNotificationDispatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.dispatcher = NotificationDispatcher(workers=4, queue_size=3)
+
+
+    def tearDown(self):
+        self.dispatcher.close()
+
+
+    def test_each_listener_gets_its_notifications_in_order(self):
+        dispatcher = NotificationDispatcher(workers=4)
+        try:
+            listeners = [RecordingListener(), RecordingListener(delay=0.001), RecordingListener()]
+            for listener in listeners:
+                dispatcher.subscribe(listener)
+            sent = ["ntf%d" % (i) for i in range(300)]
+            for msg in sent:
+                dispatcher.dispatch(msg)
+            self.assertTrue(wait_for(lambda: all(len(l.received) == len(sent) for l in listeners)))
+            for listener in listeners:
+                self.assertEqual(listener.received, sent)
+        finally:
+            dispatcher.close()
+
+
+    def test_slow_listener_does_not_delay_the_others(self):
+        slow = RecordingListener()
+        fast = RecordingListener()
+        slow.proceed.clear()
+        self.dispatcher.subscribe(slow)
+        self.dispatcher.subscribe(fast)
+        self.dispatcher.dispatch("a")
+        self.dispatcher.dispatch("b")
+        self.assertTrue(wait_for(lambda: fast.received == ["a", "b"]))
+        self.assertEqual(slow.received, [])
+        slow.proceed.set()
+        self.assertTrue(wait_for(lambda: slow.received == ["a", "b"]))
+
+
+    def test_lagging_listener_loses_the_oldest_notifications(self):
+        listener = RecordingListener()
+        listener.proceed.clear()
+        self.dispatcher.subscribe(listener)
+        self.dispatcher.dispatch("ntf0")
+        self.assertTrue(listener.entered.wait(SETTLE_TIMEOUT_s))
+        for i in range(1, 10):
+            self.dispatcher.dispatch("ntf%d" % (i))
+        listener.proceed.set()
+        self.assertTrue(wait_for(lambda: len(listener.received) == 4))
+        self.assertEqual(listener.received, ["ntf0", "ntf7", "ntf8", "ntf9"])
+        self.assertEqual(self.dispatcher.get_subscribers()[0]["dropped"], 6)
+
+
+    def test_longest_prefix_routes_the_notification(self):
+        dispatcher = NotificationDispatcher(workers=0)
+        try:
+            temp = RecordingListener()
+            temp_cpu = RecordingListener()
+            every = RecordingListener()
+            dispatcher.subscribe(temp, prefix="temp:")
+            dispatcher.subscribe(temp_cpu, prefix=["temp:cpu", "fan:"])
+            dispatcher.subscribe(every)
+            for msg in ("temp:cpu=40", "temp:gpu=50", "fan:1", "x"):
+                dispatcher.dispatch(msg)
+            self.assertEqual(temp.received, ["temp:cpu=40", "temp:gpu=50"])
+            self.assertEqual(temp_cpu.received, ["temp:cpu=40", "fan:1"])
+            self.assertEqual(every.received, ["temp:cpu=40", "temp:gpu=50", "fan:1", "x"])
+            dispatcher.unsubscribe(every)
+            dispatcher.dispatch("x")
+            self.assertEqual(dispatcher.get_stats()["unrouted"], 1)
+        finally:
+            dispatcher.close()
+
+
+class TestBatchDelivery(unittest.TestCase):
+
+    def setUp(self):
+        self.dispatcher = NotificationDispatcher(workers=2)
+
+
+    def tearDown(self):
+        self.dispatcher.close()
+
+
+    def test_batch_is_delivered_after_max_latency(self):
+        listener = BatchRecordingListener()
+        self.dispatcher.subscribe(listener, batch=BatchPolicy(max_batch=100, max_latency=0.2))
+        for i in range(5):
+            self.dispatcher.dispatch("ntf%d" % (i))
+        self.assertEqual(listener.batches, [])
+        self.assertTrue(wait_for(lambda: listener.batches))
+        self.assertEqual(listener.batches, [["ntf0", "ntf1", "ntf2", "ntf3", "ntf4"]])
+
+
+    def test_full_batches_are_delivered_at_once_and_in_order(self):
+        listener = BatchRecordingListener()
+        self.dispatcher.subscribe(listener, batch=BatchPolicy(max_batch=4, max_latency=60))
+        for i in range(12):
+            self.dispatcher.dispatch(i)
+        self.assertTrue(wait_for(lambda: sum(len(b) for b in listener.batches) == 12))
+        self.assertEqual([n for batch in listener.batches for n in batch], list(range(12)))
+        self.assertTrue(all(len(batch) <= 4 for batch in listener.batches))
+
+
+    def test_coalescing_keeps_the_latest_update_of_each_key(self):
+        listener = BatchRecordingListener()
+        policy = BatchPolicy(max_batch=100, max_latency=0.2, coalesce_key=lambda msg: msg.split("=")[0])
+        self.dispatcher.subscribe(listener, batch=policy)
+        for msg in ("a=1", "b=1", "a=2", "c=1", "a=3", "b=2"):
+            self.dispatcher.dispatch(msg)
+        self.assertTrue(wait_for(lambda: listener.batches))
+        self.assertEqual(listener.batches, [["c=1", "a=3", "b=2"]])
+        subscriber = self.dispatcher.get_subscribers()[0]
+        self.assertEqual((subscriber["delivered"], subscriber["coalesced"], subscriber["batches"]), (3, 3, 1))
+
+
+class TestCommAPINotifications(unittest.TestCase):
+
+    def test_streamed_notifications_arrive_in_order(self):
+        with Emulator() as emu:
+            api = emu.comm_api()
+            try:
+                listener = RecordingListener()
+                api.add_notification_listener(listener)
+                emu.firmware.stream(0, count=500)
+                self.assertTrue(wait_for(lambda: len(listener.received) == 500))
+                self.assertEqual(listener.received, ["ntf%d;" % (i) for i in range(500)])
+                api.remove_notification_listener(listener)
+            finally:
+                api.release()
+
+
+if __name__ == "__main__":
+    unittest.main()
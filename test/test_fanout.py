@@ -0,0 +1,150 @@
+################################################################################
+# COPYRIGHT(c) 2020 STMicroelectronics                                         #
+#                                                                              #
+# Redistribution and use in source and binary forms, with or without           #
+# modification, are permitted provided that the following conditions are met:  #
+#   1. Redistributions of source code must retain the above copyright notice,  #
+#      this list of conditions and the following disclaimer.                   #
+#   2. Redistributions in binary form must reproduce the above copyright       #
+#      notice, this list of conditions and the following disclaimer in the     #
+#      documentation and/or other materials provided with the distribution.    #
+#   3. Neither the name of STMicroelectronics nor the names of its             #
+#      contributors may be used to endorse or promote products derived from    #
+#      this software without specific prior written permission.                #
+#                                                                              #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"  #
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE    #
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE   #
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE    #
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR          #
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF         #
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS     #
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN      #
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)      #
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE   #
+# POSSIBILITY OF SUCH DAMAGE.                                                  #
+################################################################################
+
+"""Tests of the SDB fan-out ring, fed directly and by RpmsgSdbAPI against
+mp1ampstsdk.emulator.
+Run with: python3 -m pytest test
+"""
+
+
+# IMPORT
+
+from mp1ampstsdk.emulator import Emulator
+from mp1ampstsdk.fanout import SdbFanOut
+from mp1ampstsdk.fanout import SdbFanOutConsumer
+import os
+import shutil
+import tempfile
+import unittest
+
+
+# CONSTANTS
+
+BUFF_SIZE = 4096
+SLOTS = 4
+TIMEOUT_s = 5
+
+
+# FUNCTIONS
+
+def payload(sequence):
+    return bytes([sequence & 0xFF]) * 64
+
+
+# CLASSES
+
+class TestSdbFanOut(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.fanout = SdbFanOut(BUFF_SIZE, os.path.join(self.dir, "fanout.sock"), slots=SLOTS)
+        self.consumer = SdbFanOutConsumer(self.fanout.socket_path, timeout=TIMEOUT_s)
+
+
+    def tearDown(self):
+        self.consumer.close()
+        self.fanout.close()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+    def test_buffers_are_read_in_order(self):
+        for sequence in range(10):
+            self.fanout.publish(payload(sequence), sequence)
+            with self.consumer.next_buffer() as buffer:
+                self.assertEqual((buffer.sequence, bytes(buffer.data)), (sequence, payload(sequence)))
+        self.assertEqual((self.consumer.get_sequence_gaps(), self.consumer.get_overruns()), (0, 0))
+        self.assertEqual(self.fanout.get_consumers()[0]["lag"], 0)
+
+
+    def test_held_and_unread_buffers_overwritten_are_counted(self):
+        self.fanout.publish(payload(0), 0)
+        held = self.consumer.next_buffer()
+        for sequence in range(1, 7):
+            self.fanout.publish(payload(sequence), sequence)
+        # Positions 4 to 6 overwrote the held buffer and the unread 1 and 2.
+        self.assertFalse(held.is_valid())
+        self.assertEqual(self.consumer.get_overruns(), 3)
+        self.assertEqual(self.fanout.get_consumers()[0]["overruns"], 3)
+        held.release()
+        sequences = []
+        for _ in range(4):
+            with self.consumer.next_buffer() as buffer:
+                self.assertEqual(bytes(buffer.data), payload(buffer.sequence))
+                sequences.append(buffer.sequence)
+        self.assertEqual(sequences, [3, 4, 5, 6])
+        self.assertEqual(self.consumer.get_sequence_gaps(), 2)
+        self.assertEqual(self.fanout.get_consumers()[0]["lag"], 0)
+
+
+    def test_consumer_keeping_up_has_no_overrun(self):
+        lagging = SdbFanOutConsumer(self.fanout.socket_path, timeout=TIMEOUT_s)
+        try:
+            for sequence in range(3 * SLOTS):
+                self.fanout.publish(payload(sequence), sequence)
+                self.consumer.next_buffer().release()
+            self.assertEqual(self.consumer.get_overruns(), 0)
+            self.assertEqual(lagging.get_overruns(), 2 * SLOTS)
+            lags = dict((c["index"], c["lag"]) for c in self.fanout.get_consumers())
+            self.assertEqual((lags[self.consumer.index], lags[lagging.index]), (0, 3 * SLOTS))
+        finally:
+            lagging.close()
+
+
+class TestSdbFanOutFromEmulator(unittest.TestCase):
+
+    def test_every_fill_reaches_the_consumer(self):
+        fills = 50
+        tmp_dir = tempfile.mkdtemp()
+        with Emulator(buff_size=BUFF_SIZE, buff_num=8) as emu:
+            fanout = SdbFanOut(BUFF_SIZE, os.path.join(tmp_dir, "fanout.sock"), slots=fills)
+            consumer = SdbFanOutConsumer(fanout.socket_path, timeout=TIMEOUT_s)
+            sdb = emu.sdb_api()
+            try:
+                sdb.add_sdb_buffer_rx_listener(fanout)
+                sdb.init_sdb(BUFF_SIZE, 8)
+                emu.sdb_producer.attach(sdb)
+                sdb.start_sdb_receiver()
+                emu.sdb_producer.run(200, count=fills)
+                sequences = []
+                for _ in range(fills):
+                    with consumer.next_buffer() as buffer:
+                        self.assertEqual(len(buffer), BUFF_SIZE)
+                        sequences.append(buffer.sequence)
+                self.assertEqual(len(set(sequences)), fills)
+                self.assertEqual(sequences, sorted(sequences))
+                self.assertEqual((consumer.get_sequence_gaps(), consumer.get_overruns()), (0, 0))
+            finally:
+                emu.sdb_producer.wait(TIMEOUT_s)
+                sdb.stop_sdb_receiver()
+                sdb.deinit_sdb()
+                consumer.close()
+                fanout.close()
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    unittest.main()
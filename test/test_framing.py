@@ -0,0 +1,243 @@
+################################################################################
+# COPYRIGHT(c) 2020 STMicroelectronics                                         #
+#                                                                              #
+# Redistribution and use in source and binary forms, with or without           #
+# modification, are permitted provided that the following conditions are met:  #
+#   1. Redistributions of source code must retain the above copyright notice,  #
+#      this list of conditions and the following disclaimer.                   #
+#   2. Redistributions in binary form must reproduce the above copyright       #
+#      notice, this list of conditions and the following disclaimer in the     #
+#      documentation and/or other materials provided with the distribution.    #
+#   3. Neither the name of STMicroelectronics nor the names of its             #
+#      contributors may be used to endorse or promote products derived from    #
+#      this software without specific prior written permission.                #
+#                                                                              #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"  #
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE    #
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE   #
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE    #
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR          #
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF         #
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS     #
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN      #
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)      #
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE   #
+# POSSIBILITY OF SUCH DAMAGE.                                                  #
+################################################################################
+
+"""Tests of the framing module, and of CommAPI in framed mode against
+mp1ampstsdk.emulator.
+Run with: python3 -m pytest test
+"""
+
+
+# IMPORT
+
+from mp1ampstsdk.comm_exceptions import CommSDKInvalidOperationException
+from mp1ampstsdk.emulator import Emulator
+from mp1ampstsdk.framing import FRAME_BINARY
+from mp1ampstsdk.framing import FRAME_TEXT
+from mp1ampstsdk.framing import FrameDecoder
+from mp1ampstsdk.framing import FrameReader
+from mp1ampstsdk.framing import TerminatorSplitter
+from mp1ampstsdk.framing import encode_frame
+import os
+import time
+import unittest
+
+
+# CLASSES
+
+class TestFrameDecoder(unittest.TestCase):
+
+    def test_frames_fed_byte_by_byte(self):
+        stream = encode_frame("temp:21") + encode_frame(b"\xa5\x00\r\n", crc=True) + encode_frame("")
+        decoder = FrameDecoder()
+        frames = []
+        for i in range(len(stream)):
+            decoder.feed(stream[i:i + 1])
+            frames += decoder.frames()
+        self.assertEqual(frames, [(FRAME_TEXT, b"temp:21"), (FRAME_BINARY, b"\xa5\x00\r\n"), (FRAME_TEXT, b"")])
+        self.assertEqual(len(decoder), 0)
+        self.assertEqual((decoder.sync_errors, decoder.crc_errors), (0, 0))
+
+
+    def test_needed_tells_the_missing_bytes(self):
+        frame = encode_frame("abc", crc=True)
+        decoder = FrameDecoder()
+        decoder.feed(frame[:2])
+        self.assertEqual(decoder.needed(), 2)
+        decoder.feed(frame[2:5])
+        self.assertEqual(decoder.needed(), len(frame) - 5)
+        self.assertIsNone(decoder.next_frame())
+
+
+    def test_corrupted_frame_is_dropped_and_counted(self):
+        corrupted = bytearray(encode_frame("lost", crc=True))
+        corrupted[5] ^= 0xFF
+        decoder = FrameDecoder()
+        decoder.feed(bytes(corrupted) + encode_frame("kept", crc=True))
+        self.assertEqual(decoder.frames(), [(FRAME_TEXT, b"kept")])
+        self.assertTrue(decoder.last_crc)
+        self.assertEqual(decoder.crc_errors, 1)
+        # Resyncing skips the rest of the corrupted frame byte by byte.
+        self.assertEqual(decoder.sync_errors, len(corrupted) - 1)
+
+
+    def test_bytes_before_the_sync_are_skipped_and_counted(self):
+        decoder = FrameDecoder()
+        decoder.feed(b"noise" + encode_frame("ok"))
+        self.assertEqual(decoder.frames(), [(FRAME_TEXT, b"ok")])
+        self.assertFalse(decoder.last_crc)
+        self.assertEqual(decoder.sync_errors, 5)
+
+
+    def test_crc_covers_header_and_payload(self):
+        frame = bytearray(encode_frame("abc", crc=True))
+        frame[1] |= 0x02    # FRAME_TEXT turned into an unknown type
+        decoder = FrameDecoder()
+        decoder.feed(bytes(frame))
+        self.assertEqual(decoder.frames(), [])
+        self.assertEqual(decoder.crc_errors, 1)
+
+
+class TestTerminatorSplitter(unittest.TestCase):
+
+    def test_several_msgs_in_one_feed(self):
+        splitter = TerminatorSplitter(b";")
+        splitter.feed(b"a;bc;def;g")
+        self.assertEqual(splitter.frames(), [b"a;", b"bc;", b"def;"])
+        self.assertEqual(len(splitter), 1)
+
+
+    def test_terminator_split_across_feeds(self):
+        splitter = TerminatorSplitter(b"\r\n")
+        splitter.feed(b"temp:21\r")
+        self.assertEqual(splitter.frames(), [])
+        splitter.feed(b"\ntemp:")
+        self.assertEqual(splitter.frames(), [b"temp:21\r\n"])
+        splitter.feed(b"22\r\n")
+        self.assertEqual(splitter.frames(), [b"temp:22\r\n"])
+        self.assertEqual(len(splitter), 0)
+
+
+    def test_multi_byte_terminator(self):
+        splitter = TerminatorSplitter(b"<END>")
+        splitter.feed(b"a<EN>b<END><END>c<E")
+        self.assertEqual(splitter.next_frame(), b"a<EN>b<END>")
+        self.assertEqual(splitter.next_frame(), b"<END>")
+        self.assertIsNone(splitter.next_frame())
+        splitter.feed(b"ND>")
+        self.assertEqual(splitter.frames(), [b"c<END>"])
+
+
+    def test_take_pops_raw_bytes_after_the_popped_msgs(self):
+        splitter = TerminatorSplitter(b";")
+        splitter.feed(b"ok;\x00;\x01")
+        self.assertEqual(splitter.next_frame(), b"ok;")
+        self.assertEqual(splitter.take(2), b"\x00;")
+        self.assertEqual(splitter.take(8), b"\x01")
+        self.assertEqual(len(splitter), 0)
+
+
+class TestFrameReader(unittest.TestCase):
+
+    def setUp(self):
+        self.rfd, self.wfd = os.pipe()
+        os.set_blocking(self.rfd, False)
+        self.reader = FrameReader(self.rfd, TerminatorSplitter(b";"))
+
+
+    def tearDown(self):
+        os.close(self.rfd)
+        if self.wfd is not None:
+            os.close(self.wfd)
+
+
+    def hang_up(self):
+        os.close(self.wfd)
+        self.wfd = None
+
+
+    def test_several_msgs_per_read(self):
+        os.write(self.wfd, b"a;b;c")
+        self.assertEqual(self.reader.read(time.perf_counter() + 1.0), b"a;")
+        self.assertEqual(len(self.reader.splitter), 3)
+        self.assertEqual(self.reader.read(time.perf_counter()), b"b;")
+        self.assertIsNone(self.reader.read(time.perf_counter()))
+        os.write(self.wfd, b";d;")
+        self.assertEqual(self.reader.read(time.perf_counter() + 1.0), b"c;")
+        self.assertEqual(self.reader.read(time.perf_counter() + 1.0), b"d;")
+
+
+    def test_terminator_split_across_reads(self):
+        self.reader = FrameReader(self.rfd, TerminatorSplitter(b"\r\n"))
+        os.write(self.wfd, b"temp:21\r")
+        self.assertIsNone(self.reader.read(time.perf_counter() + 0.05))
+        os.write(self.wfd, b"\n")
+        self.assertEqual(self.reader.read(time.perf_counter() + 1.0), b"temp:21\r\n")
+
+
+    def test_nothing_available_is_not_an_error(self):
+        self.assertIsNone(self.reader.read(time.perf_counter() + 0.05))
+        self.assertEqual(self.reader.read_bytes(4, time.perf_counter() + 0.05), b"")
+
+
+    def test_hang_up_after_the_pending_bytes(self):
+        os.write(self.wfd, b"a;b")
+        self.hang_up()
+        self.assertEqual(self.reader.read(time.perf_counter() + 1.0), b"a;")
+        with self.assertRaises(CommSDKInvalidOperationException):
+            self.reader.read(time.perf_counter() + 1.0)
+        self.assertEqual(len(self.reader.splitter), 1)
+
+
+    def test_read_bytes_before_a_hang_up(self):
+        os.write(self.wfd, b"\x00;\x01")
+        self.hang_up()
+        self.assertEqual(self.reader.read_bytes(3, time.perf_counter() + 1.0), b"\x00;\x01")
+        with self.assertRaises(CommSDKInvalidOperationException):
+            self.reader.read_bytes(1, time.perf_counter() + 1.0)
+
+
+    def test_read_ready_pops_the_complete_msgs(self):
+        os.write(self.wfd, b"a;b;c")
+        self.assertEqual(self.reader.read_ready(), [b"a;", b"b;"])
+        self.assertEqual(self.reader.read_ready(), [])
+        os.write(self.wfd, b";")
+        self.assertEqual(self.reader.read_ready(), [b"c;"])
+
+
+    def test_read_ready_count_keeps_the_other_msgs(self):
+        os.write(self.wfd, b"a;b;c;")
+        self.assertEqual(self.reader.read_ready(count=1), [b"a;"])
+        self.assertEqual(self.reader.read_ready(), [b"b;", b"c;"])
+
+
+    def test_read_ready_without_bytes_is_not_an_error(self):
+        self.assertEqual(self.reader.read_ready(), [])
+
+
+    def test_read_ready_after_a_hang_up(self):
+        os.write(self.wfd, b"a;b")
+        self.hang_up()
+        self.assertEqual(self.reader.read_ready(), [b"a;"])
+        with self.assertRaises(CommSDKInvalidOperationException):
+            self.reader.read_ready()
+        self.assertEqual(len(self.reader.splitter), 1)
+
+
+class TestFramedCommAPI(unittest.TestCase):
+
+    def test_payloads_may_contain_the_terminator(self):
+        with Emulator(framing=True) as emu:
+            api = emu.comm_api(frame_crc=True)
+            try:
+                self.assertEqual(api.cmd_get("a\nb\r\n;"), "a\nb\r\n;")
+                self.assertEqual(api.cmd_get(b"\xa5\x00\r\n"), b"\xa5\x00\r\n")
+            finally:
+                api.release()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,217 @@
+################################################################################
+# COPYRIGHT(c) 2020 STMicroelectronics                                         #
+#                                                                              #
+# Redistribution and use in source and binary forms, with or without           #
+# modification, are permitted provided that the following conditions are met:  #
+#   1. Redistributions of source code must retain the above copyright notice,  #
+#      this list of conditions and the following disclaimer.                   #
+#   2. Redistributions in binary form must reproduce the above copyright       #
+#      notice, this list of conditions and the following disclaimer in the     #
+#      documentation and/or other materials provided with the distribution.    #
+#   3. Neither the name of STMicroelectronics nor the names of its             #
+#      contributors may be used to endorse or promote products derived from    #
+#      this software without specific prior written permission.                #
+#                                                                              #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"  #
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE    #
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE   #
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE    #
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR          #
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF         #
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS     #
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN      #
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)      #
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE   #
+# POSSIBILITY OF SUCH DAMAGE.                                                  #
+################################################################################
+
+"""Tests of the IOCore loop, and of CommAPI and RpmsgSdbAPI on an IOCore
+against mp1ampstsdk.emulator.
+Run with: python3 -m pytest test
+"""
+
+
+# IMPORT
+
+from mp1ampstsdk.comm_exceptions import CommSDKInvalidOperationException
+from mp1ampstsdk.commsdk import CommAPINotificationListener
+from mp1ampstsdk.emulator import Emulator
+from mp1ampstsdk.iocore import IOCore
+from mp1ampstsdk.py_sdbsdk import RpmsgSdbAPIListener
+import contextlib
+import io
+import os
+import threading
+import time
+import unittest
+
+
+# CONSTANTS
+
+BUFF_SIZE = 4096
+SETTLE_TIMEOUT_s = 10
+
+
+# FUNCTIONS
+
+def wait_for(condition, timeout=SETTLE_TIMEOUT_s):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+# CLASSES
+
+class RecordingListener(CommAPINotificationListener, RpmsgSdbAPIListener):
+
+    def __init__(self):
+        self.received = []
+        self.threads = set()
+
+    def on_m4_notification(self, notification):
+        self.threads.add(threading.current_thread())
+        self.received.append(notification)
+
+    def on_m4_sdb_rx(self, sdb, sdb_len):
+        self.threads.add(threading.current_thread())
+        self.received.append(sdb_len)
+
+
+class TestIOCore(unittest.TestCase):
+
+    def setUp(self):
+        self.core = IOCore()
+
+
+    def tearDown(self):
+        self.core.close()
+
+
+    def test_calls_run_in_order_on_the_loop_thread(self):
+        calls = []
+        for i in range(5):
+            self.core.call_soon(lambda i=i: calls.append((i, self.core.in_loop())))
+        self.core.call(lambda: None)
+        self.assertEqual(calls, [(i, True) for i in range(5)])
+        self.assertFalse(self.core.in_loop())
+
+
+    def test_timers_fire_by_deadline_unless_cancelled(self):
+        fired = []
+        self.core.call_later(0.06, fired.append, "late")
+        self.core.call_later(0.02, fired.append, "early")
+        self.core.call_later(0.04, fired.append, "cancelled").cancel()
+        self.assertTrue(wait_for(lambda: len(fired) == 2))
+        time.sleep(0.05)
+        self.assertEqual(fired, ["early", "late"])
+        self.assertEqual(self.core.get_stats()["timers"], 2)
+
+
+    def test_readable_fd_calls_its_callback_until_unregistered(self):
+        r, w = os.pipe()
+        try:
+            received = []
+            self.core.register(r, lambda: received.append(os.read(r, 64)))
+            os.write(w, b"a")
+            self.assertTrue(wait_for(lambda: received == [b"a"]))
+            self.core.unregister(r)
+            os.write(w, b"b")
+            time.sleep(0.05)
+            self.assertEqual(received, [b"a"])
+        finally:
+            os.close(r)
+            os.close(w)
+
+
+    def test_call_raises_what_the_callback_raises(self):
+        def fail():
+            raise ValueError("failed")
+        self.assertRaises(ValueError, self.core.call, fail)
+
+
+    def test_failing_callback_is_counted_and_quiet_unless_verbose(self):
+        def fail():
+            raise ValueError("failed")
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+            self.core.call_soon(fail)
+            self.core.call(lambda: None)
+        self.assertEqual(self.core.get_stats()["errors"], 1)
+        self.assertEqual(output.getvalue(), "")
+
+
+    def test_close_from_a_callback_stops_the_loop_once_it_returns(self):
+        pipes = [os.pipe(), os.pipe()]
+        try:
+            called = []
+            def read(r):
+                called.append(os.read(r, 64))
+                self.core.close()
+            for r, w in pipes:
+                self.core.register(r, read, r)
+            gate = threading.Event()
+            self.core.call_soon(gate.wait)
+            # both fds are readable in the same iteration of the loop
+            for r, w in pipes:
+                os.write(w, b"a")
+            gate.set()
+            self.core._th_loop.join(1)
+            self.assertFalse(self.core._th_loop.is_alive())
+            self.assertEqual(called, [b"a", b"a"])
+            self.assertEqual(self.core.get_stats()["errors"], 0)
+            self.assertRaises(CommSDKInvalidOperationException, self.core.call_soon, lambda: None)
+        finally:
+            for r, w in pipes:
+                os.close(r)
+                os.close(w)
+
+
+class TestSdkOnIOCore(unittest.TestCase):
+
+    def setUp(self):
+        self.core = IOCore()
+
+
+    def tearDown(self):
+        self.core.close()
+
+
+    def test_commands_and_notifications(self):
+        with Emulator() as emu:
+            api = emu.comm_api(io_core=self.core)
+            try:
+                listener = RecordingListener()
+                api.add_notification_listener(listener)
+                self.assertEqual(api.cmd_query("ping")[0], "ping;")
+                emu.firmware.stream(0, count=50)
+                self.assertTrue(wait_for(lambda: len(listener.received) == 50))
+                self.assertEqual(listener.received, ["ntf%d;" % (i) for i in range(50)])
+                api.remove_notification_listener(listener)
+            finally:
+                api.release()
+
+
+    def test_sdb_buffers(self):
+        with Emulator(buff_size=BUFF_SIZE, buff_num=8) as emu:
+            sdb = emu.sdb_api(io_core=self.core)
+            listener = RecordingListener()
+            sdb.add_sdb_buffer_rx_listener(listener)
+            sdb.init_sdb(BUFF_SIZE, 8)
+            try:
+                emu.sdb_producer.attach(sdb)
+                sdb.start_sdb_receiver()
+                emu.sdb_producer.run(200, count=20)
+                self.assertTrue(wait_for(lambda: len(listener.received) == 20))
+                # Without a hand-off queue the listener runs on the loop thread.
+                self.assertEqual(listener.threads, set([self.core.call(threading.current_thread)]))
+                sdb.stop_sdb_receiver()
+            finally:
+                emu.sdb_producer.wait(SETTLE_TIMEOUT_s)
+                sdb.deinit_sdb()
+
+
+if __name__ == "__main__":
+    unittest.main()
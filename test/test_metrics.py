@@ -0,0 +1,182 @@
+################################################################################
+# COPYRIGHT(c) 2020 STMicroelectronics                                         #
+#                                                                              #
+# Redistribution and use in source and binary forms, with or without           #
+# modification, are permitted provided that the following conditions are met:  #
+#   1. Redistributions of source code must retain the above copyright notice,  #
+#      this list of conditions and the following disclaimer.                   #
+#   2. Redistributions in binary form must reproduce the above copyright       #
+#      notice, this list of conditions and the following disclaimer in the     #
+#      documentation and/or other materials provided with the distribution.    #
+#   3. Neither the name of STMicroelectronics nor the names of its             #
+#      contributors may be used to endorse or promote products derived from    #
+#      this software without specific prior written permission.                #
+#                                                                              #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"  #
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE    #
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE   #
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE    #
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR          #
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF         #
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS     #
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN      #
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)      #
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE   #
+# POSSIBILITY OF SUCH DAMAGE.                                                  #
+################################################################################
+
+"""Tests of the metrics registry, and of the metrics of CommAPI, AsyncCommAPI
+and RpmsgSdbAPI against mp1ampstsdk.emulator.
+Run with: python3 -m pytest test
+"""
+
+
+# IMPORT
+
+from mp1ampstsdk.comm_exceptions import CommSDKInvalidOperationException
+from mp1ampstsdk.emulator import Emulator
+from mp1ampstsdk.metrics import MetricsRegistry
+from mp1ampstsdk.py_sdbsdk import RpmsgSdbAPIListener
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+
+# CONSTANTS
+
+BUFF_SIZE = 4096
+SETTLE_TIMEOUT_s = 10
+
+
+# CLASSES
+
+class NullListener(RpmsgSdbAPIListener):
+
+    def on_m4_sdb_rx(self, sdb, sdb_len):
+        pass
+
+
+class TestMetricsRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = self.registry.histogram("h_seconds", "Latency.", (0.1, 1))
+        for value in (0.05, 0.1, 0.5, 2):
+            histogram.observe(value)
+        snapshot = histogram.snapshot()
+        self.assertEqual(list(snapshot["buckets"].items()), [(0.1, 2), (1, 3), (float("inf"), 4)])
+        self.assertEqual(snapshot["count"], 4)
+        self.assertAlmostEqual(snapshot["sum"], 2.65)
+        self.assertRaises(CommSDKInvalidOperationException, self.registry.histogram, "bad", "Bad.", (1, 0.1))
+
+
+    def test_same_name_and_labels_return_the_same_metric(self):
+        counter = self.registry.counter("c_total", "Count.", {"port": "a"})
+        self.assertIs(self.registry.counter("c_total", "Count.", {"port": "a"}), counter)
+        self.assertIsNot(self.registry.counter("c_total", "Count.", {"port": "b"}), counter)
+        self.assertRaises(CommSDKInvalidOperationException, self.registry.histogram, "c_total", "Count.")
+
+
+    def test_prometheus_text_format(self):
+        self.registry.counter("c_total", "Count.", {"port": "/dev/\"x\""}).inc(3)
+        self.registry.histogram("h_seconds", "Latency.", (0.5,)).observe(0.25)
+        self.assertEqual(self.registry.to_prometheus(), "\n".join((
+            "# HELP c_total Count.",
+            "# TYPE c_total counter",
+            "c_total{port=\"/dev/\\\"x\\\"\"} 3",
+            "# HELP h_seconds Latency.",
+            "# TYPE h_seconds histogram",
+            "h_seconds_bucket{le=\"0.5\"} 1",
+            "h_seconds_bucket{le=\"+Inf\"} 1",
+            "h_seconds_sum 0.25",
+            "h_seconds_count 1",
+            "")))
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, "sdk.prom")
+            self.registry.write_prometheus(path)
+            with open(path) as f:
+                self.assertEqual(f.read(), self.registry.to_prometheus())
+            self.assertEqual(os.listdir(tmp_dir), ["sdk.prom"])
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+class TestSdkMetrics(unittest.TestCase):
+
+    def test_commands_are_counted_by_port(self):
+        registry = MetricsRegistry()
+        with Emulator(handler=lambda msg: None if msg == "mute" else msg) as emu:
+            api = emu.comm_api(metrics=registry)
+            try:
+                for i in range(3):
+                    self.assertEqual(api.cmd_query("ping%d" % (i))[0], "ping%d;" % (i))
+                self.assertEqual(api.cmd_query("mute", 0.2), ("", None))
+            finally:
+                api.release()
+            values = registry.as_dict()
+            port = "{port=\"%s\"" % (emu.firmware.cmd_port)
+            self.assertEqual(values["mp1ampstsdk_comm_roundtrip_seconds%s,call=\"cmd_query\"}" % (port)]["count"], 3)
+            self.assertEqual(values["mp1ampstsdk_comm_timeouts_total%s,call=\"cmd_query\"}" % (port)], 1)
+            self.assertEqual(values["mp1ampstsdk_comm_tx_msgs_total%s}" % (port)], 4)
+            self.assertEqual(values["mp1ampstsdk_comm_rx_msgs_total%s}" % (port)], 3)
+
+
+    def test_async_commands_are_counted_by_port(self):
+        registry = MetricsRegistry()
+        async def run(api):
+            for i in range(3):
+                self.assertEqual(await api.cmd_get("ping%d" % (i)), "ping%d;" % (i))
+            self.assertEqual(await api.cmd_set("mute", 0.2), "")
+            notifications = api.notifications()
+            emu.firmware.notify("ntf")
+            self.assertEqual(await notifications.__anext__(), "ntf;")
+        with Emulator(handler=lambda msg: None if msg == "mute" else msg) as emu:
+            api = emu.async_comm_api(metrics=registry)
+            try:
+                asyncio.run(run(api))
+            finally:
+                api.release()
+            values = registry.as_dict()
+            port = "{port=\"%s\"" % (emu.firmware.cmd_port)
+            self.assertEqual(values["mp1ampstsdk_comm_roundtrip_seconds%s,call=\"cmd_get\"}" % (port)]["count"], 3)
+            self.assertEqual(values["mp1ampstsdk_comm_timeouts_total%s,call=\"cmd_get\"}" % (port)], 1)
+            self.assertEqual(values["mp1ampstsdk_comm_tx_msgs_total%s}" % (port)], 4)
+            self.assertEqual(values["mp1ampstsdk_comm_rx_msgs_total%s}" % (port)], 3)
+            port = "{port=\"%s\"}" % (emu.firmware.notification_port)
+            self.assertEqual(values["mp1ampstsdk_comm_tx_msgs_total%s" % (port)], 1)
+            self.assertEqual(values["mp1ampstsdk_comm_rx_msgs_total%s" % (port)], 1)
+
+
+    def test_sdb_buffers_are_counted(self):
+        registry = MetricsRegistry()
+        with Emulator(buff_size=BUFF_SIZE, buff_num=8) as emu:
+            sdb = emu.sdb_api(metrics=registry)
+            sdb.add_sdb_buffer_rx_listener(NullListener())
+            sdb.init_sdb(BUFF_SIZE, 8)
+            try:
+                emu.sdb_producer.attach(sdb)
+                sdb.start_sdb_receiver()
+                emu.sdb_producer.run(200, count=20)
+                emu.sdb_producer.wait(SETTLE_TIMEOUT_s)
+                deadline = time.monotonic() + SETTLE_TIMEOUT_s
+                while time.monotonic() < deadline and sdb.get_stats()["buffers"] < 20:
+                    time.sleep(0.01)
+                sdb.stop_sdb_receiver()
+            finally:
+                sdb.deinit_sdb()
+            values = registry.as_dict()
+            device = "{device=\"%s\"}" % (emu.sdb_producer.device)
+            self.assertEqual(values["mp1ampstsdk_sdb_buffers_total" + device], 20)
+            self.assertEqual(values["mp1ampstsdk_sdb_rx_bytes_total" + device], 20 * BUFF_SIZE)
+            self.assertEqual(values["mp1ampstsdk_sdb_buffer_size_bytes" + device]["count"], 20)
+
+
+if __name__ == "__main__":
+    unittest.main()
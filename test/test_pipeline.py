@@ -0,0 +1,179 @@
+################################################################################
+# COPYRIGHT(c) 2020 STMicroelectronics                                         #
+#                                                                              #
+# Redistribution and use in source and binary forms, with or without           #
+# modification, are permitted provided that the following conditions are met:  #
+#   1. Redistributions of source code must retain the above copyright notice,  #
+#      this list of conditions and the following disclaimer.                   #
+#   2. Redistributions in binary form must reproduce the above copyright       #
+#      notice, this list of conditions and the following disclaimer in the     #
+#      documentation and/or other materials provided with the distribution.    #
+#   3. Neither the name of STMicroelectronics nor the names of its             #
+#      contributors may be used to endorse or promote products derived from    #
+#      this software without specific prior written permission.                #
+#                                                                              #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"  #
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE    #
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE   #
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE    #
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR          #
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF         #
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS     #
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN      #
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)      #
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE   #
+# POSSIBILITY OF SUCH DAMAGE.                                                  #
+################################################################################
+
+"""Tests of the SDB process pool, fed directly and by RpmsgSdbAPI against
+mp1ampstsdk.emulator.
+Run with: python3 -m pytest test
+"""
+
+
+# IMPORT
+
+from mp1ampstsdk.comm_exceptions import CommSDKInvalidOperationException
+from mp1ampstsdk.comm_exceptions import CommSDKTimeoutException
+from mp1ampstsdk.emulator import Emulator
+from mp1ampstsdk.pipeline import SdbProcessPool
+import threading
+import time
+import unittest
+
+
+# CONSTANTS
+
+BUFF_SIZE = 4096
+TIMEOUT_s = 10
+
+
+# FUNCTIONS
+
+# Run by the worker processes, hence at module level.
+
+def first_byte(data):
+    return data[0]
+
+
+def first_byte_early_ones_slower(data):
+    time.sleep(0.02 * (8 - data[0]))
+    return data[0]
+
+
+def first_byte_slowly(data):
+    time.sleep(0.3)
+    return data[0]
+
+
+def fail_on_zero(data):
+    if data[0] == 0:
+        raise ValueError("zero")
+    return data[0]
+
+
+# CLASSES
+
+class TestSdbProcessPool(unittest.TestCase):
+
+    def test_results_come_in_submission_order(self):
+        with SdbProcessPool(first_byte_early_ones_slower, BUFF_SIZE, workers=4) as pool:
+            for i in range(8):
+                pool.submit_data(bytes([i]) * 16, 100 + i)
+            results = pool.results(TIMEOUT_s)
+            self.assertEqual([next(results) for _ in range(8)], [(100 + i, i) for i in range(8)])
+            self.assertEqual(pool.get_stats()["results"], 8)
+
+
+    def test_timed_out_result_is_returned_by_the_next_call(self):
+        with SdbProcessPool(first_byte_slowly, BUFF_SIZE, workers=1) as pool:
+            for i in range(2):
+                pool.submit_data(bytes([i]), i)
+            with self.assertRaises(CommSDKTimeoutException):
+                next(pool.results(0.05))
+            results = pool.results(TIMEOUT_s)
+            self.assertEqual([next(results), next(results)], [(0, 0), (1, 1)])
+            stats = pool.get_stats()
+            self.assertEqual((stats["results"], stats["errors"], stats["pending"]), (2, 0, 0))
+
+
+    def test_error_of_func_is_raised_in_order(self):
+        with SdbProcessPool(fail_on_zero, BUFF_SIZE, workers=2) as pool:
+            for i in range(3):
+                pool.submit_data(bytes([i]), i)
+            with self.assertRaises(ValueError):
+                next(pool.results(TIMEOUT_s))
+            results = pool.results(TIMEOUT_s)
+            self.assertEqual([next(results), next(results)], [(1, 1), (2, 2)])
+            self.assertEqual(pool.get_stats()["errors"], 1)
+
+
+    def test_close_processes_the_queued_buffers(self):
+        delivered = []
+        pool = SdbProcessPool(first_byte_slowly, BUFF_SIZE, workers=1, slots=4, callback=lambda s, r: delivered.append(s))
+        for i in range(3):
+            pool.submit_data(bytes([i]), i)
+        pool.close()
+        self.assertEqual(delivered, [0, 1, 2])
+
+
+    def test_close_without_wait_does_not_count_cancelled_buffers_as_errors(self):
+        delivered = []
+        pool = SdbProcessPool(first_byte_slowly, BUFF_SIZE, workers=1, slots=4, callback=lambda s, r: delivered.append(s))
+        for i in range(4):
+            pool.submit_data(bytes([i]), i)
+        pool.close(wait=False)     # raises if a cancelled buffer was taken for an error
+        stats = pool.get_stats()
+        self.assertEqual(stats["errors"], 0)
+        self.assertEqual(stats["results"], len(delivered))
+        self.assertLess(len(delivered), 4)
+        self.assertEqual(delivered, list(range(len(delivered))))
+
+
+    def test_failing_callback_does_not_stop_the_delivery(self):
+        delivered = []
+        def deliver(sequence, result):
+            if sequence == 1:
+                raise ValueError("failed")
+            delivered.append(sequence)
+        pool = SdbProcessPool(first_byte, BUFF_SIZE, workers=2, slots=4, callback=deliver)
+        for i in range(4):
+            pool.submit_data(bytes([i]), i)
+        with self.assertRaises(CommSDKInvalidOperationException):
+            pool.close()
+        self.assertEqual(delivered, [0, 2, 3])
+        stats = pool.get_stats()
+        self.assertEqual((stats["results"], stats["errors"], stats["pending"]), (3, 1, 0))
+
+
+class TestSdbProcessPoolFromEmulator(unittest.TestCase):
+
+    def test_every_fill_is_processed_in_order(self):
+        fills = 40
+        sequences = []
+        done = threading.Event()
+        def on_result(sequence, result):
+            sequences.append(sequence)
+            if len(sequences) == fills:
+                done.set()
+        with Emulator(buff_size=BUFF_SIZE, buff_num=8) as emu:
+            pool = SdbProcessPool(first_byte, BUFF_SIZE, workers=2, callback=on_result)
+            sdb = emu.sdb_api()
+            try:
+                sdb.add_sdb_buffer_rx_listener(pool)
+                sdb.init_sdb(BUFF_SIZE, 8)
+                emu.sdb_producer.attach(sdb)
+                sdb.start_sdb_receiver()
+                emu.sdb_producer.run(200, count=fills)
+                self.assertTrue(done.wait(TIMEOUT_s))
+                self.assertEqual(sequences, sorted(sequences))
+                self.assertEqual(len(set(sequences)), fills)
+            finally:
+                emu.sdb_producer.wait(TIMEOUT_s)
+                sdb.stop_sdb_receiver()
+                sdb.deinit_sdb()
+                pool.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,141 @@
+################################################################################
+# COPYRIGHT(c) 2020 STMicroelectronics                                         #
+#                                                                              #
+# Redistribution and use in source and binary forms, with or without           #
+# modification, are permitted provided that the following conditions are met:  #
+#   1. Redistributions of source code must retain the above copyright notice,  #
+#      this list of conditions and the following disclaimer.                   #
+#   2. Redistributions in binary form must reproduce the above copyright       #
+#      notice, this list of conditions and the following disclaimer in the     #
+#      documentation and/or other materials provided with the distribution.    #
+#   3. Neither the name of STMicroelectronics nor the names of its             #
+#      contributors may be used to endorse or promote products derived from    #
+#      this software without specific prior written permission.                #
+#                                                                              #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"  #
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE    #
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE   #
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE    #
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR          #
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF         #
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS     #
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN      #
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)      #
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE   #
+# POSSIBILITY OF SUCH DAMAGE.                                                  #
+################################################################################
+
+"""Tests of the SDB recorder and of the recordings read back, fed directly
+and by RpmsgSdbAPI against mp1ampstsdk.emulator.
+Run with: python3 -m pytest test
+"""
+
+
+# IMPORT
+
+from mp1ampstsdk.emulator import Emulator
+from mp1ampstsdk.recorder import SdbRecorder
+from mp1ampstsdk.recorder import SdbRecording
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+
+# CONSTANTS
+
+BUFF_SIZE = 4096
+SETTLE_TIMEOUT_s = 10
+
+
+# FUNCTIONS
+
+def payload(sequence):
+    return os.urandom(1 + sequence * 37 % BUFF_SIZE)
+
+
+# CLASSES
+
+class TestSdbRecorder(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+    def record(self, buffers, **kwargs):
+        with SdbRecorder(self.dir, BUFF_SIZE, **kwargs) as recorder:
+            for sequence, data in enumerate(buffers):
+                recorder.record_data(data, sequence)
+        return recorder.get_stats()
+
+
+    def test_buffers_are_read_back_in_order(self):
+        buffers = [payload(sequence) for sequence in range(50)]
+        stats = self.record(buffers, pool_buffers=4)
+        self.assertEqual((stats["buffers"], stats["files"]), (50, 1))
+        with SdbRecording(self.dir) as recording:
+            self.assertEqual(len(recording), 50)
+            self.assertEqual([bytes(data) for data in recording], buffers)
+            self.assertEqual(recording.info(7)[0], 7)
+            self.assertEqual(recording.info(7)[4], len(buffers[7]))
+            self.assertEqual(recording.find_sequence(42), 42)
+            self.assertEqual(recording.find_sequence(50), -1)
+            self.assertEqual(recording.find_time(0), 0)
+            self.assertEqual(recording.find_time(time.time_ns()), 50)
+
+
+    def test_files_rotate_by_size(self):
+        buffers = [bytes([sequence]) * BUFF_SIZE for sequence in range(10)]
+        stats = self.record(buffers, max_file_size=3 * BUFF_SIZE)
+        with SdbRecording(self.dir) as recording:
+            self.assertGreater(len(recording.files), 1)
+            self.assertEqual(len(recording.files), stats["files"])
+            self.assertEqual([bytes(data) for data in recording], buffers)
+
+
+    def test_direct_io_round_trip(self):
+        buffers = [payload(sequence) for sequence in range(10)]
+        self.record(buffers, direct_io=True)
+        with SdbRecording(self.dir) as recording:
+            self.assertEqual([bytes(data) for data in recording], buffers)
+
+
+class TestSdbRecorderFromEmulator(unittest.TestCase):
+
+    def test_every_fill_is_recorded(self):
+        fills = 30
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            with Emulator(buff_size=BUFF_SIZE, buff_num=8) as emu:
+                sdb = emu.sdb_api()
+                recorder = SdbRecorder(tmp_dir, BUFF_SIZE)
+                sdb.add_sdb_buffer_rx_listener(recorder)
+                sdb.init_sdb(BUFF_SIZE, 8)
+                try:
+                    emu.sdb_producer.attach(sdb)
+                    sdb.start_sdb_receiver()
+                    emu.sdb_producer.run(200, count=fills)
+                    emu.sdb_producer.wait(SETTLE_TIMEOUT_s)
+                    deadline = time.monotonic() + SETTLE_TIMEOUT_s
+                    while time.monotonic() < deadline and recorder.get_stats()["buffers"] < fills:
+                        time.sleep(0.01)
+                    sdb.stop_sdb_receiver()
+                finally:
+                    sdb.deinit_sdb()
+                    recorder.close()
+            with SdbRecording(tmp_dir) as recording:
+                sequences = [recording.info(position)[0] for position in range(len(recording))]
+                self.assertEqual(len(sequences), fills)
+                self.assertEqual(sequences, list(range(sequences[0], sequences[0] + fills)))
+                self.assertTrue(all(len(data) == BUFF_SIZE for data in recording))
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    unittest.main()
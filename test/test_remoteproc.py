@@ -0,0 +1,162 @@
+################################################################################
+# COPYRIGHT(c) 2020 STMicroelectronics                                         #
+#                                                                              #
+# Redistribution and use in source and binary forms, with or without           #
+# modification, are permitted provided that the following conditions are met:  #
+#   1. Redistributions of source code must retain the above copyright notice,  #
+#      this list of conditions and the following disclaimer.                   #
+#   2. Redistributions in binary form must reproduce the above copyright       #
+#      notice, this list of conditions and the following disclaimer in the     #
+#      documentation and/or other materials provided with the distribution.    #
+#   3. Neither the name of STMicroelectronics nor the names of its             #
+#      contributors may be used to endorse or promote products derived from    #
+#      this software without specific prior written permission.                #
+#                                                                              #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"  #
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE    #
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE   #
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE    #
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR          #
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF         #
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS     #
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN      #
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)      #
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE   #
+# POSSIBILITY OF SUCH DAMAGE.                                                  #
+################################################################################
+
+"""Tests of the M4 firmware life cycle of RemoteProc, CommAPI and RpmsgSdbAPI
+against mp1ampstsdk.emulator.
+Run with: python3 -m pytest test
+"""
+
+
+# IMPORT
+
+from mp1ampstsdk.emulator import Emulator
+from mp1ampstsdk.remoteproc import RemoteProc
+import gc
+import os
+import shutil
+import tempfile
+import unittest
+
+
+# CONSTANTS
+
+FW_NAME = 'fw.elf'
+
+
+# CLASSES
+
+class TestRemoteProc(unittest.TestCase):
+
+    def setUp(self):
+        self.emu = Emulator()
+        self.src_dir = tempfile.mkdtemp(prefix="mp1ampstsdk-fw")
+        self.rproc = RemoteProc(self.emu.remoteproc.root, self.emu.firmware_dir, self.emu.run_dir)
+        self.target = os.path.join(self.emu.firmware_dir, FW_NAME)
+
+
+    def tearDown(self):
+        self.emu.release()
+        shutil.rmtree(self.src_dir, ignore_errors=True)
+
+
+    def write_image(self, image):
+        path = os.path.join(self.src_dir, FW_NAME)
+        with open(path, 'wb') as fd:
+            fd.write(image)
+        return path
+
+
+    def test_identical_image_is_not_copied_again(self):
+        path = self.write_image(b"a" * 100)
+        deployed = self.rproc.deploy_firmware(path)
+        before = os.stat(self.target)
+        self.assertEqual(self.rproc.deploy_firmware(path), deployed)
+        after = os.stat(self.target)
+        self.assertEqual((after.st_ino, after.st_mtime_ns), (before.st_ino, before.st_mtime_ns))
+
+
+    def test_different_image_replaces_the_deployed_one_atomically(self):
+        name, digest = self.rproc.deploy_firmware(self.write_image(b"a" * 100))
+        with open(self.target, 'rb') as old_fd:
+            new_name, new_digest = self.rproc.deploy_firmware(self.write_image(b"b" * 50))
+            # renamed over the old image, which is not rewritten in place
+            self.assertEqual(old_fd.read(), b"a" * 100)
+        with open(self.target, 'rb') as fd:
+            self.assertEqual(fd.read(), b"b" * 50)
+        self.assertEqual(new_name, name)
+        self.assertNotEqual(new_digest, digest)
+        self.assertEqual(os.listdir(self.emu.firmware_dir), [FW_NAME])
+
+
+    def test_matching_firmware_is_kept_running(self):
+        path = self.write_image(b"a" * 100)
+        devices = [self.emu.firmware.cmd_port]
+        self.assertTrue(self.rproc.boot(path, devices))
+        self.assertEqual(self.emu.remoteproc.firmware, FW_NAME)
+        self.assertFalse(self.rproc.boot(path, devices))
+        self.assertNotIn("stop", self.rproc.timeline)
+        self.assertTrue(self.emu.remoteproc.is_running())
+        self.assertTrue(self.rproc.boot(path, devices, force=True))
+
+
+    def test_changed_image_restarts_the_firmware(self):
+        devices = [self.emu.firmware.cmd_port]
+        self.assertTrue(self.rproc.boot(self.write_image(b"a" * 100), devices))
+        self.assertTrue(self.rproc.boot(self.write_image(b"b" * 100), devices))
+        self.assertIn("stop", self.rproc.timeline)
+        self.assertTrue(self.emu.remoteproc.is_running())
+
+
+class TestFirmwareOnRelease(unittest.TestCase):
+
+    def setUp(self):
+        self.emu = Emulator(buff_size=4096, buff_num=4)
+        self.src_dir = tempfile.mkdtemp(prefix="mp1ampstsdk-fw")
+        self.fw_path = os.path.join(self.src_dir, FW_NAME)
+        with open(self.fw_path, 'wb') as fd:
+            fd.write(b"a" * 100)
+
+
+    def tearDown(self):
+        self.emu.release()
+        shutil.rmtree(self.src_dir, ignore_errors=True)
+
+
+    def test_release_leaves_the_firmware_running(self):
+        self.emu.comm_api().release()
+        self.assertTrue(self.emu.remoteproc.is_running())
+
+
+    def test_next_object_finds_the_firmware_running(self):
+        comm = self.emu.comm_api(m4_fw_name=self.fw_path)
+        self.assertIn("start", comm.get_startup_timeline())
+        comm.release()
+        self.assertTrue(self.emu.remoteproc.is_running())
+        comm = self.emu.comm_api(m4_fw_name=self.fw_path)
+        self.assertNotIn("start", comm.get_startup_timeline())
+        comm.release()
+
+
+    def test_release_stops_the_firmware_unless_keep_running(self):
+        self.emu.comm_api(m4_fw_name=self.fw_path, keep_running=False).release()
+        self.assertFalse(self.emu.remoteproc.is_running())
+
+
+    def test_deleted_sdb_api_leaves_the_firmware_running(self):
+        sdb = self.emu.sdb_api(m4_fw_name=self.fw_path)
+        del sdb
+        gc.collect()
+        self.assertTrue(self.emu.remoteproc.is_running())
+        sdb = self.emu.sdb_api(m4_fw_name=self.fw_path, keep_running=False)
+        self.assertNotIn("start", sdb.get_startup_timeline())
+        del sdb
+        gc.collect()
+        self.assertFalse(self.emu.remoteproc.is_running())
+
+
+if __name__ == "__main__":
+    unittest.main()
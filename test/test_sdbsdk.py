@@ -0,0 +1,356 @@
+################################################################################
+# COPYRIGHT(c) 2020 STMicroelectronics                                         #
+#                                                                              #
+# Redistribution and use in source and binary forms, with or without           #
+# modification, are permitted provided that the following conditions are met:  #
+#   1. Redistributions of source code must retain the above copyright notice,  #
+#      this list of conditions and the following disclaimer.                   #
+#   2. Redistributions in binary form must reproduce the above copyright       #
+#      notice, this list of conditions and the following disclaimer in the     #
+#      documentation and/or other materials provided with the distribution.    #
+#   3. Neither the name of STMicroelectronics nor the names of its             #
+#      contributors may be used to endorse or promote products derived from    #
+#      this software without specific prior written permission.                #
+#                                                                              #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"  #
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE    #
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE   #
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE    #
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR          #
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF         #
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS     #
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN      #
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)      #
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE   #
+# POSSIBILITY OF SUCH DAMAGE.                                                  #
+################################################################################
+
+
+"""Tests of RpmsgSdbAPI and of the _sdbsdk receiver against
+mp1ampstsdk.emulator: every buffer fill has to be accounted exactly once, as
+delivered or lost.
+Run with: python3 -m pytest test
+"""
+
+
+# IMPORT
+
+from mp1ampstsdk.comm_exceptions import CommSDKInvalidOperationException
+from mp1ampstsdk.emulator import Emulator
+from mp1ampstsdk.py_sdbsdk import RpmsgSdbAPIBufferListener
+from mp1ampstsdk.py_sdbsdk import RpmsgSdbAPIListener
+from mp1ampstsdk.py_sdbsdk import SdbOverflowPolicy
+import asyncio
+import gc
+import threading
+import time
+import unittest
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# CONSTANTS
+
+BUFF_SIZE = 4096
+FILLS = 2000
+SETTLE_TIMEOUT_s = 10
+
+
+# FUNCTIONS
+
+def accounted(stats):
+    """Number of fills delivered or counted lost."""
+    return stats["buffers"] + stats["seq_gaps"] + stats["lease_overruns"] + stats["queue_drops"] + stats["empty_buffers"] + stats["size_errors"]
+
+
+# CLASSES
+
+class CountingListener(RpmsgSdbAPIListener):
+
+    def __init__(self):
+        self.buffers = 0
+
+    def on_m4_sdb_rx(self, sdb, sdb_len):
+        self.buffers += 1
+
+
+class LeaseCollector(RpmsgSdbAPIBufferListener):
+
+    def __init__(self):
+        self.leases = []
+
+    def on_m4_sdb_buffer(self, lease):
+        self.leases.append(lease)
+
+
+class GatedListener(RpmsgSdbAPIBufferListener):
+    """Holds the first buffer until opened, so that the hand-off queue fills."""
+
+    def __init__(self):
+        self.sequences = []
+        self.gate = threading.Event()
+
+    def on_m4_sdb_buffer(self, lease):
+        self.gate.wait()
+        self.sequences.append(lease.sequence)
+        lease.release()
+
+
+class TestSdbAccounting(unittest.TestCase):
+
+    def run_producer(self, buff_num, rate_hz, fills=FILLS, queue_depth=None, policy=None):
+        """Fill the ring fills times and return (stats, gaps, listener) once
+        every fill is accounted, or SETTLE_TIMEOUT_s passed."""
+        with Emulator(buff_size=BUFF_SIZE, buff_num=buff_num) as emu:
+            sdb = emu.sdb_api()
+            listener = CountingListener()
+            sdb.add_sdb_buffer_rx_listener(listener)
+            kwargs = {}
+            if queue_depth is not None:
+                kwargs["queue_depth"] = queue_depth
+            if policy is not None:
+                kwargs["overflow_policy"] = policy
+            sdb.init_sdb(BUFF_SIZE, buff_num, **kwargs)
+            try:
+                emu.sdb_producer.attach(sdb)
+                sdb.reset_stats()
+                sdb.start_sdb_receiver()
+                emu.sdb_producer.run(rate_hz, count=fills)
+                emu.sdb_producer.wait(SETTLE_TIMEOUT_s)
+                deadline = time.monotonic() + SETTLE_TIMEOUT_s
+                while time.monotonic() < deadline and accounted(sdb.get_stats()) < fills:
+                    time.sleep(0.01)
+                time.sleep(0.1)     # nothing else may be counted
+                stats = sdb.get_stats()
+                gaps = sdb.get_sequence_gaps()
+                sdb.stop_sdb_receiver()
+            finally:
+                sdb.deinit_sdb()
+        return stats, gaps, listener
+
+
+    def test_overload_counts_each_fill_once(self):
+        for buff_num in (3, 8, 16):
+            stats, gaps, listener = self.run_producer(buff_num, 0)
+            self.assertEqual(accounted(stats), FILLS, "%d buffers: %r" % (buff_num, stats))
+            self.assertEqual(stats["buffers"], listener.buffers)
+            self.assertEqual(sum(gaps[1]), stats["seq_gaps"])
+
+
+    def test_paced_stream_has_no_gap(self):
+        stats, gaps, listener = self.run_producer(8, 200, 200)
+        self.assertEqual(listener.buffers, 200)
+        self.assertEqual(stats["seq_gaps"], 0)
+
+
+class TestSdbOverflowPolicy(unittest.TestCase):
+
+    FILLS = 50
+
+    def run_blocked_listener(self, policy):
+        """Fill the ring while the listener holds the first buffer and the
+        queue of depth 2 is full; return (stats, sequences delivered)."""
+        with Emulator(buff_size=BUFF_SIZE, buff_num=8) as emu:
+            sdb = emu.sdb_api()
+            listener = GatedListener()
+            sdb.add_sdb_buffer_rx_listener(listener)
+            sdb.init_sdb(BUFF_SIZE, 8, queue_depth=2, overflow_policy=policy)
+            try:
+                emu.sdb_producer.attach(sdb)
+                sdb.reset_stats()
+                sdb.start_sdb_receiver()
+                emu.sdb_producer.run(500, count=self.FILLS)
+                emu.sdb_producer.wait(SETTLE_TIMEOUT_s)
+                time.sleep(0.1)
+                listener.gate.set()
+                deadline = time.monotonic() + SETTLE_TIMEOUT_s
+                while time.monotonic() < deadline and accounted(sdb.get_stats()) < self.FILLS:
+                    time.sleep(0.01)
+                time.sleep(0.1)
+                stats = sdb.get_stats()
+                sdb.stop_sdb_receiver()
+            finally:
+                sdb.deinit_sdb()
+        self.assertEqual(accounted(stats), self.FILLS, "%s: %r" % (policy, stats))
+        self.assertEqual(stats["buffers"], len(listener.sequences))
+        self.assertEqual(listener.sequences, sorted(listener.sequences))
+        return stats, listener.sequences
+
+
+    def test_block_waits_for_the_listener(self):
+        stats, sequences = self.run_blocked_listener(SdbOverflowPolicy.BLOCK)
+        self.assertEqual(stats["queue_drops"], 0)
+        # The receiver stops reading the ring instead of skipping buffers.
+        self.assertEqual(sequences, list(range(len(sequences))))
+
+
+    def test_drop_newest_keeps_the_queued_buffers(self):
+        stats, sequences = self.run_blocked_listener(SdbOverflowPolicy.DROP_NEWEST)
+        self.assertGreater(stats["queue_drops"], 0)
+        self.assertEqual(sequences, [0, 1, 2])
+
+
+    def test_drop_oldest_keeps_the_latest_buffers(self):
+        stats, sequences = self.run_blocked_listener(SdbOverflowPolicy.DROP_OLDEST)
+        self.assertGreater(stats["queue_drops"], 0)
+        self.assertEqual(sequences[0], 0)
+        self.assertEqual(sequences[-1], self.FILLS - 1)
+
+
+    def test_deinit_waits_for_the_buffer_being_handed_out(self):
+        with Emulator(buff_size=BUFF_SIZE, buff_num=8) as emu:
+            sdb = emu.sdb_api()
+            listener = GatedListener()
+            sdb.add_sdb_buffer_rx_listener(listener)
+            sdb.init_sdb(BUFF_SIZE, 8, queue_depth=2)
+            emu.sdb_producer.attach(sdb)
+            sdb.start_sdb_receiver()
+            emu.sdb_producer.run(0, count=1)
+            emu.sdb_producer.wait(SETTLE_TIMEOUT_s)
+            time.sleep(0.1)     # the listener holds the lease
+            sdb.stop_sdb_receiver()
+            threading.Timer(0.2, listener.gate.set).start()
+            sdb.deinit_sdb()
+            self.assertEqual(listener.sequences, [0])
+
+
+class TestSdbBufferLease(unittest.TestCase):
+
+    def setUp(self):
+        self.emu = Emulator(buff_size=BUFF_SIZE, buff_num=4)
+        self.sdb = self.emu.sdb_api()
+        self.collector = LeaseCollector()
+        self.sdb.add_sdb_buffer_rx_listener(self.collector)
+        self.sdb.init_sdb(BUFF_SIZE, 4)
+        self.emu.sdb_producer.attach(self.sdb)
+        self.sdb.start_sdb_receiver()
+        self.emu.sdb_producer.run(0, count=2)
+        self.emu.sdb_producer.wait(SETTLE_TIMEOUT_s)
+        deadline = time.monotonic() + SETTLE_TIMEOUT_s
+        while len(self.collector.leases) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+
+    def tearDown(self):
+        for lease in self.collector.leases:
+            if not lease.released:
+                lease.release()
+        self.sdb.stop_sdb_receiver()
+        self.sdb.deinit_sdb()
+        self.emu.release()
+
+
+    def test_slice_of_data_holds_the_lease(self):
+        lease = self.collector.leases[0]
+        head = lease.data[:16]
+        self.assertRaises(CommSDKInvalidOperationException, lease.release)
+        self.assertFalse(lease.released)
+        self.assertEqual(len(lease.data), BUFF_SIZE)
+        del head
+        lease.release()
+        self.assertTrue(lease.released)
+
+
+    @unittest.skipIf(numpy is None, "numpy not installed")
+    def test_view_of_numpy_array_holds_the_lease(self):
+        lease = self.collector.leases[1]
+        array = lease.as_numpy()
+        tail = array[10:]
+        del array
+        gc.collect()
+        self.assertRaises(CommSDKInvalidOperationException, lease.release)
+        self.assertEqual(tail[0], lease.data[10])
+        del tail
+        gc.collect()
+        lease.release()
+        self.assertTrue(lease.released)
+
+
+
+class TestSdbBufferStream(unittest.TestCase):
+
+    FILLS = 10
+
+    def setUp(self):
+        self.emu = Emulator(buff_size=BUFF_SIZE, buff_num=4)
+        self.sdb = self.emu.sdb_api()
+        self.sdb.init_sdb(BUFF_SIZE, 4)
+        self.emu.sdb_producer.attach(self.sdb)
+        self.sdb.reset_stats()
+
+
+    def tearDown(self):
+        self.emu.sdb_producer.stop()
+        self.sdb.deinit_sdb()
+        self.emu.release()
+
+
+    def test_for_releases_each_lease_on_the_next(self):
+        leases = []
+        with self.sdb.stream(timeout=SETTLE_TIMEOUT_s) as buffers:
+            self.emu.sdb_producer.run(200, count=self.FILLS)
+            for lease in buffers:
+                self.assertEqual(lease.data[0], lease.sequence)
+                self.assertTrue(all(previous.released for previous in leases))
+                leases.append(lease)
+                if len(leases) == self.FILLS:
+                    break
+        self.assertEqual([lease.sequence for lease in leases], list(range(self.FILLS)))
+        self.assertTrue(leases[-1].released)
+
+
+    def test_async_for(self):
+        async def consume(buffers):
+            sequences = []
+            async for lease in buffers:
+                sequences.append(lease.sequence)
+                if len(sequences) == self.FILLS:
+                    break
+            return sequences
+        with self.sdb.stream(timeout=SETTLE_TIMEOUT_s) as buffers:
+            self.emu.sdb_producer.run(200, count=self.FILLS)
+            sequences = asyncio.run(consume(buffers))
+        self.assertEqual(sequences, list(range(self.FILLS)))
+
+
+    def test_prefetch_blocks_the_receiver(self):
+        with self.sdb.stream(prefetch=2, timeout=SETTLE_TIMEOUT_s) as buffers:
+            self.emu.sdb_producer.run(200, count=self.FILLS)
+            self.emu.sdb_producer.wait(SETTLE_TIMEOUT_s)
+            time.sleep(0.1)
+            # two buffers wait for the consumer, the receiver holds the third
+            self.assertEqual(self.sdb.get_stats()["buffers"], 2)
+            self.assertEqual([next(buffers).sequence for _ in range(3)], [0, 1, 2])
+
+
+    def test_consumer_releases_without_auto_release(self):
+        with self.sdb.stream(auto_release=False, timeout=SETTLE_TIMEOUT_s) as buffers:
+            self.emu.sdb_producer.run(200, count=2)
+            first, second = next(buffers), next(buffers)
+            self.assertFalse(first.released or second.released)
+            first.release()
+            second.release()
+        self.assertEqual((first.sequence, second.sequence), (0, 1))
+
+
+    def test_reopened_stream_goes_on_with_the_ring(self):
+        for round in range(3):
+            sequences = []
+            with self.sdb.stream(timeout=SETTLE_TIMEOUT_s) as buffers:
+                self.emu.sdb_producer.run(200, count=self.FILLS)
+                for lease in buffers:
+                    sequences.append(lease.sequence)
+                    if len(sequences) == self.FILLS:
+                        break
+            self.emu.sdb_producer.wait(SETTLE_TIMEOUT_s)
+            first = round * self.FILLS
+            self.assertEqual(sequences, list(range(first, first + self.FILLS)))
+        stats = self.sdb.get_stats()
+        self.assertEqual((stats["buffers"], stats["seq_gaps"]), (3 * self.FILLS, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()